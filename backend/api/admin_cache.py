@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException
 import logging
 from services.cache_service import cache_service
+from services.single_flight import single_flight
 
 router = APIRouter(prefix="/api/admin/cache", tags=["Admin Cache"])
 logger = logging.getLogger(__name__)
@@ -9,7 +10,7 @@ logger = logging.getLogger(__name__)
 async def clear_cache_prefix(prefix: str):
     """特定のプレフィックスのキャッシュをクリア"""
     try:
-        valid_prefixes = ['chat_response', 'dlogic_analysis', 'weather_analysis', 'faq_response', 'race_analysis']
+        valid_prefixes = list(cache_service.ttl_settings.keys())
         
         if prefix not in valid_prefixes:
             raise HTTPException(status_code=400, detail=f"Invalid prefix. Valid prefixes: {valid_prefixes}")
@@ -29,9 +30,7 @@ async def clear_cache_prefix(prefix: str):
 async def clear_all_cache():
     """すべてのキャッシュをクリア"""
     try:
-        cache_service.cache.clear()
-        cache_service.hit_count = 0
-        cache_service.miss_count = 0
+        cache_service.clear_all()
         
         return {
             "status": "success",
@@ -44,9 +43,11 @@ async def clear_all_cache():
 
 @router.get("/stats")
 async def get_cache_stats():
-    """キャッシュ統計情報を取得"""
+    """キャッシュ統計情報を取得（プレフィックス別のヒット・ミス・追い出し件数、同時リクエストの合流件数を含む）"""
     try:
-        return cache_service.get_stats()
+        stats = cache_service.get_stats()
+        stats['single_flight'] = single_flight.get_stats()
+        return stats
     except Exception as e:
         logger.error(f"Cache stats error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
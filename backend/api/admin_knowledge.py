@@ -5,6 +5,7 @@ import os
 from typing import Optional
 from datetime import datetime
 from services.monthly_knowledge_updater import MonthlyKnowledgeUpdater
+from services.knowledge_delta import DELTA_PREFIX
 
 router = APIRouter(prefix="/api/admin", tags=["Admin Knowledge"])
 logger = logging.getLogger(__name__)
@@ -12,6 +13,12 @@ logger = logging.getLogger(__name__)
 # 秘密キー（環境変数から取得、デフォルトは固定値）
 SECRET_KEY = os.getenv("KNOWLEDGE_UPDATE_SECRET", "dlogic-knowledge-2025-secret")
 
+# ダウンロード・削除を許可するファイル名の接頭辞（フル更新・差分）
+UPDATE_FILE_PREFIXES = ('dlogic_knowledge_update_', DELTA_PREFIX)
+
+def _is_update_filename(filename: str) -> bool:
+    return filename.startswith(UPDATE_FILE_PREFIXES) and '..' not in filename and '/' not in filename
+
 @router.post("/knowledge-update/{secret_key}")
 async def trigger_knowledge_update(secret_key: str):
     """月次ナレッジファイル更新をトリガー"""
@@ -32,13 +39,15 @@ async def trigger_knowledge_update(secret_key: str):
             logger.info(f"Knowledge update completed successfully. File: {result['file_path']}")
             return JSONResponse(content={
                 "status": "success",
-                "message": "月次更新が正常に完了しました",
+                "message": "月次更新が正常に完了しました" if result['file_path'] else "新しいレースはありません",
                 "result": {
-                    "file_name": os.path.basename(result['file_path']),
+                    "file_name": os.path.basename(result['file_path']) if result['file_path'] else None,
                     "file_size_mb": round(result['file_size_mb'], 2),
                     "gz_file_size_mb": round(result['gz_file_size_mb'], 2),
                     "total_horses": result['total_horses'],
                     "new_horses": result['new_horses'],
+                    "updated_horses": result['updated_horses'],
+                    "delta_version": result['delta_version'],
                     "update_info": result['update_info']
                 }
             })
@@ -65,6 +74,8 @@ async def get_update_status(secret_key: str):
         current_info = {
             "total_horses": len(dlogic_manager.knowledge_data.get('horses', {})),
             "last_updated": dlogic_manager.knowledge_data.get('meta', {}).get('last_updated', 'unknown'),
+            "delta_version": dlogic_manager.get_delta_version(),
+            "watermarks": updater.watermarks.watermarks(),
             "github_url": "https://github.com/jinjinsansan/dlogic-knowledge-data/releases/download/V1.0/dlogic_raw_knowledge.json"
         }
         
@@ -85,6 +96,69 @@ async def get_update_status(secret_key: str):
         logger.error(f"Status check error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/knowledge-delta/apply/{secret_key}")
+async def apply_knowledge_deltas(secret_key: str):
+    """未適用の差分ファイルを実行中のナレッジに適用（再読み込みなし）"""
+    
+    # 秘密キーの検証
+    if secret_key != SECRET_KEY:
+        raise HTTPException(status_code=403, detail="Invalid secret key")
+    
+    try:
+        from services.dlogic_raw_data_manager import dlogic_manager
+        results = dlogic_manager.apply_pending_deltas()
+        return {
+            "status": "success",
+            "applied": [
+                {
+                    "version": r["version"],
+                    "updated_horses": len(r.get("updated", [])),
+                    "new_horses": len(r.get("added", [])),
+                    "race_rows": r.get("race_rows", 0)
+                }
+                for r in results if r["status"] == "applied"
+            ],
+            "delta_version": dlogic_manager.get_delta_version(),
+            "knowledge_version": dlogic_manager.get_knowledge_version()
+        }
+    except Exception as e:
+        logger.error(f"Delta apply error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/knowledge-reload/{secret_key}", status_code=202)
+async def trigger_knowledge_reload(secret_key: str, source: str = Query("local", pattern="^(local|cdn)$")):
+    """ナレッジのホットリロードをバックグラウンドで開始（再起動不要）
+    
+    source=local: サーバー上のナレッジファイルを読み直す / source=cdn: 配布元から再ダウンロード
+    """
+    
+    # 秘密キーの検証
+    if secret_key != SECRET_KEY:
+        raise HTTPException(status_code=403, detail="Invalid secret key")
+    
+    from services.knowledge_reloader import get_knowledge_reloader
+    reloader = get_knowledge_reloader()
+    if not reloader.start(source):
+        raise HTTPException(status_code=409, detail="Knowledge reload already running")
+    
+    logger.info(f"Knowledge reload started (source={source})")
+    return {
+        "status": "accepted",
+        "message": "ナレッジの差し替えを開始しました",
+        "reload": reloader.get_status()
+    }
+
+@router.get("/knowledge-reload-status/{secret_key}")
+async def get_knowledge_reload_status(secret_key: str):
+    """ホットリロードの進行状況"""
+    
+    # 秘密キーの検証
+    if secret_key != SECRET_KEY:
+        raise HTTPException(status_code=403, detail="Invalid secret key")
+    
+    from services.knowledge_reloader import get_knowledge_reloader
+    return get_knowledge_reloader().get_status()
+
 @router.get("/download-knowledge-update/{secret_key}/{filename}")
 async def download_knowledge_update(secret_key: str, filename: str):
     """生成されたナレッジファイルをダウンロード"""
@@ -94,7 +168,7 @@ async def download_knowledge_update(secret_key: str, filename: str):
         raise HTTPException(status_code=403, detail="Invalid secret key")
     
     # セキュリティ: ファイル名の検証
-    if not filename.startswith('dlogic_knowledge_update_') or '..' in filename:
+    if not _is_update_filename(filename):
         raise HTTPException(status_code=400, detail="Invalid filename")
     
     # ファイルパスの構築
@@ -121,7 +195,7 @@ async def delete_knowledge_update(secret_key: str, filename: str):
         raise HTTPException(status_code=403, detail="Invalid secret key")
     
     # セキュリティ: ファイル名の検証
-    if not filename.startswith('dlogic_knowledge_update_') or '..' in filename:
+    if not _is_update_filename(filename):
         raise HTTPException(status_code=400, detail="Invalid filename")
     
     try:
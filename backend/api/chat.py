@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from typing import Dict, Any, List, Optional
 import logging
 import re
@@ -8,6 +8,10 @@ from services.integrated_d_logic_calculator import d_logic_calculator
 from services.dlogic_raw_data_manager import dlogic_manager
 from services.fast_dlogic_engine import FastDLogicEngine
 from services.cache_service import cache_service, cached
+from services.compact_response import compact_race_result, encode_response
+from services.race_card_precompute import get_race_card_precompute
+from services.serialization import FastJSONResponse
+from services.single_flight import single_flight
 
 router = APIRouter(prefix="/api/chat", tags=["Chat"])
 
@@ -16,6 +20,8 @@ logger = logging.getLogger(__name__)
 # グローバルインスタンスを初期化（一度だけナレッジを読み込む）
 fast_engine_instance = FastDLogicEngine()
 logger.info(f"高速D-Logicエンジンを初期化しました")
+# 出走馬一括の分析は開催の事前計算と同じキャッシュを使う（同じエンジンを共有）
+race_card = get_race_card_precompute(fast_engine_instance)
 
 def extract_horse_name(text: str) -> Optional[str]:
     """テキストから馬名を抽出（100点満点・インジケーター優先版）"""
@@ -167,20 +173,36 @@ async def get_horse_d_logic_analysis(horse_name: str) -> Dict[str, Any]:
     """馬のD-Logic分析結果を取得"""
     try:
         # キャッシュチェック
-        cached_result = cache_service.get('dlogic_analysis', horse_name)
+        cached_result = await cache_service.get_async('dlogic_analysis', horse_name)
         if cached_result is not None:
             logger.info(f"キャッシュから取得: {horse_name}")
             return cached_result
         
+        # 同じ馬の分析が実行中なら合流して結果を待つ
+        return await single_flight.run(
+            'dlogic_analysis', horse_name,
+            lambda: _compute_horse_d_logic_analysis(horse_name)
+        )
+        
+    except Exception as e:
+        logger.error(f"D-Logic analysis error for {horse_name}: {e}")
+        return {
+            "status": "error",
+            "message": f"分析エラーが発生しました: {str(e)}"
+        }
+
+async def _compute_horse_d_logic_analysis(horse_name: str) -> Dict[str, Any]:
+    """馬のD-Logic分析を実行してキャッシュに保存"""
+    try:
         # グローバルインスタンスを使用
-        result = fast_engine_instance.analyze_single_horse(horse_name)
+        result = await fast_engine_instance.analyze_single_horse_async(horse_name)
         
         # データソースのチェックを先に行う
         data_source = result.get('data_source', 'unknown')
         logger.info(f"馬名 '{horse_name}' の分析結果: ソース={data_source}")
         
         # 馬が見つからない場合
-        if data_source == 'not_found' or data_source == 'mysql_fallback':
+        if data_source == 'not_found':
             error_msg = result.get("error", f"{horse_name}のデータは現在のナレッジベースに含まれていません。")
             logger.warning(f"馬名 '{horse_name}' が見つかりません: {error_msg}")
             return {
@@ -225,7 +247,7 @@ async def get_horse_d_logic_analysis(horse_name: str) -> Dict[str, Any]:
             }
             
             # キャッシュに保存（48時間）
-            cache_service.set('dlogic_analysis', horse_name, success_result)
+            await cache_service.set_async('dlogic_analysis', horse_name, success_result)
             logger.info(f"キャッシュに保存: {horse_name}")
             
             return success_result
@@ -262,14 +284,33 @@ async def get_multiple_horses_analysis(horse_names: List[str], race_info: str =
         
         # キャッシュキー（馬名リストをソートして一意にする）
         cache_key = {'horses': sorted(horse_names), 'race_info': race_info}
-        cached_result = cache_service.get('race_analysis', cache_key)
+        cached_result = await cache_service.get_async('race_analysis', cache_key)
         if cached_result is not None:
             logger.info(f"レース分析をキャッシュから取得: {len(horse_names)}頭")
             return cached_result
         
+        # 同じレースの分析が実行中なら合流して結果を待つ
+        return await single_flight.run(
+            'race_analysis', cache_key,
+            lambda: _compute_multiple_horses_analysis(horse_names, race_info, cache_key)
+        )
+        
+    except Exception as e:
+        logger.error(f"Multiple horses analysis error: {e}")
+        return {
+            "status": "error",
+            "message": f"複数馬分析エラー: {str(e)}",
+            "requested_horses": horse_names,
+            "race_info": race_info
+        }
+
+async def _compute_multiple_horses_analysis(horse_names: List[str], race_info: str,
+                                            cache_key: Dict[str, Any]) -> Dict[str, Any]:
+    """複数馬のD-Logic分析を実行してキャッシュに保存"""
+    try:
         # FastDLogicEngineを使用して一括分析
         logger.info(f"Analyzing {len(horse_names)} horses: {horse_names[:5]}..." if len(horse_names) > 5 else f"Analyzing {len(horse_names)} horses: {horse_names}")
-        result = fast_engine_instance.analyze_race_horses(horse_names)
+        result = await race_card.get_race_analysis_async(horse_names)
         
         # 分析結果の検証
         if not result.get('horses'):
@@ -293,7 +334,7 @@ async def get_multiple_horses_analysis(horse_names: List[str], race_info: str =
         }
         
         # キャッシュに保存（6時間）
-        cache_service.set('race_analysis', cache_key, success_result)
+        await cache_service.set_async('race_analysis', cache_key, success_result)
         logger.info(f"レース分析をキャッシュに保存: {len(horse_names)}頭")
         
         return success_result
@@ -317,6 +358,7 @@ async def weather_analysis(request: Dict[str, Any]):
     {
         "horse_names": ["レガレイラ"],
         "baba_condition": 3,  // 1=良, 2=稍重, 3=重, 4=不良
+        "all_conditions": false,  // trueなら良・稍重・重・不良をまとめて返す（baba_conditionは無視）
         "original_result": {...}  // 標準D-Logicの結果（オプション）
     }
     """
@@ -328,13 +370,24 @@ async def weather_analysis(request: Dict[str, Any]):
         if not horse_names:
             raise HTTPException(status_code=400, detail="馬名が指定されていません")
         
+        if request.get("all_conditions"):
+            # 4つの馬場状態を1回で計算（馬場状態の切り替えに再リクエスト不要）
+            result = await race_card.get_all_weather_async(horse_names)
+            
+            return FastJSONResponse({
+                "status": "success",
+                "analysis_type": "all_conditions",
+                "result": result,
+                "weather_conditions": {1: "良", 2: "稍重", 3: "重", 4: "不良"}
+            })
+        
         if baba_condition not in [1, 2, 3, 4]:
             raise HTTPException(status_code=400, detail="馬場状態は1,2,3,4のいずれかを指定してください")
         
         # 単頭か複数頭かで処理を分岐
         if len(horse_names) == 1:
             # 単頭分析
-            result = fast_engine_instance.analyze_single_horse_weather(horse_names[0], baba_condition)
+            result = await fast_engine_instance.analyze_single_horse_weather_async(horse_names[0], baba_condition)
             
             return {
                 "status": "success",
@@ -343,15 +396,15 @@ async def weather_analysis(request: Dict[str, Any]):
                 "weather_condition": {1: "良", 2: "稍重", 3: "重", 4: "不良"}[baba_condition]
             }
         else:
-            # 複数頭分析
-            result = fast_engine_instance.analyze_race_horses_weather(horse_names, baba_condition)
+            # 複数頭分析（4馬場の事前計算キャッシュから取り出す）
+            result = await race_card.get_weather_async(horse_names, baba_condition)
             
-            return {
+            return FastJSONResponse({
                 "status": "success",
                 "analysis_type": "multiple",
                 "result": result,
                 "weather_condition": {1: "良", 2: "稍重", 3: "重", 4: "不良"}[baba_condition]
-            }
+            })
             
     except HTTPException:
         raise
@@ -362,8 +415,12 @@ async def weather_analysis(request: Dict[str, Any]):
         raise HTTPException(status_code=500, detail=f"天候適性分析中にエラーが発生しました: {str(e)}")
 
 @router.post("/message")
-async def chat_message(request: Dict[str, Any]):
-    """チャットメッセージを処理し、OpenAI応答を生成"""
+async def chat_message(request: Dict[str, Any], http_request: Request):
+    """チャットメッセージを処理し、OpenAI応答を生成
+    
+    "response_format": "compact" を指定すると、複数馬分析の horses を列形式にし、
+    Accept / Accept-Encoding に合わせて msgpack・gzip/br で返す
+    """
     try:
         user_message = request.get("message", "")
         chat_history = request.get("history", [])
@@ -689,7 +746,16 @@ D-Logic 12項目説明：
                 response_data["analysis_type"] = "single_horse"
             response_data["d_logic_result"] = d_logic_result
         
-        return response_data
+        if request.get("response_format") == "compact":
+            analysis_result = d_logic_result.get("analysis_result") if d_logic_result else None
+            if isinstance(analysis_result, dict):
+                response_data["d_logic_result"] = {
+                    **d_logic_result,
+                    "analysis_result": compact_race_result(analysis_result)
+                }
+            return encode_response(response_data, http_request)
+        
+        return FastJSONResponse(response_data)
             
     except Exception as e:
         logger.error(f"Chat message processing error: {e}")
@@ -901,5 +967,6 @@ async def get_cache_stats():
     return {
         "status": "success",
         "cache_stats": stats,
+        "single_flight_stats": single_flight.get_stats(),
         "recommendation": "キャッシュヒット率が70%以上で良好です" if stats["hit_rate"] >= 70 else "キャッシュヒット率を改善できます"
     }
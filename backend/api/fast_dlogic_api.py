@@ -3,17 +3,23 @@
 高速D-Logic分析API
 ナレッジベース対応リアルタイム計算API
 """
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
 from typing import List, Optional
 from pydantic import BaseModel
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from services.compact_response import compact_race_result, encode_response
 from services.fast_dlogic_engine import FastDLogicEngine
+from services.jockey_analytics import jockey_analytics, venue_course_key
+from services.race_card_precompute import get_race_card_precompute
+from services.serialization import FastJSONResponse
 
 router = APIRouter()
 engine = FastDLogicEngine()
+# 出走馬一括の分析は開催の事前計算と同じキャッシュを使う
+race_card = get_race_card_precompute(engine)
 
 class HorseAnalysisRequest(BaseModel):
     horse_name: str
@@ -23,6 +29,19 @@ class RaceAnalysisRequest(BaseModel):
     horse_names: List[str]
     race_name: Optional[str] = None
     race_date: Optional[str] = None
+    response_format: Optional[str] = None  # "compact" で列形式
+
+class JockeyEntry(BaseModel):
+    horse_name: str
+    jockey: str
+    post_position: Optional[int] = None
+    sire: Optional[str] = None
+
+class RaceJockeyRequest(BaseModel):
+    entries: List[JockeyEntry]
+    venue: Optional[str] = None
+    distance: Optional[str] = None
+    baba_condition: Optional[int] = None
 
 class HorseAnalysisResponse(BaseModel):
     horse_name: str
@@ -47,7 +66,7 @@ async def analyze_single_horse(request: HorseAnalysisRequest):
     - **analysis_type**: 分析タイプ（standard/detailed）
     """
     try:
-        result = engine.analyze_single_horse(request.horse_name)
+        result = await engine.analyze_single_horse_async(request.horse_name)
         
         if "error" in result:
             raise HTTPException(status_code=404, detail=result["error"])
@@ -58,13 +77,15 @@ async def analyze_single_horse(request: HorseAnalysisRequest):
         raise HTTPException(status_code=500, detail=f"分析エラー: {str(e)}")
 
 @router.post("/race-analysis", response_model=RaceAnalysisResponse)
-async def analyze_race_horses(request: RaceAnalysisRequest):
+async def analyze_race_horses(request: RaceAnalysisRequest, http_request: Request):
     """
     レース出走馬一括D-Logic分析
     
     - **horse_names**: 分析する馬名のリスト
     - **race_name**: レース名（オプション）
     - **race_date**: レース日（オプション）
+    - **response_format**: "compact" なら horses を列形式にし、Accept / Accept-Encoding に合わせて
+      msgpack・gzip/br で返す（オプション）
     """
     try:
         if not request.horse_names:
@@ -73,7 +94,7 @@ async def analyze_race_horses(request: RaceAnalysisRequest):
         if len(request.horse_names) > 20:
             raise HTTPException(status_code=400, detail="一度に分析できるのは20頭までです")
         
-        result = engine.analyze_race_horses(request.horse_names)
+        result = await race_card.get_race_analysis_async(request.horse_names)
         
         # レース情報を追加
         if request.race_name:
@@ -81,7 +102,10 @@ async def analyze_race_horses(request: RaceAnalysisRequest):
         if request.race_date:
             result['race_analysis']['race_date'] = request.race_date
         
-        return result
+        if request.response_format == 'compact':
+            return encode_response(compact_race_result(result), http_request)
+        # response_model の検証を通さずにそのままシリアライズ（形式は RaceAnalysisResponse と同じ）
+        return FastJSONResponse(result)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"レース分析エラー: {str(e)}")
@@ -102,8 +126,8 @@ async def search_horse_by_name(
         
         # 部分一致検索
         matches = []
-        for horse_name in horses.keys():
-            if query.lower() in horse_name.lower():
+        for horse_name in engine.raw_manager.name_index.search(query):
+            if horse_name in horses:
                 horse_data = horses[horse_name]
                 basic_info = horse_data.get('basic_info', {})
                 stats = horse_data.get('aggregated_stats', {})
@@ -139,6 +163,46 @@ async def get_performance_stats():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"統計取得エラー: {str(e)}")
 
+@router.get("/jockey-stats")
+async def get_jockey_stats(
+    jockey: str = Query(..., description="騎手名"),
+    venue: Optional[str] = Query(None, description="競馬場（例: 中山）"),
+    distance: Optional[str] = Query(None, description="距離（例: 2500）"),
+    baba_condition: Optional[str] = Query(None, description="馬場状態（1-4 または 良/稍重/重/不良）"),
+    post_position: Optional[int] = Query(None, description="枠番"),
+    sire: Optional[str] = Query(None, description="父馬名")
+):
+    """
+    騎手の条件別複勝率（例: 中山_2500m・重）
+    """
+    venue_course = venue_course_key(venue, distance) if venue else None
+    result = jockey_analytics.query(jockey, venue_course=venue_course, baba=baba_condition,
+                                    post_position=post_position, sire=sire)
+    if result['knowledge_key'] is None:
+        raise HTTPException(status_code=404, detail=f"{jockey}の騎手データが見つかりません")
+    return result
+
+@router.post("/jockey-compatibility")
+async def analyze_race_jockey_compatibility(request: RaceJockeyRequest):
+    """
+    出走馬全体の騎手相性（3_jockey_compatibility）を一括計算
+    
+    - **entries**: 馬名・騎手名・枠番・父馬名
+    - **venue** / **distance**: コース（例: 中山 / 2500）
+    - **baba_condition**: 馬場状態（1=良, 2=稍重, 3=重, 4=不良）
+    """
+    if not request.entries:
+        raise HTTPException(status_code=400, detail="出走馬リストが空です")
+    venue_course = venue_course_key(request.venue, request.distance) if request.venue else None
+    horses = jockey_analytics.race_jockey_compatibility(
+        [entry.dict() for entry in request.entries], venue_course=venue_course, baba=request.baba_condition
+    )
+    return {
+        'venue_course': venue_course,
+        'baba_condition': request.baba_condition,
+        'horses': horses
+    }
+
 @router.get("/arima-kinen-2024")
 async def get_arima_kinen_2024_analysis():
     """
@@ -152,7 +216,7 @@ async def get_arima_kinen_2024_analysis():
             "シュトルーヴェ", "スタニングローズ", "ダノンベルーガ", "ハヤヤッコ"
         ]
         
-        result = engine.analyze_race_horses(arima_horses)
+        result = await engine.analyze_race_horses_async(arima_horses)
         result['race_analysis']['race_name'] = "2024年有馬記念"
         result['race_analysis']['race_date'] = "2024-12-22"
         result['race_analysis']['racecourse'] = "中山競馬場"
@@ -14,7 +14,7 @@ import requests
 import json
 
 # MyLogic計算エンジンをインポート
-from services.mylogic_calculator import MyLogicCalculator
+from services.mylogic_calculator import MyLogicCalculator, MAX_HORSES
 
 load_dotenv()
 
@@ -269,14 +269,15 @@ async def preview_analysis(
             )
         
         # プレビュー用にMyLogic計算エンジンで分析
-        # 最大3頭までに制限
-        preview_horses = request.horse_names[:3]
+        # 出走馬の12項目はキャッシュ済みなので、重みを変えても全頭を再計算できる
+        preview_horses = request.horse_names[:MAX_HORSES]
         
         # WeightConfigオブジェクトを辞書に変換
         weights_dict = dict(request.weights) if hasattr(request.weights, '__dict__') else request.weights
         results = mylogic_calculator.analyze_multiple_horses(
             preview_horses,
-            weights_dict
+            weights_dict,
+            details=False
         )
         
         # プレビュー用に簡略化された結果を返す
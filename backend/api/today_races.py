@@ -9,6 +9,7 @@ import os
 import mysql.connector
 from datetime import datetime, date
 import logging
+from services.race_card_precompute import get_race_card_precompute
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -38,6 +39,27 @@ def get_mysql_connection():
             return None
 
 def load_today_races_data() -> Dict[str, Any]:
+    """本日レースデータを取得し、全レースの事前計算を開始（計算済みの開催は何もしない）"""
+    data = _fetch_today_races_data()
+    schedule_card_precompute(data)
+    return data
+
+def schedule_card_precompute(data: Dict[str, Any]):
+    """本日の全レースの出走馬をバックグラウンドで事前計算（失敗してもレース情報の取得には影響させない）"""
+    try:
+        races = [
+            {
+                "race_id": f"{data.get('date')}_{race.get('raceId')}",
+                "horses": [horse.get("name") for horse in race.get("horses", [])]
+            }
+            for racecourse in data.get("racecourses", [])
+            for race in racecourse.get("races", [])
+        ]
+        get_race_card_precompute().register_card(f"today_{data.get('date')}", races, source="today_races")
+    except Exception as e:
+        logger.warning(f"事前計算の登録に失敗: {e}")
+
+def _fetch_today_races_data() -> Dict[str, Any]:
     """MySQLから本日レースデータを取得（未来データ対応版）"""
     try:
         conn = get_mysql_connection()
@@ -220,6 +242,14 @@ async def get_today_races() -> Dict[str, Any]:
     
     return response_data
 
+@router.get("/today-races/precompute")
+async def get_precompute_progress() -> Dict[str, Any]:
+    """
+    開催の事前計算（全レース × 標準・4馬場）の進捗
+    GET /api/today-races/precompute
+    """
+    return get_race_card_precompute().get_progress()
+
 @router.get("/race-detail/{race_id}")
 async def get_race_detail(race_id: str) -> Dict[str, Any]:
     """
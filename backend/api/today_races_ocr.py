@@ -7,6 +7,7 @@ from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
 import logging
 from pydantic import BaseModel
+from services.race_card_precompute import get_race_card_precompute
 
 router = APIRouter(prefix="/api/today-races/ocr", tags=["Today Races OCR"])
 logger = logging.getLogger(__name__)
@@ -71,6 +72,9 @@ async def save_race_data(race_data: RaceData):
         
         logger.info(f"レース情報を保存: {race_id}")
         
+        # 当日の全レースをバックグラウンドで事前計算（計算済みのレースはスキップ）
+        schedule_card_precompute(date_key)
+        
         return {
             "status": "success",
             "race_id": race_id,
@@ -205,6 +209,7 @@ async def update_race(race_id: str, update_data: RaceUpdateData):
                 race_data["race_name"] = update_data.race_name
             if update_data.horses is not None:
                 race_data["horses"] = update_data.horses
+                schedule_card_precompute(date_part)
             
             logger.info(f"レース情報を更新: {race_id}")
             
@@ -262,6 +267,17 @@ async def toggle_race_visibility(race_id: str, visibility_data: VisibilityData):
             detail="表示設定の更新に失敗しました"
         )
 
+def schedule_card_precompute(date_key: str):
+    """指定日の登録済みレース全体の事前計算を開始（失敗してもレース登録には影響させない）"""
+    try:
+        races = [
+            {"race_id": race_id, "horses": race.get("horses", [])}
+            for race_id, race in race_storage.get(date_key, {}).items()
+        ]
+        get_race_card_precompute().register_card(f"ocr_{date_key}", races, source="ocr")
+    except Exception as e:
+        logger.warning(f"事前計算の登録に失敗: {e}")
+
 def cleanup_old_races():
     """古いレース情報をクリーンアップ（前日以前のデータを削除）"""
     try:
@@ -14,6 +14,8 @@ import mysql.connector
 from datetime import datetime
 from typing import Dict, List, Any, Optional
 from collections import OrderedDict
+from services.race_history_extractor import RaceHistoryExtractor, RaceHistoryQuery
+from services.checkpoint_log import CheckpointLog
 
 class DLogicKnowledgeBuilder:
     """D-Logic生データナレッジファイル構築クラス"""
@@ -33,7 +35,8 @@ class DLogicKnowledgeBuilder:
         # 出力ファイル
         self.json_file = "data/dlogic_raw_knowledge.json"
         self.text_file = "data/dlogic_raw_knowledge_summary.txt"
-        self.temp_json = "data/dlogic_raw_knowledge_temp.json"
+        # 処理済みの馬を追記するチェックポイント（完了時に最終ファイルへコンパクション）
+        self.checkpoint_file = "data/checkpoints/dlogic_raw_knowledge_v2.jsonl"
         
         # D-Logic計算に必要な12項目に関連するフィールド
         self.required_fields = [
@@ -68,6 +71,46 @@ class DLogicKnowledgeBuilder:
             "BAREI"                 # 馬齢
         ]
         
+        # 全対象馬を1本の順序付きクエリで流し読み（最新5走・3走以上）
+        self.extractor = RaceHistoryExtractor(RaceHistoryQuery(
+            columns="""
+                u.BAMEI,
+                u.RACE_CODE,
+                u.KAISAI_NEN,
+                u.KAISAI_GAPPI,
+                u.KAKUTEI_CHAKUJUN,
+                u.TANSHO_ODDS,
+                u.TANSHO_NINKIJUN,
+                u.FUTAN_JURYO,
+                u.BATAIJU,
+                u.ZOGEN_SA,
+                u.KISHUMEI_RYAKUSHO,
+                u.CHOKYOSHIMEI_RYAKUSHO,
+                u.CORNER1_JUNI,
+                u.CORNER2_JUNI,
+                u.CORNER3_JUNI,
+                u.CORNER4_JUNI,
+                u.SOHA_TIME,
+                u.BAREI,
+                u.SEIBETSU_CODE,
+                r.KYORI,
+                r.TRACK_CODE,
+                r.SHIBA_BABAJOTAI_CODE,
+                r.DIRT_BABAJOTAI_CODE,
+                r.TENKO_CODE
+            """,
+            from_clause="umagoto_race_joho u LEFT JOIN race_shosai r ON u.RACE_CODE = r.RACE_CODE",
+            conditions=[
+                "u.KAISAI_NEN >= '2015'",
+                "u.KAISAI_NEN <= '2025'",
+                "u.BAMEI IS NOT NULL",
+                "u.BAMEI != ''",
+                "u.KAKUTEI_CHAKUJUN IS NOT NULL"
+            ],
+            max_races=5,
+            min_races=3
+        ))
+        
     def create_connection(self):
         """MySQL接続を作成"""
         return mysql.connector.connect(**self.mysql_config)
@@ -77,79 +120,36 @@ class DLogicKnowledgeBuilder:
         単一馬の生データ抽出（最新5走または3走）
         D-Logic計算に必要な12項目のデータのみを取得
         """
-        cursor = conn.cursor(dictionary=True)
-        
-        try:
-            # 最新のレースから順に取得
-            query = f"""
-                SELECT 
-                    u.BAMEI,
-                    u.RACE_CODE,
-                    u.KAISAI_NEN,
-                    u.KAISAI_GAPPI,
-                    u.KAKUTEI_CHAKUJUN,
-                    u.TANSHO_ODDS,
-                    u.TANSHO_NINKIJUN,
-                    u.FUTAN_JURYO,
-                    u.BATAIJU,
-                    u.ZOGEN_SA,
-                    u.KISHUMEI_RYAKUSHO,
-                    u.CHOKYOSHIMEI_RYAKUSHO,
-                    u.CORNER1_JUNI,
-                    u.CORNER2_JUNI,
-                    u.CORNER3_JUNI,
-                    u.CORNER4_JUNI,
-                    u.SOHA_TIME,
-                    u.BAREI,
-                    u.SEIBETSU_CODE,
-                    r.KYORI,
-                    r.TRACK_CODE,
-                    r.SHIBA_BABAJOTAI_CODE,
-                    r.DIRT_BABAJOTAI_CODE,
-                    r.TENKO_CODE
-                FROM umagoto_race_joho u
-                LEFT JOIN race_shosai r ON u.RACE_CODE = r.RACE_CODE
-                WHERE u.BAMEI = %s
-                AND u.KAISAI_NEN >= '2015'
-                AND u.KAISAI_NEN <= '2025'
-                AND u.KAKUTEI_CHAKUJUN IS NOT NULL
-                ORDER BY u.KAISAI_NEN DESC, u.KAISAI_GAPPI DESC
-                LIMIT 5
-            """
-            
-            cursor.execute(query, (horse_name,))
-            races = cursor.fetchall()
-            
-            # 3走未満はスキップ
-            if len(races) < 3:
-                return None
-            
-            # 生データとして保存（計算はしない）
-            race_data = []
-            for race in races:
-                # データクリーニング
-                cleaned_race = {}
-                for key, value in race.items():
-                    if value is not None:
-                        # 文字列の場合は前後の空白を削除
-                        if isinstance(value, str):
-                            cleaned_race[key] = value.strip()
-                        else:
-                            cleaned_race[key] = value
+        races = self.extractor.extract_one(conn, horse_name)
+        if races is None:
+            return None
+        return self.build_horse_record(horse_name, races)
+    
+    def build_horse_record(self, horse_name: str, races: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """抽出したレース行（新しい順）から1頭分の生データを作成"""
+        # 生データとして保存（計算はしない）
+        race_data = []
+        for race in races:
+            # データクリーニング
+            cleaned_race = {}
+            for key, value in race.items():
+                if value is not None:
+                    # 文字列の場合は前後の空白を削除
+                    if isinstance(value, str):
+                        cleaned_race[key] = value.strip()
                     else:
-                        cleaned_race[key] = None
-                
-                race_data.append(cleaned_race)
-            
-            return {
-                "horse_name": horse_name,
-                "race_count": len(race_data),
-                "races": race_data,
-                "last_update": datetime.now().isoformat()
-            }
+                        cleaned_race[key] = value
+                else:
+                    cleaned_race[key] = None
             
-        finally:
-            cursor.close()
+            race_data.append(cleaned_race)
+        
+        return {
+            "horse_name": horse_name,
+            "race_count": len(race_data),
+            "races": race_data,
+            "last_update": datetime.now().isoformat()
+        }
     
     def build_knowledge(self):
         """ナレッジファイルを構築"""
@@ -186,8 +186,15 @@ class DLogicKnowledgeBuilder:
             f.write(f"収集データ: 各馬の最新5走（最低3走）\n")
             f.write("="*60 + "\n\n")
         
+        # 前回中断分をチェックポイントから復元（馬名順に流し読みするので最後の馬名の次から再開）
+        checkpoint = CheckpointLog(self.checkpoint_file)
+        for horse_name, record in checkpoint.items():
+            knowledge["horses"][horse_name] = record
+        if len(checkpoint):
+            print(f"♻️ チェックポイントから再開: {len(checkpoint):,}頭処理済み（{checkpoint.last_key} の次から）\n")
+        
         conn = None
-        total_processed = 0
+        total_processed = len(checkpoint)
         total_skipped = 0
         total_errors = 0
         
@@ -195,45 +202,42 @@ class DLogicKnowledgeBuilder:
             conn = self.create_connection()
             cursor = conn.cursor(dictionary=True)
             
-            # 対象馬を取得（3走以上）
-            print("📊 対象馬を抽出中...")
+            # 対象馬数を集計（進捗表示用）
+            print("📊 対象馬数を集計中...")
             cursor.execute("""
-                SELECT BAMEI, COUNT(*) as race_count
-                FROM umagoto_race_joho
-                WHERE KAISAI_NEN >= '2015'
-                AND KAISAI_NEN <= '2025'
-                AND BAMEI IS NOT NULL
-                AND BAMEI != ''
-                AND KAKUTEI_CHAKUJUN IS NOT NULL
-                GROUP BY BAMEI
-                HAVING race_count >= 3
-                ORDER BY race_count DESC, BAMEI
+                SELECT COUNT(*) as horse_count
+                FROM (
+                    SELECT BAMEI
+                    FROM umagoto_race_joho
+                    WHERE KAISAI_NEN >= '2015'
+                    AND KAISAI_NEN <= '2025'
+                    AND BAMEI IS NOT NULL
+                    AND BAMEI != ''
+                    AND KAKUTEI_CHAKUJUN IS NOT NULL
+                    GROUP BY BAMEI
+                    HAVING COUNT(*) >= 3
+                ) t
             """)
             
-            horses = cursor.fetchall()
+            total_horses = cursor.fetchone()['horse_count']
             cursor.close()
             
-            total_horses = len(horses)
             print(f"✅ 対象馬数: {total_horses:,}頭（3走以上）\n")
             
             # 進捗パラメータ
             checkpoint_interval = 100
-            save_interval = 500
             text_update_interval = 50
             
-            # 処理開始
-            for idx, horse_data in enumerate(horses):
-                horse_name = horse_data['BAMEI']
-                
+            # 処理開始（馬ごとのクエリではなく1本のクエリを馬名順に流し読み）
+            print("🌊 一括抽出開始（1クエリ・馬名順）")
+            stream = self.extractor.stream(conn, start_after=checkpoint.last_key)
+            for idx, (horse_name, races) in enumerate(stream, start=total_processed):
                 try:
-                    # 生データ抽出
-                    raw_data = self.extract_horse_data(conn, horse_name)
-                    
-                    if raw_data:
-                        knowledge["horses"][horse_name] = raw_data
-                        total_processed += 1
-                    else:
-                        total_skipped += 1
+                    record = self.build_horse_record(horse_name, races)
+                    checkpoint.append(horse_name, record)
+                    knowledge["horses"][horse_name] = record
+                    total_processed += 1
+                    elapsed = time.time() - start_time
                     
                     # 進捗表示
                     if (idx + 1) % checkpoint_interval == 0:
@@ -253,38 +257,33 @@ class DLogicKnowledgeBuilder:
                     if (idx + 1) % text_update_interval == 0:
                         self.update_text_file(knowledge, total_processed, total_skipped, 
                                             total_errors, elapsed, total_horses)
-                    
-                    # 定期保存
-                    if total_processed % save_interval == 0 and total_processed > 0:
-                        knowledge["meta"]["total_horses"] = total_processed
-                        knowledge["meta"]["last_updated"] = datetime.now().isoformat()
-                        with open(self.temp_json, 'w', encoding='utf-8') as f:
-                            json.dump(knowledge, f, ensure_ascii=False, indent=2)
-                        print(f"💾 中間保存: {total_processed:,}頭完了")
                 
                 except Exception as e:
                     total_errors += 1
                     if total_errors <= 10:
                         print(f"❌ エラー {horse_name}: {str(e)}")
             
+            # 3走未満は抽出中に除外済み
+            total_skipped = self.extractor.horses_skipped
+            extract_stats = self.extractor.get_stats()
+            print(f"📊 抽出統計: クエリ{extract_stats['query_count']}回 "
+                  f"読込行数{extract_stats['rows_scanned']:,} "
+                  f"抽出時間{extract_stats['elapsed_seconds']/60:.1f}分")
+            
             # 最終保存
             knowledge["meta"]["total_horses"] = total_processed
             knowledge["meta"]["last_updated"] = datetime.now().isoformat()
             knowledge["meta"]["status"] = "completed"
             
             print("\n💾 最終保存中...")
-            with open(self.json_file, 'w', encoding='utf-8') as f:
-                json.dump(knowledge, f, ensure_ascii=False, indent=2)
+            checkpoint.compact(self.json_file, knowledge["meta"])
+            checkpoint.discard()
             
             # 最終テキストファイル更新
             elapsed_total = time.time() - start_time
             self.create_final_summary(knowledge, total_processed, total_skipped, 
                                     total_errors, elapsed_total)
             
-            # 一時ファイル削除
-            if os.path.exists(self.temp_json):
-                os.remove(self.temp_json)
-            
             # 完了レポート
             self.print_completion_report(total_processed, total_skipped, 
                                        total_errors, elapsed_total)
@@ -295,6 +294,8 @@ class DLogicKnowledgeBuilder:
             traceback.print_exc()
         
         finally:
+            # 中断時は追記済みの馬がチェックポイントに残る
+            checkpoint.close()
             if conn:
                 conn.close()
                 print("🔌 MySQL接続終了")
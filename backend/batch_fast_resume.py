@@ -2,6 +2,7 @@
 """
 D-Logic高速バッチ処理（残り作業専用）
 既存のナレッジデータから未処理分のみを効率的に処理
+処理済みの馬はチェックポイントログに追記し、中断しても続きから再開できる
 """
 import os
 import sys
@@ -15,10 +16,14 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from utils.mysql_connection_manager import get_mysql_manager
 from services.dlogic_raw_data_manager import DLogicRawDataManager
+from services.checkpoint_log import CheckpointLog
 
 # MySQL接続マネージャー
 mysql_manager = get_mysql_manager()
 
+# チェックポイントログ（1行1頭の追記のみ・完了時にナレッジへ反映して削除）
+CHECKPOINT_FILE = "data/checkpoints/fast_resume.jsonl"
+
 def extract_horse_raw_data_fast(horse_name: str) -> Dict[str, Any]:
     """超高速データ抽出（最小限の情報のみ）"""
     
@@ -74,9 +79,14 @@ def fast_batch_resume():
     print(f"📊 現在のナレッジ数: {current_count:,}頭")
     
     # 既存の馬名を取得
-    existing_horses = set(manager.knowledge_data.get("horses", {}).keys())
+    existing_horses = manager.knowledge_data.get("horses", {})
     print(f"📋 既存データ: {len(existing_horses):,}頭")
     
+    # 前回中断時のチェックポイント
+    checkpoint = CheckpointLog(CHECKPOINT_FILE)
+    if len(checkpoint):
+        print(f"♻️ チェックポイントから再開: {len(checkpoint):,}頭処理済み")
+    
     try:
         # 小さなバッチで対象馬を取得（未処理分のみ）
         print("🔍 未処理馬の検索中...")
@@ -93,20 +103,18 @@ def fast_batch_resume():
             LIMIT 2000
         """)
         
-        # 未処理の馬のみフィルター
-        unprocessed_horses = [h for h in horses if h['BAMEI'] not in existing_horses]
+        # 未処理の馬のみフィルター（既存ナレッジ・チェックポイントともにO(1)判定）
+        unprocessed_horses = [
+            h for h in horses
+            if h['BAMEI'] not in existing_horses and h['BAMEI'] not in checkpoint
+        ]
         total_unprocessed = len(unprocessed_horses)
         
         print(f"🐎 全対象馬数: {len(horses):,}頭")
         print(f"🎯 未処理馬数: {total_unprocessed:,}頭")
         
-        if total_unprocessed == 0:
-            print("✅ 全ての馬の処理が完了しています")
-            return
-        
         processed = 0
         errors = 0
-        batch_size = 50
         
         for i, horse_data in enumerate(unprocessed_horses):
             horse_name = horse_data['BAMEI']
@@ -116,7 +124,8 @@ def fast_batch_resume():
                 raw_data = extract_horse_raw_data_fast(horse_name)
                 
                 if raw_data:
-                    manager.add_horse_knowledge(horse_name, raw_data)
+                    # 1頭ずつ追記（fsyncはまとめて行うため件数が増えてもコストは一定）
+                    checkpoint.append(horse_name, raw_data)
                     processed += 1
                     
                     # 進行状況表示
@@ -130,11 +139,6 @@ def fast_batch_resume():
                               f"({processed/total_unprocessed*100:.1f}%) "
                               f"速度: {speed:.1f}頭/秒 "
                               f"残り時間: {eta/60:.1f}分")
-                    
-                    # バッチ保存
-                    if processed % batch_size == 0:
-                        manager.save_knowledge_data()
-                        print(f"💾 中間保存: {processed:,}頭完了")
                         
                 else:
                     errors += 1
@@ -144,8 +148,12 @@ def fast_batch_resume():
                 if errors % 10 == 0:
                     print(f"⚠️ エラー累計: {errors}件")
         
-        # 最終保存
-        manager.save_knowledge_data()
+        # チェックポイントをナレッジに反映して原子的に保存
+        print("💾 チェックポイントをナレッジに反映中...")
+        for horse_name, raw_data in checkpoint.items():
+            manager.add_horse_raw_data(horse_name, raw_data)
+        manager._save_knowledge()
+        checkpoint.discard()
         
         elapsed = time.time() - start_time
         final_count = len(manager.knowledge_data.get("horses", {}))
@@ -154,7 +162,7 @@ def fast_batch_resume():
         print("🎉 バッチ処理完了！")
         print(f"📊 最終結果:")
         print(f"   - 処理開始前: {current_count:,}頭")
-        print(f"   - 新規追加: {processed:,}頭") 
+        print(f"   - 新規追加: {final_count - current_count:,}頭 (今回 {processed:,}頭)") 
         print(f"   - 最終総数: {final_count:,}頭")
         print(f"   - エラー数: {errors:,}件")
         print(f"   - 実行時間: {elapsed/60:.1f}分")
@@ -163,8 +171,10 @@ def fast_batch_resume():
         
     except Exception as e:
         print(f"❌ バッチ処理エラー: {str(e)}")
-        # エラー時も保存
-        manager.save_knowledge_data()
+        # 処理済み分はチェックポイントに残っている（次回続きから）
+        print(f"💾 チェックポイント保持: {len(checkpoint):,}頭 ({CHECKPOINT_FILE})")
+    finally:
+        checkpoint.close()
         
 if __name__ == "__main__":
-    fast_batch_resume()
\ No newline at end of file
+    fast_batch_resume()
@@ -15,37 +15,48 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from utils.mysql_connection_manager import get_mysql_manager
 from services.dlogic_raw_data_manager import DLogicRawDataManager
+from services.race_history_extractor import RaceHistoryExtractor, RaceHistoryQuery
 
 # MySQL接続マネージャー
 mysql_manager = get_mysql_manager()
 
+# シンプルなクエリ（JOIN削除、必要最小限のフィールド）を対象馬まとめて流し読み
+race_extractor = RaceHistoryExtractor(RaceHistoryQuery(
+    columns="""
+        RACE_CODE,
+        KAISAI_NEN,
+        KAISAI_GAPPI,
+        KAKUTEI_CHAKUJUN as finish,
+        TANSHO_ODDS as odds,
+        TANSHO_NINKIJUN as popularity,
+        FUTAN_JURYO as weight,
+        BATAIJU as horse_weight,
+        ZOGEN_SA as weight_change,
+        KISHUMEI_RYAKUSHO as jockey,
+        CHOKYOSHIMEI_RYAKUSHO as trainer,
+        SOHA_TIME as time,
+        BAREI as age,
+        SEIBETSU_CODE as sex
+    """,
+    from_clause="umagoto_race_joho",
+    conditions=[
+        "KAISAI_NEN IS NOT NULL",
+        "KAKUTEI_CHAKUJUN IS NOT NULL"
+    ],
+    order_by="KAISAI_NEN DESC, KAISAI_GAPPI DESC",
+    key_column="BAMEI",
+    max_races=50,
+    min_races=1
+))
+
 def extract_horse_raw_data_optimized(horse_name: str) -> Dict[str, Any]:
-    """最適化された生データ抽出"""
-    
-    # シンプルなクエリに変更（JOIN削除、必要最小限のフィールド）
-    races = mysql_manager.execute_query("""
-        SELECT 
-            RACE_CODE,
-            KAISAI_NEN,
-            KAISAI_GAPPI,
-            KAKUTEI_CHAKUJUN as finish,
-            TANSHO_ODDS as odds,
-            TANSHO_NINKIJUN as popularity,
-            FUTAN_JURYO as weight,
-            BATAIJU as horse_weight,
-            ZOGEN_SA as weight_change,
-            KISHUMEI_RYAKUSHO as jockey,
-            CHOKYOSHIMEI_RYAKUSHO as trainer,
-            SOHA_TIME as time,
-            BAREI as age,
-            SEIBETSU_CODE as sex
-        FROM umagoto_race_joho 
-        WHERE BAMEI = %s
-        AND KAISAI_NEN IS NOT NULL
-        AND KAKUTEI_CHAKUJUN IS NOT NULL
-        ORDER BY KAISAI_NEN DESC, KAISAI_GAPPI DESC
-        LIMIT 50
-    """, (horse_name,))
+    """最適化された生データ抽出（1頭分）"""
+    with mysql_manager.get_connection() as conn:
+        races = race_extractor.extract_one(conn, horse_name)
+    return build_raw_data_optimized(races or [])
+
+def build_raw_data_optimized(races: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """抽出したレース行（新しい順）から軽量データを作成"""
     
     # 軽量データ処理
     race_history = []
@@ -127,63 +138,53 @@ def batch_create_knowledge_optimized():
         # 高速処理設定
         checkpoint_interval = 25
         save_interval = 100
-        batch_delay = 1  # 1秒に短縮
         
-        print(f"⚙️ 高速設定: チェックポイント{checkpoint_interval}, 保存{save_interval}, 遅延{batch_delay}秒")
+        # 既存データスキップ
+        targets = []
+        for horse in horses:
+            if manager.get_horse_raw_data(horse['BAMEI']):
+                skipped += 1
+            else:
+                targets.append(horse['BAMEI'])
+        print(f"⏭️  スキップ済み: {skipped}頭")
+        
+        print(f"⚙️ 高速設定: チェックポイント{checkpoint_interval}, 保存{save_interval}, "
+              f"{race_extractor.name_chunk_size}頭ずつまとめて抽出")
         print("🏁 処理開始!")
         
-        for i, horse in enumerate(horses):
-            horse_name = horse['BAMEI']
-            
-            try:
-                # 既存データスキップ
-                if manager.get_horse_raw_data(horse_name):
-                    skipped += 1
-                    if skipped % 100 == 0:
-                        print(f"⏭️  スキップ済み: {skipped}頭")
-                    continue
-                
-                # 最適化されたデータ抽出
-                start_extract = time.time()
-                raw_data = extract_horse_raw_data_optimized(horse_name)
-                extract_time = time.time() - start_extract
-                
-                if raw_data["race_history"]:
-                    # ナレッジ追加
-                    manager.add_horse_raw_data(horse_name, raw_data)
-                    processed += 1
+        # 馬ごとのクエリではなく、対象馬をまとめたクエリを馬名順に流し読み
+        with mysql_manager.get_connection() as conn:
+            for horse_name, races in race_extractor.stream(conn, targets):
+                try:
+                    raw_data = build_raw_data_optimized(races)
                     
-                    # プログレス表示
-                    if processed % checkpoint_interval == 0:
-                        elapsed = time.time() - start_time
-                        rate = processed / elapsed
-                        remaining = total_horses - processed - skipped
-                        eta = remaining / rate if rate > 0 else 0
-                        current_time = datetime.now().strftime('%H:%M:%S')
+                    if raw_data["race_history"]:
+                        # ナレッジ追加
+                        manager.add_horse_raw_data(horse_name, raw_data)
+                        processed += 1
                         
-                        print(f"⏳ [{current_time}] {processed:4d}/{total_horses} 完了 "
-                              f"速度:{rate:.1f}頭/秒 残り:{eta/60:.0f}分 "
-                              f"抽出:{extract_time:.1f}s")
-                    
-                    # 定期保存
-                    if processed % save_interval == 0:
-                        manager._save_knowledge()
-                        current_time = datetime.now().strftime('%H:%M:%S')
-                        print(f"💾 [{current_time}] 中間保存完了: {processed}頭")
-                
-                # 高速処理用の短い待機
-                if processed % 5 == 0:
-                    time.sleep(batch_delay)
+                        # プログレス表示
+                        if processed % checkpoint_interval == 0:
+                            elapsed = time.time() - start_time
+                            rate = processed / elapsed
+                            remaining = total_horses - processed - skipped
+                            eta = remaining / rate if rate > 0 else 0
+                            current_time = datetime.now().strftime('%H:%M:%S')
+                            
+                            print(f"⏳ [{current_time}] {processed:4d}/{total_horses} 完了 "
+                                  f"速度:{rate:.1f}頭/秒 残り:{eta/60:.0f}分 "
+                                  f"クエリ:{race_extractor.query_count}回")
                         
-            except Exception as e:
-                errors += 1
-                if errors <= 10:
-                    print(f"❌ {horse_name} エラー: {e}")
-                
-                # エラー監視
-                if errors % 50 == 0:
-                    print(f"⚠️ エラー多発: {errors}件 - 接続確認中...")
-                    mysql_manager.test_connection()
+                        # 定期保存
+                        if processed % save_interval == 0:
+                            manager._save_knowledge()
+                            current_time = datetime.now().strftime('%H:%M:%S')
+                            print(f"💾 [{current_time}] 中間保存完了: {processed}頭")
+                            
+                except Exception as e:
+                    errors += 1
+                    if errors <= 10:
+                        print(f"❌ {horse_name} エラー: {e}")
         
         # 最終保存
         manager._save_knowledge()
@@ -198,6 +199,7 @@ def batch_create_knowledge_optimized():
         print(f"❌ エラー: {errors}頭")
         print(f"⏱️ 総処理時間: {elapsed_total/60:.1f}分")
         print(f"🚀 処理速度: {processed/(elapsed_total/60):.1f}頭/分")
+        print(f"🔎 クエリ回数: {race_extractor.query_count}回 (読込 {race_extractor.rows_scanned}行)")
         
         # ファイルサイズ確認
         if os.path.exists(manager.knowledge_file):
@@ -235,8 +237,8 @@ if __name__ == "__main__":
     print("⚡ D-Logic生データナレッジ一括作成バッチ (最適化版)")
     print("🔧 最適化内容:")
     print("   - JOIN削除によるクエリ高速化")
+    print("   - 対象馬をまとめた一括抽出（馬ごとのクエリを廃止）")
     print("   - 軽量データ処理")
-    print("   - 短い待機間隔")
     print("   - 頻繁な進捗表示")
     print("")
     batch_create_knowledge_optimized()
\ No newline at end of file
@@ -2,11 +2,16 @@
 """
 D-Logic ナレッジファイル再構築バッチ 2025年版
 2020-2025年の5走以上の馬データ（目標30,000頭）を効率的に再構築
+
+馬名のハッシュで分割し、CPUコア数分のワーカープロセスが各自の接続で
+担当分を1本のクエリで流し読みして部分ファイルを作成、最後に馬名順にマージする。
+（環境変数 REBUILD_WORKERS / REBUILD_PARTITIONS / REBUILD_RESUME）
 """
 import os
 import sys
 import json
 import time
+import shutil
 import mysql.connector
 from datetime import datetime
 from typing import Dict, List, Any, Optional
@@ -15,6 +20,43 @@ from collections import defaultdict
 # プロジェクトルートをパスに追加
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from services.partitioned_build import (
+    PartitionWriter, default_workers, merge_partitions, part_path,
+    partition_of, partition_sql, run_partitions, write_manifest
+)
+from services.race_history_extractor import RaceHistoryExtractor, RaceHistoryQuery
+
+# 出力ファイル
+OUTPUT_FILE = "data/dlogic_raw_knowledge.json"
+PARTS_DIR = "data/rebuild_parts"
+# 収録上限（出走数の多い順、同数は馬名順）
+MAX_HORSES = 30000
+
+RACE_COLUMNS = """
+    u.RACE_CODE,
+    u.KAISAI_NEN,
+    u.KAISAI_GAPPI,
+    u.KAKUTEI_CHAKUJUN as finish,
+    u.TANSHO_ODDS as odds,
+    u.TANSHO_NINKIJUN as popularity,
+    u.FUTAN_JURYO as weight,
+    u.BATAIJU as horse_weight,
+    u.ZOGEN_SA as weight_change,
+    u.KISHUMEI_RYAKUSHO as jockey,
+    u.CHOKYOSHIMEI_RYAKUSHO as trainer,
+    u.CORNER1_JUNI,
+    u.CORNER2_JUNI,
+    u.CORNER3_JUNI,
+    u.CORNER4_JUNI,
+    u.SOHA_TIME as time,
+    u.BAREI as age,
+    u.SEIBETSU_CODE as sex,
+    r.KYORI as distance,
+    r.TRACK_CODE as track,
+    r.BABA_JOTAI_CODE as ground_condition,
+    r.TENKOU_CODE as weather
+"""
+
 def create_mysql_connection():
     """MySQL接続を作成"""
     return mysql.connector.connect(
@@ -33,30 +75,8 @@ def extract_horse_raw_data(conn, horse_name: str) -> Dict[str, Any]:
     cursor = conn.cursor(dictionary=True)
     
     # レース履歴取得
-    cursor.execute("""
-        SELECT 
-            u.RACE_CODE,
-            u.KAISAI_NEN,
-            u.KAISAI_GAPPI,
-            u.KAKUTEI_CHAKUJUN as finish,
-            u.TANSHO_ODDS as odds,
-            u.TANSHO_NINKIJUN as popularity,
-            u.FUTAN_JURYO as weight,
-            u.BATAIJU as horse_weight,
-            u.ZOGEN_SA as weight_change,
-            u.KISHUMEI_RYAKUSHO as jockey,
-            u.CHOKYOSHIMEI_RYAKUSHO as trainer,
-            u.CORNER1_JUNI,
-            u.CORNER2_JUNI,
-            u.CORNER3_JUNI,
-            u.CORNER4_JUNI,
-            u.SOHA_TIME as time,
-            u.BAREI as age,
-            u.SEIBETSU_CODE as sex,
-            r.KYORI as distance,
-            r.TRACK_CODE as track,
-            r.BABA_JOTAI_CODE as ground_condition,
-            r.TENKOU_CODE as weather
+    cursor.execute(f"""
+        SELECT {RACE_COLUMNS}
         FROM umagoto_race_joho u
         LEFT JOIN race_shosai r ON u.RACE_CODE = r.RACE_CODE
         WHERE u.BAMEI = %s
@@ -69,6 +89,10 @@ def extract_horse_raw_data(conn, horse_name: str) -> Dict[str, Any]:
     races = cursor.fetchall()
     cursor.close()
     
+    return build_horse_raw_data(races)
+
+def build_horse_raw_data(races: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """レース行（新しい順）から1頭分の生データを作成"""
     # 5走未満は除外
     if len(races) < 5:
         return {"race_history": []}
@@ -163,158 +187,142 @@ def extract_horse_raw_data(conn, horse_name: str) -> Dict[str, Any]:
         "aggregated_stats": aggregated_stats
     }
 
-def rebuild_knowledge_2025():
-    """2025年版ナレッジファイル再構築"""
+def rebuild_partition(partition: int, partitions: int, parts_dir: str,
+                      connect=create_mysql_connection) -> Dict[str, Any]:
+    """1パーティション分を自分の接続で抽出して部分ファイルに書き出す（ワーカープロセスで実行）"""
+    path = part_path(parts_dir, partition, partitions)
+    if os.path.exists(path):
+        # 前回の実行で完了済み
+        with open(path, 'r', encoding='utf-8') as f:
+            return {"partition": partition, "horses": sum(1 for _ in f), "errors": 0, "resumed": True}
+    
+    extractor = RaceHistoryExtractor(RaceHistoryQuery(
+        columns=RACE_COLUMNS,
+        from_clause="umagoto_race_joho u LEFT JOIN race_shosai r ON u.RACE_CODE = r.RACE_CODE",
+        conditions=[
+            "u.KAISAI_NEN >= '2020'",
+            "u.KAISAI_NEN <= '2025'",
+            "u.BAMEI IS NOT NULL",
+            "u.BAMEI != ''",
+            "u.KAKUTEI_CHAKUJUN IS NOT NULL",
+            partition_sql("u.BAMEI", partition, partitions)
+        ],
+        max_races=None,
+        min_races=5
+    ))
+    
+    start_time = time.time()
+    errors = 0
+    conn = connect()
+    try:
+        with PartitionWriter(path) as writer:
+            for horse_name, races in extractor.stream(conn):
+                try:
+                    raw_data = build_horse_raw_data(races)
+                except Exception as e:
+                    errors += 1
+                    if errors <= 10:
+                        print(f"❌ [P{partition}] エラー {horse_name}: {str(e)}")
+                    continue
+                
+                if raw_data["race_history"]:
+                    writer.write(horse_name, len(races), {
+                        "name": horse_name,
+                        "registered_race_count": len(races),
+                        **raw_data
+                    })
+    finally:
+        conn.close()
+    
+    elapsed = time.time() - start_time
+    print(f"✅ [P{partition}] {writer.count:,}頭 {elapsed:.0f}秒 (読込 {extractor.rows_scanned:,}行)")
+    return {
+        "partition": partition,
+        "horses": writer.count,
+        "errors": errors,
+        "rows_scanned": extractor.rows_scanned,
+        "elapsed_seconds": elapsed,
+        "resumed": False
+    }
+
+def find_in_parts(parts_dir: str, partitions: int, horse_name: str) -> Optional[Dict[str, Any]]:
+    """部分ファイルから1頭分を探す（全体を読み込まずに確認するため）"""
+    path = part_path(parts_dir, partition_of(horse_name, partitions), partitions)
+    key = json.dumps(horse_name, ensure_ascii=False) + '\t'
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith(key):
+                return json.loads(line.split('\t', 2)[2])
+    return None
+
+def rebuild_knowledge_2025(workers: Optional[int] = None, partitions: Optional[int] = None,
+                           max_horses: int = MAX_HORSES, resume: Optional[bool] = None):
+    """2025年版ナレッジファイル再構築（ハッシュ分割・マルチプロセス）"""
     start_time = time.time()
+    workers = workers or int(os.getenv('REBUILD_WORKERS', 0)) or default_workers()
+    partitions = partitions or int(os.getenv('REBUILD_PARTITIONS', 0)) or workers
+    if resume is None:
+        resume = os.getenv('REBUILD_RESUME', 'false').lower() in ('1', 'true', 'yes')
     
     print("🏗️ D-Logic ナレッジファイル再構築開始（2025年版）")
     print(f"📅 対象期間: 2020年～2025年")
     print(f"🎯 対象条件: 5走以上の馬")
     print(f"🏁 目標: 30,000頭以上")
+    print(f"⚙️ ワーカー: {workers}プロセス / パーティション: {partitions}")
     print(f"🕐 開始時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("="*60)
     
-    # 出力ファイル
-    output_file = "data/dlogic_raw_knowledge.json"
-    temp_file = "data/dlogic_raw_knowledge_temp.json"
-    
-    # ナレッジ構造初期化
-    knowledge = {
-        "meta": {
-            "created": datetime.now().isoformat(),
-            "version": "2.0",
-            "description": "D-Logic生データナレッジ 2020-2025年版",
-            "criteria": "5走以上",
-            "target_count": "30,000+",
-            "last_updated": datetime.now().isoformat()
-        },
-        "horses": {}
-    }
-    
-    conn = None
-    total_processed = 0
-    total_errors = 0
+    if not resume and os.path.exists(PARTS_DIR):
+        shutil.rmtree(PARTS_DIR)
+    os.makedirs(PARTS_DIR, exist_ok=True)
     
     try:
-        # MySQL接続
-        conn = create_mysql_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        print("📊 対象馬を抽出中...")
-        
-        # 5走以上の馬を効率的に取得（年度別集計を避ける）
-        cursor.execute("""
-            SELECT BAMEI, COUNT(*) as race_count
-            FROM umagoto_race_joho
-            WHERE KAISAI_NEN >= '2020'
-            AND KAISAI_NEN <= '2025'
-            AND BAMEI IS NOT NULL
-            AND BAMEI != ''
-            AND KAKUTEI_CHAKUJUN IS NOT NULL
-            GROUP BY BAMEI
-            HAVING race_count >= 5
-            ORDER BY race_count DESC
-            LIMIT 50000
-        """)
-        
-        horses = cursor.fetchall()
-        cursor.close()
-        
-        total_horses = len(horses)
-        print(f"✅ 対象馬数: {total_horses:,}頭（5走以上）")
-        
-        if total_horses == 0:
-            print("❌ 対象馬が見つかりません")
-            return
-        
+        # 1. 各ワーカーが担当パーティションを抽出
         print("\n🏃 処理開始...")
         print("-"*60)
+        partition_stats = run_partitions(rebuild_partition, partitions, workers, args=(PARTS_DIR,))
+        extracted = sum(stat["horses"] for stat in partition_stats)
+        total_errors = sum(stat["errors"] for stat in partition_stats)
+        print(f"✅ 抽出完了: {extracted:,}頭 ({time.time() - start_time:.0f}秒)")
         
-        # バッチ処理パラメータ
-        checkpoint_interval = 100  # 進捗表示間隔
-        save_interval = 500       # 保存間隔
-        
-        for idx, horse_data in enumerate(horses):
-            horse_name = horse_data['BAMEI']
-            race_count = horse_data['race_count']
-            
-            try:
-                # 生データ抽出
-                raw_data = extract_horse_raw_data(conn, horse_name)
-                
-                if raw_data["race_history"]:
-                    # ナレッジに追加
-                    knowledge["horses"][horse_name] = {
-                        "name": horse_name,
-                        "registered_race_count": race_count,
-                        **raw_data
-                    }
-                    total_processed += 1
-                    
-                    # 進捗表示
-                    if total_processed % checkpoint_interval == 0:
-                        progress = (idx + 1) / total_horses * 100
-                        elapsed = time.time() - start_time
-                        rate = total_processed / elapsed if elapsed > 0 else 0
-                        eta = (total_horses - idx - 1) / rate if rate > 0 else 0
-                        
-                        print(f"⏳ {total_processed:,}/{total_horses:,} 処理済 "
-                              f"({progress:.1f}%) "
-                              f"速度: {rate:.1f}頭/秒 "
-                              f"残り: {eta/60:.1f}分")
-                    
-                    # 定期保存
-                    if total_processed % save_interval == 0:
-                        knowledge["meta"]["last_updated"] = datetime.now().isoformat()
-                        knowledge["meta"]["current_count"] = total_processed
-                        with open(temp_file, 'w', encoding='utf-8') as f:
-                            json.dump(knowledge, f, ensure_ascii=False, indent=2)
-                        print(f"💾 中間保存: {total_processed:,}頭完了")
-                
-            except Exception as e:
-                total_errors += 1
-                if total_errors <= 10:
-                    print(f"❌ エラー {horse_name}: {str(e)}")
-                
-                # エラーが多すぎる場合は再接続
-                if total_errors % 50 == 0:
-                    print("⚠️ エラー多発、MySQL再接続...")
-                    if conn:
-                        conn.close()
-                    conn = create_mysql_connection()
-            
-            # 30,000頭に達したら終了
-            if total_processed >= 30000:
-                print(f"\n✅ 目標の30,000頭に到達しました！")
-                break
-        
-        # 最終保存
-        knowledge["meta"]["last_updated"] = datetime.now().isoformat()
-        knowledge["meta"]["total_count"] = total_processed
-        knowledge["meta"]["status"] = "completed"
-        
-        print("\n💾 最終保存中...")
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(knowledge, f, ensure_ascii=False, indent=2)
-        
-        # 一時ファイル削除
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
+        # 2. 馬名順にマージ（パーティション数に関係なく同じバイト列）
+        print("\n💾 マージ中...")
+        meta = {
+            "version": "2.0",
+            "description": "D-Logic生データナレッジ 2020-2025年版",
+            "criteria": "5走以上",
+            "target_count": "30,000+",
+            "status": "completed"
+        }
+        paths = [part_path(PARTS_DIR, partition, partitions) for partition in range(partitions)]
+        merge_result = merge_partitions(paths, OUTPUT_FILE, meta, limit=max_horses, count_field="total_count")
         
-        # 完了レポート
+        # 3. ビルド情報（時刻・所要時間）は成果物とは別に保存
         elapsed_total = time.time() - start_time
-        file_size = os.path.getsize(output_file) / (1024 * 1024) if os.path.exists(output_file) else 0
+        manifest_path = write_manifest(OUTPUT_FILE, {
+            "created": datetime.now().isoformat(),
+            "elapsed_seconds": elapsed_total,
+            "workers": workers,
+            "partitions": partitions,
+            "extracted_horses": extracted,
+            "errors": total_errors,
+            "partition_stats": partition_stats,
+            **merge_result
+        })
+        total_processed = merge_result["horses"]
         
+        # 完了レポート
         print("\n" + "="*60)
         print("🎉 ナレッジファイル再構築完了！")
         print(f"📊 処理結果:")
-        print(f"   - 処理成功: {total_processed:,}頭")
+        print(f"   - 処理成功: {total_processed:,}頭 (抽出 {extracted:,}頭)")
         print(f"   - エラー: {total_errors:,}件")
-        print(f"   - 成功率: {(total_processed/len(horses)*100):.1f}%")
         print(f"   - 処理時間: {elapsed_total/3600:.1f}時間")
         print(f"   - 平均速度: {total_processed/(elapsed_total/60):.0f}頭/分")
-        print(f"   - ファイルサイズ: {file_size:.1f}MB")
-        print(f"   - 保存先: {os.path.abspath(output_file)}")
+        print(f"   - ファイルサイズ: {merge_result['size_bytes'] / (1024 * 1024):.1f}MB")
+        print(f"   - SHA-256: {merge_result['sha256']}")
+        print(f"   - 保存先: {os.path.abspath(OUTPUT_FILE)}")
+        print(f"   - ビルド情報: {os.path.abspath(manifest_path)}")
         print("="*60)
         
         # テスト実行
@@ -322,14 +330,15 @@ def rebuild_knowledge_2025():
         test_horses = ["ダノンザキッド", "ジャスティンミラノ", "シティオブトロイ", "レガレイラ", "ドウデュース"]
         
         for test_horse in test_horses:
-            if test_horse in knowledge["horses"]:
-                horse_data = knowledge["horses"][test_horse]
+            horse_data = find_in_parts(PARTS_DIR, partitions, test_horse)
+            if horse_data:
                 race_count = len(horse_data.get("race_history", []))
                 wins = horse_data.get("aggregated_stats", {}).get("wins", 0)
                 print(f"  ✅ {test_horse}: {race_count}走 {wins}勝")
             else:
                 print(f"  ⚠️ {test_horse}: データなし")
         
+        shutil.rmtree(PARTS_DIR)
         print("\n✅ 再構築プロセス完了！")
         
     except Exception as e:
@@ -337,25 +346,15 @@ def rebuild_knowledge_2025():
         import traceback
         traceback.print_exc()
         
-        # エラー時も途中経過を保存
-        if knowledge["horses"]:
-            knowledge["meta"]["status"] = "error"
-            knowledge["meta"]["error"] = str(e)
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                json.dump(knowledge, f, ensure_ascii=False, indent=2)
-            print(f"💾 エラー保存: {temp_file}")
-    
-    finally:
-        if conn:
-            conn.close()
-            print("🔌 MySQL接続終了")
+        # 完了済みパーティションは残す（REBUILD_RESUME=true で続きから）
+        print(f"💾 完了済みの部分ファイル: {os.path.abspath(PARTS_DIR)}")
 
 if __name__ == "__main__":
     print("🚀 D-Logic ナレッジファイル再構築バッチ（2025年版）")
     print("")
     print("このバッチは以下の処理を行います：")
     print("  1. 2020-2025年のレースデータから5走以上の馬を抽出")
-    print("  2. 各馬の詳細な生データを収集")
+    print("  2. 馬名ハッシュで分割し、CPUコア数分のプロセスで並列収集")
     print("  3. 30,000頭以上のデータをナレッジファイルに保存")
     print("")
     print("⚠️ 推定処理時間: 1-3時間")
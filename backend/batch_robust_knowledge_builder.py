@@ -16,6 +16,7 @@ import logging
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from services.dlogic_raw_data_manager import DLogicRawDataManager
+from services.race_history_extractor import RaceHistoryExtractor, RaceHistoryQuery
 
 # ログ設定
 logging.basicConfig(
@@ -47,8 +48,42 @@ class RobustKnowledgeBuilder:
         self.connection = None
         self.processed_count = 0
         self.error_count = 0
-        self.chunk_size = 100  # 小さなチャンクで処理
-        self.reconnect_interval = 1000  # 1000頭ごとに接続リフレッシュ
+        self.chunk_size = 100  # 100頭ごとに保存
+        self.reconnect_interval = 1000  # 一括抽出では中断時のみ再接続（互換のため残す）
+        self.max_stream_retries = 5
+        
+        # 2020年以降の全出走を馬名順に1本のクエリで流し読み（各馬最新50走）
+        self.extractor = RaceHistoryExtractor(RaceHistoryQuery(
+            columns="""
+                u.RACE_CODE,
+                CONCAT(u.KAISAI_NEN, LPAD(u.KAISAI_GAPPI, 4, '0')) as date,
+                u.KAKUTEI_CHAKUJUN as finish,
+                u.TANSHO_ODDS as odds,
+                u.TANSHO_NINKIJUN as popularity,
+                u.FUTAN_JURYO as weight,
+                u.BATAIJU as horse_weight,
+                u.ZOGEN_SA as weight_change,
+                u.KISHUMEI_RYAKUSHO as jockey,
+                u.CHOKYOSHIMEI_RYAKUSHO as trainer,
+                u.CORNER1_JUNI,
+                u.CORNER2_JUNI,
+                u.CORNER3_JUNI,
+                u.CORNER4_JUNI,
+                u.SOHA_TIME as time,
+                u.BAREI as age,
+                u.SEIBETSU_CODE as sex,
+                r.KYORI as distance,
+                r.TRACK_CODE as track
+            """,
+            from_clause="umagoto_race_joho u LEFT JOIN race_shosai r ON u.RACE_CODE = r.RACE_CODE",
+            conditions=[
+                "u.KAISAI_NEN >= 2020",
+                "u.BAMEI IS NOT NULL",
+                "u.BAMEI != ''"
+            ],
+            max_races=50,
+            min_races=1
+        ))
         
         logger.info("🚀 堅牢なD-Logicナレッジ構築システム初期化")
     
@@ -85,83 +120,10 @@ class RobustKnowledgeBuilder:
                 if not self.connection or not self.connection.is_connected():
                     self.get_fresh_connection()
                 
-                cursor = self.connection.cursor(dictionary=True)
-                
-                # レース履歴取得
-                cursor.execute("""
-                    SELECT 
-                        u.RACE_CODE,
-                        CONCAT(u.KAISAI_NEN, LPAD(u.KAISAI_GAPPI, 4, '0')) as date,
-                        u.KAKUTEI_CHAKUJUN as finish,
-                        u.TANSHO_ODDS as odds,
-                        u.TANSHO_NINKIJUN as popularity,
-                        u.FUTAN_JURYO as weight,
-                        u.BATAIJU as horse_weight,
-                        u.ZOGEN_SA as weight_change,
-                        u.KISHUMEI_RYAKUSHO as jockey,
-                        u.CHOKYOSHIMEI_RYAKUSHO as trainer,
-                        u.CORNER1_JUNI,
-                        u.CORNER2_JUNI,
-                        u.CORNER3_JUNI,
-                        u.CORNER4_JUNI,
-                        u.SOHA_TIME as time,
-                        u.BAREI as age,
-                        u.SEIBETSU_CODE as sex,
-                        r.KYORI as distance,
-                        r.TRACK_CODE as track
-                    FROM umagoto_race_joho u
-                    LEFT JOIN race_shosai r ON u.RACE_CODE = r.RACE_CODE
-                    WHERE u.BAMEI = %s
-                    AND u.KAISAI_NEN >= 2020
-                    ORDER BY u.KAISAI_NEN DESC, u.KAISAI_GAPPI DESC
-                    LIMIT 50
-                """, (horse_name,))
-                
-                races = cursor.fetchall()
-                cursor.close()
-                
+                races = self.extractor.extract_one(self.connection, horse_name)
                 if not races:
                     return None
-                
-                # データ構造化
-                race_history = []
-                basic_info = {
-                    "sex": races[0]['sex'] or "0",
-                    "age": races[0]['age'] or 0,
-                    "last_race_date": races[0]['date']
-                }
-                
-                for race in races:
-                    corner_positions = []
-                    for corner in [race['CORNER1_JUNI'], race['CORNER2_JUNI'], 
-                                 race['CORNER3_JUNI'], race['CORNER4_JUNI']]:
-                        if corner and corner != 0:
-                            corner_positions.append(int(corner))
-                    
-                    race_data = {
-                        "race_code": race['RACE_CODE'],
-                        "date": race['date'],
-                        "finish": int(race['finish']) if race['finish'] else 0,
-                        "odds": float(race['odds']) if race['odds'] else 0.0,
-                        "popularity": int(race['popularity']) if race['popularity'] else 0,
-                        "weight": int(race['weight']) if race['weight'] else 0,
-                        "horse_weight": int(race['horse_weight']) if race['horse_weight'] else 0,
-                        "weight_change": race['weight_change'] or "000",
-                        "jockey": race['jockey'] or "",
-                        "trainer": race['trainer'] or "",
-                        "corner_positions": corner_positions,
-                        "time": float(race['time']) if race['time'] else 0.0,
-                        "age": int(race['age']) if race['age'] else 0,
-                        "sex": race['sex'] or "0",
-                        "distance": int(race['distance']) if race['distance'] else 0,
-                        "track": race['track'] or ""
-                    }
-                    race_history.append(race_data)
-                
-                return {
-                    "basic_info": basic_info,
-                    "race_history": race_history
-                }
+                return self.build_raw_data(races)
                 
             except Exception as e:
                 logger.warning(f"⚠️ {horse_name} 抽出エラー (試行 {attempt + 1}/{max_retries}): {e}")
@@ -177,122 +139,142 @@ class RobustKnowledgeBuilder:
         
         return None
     
-    def get_target_horses(self, exclude_existing=True) -> List[str]:
-        """処理対象馬のリスト取得"""
-        try:
-            self.get_fresh_connection()
-            cursor = self.connection.cursor()
-            
-            # 既存ナレッジから除外する馬名取得
-            existing_horses = set()
-            if exclude_existing:
-                existing_data = self.raw_manager.knowledge_data
-                existing_horses = set(existing_data.get('horses', {}).keys())
-                logger.info(f"📚 既存ナレッジ: {len(existing_horses)}頭をスキップ")
-            
-            # ユニークな馬名を取得（2020年以降のデータ）
-            cursor.execute("""
-                SELECT DISTINCT u.BAMEI
-                FROM umagoto_race_joho u
-                WHERE u.KAISAI_NEN >= 2020
-                AND u.BAMEI IS NOT NULL
-                AND u.BAMEI != ''
-                ORDER BY u.BAMEI
-            """)
-            
-            all_horses = [row[0] for row in cursor.fetchall()]
-            cursor.close()
-            
-            # 既存を除外
-            target_horses = [horse for horse in all_horses if horse not in existing_horses]
-            
-            logger.info(f"🎯 処理対象: {len(target_horses)}頭（全体: {len(all_horses)}頭）")
-            return target_horses
-            
-        except Exception as e:
-            logger.error(f"❌ 対象馬取得エラー: {e}")
-            return []
-    
-    def process_chunk(self, horses_chunk: List[str]) -> Dict[str, Any]:
-        """チャンク単位での処理"""
-        chunk_results = {}
-        chunk_errors = 0
+    def build_raw_data(self, races: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """抽出したレース行（新しい順）をナレッジ形式に構造化"""
+        race_history = []
+        basic_info = {
+            "sex": races[0]['sex'] or "0",
+            "age": races[0]['age'] or 0,
+            "last_race_date": races[0]['date']
+        }
         
-        for horse_name in horses_chunk:
-            try:
-                raw_data = self.extract_horse_raw_data_robust(horse_name)
-                if raw_data:
-                    chunk_results[horse_name] = raw_data
-                    self.processed_count += 1
-                else:
-                    chunk_errors += 1
-                    self.error_count += 1
-                
-                # プログレス表示
-                if self.processed_count % 10 == 0:
-                    logger.info(f"⏳ {self.processed_count}頭処理完了 (エラー: {self.error_count})")
-                
-            except Exception as e:
-                logger.warning(f"❌ {horse_name} 処理エラー: {e}")
-                chunk_errors += 1
-                self.error_count += 1
+        for race in races:
+            corner_positions = []
+            for corner in [race['CORNER1_JUNI'], race['CORNER2_JUNI'], 
+                         race['CORNER3_JUNI'], race['CORNER4_JUNI']]:
+                if corner and corner != 0:
+                    corner_positions.append(int(corner))
+            
+            race_data = {
+                "race_code": race['RACE_CODE'],
+                "date": race['date'],
+                "finish": int(race['finish']) if race['finish'] else 0,
+                "odds": float(race['odds']) if race['odds'] else 0.0,
+                "popularity": int(race['popularity']) if race['popularity'] else 0,
+                "weight": int(race['weight']) if race['weight'] else 0,
+                "horse_weight": int(race['horse_weight']) if race['horse_weight'] else 0,
+                "weight_change": race['weight_change'] or "000",
+                "jockey": race['jockey'] or "",
+                "trainer": race['trainer'] or "",
+                "corner_positions": corner_positions,
+                "time": float(race['time']) if race['time'] else 0.0,
+                "age": int(race['age']) if race['age'] else 0,
+                "sex": race['sex'] or "0",
+                "distance": int(race['distance']) if race['distance'] else 0,
+                "track": race['track'] or ""
+            }
+            race_history.append(race_data)
         
-        return chunk_results
+        return {
+            "basic_info": basic_info,
+            "race_history": race_history
+        }
+    
+    def save_chunk(self, chunk_num: int, chunk_results: Dict[str, Any]):
+        """チャンク単位での中間保存"""
+        try:
+            for horse_name, horse_data in chunk_results.items():
+                self.raw_manager.add_horse_raw_data(horse_name, horse_data)
+            self.raw_manager._save_knowledge()
+            logger.info(f"💾 チャンク {chunk_num} 保存完了 ({len(chunk_results)}頭)")
+        except Exception as e:
+            logger.error(f"❌ チャンク {chunk_num} 保存エラー: {e}")
     
     def run_robust_batch(self, max_horses: int = None):
-        """堅牢なバッチ処理実行"""
+        """堅牢なバッチ処理実行
+        
+        馬ごとのクエリではなく、1本のクエリを馬名順に流し読みする。
+        接続が切れた場合は最後に処理した馬名の次から再開する。
+        """
         start_time = datetime.now()
         logger.info("🏗️ 堅牢なD-Logic生データナレッジ構築開始")
         
-        # 処理対象馬取得
-        target_horses = self.get_target_horses()
-        if max_horses:
-            target_horses = target_horses[:max_horses]
+        # 既存ナレッジの馬は流し読み中にスキップ
+        existing_horses = set(self.raw_manager.knowledge_data.get('horses', {}).keys())
+        logger.info(f"📚 既存ナレッジ: {len(existing_horses)}頭をスキップ")
         
-        if not target_horses:
-            logger.info("✅ 処理対象馬がありません")
-            return
-        
-        logger.info(f"🎯 処理予定: {len(target_horses)}頭")
-        
-        # チャンク単位で処理
-        total_chunks = (len(target_horses) + self.chunk_size - 1) // self.chunk_size
+        chunk_results = {}
+        chunk_num = 0
+        skipped = 0
+        last_horse = None
+        retries = 0
+        done = False
         
-        for i in range(0, len(target_horses), self.chunk_size):
-            chunk_num = i // self.chunk_size + 1
-            chunk_horses = target_horses[i:i + self.chunk_size]
-            
-            logger.info(f"📦 チャンク {chunk_num}/{total_chunks} 処理中 ({len(chunk_horses)}頭)")
-            
-            # 接続リフレッシュ
-            if self.processed_count > 0 and self.processed_count % self.reconnect_interval == 0:
-                logger.info("🔄 MySQL接続リフレッシュ")
-                self.get_fresh_connection()
-            
-            # チャンク処理
-            chunk_results = self.process_chunk(chunk_horses)
-            
-            # 中間保存
-            if chunk_results:
+        while not done:
+            try:
+                if not self.connection or not self.connection.is_connected():
+                    self.get_fresh_connection()
+                
+                stream = self.extractor.stream(self.connection, start_after=last_horse)
                 try:
-                    for horse_name, horse_data in chunk_results.items():
-                        self.raw_manager.add_horse_raw_data(horse_name, horse_data)
-                    self.raw_manager._save_knowledge()
-                    logger.info(f"💾 チャンク {chunk_num} 保存完了 ({len(chunk_results)}頭)")
-                except Exception as e:
-                    logger.error(f"❌ チャンク {chunk_num} 保存エラー: {e}")
-            
-            # 小休憩
-            time.sleep(0.5)
+                    for horse_name, races in stream:
+                        last_horse = horse_name
+                        if horse_name in existing_horses:
+                            skipped += 1
+                            continue
+                        
+                        try:
+                            chunk_results[horse_name] = self.build_raw_data(races)
+                            self.processed_count += 1
+                        except Exception as e:
+                            logger.warning(f"❌ {horse_name} 処理エラー: {e}")
+                            self.error_count += 1
+                        
+                        # プログレス表示
+                        if self.processed_count % 10 == 0:
+                            logger.info(f"⏳ {self.processed_count}頭処理完了 (エラー: {self.error_count})")
+                        
+                        # 中間保存
+                        if len(chunk_results) >= self.chunk_size:
+                            chunk_num += 1
+                            self.save_chunk(chunk_num, chunk_results)
+                            chunk_results = {}
+                        
+                        if max_horses and self.processed_count >= max_horses:
+                            break
+                finally:
+                    stream.close()
+                done = True
+                
+            except Exception as e:
+                retries += 1
+                if retries > self.max_stream_retries:
+                    logger.error(f"❌ 一括抽出を中止 (再試行上限): {e}")
+                    break
+                logger.warning(f"⚠️ 一括抽出中断 (試行 {retries}/{self.max_stream_retries}): {e}")
+                logger.info(f"🔄 {last_horse or '先頭'} の次から再開します")
+                time.sleep(2 ** retries)  # 指数バックオフ
+                try:
+                    self.get_fresh_connection()
+                except Exception:
+                    pass
+        
+        # 残りを保存
+        if chunk_results:
+            chunk_num += 1
+            self.save_chunk(chunk_num, chunk_results)
         
         # 処理完了
         end_time = datetime.now()
         duration = end_time - start_time
+        extract_stats = self.extractor.get_stats()
         
         logger.info("✅ 堅牢なD-Logic生データナレッジ構築完了!")
         logger.info(f"📊 処理統計:")
         logger.info(f"  - 成功: {self.processed_count}頭")
+        logger.info(f"  - スキップ(既存): {skipped}頭")
         logger.info(f"  - エラー: {self.error_count}頭")
+        logger.info(f"  - クエリ回数: {extract_stats['query_count']}回 (読込 {extract_stats['rows_scanned']}行)")
         logger.info(f"  - 処理時間: {duration}")
         
         # 最終確認
@@ -10,6 +10,11 @@ import os
 from datetime import datetime
 from collections import defaultdict
 
+from services.checkpoint_log import CheckpointLog
+
+# 処理済みの馬を追記するチェックポイント（中断しても同じログから再開）
+CHECKPOINT_FILE = "data/checkpoints/strategic_batch.jsonl"
+
 def strategic_batch_process():
     """戦略的バッチ処理メイン"""
     start_time = time.time()
@@ -23,16 +28,16 @@ def strategic_batch_process():
     existing_horses = load_existing_horses_efficiently()
     print(f"📊 既存馬名数: {len(existing_horses):,}頭")
     
-    # 新しいナレッジデータ
-    new_knowledge = {
-        "meta": {
-            "created": datetime.now().isoformat(),
-            "version": "strategic_1.0",
-            "source": "strategic_batch",
-            "target_records": 0
-        },
-        "horses": {}
+    # 新しいナレッジのメタ情報（馬データはチェックポイントログに追記）
+    meta = {
+        "created": datetime.now().isoformat(),
+        "version": "strategic_1.0",
+        "source": "strategic_batch",
+        "target_records": 0
     }
+    checkpoint = CheckpointLog(CHECKPOINT_FILE)
+    if len(checkpoint):
+        print(f"♻️ チェックポイントから再開: {len(checkpoint):,}頭処理済み")
     
     # 直接MySQL接続
     conn = mysql.connector.connect(
@@ -47,8 +52,8 @@ def strategic_batch_process():
     )
     
     try:
-        processed_horses = 0
-        total_records = 0
+        processed_horses = len(checkpoint)
+        total_records = sum(len(data.get('races', [])) for _, data in checkpoint.items())
         
         # 戦略1: 年ごとに処理して負荷分散
         years = ['2024', '2023', '2022', '2021', '2020']
@@ -66,10 +71,12 @@ def strategic_batch_process():
             for horse_name in horses_this_year:
                 if year_processed >= 200:  # 年あたり最大200頭まで
                     break
+                if horse_name in checkpoint:
+                    continue
                     
                 horse_data = extract_horse_data_efficient(conn, horse_name, year)
                 if horse_data:
-                    new_knowledge["horses"][horse_name] = horse_data
+                    checkpoint.append(horse_name, horse_data)
                     year_processed += 1
                     total_records += len(horse_data.get('races', []))
                     
@@ -80,22 +87,21 @@ def strategic_batch_process():
             year_time = time.time() - year_start
             print(f"   ✅ {year}年完了: {year_processed}頭, {year_time:.1f}秒")
             
-            # 中間保存
-            if processed_horses % 100 == 0:
-                save_intermediate_data(new_knowledge, output_file, processed_horses)
+            # 中間保存（年ごとにチェックポイントを確定）
+            save_intermediate_data(checkpoint, processed_horses)
             
             # 早期終了条件（十分なデータが集まった場合）
             if processed_horses >= 1000:
                 print(f"🎯 目標達成: {processed_horses}頭処理完了")
                 break
         
-        # 最終保存
-        new_knowledge["meta"]["horses_count"] = processed_horses
-        new_knowledge["meta"]["total_records"] = total_records
-        new_knowledge["meta"]["completed"] = datetime.now().isoformat()
+        # 最終保存（チェックポイントから原子的に書き出し）
+        meta["horses_count"] = processed_horses
+        meta["total_records"] = total_records
+        meta["completed"] = datetime.now().isoformat()
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(new_knowledge, f, ensure_ascii=False, indent=2)
+        checkpoint.compact(output_file, meta)
+        checkpoint.discard()
         
         elapsed = time.time() - start_time
         
@@ -111,7 +117,9 @@ def strategic_batch_process():
         
     except Exception as e:
         print(f"❌ 処理エラー: {e}")
+        print(f"💾 チェックポイント保持: {len(checkpoint):,}頭 ({CHECKPOINT_FILE})")
     finally:
+        checkpoint.close()
         conn.close()
 
 def load_existing_horses_efficiently():
@@ -216,13 +224,9 @@ def extract_horse_data_efficient(conn, horse_name, primary_year):
     finally:
         cursor.close()
 
-def save_intermediate_data(knowledge, output_file, count):
-    """中間データ保存"""
-    knowledge["meta"]["intermediate_save"] = datetime.now().isoformat()
-    knowledge["meta"]["current_count"] = count
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(knowledge, f, ensure_ascii=False, indent=2)
+def save_intermediate_data(checkpoint, count):
+    """中間データ保存（追記済みのログをfsyncで確定するだけ。全体の書き直しはしない）"""
+    checkpoint.sync()
     print(f"💾 中間保存完了: {count}頭")
 
 if __name__ == "__main__":
@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 """
 分割されたD-Logicデータを統合して読み込むローダー
+バイナリ分割形式（.dlshard）はBloomフィルタで必要なシャードだけを開く
 """
 
 import json
 import os
-from typing import Dict, Any
+from typing import Dict, Any, List
 
 class DLogicDataLoader:
     def __init__(self, data_dir: str = 'data/chunks'):
@@ -13,12 +14,16 @@ class DLogicDataLoader:
         self.index_file = os.path.join(data_dir, 'dlogic_index.json')
         self._index = None
         self._cache = {}
+        self._shards = None
     
     def load_index(self) -> Dict[str, Any]:
         """インデックスファイルを読み込み"""
         if self._index is None:
             with open(self.index_file, 'r', encoding='utf-8') as f:
                 self._index = json.load(f)
+            if self._index['meta'].get('format') == 'dlshard':
+                from services.knowledge_shards import ShardedKnowledge
+                self._shards = ShardedKnowledge(self.data_dir, self._index)
         return self._index
     
     def load_chunk(self, chunk_id: int) -> Dict[str, Any]:
@@ -27,6 +32,8 @@ class DLogicDataLoader:
             return self._cache[chunk_id]
         
         index = self.load_index()
+        if self._shards is not None:
+            return {'meta': index['meta'], 'horses': self._shards.chunk_horses(chunk_id)}
         chunk_info = next(c for c in index['chunks'] if c['chunk_id'] == chunk_id)
         
         filepath = os.path.join(self.data_dir, chunk_info['filename'])
@@ -51,6 +58,10 @@ class DLogicDataLoader:
         """特定の馬のデータを検索"""
         index = self.load_index()
         
+        # バイナリ分割の場合はBloomフィルタで候補シャードを絞る
+        if self._shards is not None:
+            return self._shards.find_horse(horse_name)
+        
         # アルファベット分割の場合は効率的に検索
         if index['meta']['split_method'] == 'alphabetical':
             for chunk_info in index['chunks']:
@@ -67,6 +78,13 @@ class DLogicDataLoader:
         
         return None
     
+    def find_horses(self, horse_names: List[str]) -> Dict[str, Any]:
+        """複数の馬（出走馬全体など）をまとめて検索"""
+        self.load_index()
+        if self._shards is not None:
+            return self._shards.find_horses(horse_names)
+        return {name: self.find_horse(name) for name in horse_names}
+    
     def get_stats(self) -> Dict[str, Any]:
         """データ統計を取得"""
         index = self.load_index()
@@ -32,8 +32,10 @@ from api.admin_cache import router as admin_cache_router
 from api.mylogic import router as mylogic_router
 from models.d_logic_models import ChatDLogicRequest, ChatDLogicResponse
 from services.knowledge_base import KnowledgeBase
+from services.serialization import FastJSONResponse
 
-app = FastAPI(title="Dロジック競馬予想AI", version="2.0.0")
+# レスポンスは共通のJSONシリアライズ（orjson）で返す
+app = FastAPI(title="Dロジック競馬予想AI", version="2.0.0", default_response_class=FastJSONResponse)
 
 # CORS設定
 app.add_middleware(
@@ -2,6 +2,7 @@
 """
 Render向けD-Logicデータマネージャー
 分割されたJSONファイルを効率的に読み込み・キャッシュ
+バイナリ分割形式（.dlshard）の場合はBloomフィルタで必要なシャードだけを開く
 """
 
 import json
@@ -12,6 +13,8 @@ import aiofiles
 from functools import lru_cache
 import logging
 
+from services.knowledge_shards import ShardedKnowledge
+
 class RenderDataManager:
     """
     Render環境で分割されたD-Logicデータを効率的に管理するクラス
@@ -24,6 +27,7 @@ class RenderDataManager:
         self._index = None
         self._chunk_cache = {}
         self._cache_order = []
+        self._shards: Optional[ShardedKnowledge] = None
         
         # ロガーの設定
         self.logger = logging.getLogger(__name__)
@@ -36,6 +40,9 @@ class RenderDataManager:
                 async with aiofiles.open(self.index_file, 'r', encoding='utf-8') as f:
                     content = await f.read()
                     self._index = json.loads(content)
+                if self._index['meta'].get('format') == 'dlshard':
+                    # 各シャードのBloomフィルタだけを読み込む（馬データは検索時に必要な分だけ）
+                    self._shards = await asyncio.to_thread(ShardedKnowledge, self.data_dir, self._index)
                 self.logger.info(f"Loaded index with {self._index['meta']['total_chunks']} chunks")
             except Exception as e:
                 self.logger.error(f"Failed to load index: {e}")
@@ -53,6 +60,9 @@ class RenderDataManager:
         
         # インデックスから該当チャンクの情報を取得
         index = await self.load_index()
+        if self._shards is not None:
+            horses = await asyncio.to_thread(self._shards.chunk_horses, chunk_id)
+            return {'meta': index['meta'], 'horses': horses}
         chunk_info = next((c for c in index['chunks'] if c['chunk_id'] == chunk_id), None)
         
         if not chunk_info:
@@ -88,7 +98,10 @@ class RenderDataManager:
         split_method = index['meta']['split_method']
         
         try:
-            if split_method == 'alphabetical':
+            if self._shards is not None:
+                return await asyncio.to_thread(self._shards.find_horse, horse_name)
+            
+            elif split_method == 'alphabetical':
                 # アルファベット分割の場合は効率的に検索
                 for chunk_info in index['chunks']:
                     if ('first_horse' in chunk_info and 
@@ -110,6 +123,15 @@ class RenderDataManager:
     
     async def find_horses_batch(self, horse_names: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
         """複数の馬を一括検索（並列処理）"""
+        await self.load_index()
+        if self._shards is not None:
+            # 出走馬全体をフィルタで振り分け、該当シャードを1回ずつ開いて検索
+            try:
+                return await asyncio.to_thread(self._shards.find_horses, horse_names)
+            except Exception as e:
+                self.logger.error(f"Error finding horses {horse_names}: {e}")
+                return {name: None for name in horse_names}
+        
         tasks = [self.find_horse(name) for name in horse_names]
         results = await asyncio.gather(*tasks, return_exceptions=True)
         
@@ -132,8 +154,8 @@ class RenderDataManager:
             'total_chunks': index['meta']['total_chunks'],
             'total_horses': total_horses,
             'split_method': index['meta']['split_method'],
-            'cached_chunks': len(self._chunk_cache),
-            'cache_order': self._cache_order.copy(),
+            'cached_chunks': len(self._shards.opened_shards) if self._shards is not None else len(self._chunk_cache),
+            'cache_order': sorted(self._shards.opened_shards) if self._shards is not None else self._cache_order.copy(),
             'chunks': index['chunks']
         }
     
@@ -141,6 +163,8 @@ class RenderDataManager:
         """キャッシュをクリア"""
         self._chunk_cache.clear()
         self._cache_order.clear()
+        if self._shards is not None:
+            self._shards.close()
         self.logger.info("Cache cleared")
     
     async def preload_popular_chunks(self, chunk_ids: List[int]):
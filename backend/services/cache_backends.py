@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+CacheServiceの保存先（バックエンド）
+- memory: プロセス内LRU（既定）
+- sqlite: 同一ホストのワーカー間で共有するSQLiteファイル
+- redis:  複数ホストで共有するRedis（Redisプロトコル互換クライアント）
+
+共有バックエンドは保存時に1回だけJSONにシリアライズし、サイズもそのバイト長を使う
+（外部の保存先から読んだ値をpickleで復元しない。値はAPIの応答と同じJSON互換の辞書・リスト）
+バックエンドはそれぞれスレッドセーフ（CacheServiceはロックを持たずに呼び出す）
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+from services.serialization import dumps_bytes, loads
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# get()で値がなかったことを表す番兵
+MISS = object()
+
+
+def _serialize(value: Any) -> bytes:
+    return dumps_bytes(value)
+
+
+def _deserialize(blob: bytes) -> Any:
+    return loads(blob)
+
+
+def _shared_key(key: Any) -> str:
+    """プロセス間で共通のキー文字列（hash()はプロセスごとに異なるためreprから算出）"""
+    return hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class MemoryCacheBackend:
+    """プロセス内のプレフィックス別LRU"""
+
+    name = 'memory'
+
+    def __init__(self, size_estimator):
+        self._estimate_size = size_estimator
+        # prefix -> OrderedDict[key -> (value, expires_at(monotonic), size)]
+        self._stores: Dict[str, 'OrderedDict[Any, Tuple[Any, float, int]]'] = {}
+        self._bytes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _store(self, prefix: str):
+        store = self._stores.get(prefix)
+        if store is None:
+            store = self._stores[prefix] = OrderedDict()
+            self._bytes[prefix] = 0
+        return store
+
+    def get(self, prefix: str, key: Any) -> Tuple[Any, bool]:
+        """(値 or MISS, 期限切れだったか)を返す"""
+        with self._lock:
+            store = self._store(prefix)
+            entry = store.get(key)
+            if entry is None:
+                return MISS, False
+            if time.monotonic() < entry[1]:
+                store.move_to_end(key)
+                return entry[0], False
+            del store[key]
+            self._bytes[prefix] -= entry[2]
+            return MISS, True
+
+    def set(self, prefix: str, key: Any, value: Any, ttl_seconds: float,
+            max_entries: int, max_bytes: int) -> Tuple[bool, int]:
+        """保存して(保存したか, 追い出した件数)を返す"""
+        size = self._estimate_size(value)
+        if size > max_bytes:
+            # 単体で上限を超える値は保存しない（既存の値はそのまま）
+            return False, 0
+
+        with self._lock:
+            store = self._store(prefix)
+            old = store.pop(key, None)
+            if old is not None:
+                self._bytes[prefix] -= old[2]
+            store[key] = (value, time.monotonic() + ttl_seconds, size)
+            self._bytes[prefix] += size
+
+            # 上限を超えたら最も使われていないものから削除
+            evicted = 0
+            while len(store) > max_entries or self._bytes[prefix] > max_bytes:
+                _, (_, _, evicted_size) = store.popitem(last=False)
+                self._bytes[prefix] -= evicted_size
+                evicted += 1
+        return True, evicted
+
+    def clear_prefix(self, prefix: str) -> int:
+        with self._lock:
+            count = len(self._store(prefix))
+            self._stores[prefix].clear()
+            self._bytes[prefix] = 0
+        return count
+
+    def clear_all(self):
+        with self._lock:
+            self._stores.clear()
+            self._bytes.clear()
+
+    def usage(self) -> Dict[str, Tuple[int, int]]:
+        """プレフィックス別の(件数, バイト数)"""
+        with self._lock:
+            return {prefix: (len(store), self._bytes[prefix]) for prefix, store in self._stores.items()}
+
+
+class SQLiteCacheBackend:
+    """SQLiteファイルによる同一ホスト内の共有キャッシュ（WALモード）"""
+
+    name = 'sqlite'
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                prefix TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (prefix, key)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_lru ON cache_entries (prefix, accessed_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, prefix: str, key: Any) -> Tuple[Any, bool]:
+        conn = self._conn()
+        skey = _shared_key(key)
+        row = conn.execute(
+            "SELECT value, expires_at FROM cache_entries WHERE prefix = ? AND key = ?",
+            (prefix, skey)
+        ).fetchone()
+        if row is None:
+            return MISS, False
+        now = time.time()
+        if now >= row[1]:
+            conn.execute("DELETE FROM cache_entries WHERE prefix = ? AND key = ?", (prefix, skey))
+            return MISS, True
+        conn.execute(
+            "UPDATE cache_entries SET accessed_at = ? WHERE prefix = ? AND key = ?",
+            (now, prefix, skey)
+        )
+        return _deserialize(row[0]), False
+
+    def set(self, prefix: str, key: Any, value: Any, ttl_seconds: float,
+            max_entries: int, max_bytes: int) -> Tuple[bool, int]:
+        blob = _serialize(value)
+        if len(blob) > max_bytes:
+            return False, 0
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?, ?, ?)",
+                (prefix, _shared_key(key), blob, now + ttl_seconds, len(blob), now)
+            )
+            count, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries WHERE prefix = ?",
+                (prefix,)
+            ).fetchone()
+
+            evicted = 0
+            if count > max_entries or total > max_bytes:
+                # 古い順に上限内に収まるまで削除
+                victims = []
+                for skey, size in conn.execute(
+                    "SELECT key, size FROM cache_entries WHERE prefix = ? ORDER BY accessed_at",
+                    (prefix,)
+                ):
+                    if count <= max_entries and total <= max_bytes:
+                        break
+                    victims.append((prefix, skey))
+                    count -= 1
+                    total -= size
+                conn.executemany("DELETE FROM cache_entries WHERE prefix = ? AND key = ?", victims)
+                evicted = len(victims)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return True, evicted
+
+    def clear_prefix(self, prefix: str) -> int:
+        return self._conn().execute("DELETE FROM cache_entries WHERE prefix = ?", (prefix,)).rowcount
+
+    def clear_all(self):
+        self._conn().execute("DELETE FROM cache_entries")
+
+    def usage(self) -> Dict[str, Tuple[int, int]]:
+        rows = self._conn().execute(
+            "SELECT prefix, COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries GROUP BY prefix"
+        )
+        return {prefix: (count, total) for prefix, count, total in rows}
+
+
+class RedisCacheBackend:
+    """Redisによる共有キャッシュ
+
+    値は {namespace}:{prefix}:{key} にPX付きで保存し、
+    LRU順はプレフィックス別のソート済みセット、サイズはハッシュで管理する。
+    上限の判定は複数ワーカー間で厳密ではない（近似）。
+    """
+
+    name = 'redis'
+
+    def __init__(self, client, namespace: str = 'dlogic:cache'):
+        self.client = client
+        self.namespace = namespace
+
+    def _value_key(self, prefix: str, skey: str) -> str:
+        return f"{self.namespace}:{prefix}:{skey}"
+
+    def _lru_key(self, prefix: str) -> str:
+        return f"{self.namespace}:lru:{prefix}"
+
+    def _size_key(self, prefix: str) -> str:
+        return f"{self.namespace}:size:{prefix}"
+
+    @property
+    def _bytes_key(self) -> str:
+        return f"{self.namespace}:bytes"
+
+    def _forget(self, prefix: str, skey: str):
+        """LRU・サイズ管理からエントリを外す"""
+        size = self.client.hget(self._size_key(prefix), skey)
+        self.client.zrem(self._lru_key(prefix), skey)
+        if size is not None:
+            self.client.hdel(self._size_key(prefix), skey)
+            self.client.hincrby(self._bytes_key, prefix, -int(size))
+
+    def get(self, prefix: str, key: Any) -> Tuple[Any, bool]:
+        skey = _shared_key(key)
+        blob = self.client.get(self._value_key(prefix, skey))
+        if blob is None:
+            # LRUに残っていればTTLで消えたエントリ
+            if self.client.zscore(self._lru_key(prefix), skey) is not None:
+                self._forget(prefix, skey)
+                return MISS, True
+            return MISS, False
+        self.client.zadd(self._lru_key(prefix), {skey: time.time()})
+        return _deserialize(blob), False
+
+    def set(self, prefix: str, key: Any, value: Any, ttl_seconds: float,
+            max_entries: int, max_bytes: int) -> Tuple[bool, int]:
+        blob = _serialize(value)
+        if len(blob) > max_bytes:
+            return False, 0
+        skey = _shared_key(key)
+        if self.client.zscore(self._lru_key(prefix), skey) is not None:
+            self._forget(prefix, skey)
+
+        self.client.set(self._value_key(prefix, skey), blob, px=max(1, int(ttl_seconds * 1000)))
+        self.client.zadd(self._lru_key(prefix), {skey: time.time()})
+        self.client.hset(self._size_key(prefix), skey, len(blob))
+        total = self.client.hincrby(self._bytes_key, prefix, len(blob))
+
+        evicted = 0
+        while self.client.zcard(self._lru_key(prefix)) > max_entries or total > max_bytes:
+            oldest = self.client.zrange(self._lru_key(prefix), 0, 0)
+            if not oldest:
+                break
+            victim = oldest[0].decode('utf-8') if isinstance(oldest[0], bytes) else oldest[0]
+            self.client.delete(self._value_key(prefix, victim))
+            self._forget(prefix, victim)
+            total = int(self.client.hget(self._bytes_key, prefix) or 0)
+            evicted += 1
+        return True, evicted
+
+    def clear_prefix(self, prefix: str) -> int:
+        members = self.client.zrange(self._lru_key(prefix), 0, -1)
+        for member in members:
+            member = member.decode('utf-8') if isinstance(member, bytes) else member
+            self.client.delete(self._value_key(prefix, member))
+        self.client.delete(self._lru_key(prefix), self._size_key(prefix))
+        self.client.hdel(self._bytes_key, prefix)
+        return len(members)
+
+    def clear_all(self):
+        for prefix in list(self.usage().keys()):
+            self.clear_prefix(prefix)
+
+    def usage(self) -> Dict[str, Tuple[int, int]]:
+        usage = {}
+        for prefix, total in self.client.hgetall(self._bytes_key).items():
+            prefix = prefix.decode('utf-8') if isinstance(prefix, bytes) else prefix
+            usage[prefix] = (self.client.zcard(self._lru_key(prefix)), int(total))
+        return usage
+
+
+def create_cache_backend(size_estimator):
+    """環境変数CACHE_BACKENDに応じてバックエンドを作成
+
+    共有バックエンドを指定して初期化できない場合はメモリキャッシュに切り替えず RuntimeError
+    （ワーカーごとのキャッシュに黙って戻ると共有されないため）
+    """
+    backend_type = os.getenv('CACHE_BACKEND', 'memory').lower()
+    if backend_type == 'memory':
+        return MemoryCacheBackend(size_estimator)
+    try:
+        if backend_type == 'sqlite':
+            path = os.getenv('CACHE_SQLITE_PATH', os.path.join(
+                os.path.dirname(__file__), '..', 'data', 'cache.sqlite3'
+            ))
+            return SQLiteCacheBackend(path)
+        if backend_type == 'redis':
+            if redis is None:
+                raise RuntimeError("redisパッケージがインストールされていません（pip install redis）")
+            client = redis.Redis.from_url(os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0'))
+            client.ping()
+            return RedisCacheBackend(client)
+    except Exception as e:
+        raise RuntimeError(f"キャッシュバックエンド({backend_type})の初期化に失敗しました: {e}") from e
+    raise RuntimeError(f"不明なキャッシュバックエンド: {backend_type}（memory / sqlite / redis）")
@@ -2,21 +2,44 @@
 """
 キャッシュサービス
 OpenAI APIとD-Logic分析結果をキャッシュして負荷軽減
+プレフィックスごとにTTL・件数上限・バイト上限を持つLRUキャッシュ
+（保存先はservices/cache_backends.pyで切り替え: memory / sqlite / redis）
 """
-from datetime import datetime, timedelta
+from datetime import timedelta
 from typing import Any, Dict, Optional
-import hashlib
-import json
-from functools import lru_cache
+import asyncio
+import sys
+import threading
+from services.cache_backends import MISS, create_cache_backend
+
+# プレフィックス別の上限（件数, バイト数）
+DEFAULT_SIZE_LIMIT = (500, 16 * 1024 * 1024)
+
+
+class _PrefixCounters:
+    """1プレフィックス分の統計（プロセスごと）"""
+
+    __slots__ = ('hits', 'misses', 'evictions', 'expirations', 'rejections')
 
-class CacheService:
-    """メモリベースのキャッシュサービス"""
-    
     def __init__(self):
-        self.cache: Dict[str, Dict[str, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejections = 0
+
+
+class CacheService:
+    """キャッシュサービス"""
+
+    def __init__(self, backend=None):
+        self.backend = backend or create_cache_backend(_estimate_size)
+        self._counters: Dict[str, _PrefixCounters] = {}
+        # 統計のカウンタだけを守る（バックエンドの読み書きはロックの外で行う）
+        self._lock = threading.RLock()
         self.hit_count = 0
         self.miss_count = 0
-        
+
         # TTL設定（用途別）
         self.ttl_settings = {
             'chat_response': timedelta(hours=24),      # チャット応答: 24時間
@@ -24,125 +47,176 @@ class CacheService:
             'weather_analysis': timedelta(hours=12),   # 天候適性: 12時間
             'faq_response': timedelta(days=7),         # FAQ: 7日間
             'race_analysis': timedelta(hours=6),       # レース分析: 6時間
+            'race_card': timedelta(hours=24),          # 開催の事前計算（ナレッジのバージョン付き）: 24時間
         }
-    
-    def _generate_key(self, prefix: str, data: Any) -> str:
-        """キャッシュキーを生成"""
+
+        # 容量設定（用途別: 最大件数, 最大バイト数）
+        self.size_limits = {
+            'chat_response': (500, 16 * 1024 * 1024),
+            'dlogic_analysis': (2000, 16 * 1024 * 1024),
+            'weather_analysis': (1000, 8 * 1024 * 1024),
+            'faq_response': (200, 4 * 1024 * 1024),
+            'race_analysis': (500, 32 * 1024 * 1024),
+            'race_card': (1000, 64 * 1024 * 1024),
+        }
+
+    def _generate_key(self, prefix: str, data: Any) -> Any:
+        """キャッシュキーを生成（ハッシュ計算なしのハッシュ可能な値）"""
+        if isinstance(data, (str, int, float, bool)) or data is None:
+            return data
         if isinstance(data, dict):
-            # 辞書の場合はソートしてJSON化
-            data_str = json.dumps(data, sort_keys=True, ensure_ascii=False)
-        elif isinstance(data, list):
-            # リストの場合はソートしてJSON化
-            data_str = json.dumps(sorted(data), ensure_ascii=False)
-        else:
-            data_str = str(data)
-        
-        # MD5ハッシュでキーを生成
-        hash_obj = hashlib.md5(data_str.encode('utf-8'))
-        return f"{prefix}:{hash_obj.hexdigest()}"
-    
+            # 辞書はキー順にそろえる
+            return ('dict', _freeze(data))
+        if isinstance(data, list):
+            # リストは順序を無視（従来通りソートしてから）
+            return ('list', tuple(sorted(_freeze(item) for item in data)))
+        return ('other', _freeze(data))
+
+    def _counter(self, prefix: str) -> _PrefixCounters:
+        counter = self._counters.get(prefix)
+        if counter is None:
+            counter = self._counters[prefix] = _PrefixCounters()
+        return counter
+
     def get(self, prefix: str, data: Any) -> Optional[Any]:
         """キャッシュから取得"""
         key = self._generate_key(prefix, data)
-        
-        if key in self.cache:
-            entry = self.cache[key]
-            # 有効期限チェック
-            if datetime.now() < entry['expires_at']:
+        try:
+            value, expired = self.backend.get(prefix, key)
+        except Exception as e:
+            print(f"⚠️ キャッシュ取得エラー({self.backend.name}): {e}")
+            value, expired = MISS, False
+
+        with self._lock:
+            counter = self._counter(prefix)
+            if value is not MISS:
+                counter.hits += 1
                 self.hit_count += 1
                 print(f"📋 キャッシュヒット: {prefix} (ヒット率: {self.get_hit_rate():.1f}%)")
-                return entry['value']
-            else:
-                # 期限切れは削除
-                del self.cache[key]
-        
-        self.miss_count += 1
-        return None
-    
+                return value
+
+            # 期限切れは参照時にバックエンド側で削除済み
+            if expired:
+                counter.expirations += 1
+            counter.misses += 1
+            self.miss_count += 1
+            return None
+
     def set(self, prefix: str, data: Any, value: Any, ttl_override: Optional[timedelta] = None) -> None:
-        """キャッシュに保存"""
+        """キャッシュに保存（上限を超えたら最も使われていないものから削除）"""
         key = self._generate_key(prefix, data)
-        
+
         # TTL決定
         ttl = ttl_override or self.ttl_settings.get(prefix, timedelta(hours=24))
-        
-        self.cache[key] = {
-            'value': value,
-            'created_at': datetime.now(),
-            'expires_at': datetime.now() + ttl,
-            'prefix': prefix
-        }
-        
-        # メモリ管理（最大1000エントリ）
-        if len(self.cache) > 1000:
-            self._cleanup_old_entries()
-    
-    def _cleanup_old_entries(self):
-        """古いエントリを削除"""
-        now = datetime.now()
-        # 期限切れを削除
-        expired_keys = [k for k, v in self.cache.items() if v['expires_at'] < now]
-        for key in expired_keys:
-            del self.cache[key]
-        
-        # それでも多い場合は古い順に削除
-        if len(self.cache) > 800:
-            sorted_items = sorted(
-                self.cache.items(),
-                key=lambda x: x[1]['created_at']
-            )
-            for key, _ in sorted_items[:200]:
-                del self.cache[key]
-    
+        max_entries, max_bytes = self.size_limits.get(prefix, DEFAULT_SIZE_LIMIT)
+
+        try:
+            stored, evicted = self.backend.set(prefix, key, value, ttl.total_seconds(), max_entries, max_bytes)
+        except Exception as e:
+            print(f"⚠️ キャッシュ保存エラー({self.backend.name}): {e}")
+            return
+        with self._lock:
+            counter = self._counter(prefix)
+            counter.evictions += evicted
+            if not stored:
+                # 単体でバイト上限を超える値は保存しない
+                counter.rejections += 1
+
+    async def get_async(self, prefix: str, data: Any) -> Optional[Any]:
+        """非同期ハンドラ用のget（共有バックエンドの通信はスレッドで行いイベントループを止めない）"""
+        if self.backend.name == 'memory':
+            return self.get(prefix, data)
+        return await asyncio.to_thread(self.get, prefix, data)
+
+    async def set_async(self, prefix: str, data: Any, value: Any, ttl_override: Optional[timedelta] = None) -> None:
+        """非同期ハンドラ用のset"""
+        if self.backend.name == 'memory':
+            self.set(prefix, data, value, ttl_override)
+        else:
+            await asyncio.to_thread(self.set, prefix, data, value, ttl_override)
+
     def clear_prefix(self, prefix: str):
         """特定のプレフィックスのキャッシュをクリア"""
-        keys_to_delete = [k for k, v in self.cache.items() if v.get('prefix') == prefix]
-        for key in keys_to_delete:
-            del self.cache[key]
-        print(f"🗑️ {prefix}のキャッシュをクリア: {len(keys_to_delete)}件")
-    
+        count = self.backend.clear_prefix(prefix)
+        print(f"🗑️ {prefix}のキャッシュをクリア: {count}件")
+
+    def clear_all(self):
+        """すべてのキャッシュと統計をクリア"""
+        self.backend.clear_all()
+        with self._lock:
+            self._counters.clear()
+            self.hit_count = 0
+            self.miss_count = 0
+
     def get_hit_rate(self) -> float:
         """キャッシュヒット率を取得"""
         total = self.hit_count + self.miss_count
         if total == 0:
             return 0.0
         return (self.hit_count / total) * 100
-    
+
     def get_stats(self) -> Dict[str, Any]:
         """キャッシュ統計情報を取得"""
-        stats = {
-            'total_entries': len(self.cache),
-            'hit_count': self.hit_count,
-            'miss_count': self.miss_count,
-            'hit_rate': self.get_hit_rate(),
-            'memory_usage_mb': self._estimate_memory_usage(),
-            'entries_by_prefix': {}
-        }
-        
-        # プレフィックス別の統計
-        for key, entry in self.cache.items():
-            prefix = entry.get('prefix', 'unknown')
-            if prefix not in stats['entries_by_prefix']:
-                stats['entries_by_prefix'][prefix] = 0
-            stats['entries_by_prefix'][prefix] += 1
-        
+        usage = self.backend.usage()
+        with self._lock:
+            stats = {
+                'backend': self.backend.name,
+                'total_entries': sum(entries for entries, _ in usage.values()),
+                'hit_count': self.hit_count,
+                'miss_count': self.miss_count,
+                'hit_rate': self.get_hit_rate(),
+                'memory_usage_mb': sum(size for _, size in usage.values()) / (1024 * 1024),
+                'entries_by_prefix': {},
+                'prefixes': {}
+            }
+
+            # プレフィックス別の統計（件数・サイズは共有分、ヒット等はこのプロセス分）
+            for prefix in sorted(set(usage) | set(self._counters)):
+                entries, size = usage.get(prefix, (0, 0))
+                counter = self._counter(prefix)
+                max_entries, max_bytes = self.size_limits.get(prefix, DEFAULT_SIZE_LIMIT)
+                lookups = counter.hits + counter.misses
+                stats['entries_by_prefix'][prefix] = entries
+                stats['prefixes'][prefix] = {
+                    'entries': entries,
+                    'bytes': size,
+                    'max_entries': max_entries,
+                    'max_bytes': max_bytes,
+                    'hits': counter.hits,
+                    'misses': counter.misses,
+                    'hit_rate': (counter.hits / lookups * 100) if lookups else 0.0,
+                    'evictions': counter.evictions,
+                    'expirations': counter.expirations,
+                    'rejections': counter.rejections
+                }
+
         return stats
-    
-    def _estimate_memory_usage(self) -> float:
-        """メモリ使用量を推定（MB）"""
-        # 簡易的な推定
-        total_size = 0
-        for key, entry in self.cache.items():
-            # キーのサイズ
-            total_size += len(key.encode('utf-8'))
-            # 値のサイズ（JSON化して推定）
-            try:
-                value_str = json.dumps(entry, ensure_ascii=False)
-                total_size += len(value_str.encode('utf-8'))
-            except:
-                total_size += 1000  # エラー時は1KBと仮定
-        
-        return total_size / (1024 * 1024)  # MB変換
+
+
+def _freeze(data: Any) -> Any:
+    """辞書・リストをハッシュ可能なタプルに変換"""
+    if isinstance(data, dict):
+        return tuple(sorted((str(k), _freeze(v)) for k, v in data.items()))
+    if isinstance(data, (list, tuple)):
+        return tuple(_freeze(item) for item in data)
+    if isinstance(data, set):
+        return tuple(sorted(_freeze(item) for item in data))
+    try:
+        hash(data)
+        return data
+    except TypeError:
+        return repr(data)
+
+
+def _estimate_size(value: Any, depth: int = 2) -> int:
+    """値のサイズ（バイト）を見積もる（シリアライズせず、入れ子2段までのsys.getsizeofの合計で概算）"""
+    size = sys.getsizeof(value, 64)
+    if depth:
+        if isinstance(value, dict):
+            size += sum(sys.getsizeof(k, 64) + _estimate_size(v, depth - 1) for k, v in value.items())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            size += sum(_estimate_size(item, depth - 1) for item in value)
+    return size
 
 
 # グローバルインスタンス（全インスタンスで共有）
@@ -159,16 +233,16 @@ def cached(prefix: str, ttl: Optional[timedelta] = None):
                 'args': args,
                 'kwargs': kwargs
             }
-            
+
             # キャッシュチェック
             cached_value = cache_service.get(prefix, cache_data)
             if cached_value is not None:
                 return cached_value
-            
+
             # 実行してキャッシュ
             result = func(*args, **kwargs)
             cache_service.set(prefix, cache_data, result, ttl)
             return result
-        
+
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+ナレッジ構築のチェックポイントログ
+処理済みの馬を1行1頭で追記するだけのログ（JSON Lines）と、
+ログから最終ナレッジファイルへの原子的な書き出し（コンパクション）
+
+- 追記はN件ごと・T秒ごとにまとめてfsync（件数に関係なく1頭あたりのコストは一定）
+- クラッシュで書きかけになった末尾の行は、次回オープン時に切り捨てる
+- 再開時の「処理済みか」の判定はメモリ上の索引でO(1)
+- 最終ファイルは一時ファイルに書いてfsyncしてから置き換える（途中で落ちても壊れない）
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from services.serialization import dumps_bytes, json_default, loads
+
+# まとめてfsyncする件数・間隔（秒）
+CHECKPOINT_SYNC_EVERY = int(os.getenv('CHECKPOINT_SYNC_EVERY', 100))
+CHECKPOINT_SYNC_INTERVAL = float(os.getenv('CHECKPOINT_SYNC_INTERVAL', 5.0))
+
+
+def _fsync_directory(path: str):
+    """リネームを確定させる（ディレクトリをopenできないOSでは何もしない）"""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path: str, write: Callable[[Any], None], encoding: str = 'utf-8'):
+    """write(f)で一時ファイルに書き、fsync後に置き換える"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'w', encoding=encoding) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _fsync_directory(path)
+
+
+def write_knowledge_stream(output_path: str, meta: Dict[str, Any],
+                           horses: Iterable[Tuple[str, Any]]) -> Dict[str, Any]:
+    """{"meta", "horses"} のナレッジJSONを1頭ずつ書き出す（全体をメモリに載せない）
+
+    書式は json.dump(knowledge, ensure_ascii=False, indent=2) と同じ。
+    """
+    digest = hashlib.sha256()
+    result = {"horses": 0}
+
+    def write(f):
+        def emit(text: str):
+            f.write(text)
+            digest.update(text.encode('utf-8'))
+
+        meta_json = json.dumps(meta, ensure_ascii=False, indent=2, default=json_default)
+        emit('{\n  "meta": ' + meta_json.replace('\n', '\n  ') + ',\n  "horses": {')
+        written = 0
+        for key, record in horses:
+            pretty = json.dumps(record, ensure_ascii=False, indent=2, default=json_default)
+            emit(('\n' if written == 0 else ',\n') +
+                 '    ' + json.dumps(key, ensure_ascii=False) + ': ' + pretty.replace('\n', '\n    '))
+            written += 1
+        emit('\n  }\n}' if written else '}\n}')
+        result["horses"] = written
+
+    atomic_write(output_path, write)
+    result.update({
+        "output_path": output_path,
+        "sha256": digest.hexdigest(),
+        "size_bytes": os.path.getsize(output_path)
+    })
+    return result
+
+
+class CheckpointLog:
+    """処理済みの馬を追記していくチェックポイントログ"""
+
+    def __init__(self, path: str, sync_every: Optional[int] = None,
+                 sync_interval: Optional[float] = None):
+        self.path = path
+        self.sync_every = sync_every or CHECKPOINT_SYNC_EVERY
+        self.sync_interval = sync_interval if sync_interval is not None else CHECKPOINT_SYNC_INTERVAL
+        # 馬名 -> 最新レコードの行頭オフセット（同じ馬が複数回あれば後勝ち）
+        self._offsets: Dict[str, int] = {}
+        self.last_key: Optional[str] = None
+        self.recovered_bytes = 0
+        self.sync_count = 0
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._load()
+        self._file = open(path, 'ab')
+
+    def _load(self):
+        """既存ログを読み込み、書きかけの末尾行があれば切り捨てる"""
+        if not os.path.exists(self.path):
+            return
+        valid_end = 0
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    key = loads(line)[0]
+                except (ValueError, IndexError, TypeError):
+                    break
+                self._offsets.pop(key, None)
+                self._offsets[key] = offset
+                self.last_key = key
+                offset += len(line)
+                valid_end = offset
+
+        size = os.path.getsize(self.path)
+        if valid_end < size:
+            self.recovered_bytes = size - valid_end
+            print(f"⚠️ チェックポイントログ末尾の不完全な{self.recovered_bytes}バイトを破棄: {self.path}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_end)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def keys(self) -> Iterable[str]:
+        return self._offsets.keys()
+
+    def append(self, key: str, record: Any):
+        """1頭分を追記（fsyncはまとめて行う）"""
+        line = dumps_bytes([key, record]) + b'\n'
+        offset = self._file.tell()
+        self._file.write(line)
+        self._offsets.pop(key, None)
+        self._offsets[key] = offset
+        self.last_key = key
+        self._pending += 1
+        if (self._pending >= self.sync_every or
+                time.monotonic() - self._last_sync >= self.sync_interval):
+            self.sync()
+
+    def sync(self):
+        """未確定の追記をディスクに確定"""
+        if self._file.closed:
+            return
+        self._file.flush()
+        if self._pending:
+            os.fsync(self._file.fileno())
+            self.sync_count += 1
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """(馬名, レコード) を追記順に返す（同じ馬は最新のみ）"""
+        self.sync()
+        latest = sorted((offset, key) for key, offset in self._offsets.items())
+        with open(self.path, 'rb') as f:
+            for offset, key in latest:
+                f.seek(offset)
+                yield key, loads(f.readline())[1]
+
+    def compact(self, output_path: str, meta: Dict[str, Any],
+                base_horses: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """既存データ（base_horses）とログを1つのナレッジファイルに原子的に書き出す"""
+        def horses():
+            if base_horses:
+                for key, record in base_horses.items():
+                    if key not in self._offsets:
+                        yield key, record
+            yield from self.items()
+
+        return write_knowledge_stream(output_path, meta, horses())
+
+    def discard(self):
+        """コンパクション後にログを削除"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "entries": len(self._offsets),
+            "sync_count": self.sync_count,
+            "recovered_bytes": self.recovered_bytes
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
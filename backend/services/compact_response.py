@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+コンパクト（列形式）レスポンス
+出走馬ごとの入れ子の辞書（d_logic_scores と12項目の長いキー名の繰り返し）を、
+項目名のヘッダー1つ + 項目ごとの値の配列に変換し、クライアントに合わせてエンコード・圧縮する
+
+- エンコード: Accept に application/msgpack があれば msgpack（msgpack がインストールされている場合のみ）、
+  それ以外は JSON（services.serialization）
+- 圧縮: Accept-Encoding に合わせて br（brotli がインストールされている場合のみ）→ gzip
+- 馬ごとの計算時刻・フェーズ別時間は省く（レース全体の集計は race_analysis に残る）
+"""
+import gzip
+import os
+from typing import Any, Dict, List, Optional
+
+from fastapi import Request, Response
+
+from services.serialization import dumps_bytes, json_default
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# この大きさ未満のレスポンスは圧縮しない
+COMPRESS_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.getenv('RESPONSE_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.getenv('RESPONSE_BROTLI_QUALITY', 5))
+
+COLUMNAR_FORMAT = 'columnar'
+SCORES_FIELD = 'd_logic_scores'
+# 列形式では省く馬ごとの項目
+DROPPED_FIELDS = frozenset({'calculation_time', 'timing_breakdown'})
+
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def to_columnar(horses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """出走馬の結果リストを列形式に変換
+
+    Returns:
+        {"format": "columnar", "count": 頭数,
+         "factors": [12項目名], "scores": [[項目1の全馬の値], ...],
+         "fields": [その他の項目名], "columns": {項目名: [全馬の値]}}
+        値がない馬は None
+    """
+    factors: Dict[str, None] = {}
+    fields: Dict[str, None] = {}
+    for horse in horses:
+        for key, value in horse.items():
+            if key in DROPPED_FIELDS:
+                continue
+            if key == SCORES_FIELD and isinstance(value, dict):
+                factors.update(dict.fromkeys(value))
+            else:
+                fields[key] = None
+
+    horse_scores = [horse.get(SCORES_FIELD) or {} for horse in horses]
+    return {
+        'format': COLUMNAR_FORMAT,
+        'count': len(horses),
+        'factors': list(factors),
+        'scores': [[scores.get(factor) for scores in horse_scores] for factor in factors],
+        'fields': list(fields),
+        'columns': {field: [horse.get(field) for horse in horses] for field in fields},
+    }
+
+
+def from_columnar(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """列形式を出走馬ごとの辞書に戻す（Pythonクライアント・テスト用）"""
+    horses = []
+    for index in range(payload['count']):
+        horse = {field: payload['columns'][field][index] for field in payload['fields']}
+        scores = {factor: column[index] for factor, column in zip(payload['factors'], payload['scores'])}
+        if any(value is not None for value in scores.values()):
+            horse[SCORES_FIELD] = scores
+        horses.append(horse)
+    return horses
+
+
+def compact_race_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """レース分析結果の horses を列形式にしたコピー（元の結果・キャッシュは変更しない）"""
+    horses = result.get('horses')
+    if not isinstance(horses, list):
+        return result
+    return {**result, 'horses': to_columnar(horses)}
+
+
+def _accepted_encodings(header: str) -> Dict[str, float]:
+    """Accept-Encoding を {エンコーディング: q値} に（q=0 は除く）"""
+    encodings = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if quality > 0:
+            encodings[name] = quality
+    return encodings
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """使える圧縮方式のうちクライアントのq値が最も高いもの（同じならbr優先）"""
+    accepted = _accepted_encodings(accept_encoding or '')
+    available = (['br'] if brotli is not None else []) + ['gzip']
+    candidates = [name for name in available if name in accepted or '*' in accepted]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda name: accepted.get(name, accepted.get('*', 0.0)))
+
+
+def encode_response(content: Any, request: Request, status_code: int = 200) -> Response:
+    """Accept / Accept-Encoding に合わせてエンコード・圧縮したレスポンス"""
+    accept = request.headers.get('accept', '')
+    if msgpack is not None and any(media_type in accept for media_type in MSGPACK_TYPES):
+        body = msgpack.packb(content, default=json_default, use_bin_type=True)
+        media_type = 'application/msgpack'
+    else:
+        body = dumps_bytes(content)
+        media_type = 'application/json'
+
+    headers = {'Vary': 'Accept, Accept-Encoding'}
+    encoding = choose_encoding(request.headers.get('accept-encoding', ''))
+    if encoding and len(body) >= COMPRESS_MIN_BYTES:
+        if encoding == 'br':
+            body = brotli.compress(body, quality=BROTLI_QUALITY)
+        else:
+            body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        headers['Content-Encoding'] = encoding
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
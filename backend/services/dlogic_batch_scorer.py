@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+D-Logic一括スコアリングエンジン
+出走馬全頭（またはナレッジ全体）の12項目をNumPyで一括計算
+スカラー版（DLogicRawDataManager._calc_*）と同一の結果を返す
+入力は生データ辞書または解析済みレース記録（HorseRecords）
+"""
+from typing import Dict, List, Any, Optional, Tuple
+
+from services.race_record import INVALID, HorseRecords, RaceRecord, as_horse_records
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 各項目の「着順→スコア」係数（max(0, 100 - (平均着順 - 1) * 係数)）
+_GROUP_FACTOR_SLOPES = {
+    "1_distance_aptitude": 10,
+    "3_jockey_compatibility": 8,
+    "4_trainer_evaluation": 8,
+    "5_track_aptitude": 8,
+    "6_weather_aptitude": 8,
+}
+
+class _GroupEvents:
+    """(馬, グループ)単位で着順を集計するためのイベント列"""
+
+    def __init__(self):
+        self.group_ids: Dict[Tuple[int, Any], int] = {}
+        self.group_horse: List[int] = []
+        self.event_group: List[int] = []
+        self.event_value: List[int] = []
+
+    def add(self, horse_idx: int, key: Any, value: int):
+        group_key = (horse_idx, key)
+        gid = self.group_ids.get(group_key)
+        if gid is None:
+            # 出現順にIDを振ることでスカラー版と同じ加算順序になる
+            gid = len(self.group_horse)
+            self.group_ids[group_key] = gid
+            self.group_horse.append(horse_idx)
+        self.event_group.append(gid)
+        self.event_value.append(value)
+
+
+class _RaceEvents:
+    """レース単位のスコア計算用の列"""
+
+    def __init__(self, *fields: str):
+        self.horse: List[int] = []
+        self.columns: Dict[str, List[Any]] = {field: [] for field in fields}
+
+    def add(self, horse_idx: int, **values):
+        self.horse.append(horse_idx)
+        for field, value in values.items():
+            self.columns[field].append(value)
+
+    def array(self, field: str, dtype) -> "np.ndarray":
+        return np.asarray(self.columns[field], dtype=dtype)
+
+
+class DLogicBatchScorer:
+    """12項目D-Logicの一括ベクトル計算"""
+
+    def __init__(self, raw_manager):
+        self.raw_manager = raw_manager
+
+    @property
+    def available(self) -> bool:
+        """NumPyが利用可能か"""
+        return np is not None
+
+    def score_raw_data(self, raw_datas: List[Any]) -> List[Optional[Dict[str, Any]]]:
+        """生データ辞書（またはHorseRecords）のリストを一括計算
+
+        Returns:
+            入力順に {"d_logic_scores", "total_score", "grade"}
+            （スカラー版で例外になる馬はNone）
+        """
+        if not raw_datas:
+            return []
+        if np is None:
+            return [self._score_scalar(raw_data) for raw_data in raw_datas]
+
+        horses: List[HorseRecords] = [as_horse_records(raw_data) for raw_data in raw_datas]
+        n = len(horses)
+        groups = {key: _GroupEvents() for key in _GROUP_FACTOR_SLOPES}
+        popularity = _RaceEvents("pop", "fin")
+        weight = _RaceEvents("weight", "fin")
+        horse_weight = _RaceEvents("weight", "change", "fin")
+        corner = _RaceEvents("improvement")
+        margin = _RaceEvents("fin", "margin")
+        time_index = _RaceEvents("time", "fin", "distance")
+        bloodline = [0.0] * n
+        # 集計済みstatsを持つ馬など、スカラー版で計算する項目
+        overrides = set()
+
+        for h, horse in enumerate(horses):
+            stats = horse.stats
+            if stats.get("jockey_performance", {}):
+                overrides.add((h, "3_jockey_compatibility"))
+            if stats.get("trainer_performance", {}):
+                overrides.add((h, "4_trainer_evaluation"))
+
+            for race in horse.races:
+                self._collect_race(h, race, groups, popularity, weight, horse_weight,
+                                   corner, margin, time_index)
+
+            wins = stats.get("wins", 0)
+            total = stats.get("total_races", 0)
+            if total == 0 and horse.races:
+                total = len(horse.races)
+                wins = sum(1 for race in horse.races if race.win)
+            win_rate = wins / total if total > 0 else 0
+            bloodline[h] = min(100, win_rate * 200)
+
+        matrix = np.empty((n, len(self.raw_manager.FACTOR_KEYS)), dtype=np.float64)
+        column = {key: i for i, key in enumerate(self.raw_manager.FACTOR_KEYS)}
+
+        for key, events in groups.items():
+            matrix[:, column[key]] = self._group_mean_score(events, n, _GROUP_FACTOR_SLOPES[key])
+        matrix[:, column["2_bloodline_evaluation"]] = bloodline
+        matrix[:, column["7_popularity_factor"]] = self._popularity_scores(popularity, n)
+        matrix[:, column["8_weight_impact"]] = self._weight_scores(weight, n)
+        matrix[:, column["9_horse_weight_impact"]] = self._horse_weight_scores(horse_weight, n)
+        matrix[:, column["10_corner_specialist_degree"]] = self._corner_scores(corner, n)
+        matrix[:, column["11_margin_analysis"]] = self._margin_scores(margin, n)
+        matrix[:, column["12_time_index"]] = self._time_scores(time_index, n)
+
+        # スカラー版で計算すべき項目を上書き
+        failed = set()
+        for (h, key) in overrides:
+            try:
+                matrix[h, column[key]] = self._scalar_method(key)(horses[h])
+            except Exception:
+                failed.add(h)
+
+        totals = self.total_scores(matrix)
+        results = []
+        for h in range(n):
+            if h in failed:
+                results.append(None)
+                continue
+            scores = {key: float(matrix[h, i]) for i, key in enumerate(self.raw_manager.FACTOR_KEYS)}
+            total = float(totals[h])
+            results.append({
+                "d_logic_scores": scores,
+                "total_score": total,
+                "grade": self.raw_manager._grade_performance(total),
+            })
+        return results
+
+    def total_scores(self, matrix: "np.ndarray") -> "np.ndarray":
+        """12項目行列から総合スコアを計算（スカラー版と同じ加算順序）"""
+        weighted_sum = np.zeros(matrix.shape[0], dtype=np.float64)
+        for i, weight in enumerate(self.raw_manager.FACTOR_WEIGHTS):
+            weighted_sum = weighted_sum + matrix[:, i] * weight
+        return weighted_sum / sum(self.raw_manager.FACTOR_WEIGHTS)
+
+    def _score_scalar(self, raw_data: Any) -> Optional[Dict[str, Any]]:
+        """NumPyがない環境向けのスカラー計算"""
+        raw_data = as_horse_records(raw_data)
+        try:
+            scores = {key: self._scalar_method(key)(raw_data) for key in self.raw_manager.FACTOR_KEYS}
+        except Exception:
+            return None
+        total = self.raw_manager._calculate_total_score(scores)
+        return {
+            "d_logic_scores": scores,
+            "total_score": total,
+            "grade": self.raw_manager._grade_performance(total),
+        }
+
+    def _scalar_method(self, key: str):
+        manager = self.raw_manager
+        return {
+            "1_distance_aptitude": manager._calc_distance_aptitude,
+            "2_bloodline_evaluation": manager._calc_bloodline_evaluation,
+            "3_jockey_compatibility": manager._calc_jockey_compatibility,
+            "4_trainer_evaluation": manager._calc_trainer_evaluation,
+            "5_track_aptitude": manager._calc_track_aptitude,
+            "6_weather_aptitude": manager._calc_weather_aptitude,
+            "7_popularity_factor": manager._calc_popularity_factor,
+            "8_weight_impact": manager._calc_weight_impact,
+            "9_horse_weight_impact": manager._calc_horse_weight_impact,
+            "10_corner_specialist_degree": manager._calc_corner_specialist,
+            "11_margin_analysis": manager._calc_margin_analysis,
+            "12_time_index": manager._calc_time_index,
+        }[key]
+
+    # --- 解析済みレース記録（services/race_record.py）1件の展開 ---
+
+    @staticmethod
+    def _collect_race(h: int, race: RaceRecord, groups, popularity, weight,
+                      horse_weight, corner, margin, time_index):
+        finish = race.finish if isinstance(race.finish, int) else None
+
+        # 1. 距離適性
+        distance_finish = race.distance_finish if isinstance(race.distance_finish, int) else None
+        if race.distance_key is not None and distance_finish is not None:
+            groups["1_distance_aptitude"].add(h, race.distance_key, distance_finish)
+
+        # 3/4. 騎手・調教師（集計済みstatsを持つ馬は後でスカラー版の値で上書き）
+        if finish is not None:
+            if race.jockey is not None:
+                groups["3_jockey_compatibility"].add(h, race.jockey, finish)
+            if race.trainer is not None:
+                groups["4_trainer_evaluation"].add(h, race.trainer, finish)
+
+        # 5. トラック適性
+        if race.track is not None and finish is not None:
+            groups["5_track_aptitude"].add(h, race.track, finish)
+
+        # 6. 天候適性（組み合わせがあれば着順は数値）
+        if race.weather_key is not None:
+            groups["6_weather_aptitude"].add(h, race.weather_key, race.finish)
+
+        if finish is None:
+            return
+
+        # 7. 人気度要因
+        if race.popularity is not None and race.popularity > 0 and finish > 0:
+            popularity.add(h, pop=race.popularity, fin=finish)
+
+        # 8. 重量影響度
+        if race.futan is not None:
+            weight.add(h, weight=race.futan, fin=finish)
+
+        # 9. 馬体重影響度
+        if race.bataiju is not None and race.zogen is not INVALID:
+            horse_weight.add(h, weight=race.bataiju, change=race.zogen, fin=finish)
+
+        # 10. コーナー専門度
+        if race.first_corner is not None and race.first_corner is not INVALID:
+            corner.add(h, improvement=race.first_corner - finish)
+
+        # 11. 着差分析（着差は勝ち鞍のみ記録作成時に数値化済み）
+        margin.add(h, fin=finish, margin=race.margin)
+
+        # 12. タイム指数
+        if race.time is not None and race.distance is not None:
+            time_index.add(h, time=race.time, fin=finish, distance=race.distance)
+
+    # --- ベクトル計算 ---
+
+    @staticmethod
+    def _horse_mean(horse: "np.ndarray", values: "np.ndarray", n: int) -> "np.ndarray":
+        """馬ごとの平均（データなしは50.0）。bincountは入力順に加算する"""
+        sums = np.bincount(horse, weights=values, minlength=n)
+        counts = np.bincount(horse, minlength=n)
+        result = np.full(n, 50.0)
+        mask = counts > 0
+        result[mask] = sums[mask] / counts[mask]
+        return result
+
+    def _group_mean_score(self, events: _GroupEvents, n: int, slope: int) -> "np.ndarray":
+        if not events.event_group:
+            return np.full(n, 50.0)
+        group = np.asarray(events.event_group, dtype=np.int64)
+        values = np.asarray(events.event_value, dtype=np.float64)
+        g = len(events.group_horse)
+        group_sum = np.bincount(group, weights=values, minlength=g)
+        group_count = np.bincount(group, minlength=g)
+        filled = group_count > 0
+        avg = group_sum[filled] / group_count[filled]
+        scores = np.maximum(0, 100 - (avg - 1) * slope)
+        group_horse = np.asarray(events.group_horse, dtype=np.int64)[filled]
+        return self._horse_mean(group_horse, scores, n)
+
+    def _popularity_scores(self, events: _RaceEvents, n: int) -> "np.ndarray":
+        if not events.horse:
+            return np.full(n, 50.0)
+        pop = events.array("pop", np.float64)
+        fin = events.array("fin", np.float64)
+        scores = np.where(fin <= pop, 100 - (fin - 1) * 5, np.maximum(0, 80 - (fin - pop) * 10))
+        return self._horse_mean(np.asarray(events.horse), scores, n)
+
+    def _weight_scores(self, events: _RaceEvents, n: int) -> "np.ndarray":
+        if not events.horse:
+            return np.full(n, 50.0)
+        weight = events.array("weight", np.float64)
+        fin = events.array("fin", np.float64)
+        weight_score = np.maximum(0, 100 - np.abs(weight - 550) / 10 * 5)
+        finish_score = np.maximum(0, 100 - (fin - 1) * 8)
+        return self._horse_mean(np.asarray(events.horse), (weight_score + finish_score) / 2, n)
+
+    def _horse_weight_scores(self, events: _RaceEvents, n: int) -> "np.ndarray":
+        if not events.horse:
+            return np.full(n, 50.0)
+        weight = events.array("weight", np.float64)
+        change = events.array("change", np.float64)
+        fin = events.array("fin", np.float64)
+        weight_score = np.maximum(0, 100 - np.abs(weight - 480) / 2)
+        weight_score = np.where(np.abs(change) > 10, weight_score - 10, weight_score)
+        finish_score = np.maximum(0, 100 - (fin - 1) * 8)
+        return self._horse_mean(np.asarray(events.horse), (weight_score + finish_score) / 2, n)
+
+    def _corner_scores(self, events: _RaceEvents, n: int) -> "np.ndarray":
+        if not events.horse:
+            return np.full(n, 50.0)
+        improvement = events.array("improvement", np.float64)
+        horse = np.asarray(events.horse)
+        sums = np.bincount(horse, weights=improvement, minlength=n)
+        counts = np.bincount(horse, minlength=n)
+        result = np.full(n, 50.0)
+        mask = counts > 0
+        avg = sums[mask] / counts[mask]
+        result[mask] = np.minimum(100, np.maximum(0, 50 + avg * 5))
+        return result
+
+    def _margin_scores(self, events: _RaceEvents, n: int) -> "np.ndarray":
+        if not events.horse:
+            return np.full(n, 50.0)
+        fin = events.array("fin", np.float64)
+        margin_val = events.array("margin", np.float64)
+        base = np.maximum(0, 100 - (fin - 1) * 6)
+        bonus = (fin == 1) & (margin_val > 1)
+        base = np.where(bonus, np.minimum(100, base + margin_val * 2), base)
+        return self._horse_mean(np.asarray(events.horse), base, n)
+
+    def _time_scores(self, events: _RaceEvents, n: int) -> "np.ndarray":
+        if not events.horse:
+            return np.full(n, 50.0)
+        time_float = events.array("time", np.float64) / 10.0
+        fin = events.array("fin", np.float64)
+        distance = events.array("distance", np.float64)
+        valid = (time_float > 0) & (distance > 0)
+        base_time = np.select(
+            [distance <= 1200, distance <= 1600, distance <= 2000],
+            [70.0, 95.0, 120.0],
+            default=150.0,
+        )
+        time_score = np.maximum(0, 100 - (time_float - base_time) * 2)
+        finish_score = np.maximum(0, 100 - (fin - 1) * 8)
+        combined = (time_score + finish_score) / 2
+        return self._horse_mean(np.asarray(events.horse)[valid], combined[valid], n)
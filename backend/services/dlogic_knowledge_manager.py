@@ -3,12 +3,12 @@
 D-Logicナレッジファイル管理システム
 過去5年分の馬データを事前計算・高速検索
 """
-import json
 import os
 from typing import Dict, List, Any, Optional
 from datetime import datetime, timedelta
 import mysql.connector
 from .advanced_d_logic_analyzer import AdvancedDLogicAnalyzer
+from .serialization import dump, load
 
 class DLogicKnowledgeManager:
     """D-Logicナレッジ管理システム"""
@@ -26,8 +26,8 @@ class DLogicKnowledgeManager:
         """ナレッジファイル読み込み"""
         if os.path.exists(self.knowledge_file):
             try:
-                with open(self.knowledge_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+                with open(self.knowledge_file, 'rb') as f:
+                    data = load(f)
                     print(f"✅ ナレッジファイル読み込み: {len(data.get('horses', {}))}頭")
                     return data
             except Exception as e:
@@ -50,7 +50,7 @@ class DLogicKnowledgeManager:
         
         os.makedirs(os.path.dirname(self.knowledge_file), exist_ok=True)
         with open(self.knowledge_file, 'w', encoding='utf-8') as f:
-            json.dump(self.knowledge_data, f, ensure_ascii=False, indent=2)
+            dump(self.knowledge_data, f, indent=True)
     
     def get_dlogic_score(self, horse_name: str) -> Dict[str, Any]:
         """D-Logicスコア取得（高速検索 + 動的拡張）"""
@@ -3,23 +3,35 @@
 D-Logic遅延読み込みナレッジマネージャー
 メモリ効率を重視した実装（Render対応）
 """
-import json
 import os
-import requests
 from typing import Dict, List, Any, Optional
 from datetime import datetime
 from functools import lru_cache
 import tempfile
 import gzip
 import pickle
+from services.checkpoint_log import atomic_write
+from services.knowledge_downloader import KnowledgeDownloader
+from services.knowledge_offset_index import file_signature, read_horse, scan_horse_offsets
+from services.serialization import dump, load
 
 class DLogicLazyDataManager:
     """D-Logic遅延読み込みデータ管理システム"""
     
     def __init__(self):
-        self.knowledge_url = "https://github.com/jinjinsansan/dlogic-knowledge-data/releases/download/V2.0/dlogic_raw_knowledge.json"
+        self.knowledge_url = os.getenv(
+            'DLOGIC_LAZY_KNOWLEDGE_URL',
+            "https://github.com/jinjinsansan/dlogic-knowledge-data/releases/download/V2.0/dlogic_raw_knowledge.json"
+        )
+        # ダウンロードしたナレッジ（馬ごとのバイト位置でシークして読む）とインデックス
+        self.knowledge_file = os.getenv(
+            'DLOGIC_LAZY_KNOWLEDGE_FILE', os.path.join(tempfile.gettempdir(), "dlogic_raw_knowledge.json")
+        )
+        self.index_file = os.getenv(
+            'DLOGIC_LAZY_INDEX_FILE', os.path.join(tempfile.gettempdir(), "horse_index.json")
+        )
         self.cache_file = os.path.join(tempfile.gettempdir(), "dlogic_cache.pkl.gz")
-        self.horse_index = {}  # 馬名 -> ファイル内位置のマッピング
+        self.horse_index = {}  # 馬名 -> ファイル内のバイト範囲 [開始, 終了]
         self.cached_horses = {}  # 最近使用した馬データ（LRUキャッシュ）
         self.max_cache_size = 1000  # 最大1000頭をメモリキャッシュ
         
@@ -29,87 +41,55 @@ class DLogicLazyDataManager:
         
     def _initialize_index(self):
         """軽量インデックスファイルの初期化"""
-        index_file = os.path.join(tempfile.gettempdir(), "horse_index.json")
-        
-        if os.path.exists(index_file):
-            # 既存インデックス読み込み
+        if os.path.exists(self.index_file) and os.path.exists(self.knowledge_file):
+            # 既存インデックス読み込み（ナレッジファイルと対応している場合のみ）
             try:
-                with open(index_file, 'r', encoding='utf-8') as f:
-                    self.horse_index = json.load(f)
-                print(f"✅ インデックス読み込み: {len(self.horse_index)}頭")
-                return
+                with open(self.index_file, 'rb') as f:
+                    saved = load(f)
+                if saved.get("source") == file_signature(self.knowledge_file):
+                    self.horse_index = saved["horses"]
+                    print(f"✅ インデックス読み込み: {len(self.horse_index)}頭")
+                    return
+                print("⚠️ インデックスがナレッジファイルと一致しないため再作成します")
             except Exception as e:
                 print(f"⚠️ インデックス読み込み失敗: {e}")
         
         # インデックス作成
         print("📦 インデックス作成中...")
         self._create_horse_index()
+        if not self.horse_index:
+            return
         
         # インデックス保存
         try:
-            with open(index_file, 'w', encoding='utf-8') as f:
-                json.dump(self.horse_index, f, ensure_ascii=False)
+            index = {"source": file_signature(self.knowledge_file), "horses": self.horse_index}
+            atomic_write(self.index_file, lambda f: dump(index, f))
             print("💾 インデックス保存完了")
         except Exception as e:
             print(f"⚠️ インデックス保存失敗: {e}")
     
     def _create_horse_index(self):
-        """馬名インデックスを作成（メモリ効率重視）"""
+        """馬名インデックスを作成（メモリ効率重視）
+        
+        ナレッジファイルをディスクへストリーミング保存し、ストリーミングパーサーで
+        各馬の値が置かれたバイト範囲だけを記録する（ファイル全体は解析しない）
+        """
         try:
             print("📥 ナレッジファイルのストリーミング読み込み開始...")
-            response = requests.get(self.knowledge_url, stream=True, timeout=120)
-            
-            if response.status_code != 200:
-                print(f"❌ ダウンロード失敗: {response.status_code}")
-                self.horse_index = {}
-                return
-            
-            # JSONを部分的に解析してhorsesセクションの馬名だけを抽出
-            content = ""
-            horses_section_found = False
-            bracket_count = 0
-            current_horse_name = None
-            
-            for chunk in response.iter_content(chunk_size=8192):
-                if isinstance(chunk, bytes):
-                    chunk = chunk.decode('utf-8', errors='ignore')
-                content += chunk
-                
-                # horsesセクションを探す
-                if not horses_section_found and '"horses": {' in content:
-                    horses_section_found = True
-                    horses_start = content.find('"horses": {')
-                    content = content[horses_start:]
-                    print("✅ horsesセクション発見")
-                
-                if horses_section_found:
-                    # 馬名を抽出
-                    import re
-                    horse_pattern = r'"([^"]+)": \{'
-                    matches = re.findall(horse_pattern, content)
-                    
-                    for match in matches:
-                        if match != "horses":  # horsesキー自体を除外
-                            self.horse_index[match] = True  # 存在フラグ
-                    
-                    # メモリ節約のため処理済み部分を削除
-                    if len(content) > 50000:
-                        content = content[-10000:]  # 末尾10KBだけ保持
+            try:
+                KnowledgeDownloader(self.knowledge_url, self.knowledge_file).download()
+            except Exception as e:
+                if not os.path.exists(self.knowledge_file):
+                    raise
+                print(f"⚠️ ダウンロード失敗（保存済みのナレッジファイルを使用）: {e}")
             
+            offsets = scan_horse_offsets(self.knowledge_file)
+            self.horse_index = {name: [start, end] for name, (start, end) in offsets.items()}
             print(f"✅ インデックス作成完了: {len(self.horse_index)}頭")
             
         except Exception as e:
             print(f"❌ インデックス作成エラー: {e}")
-            # フォールバック: よく使われる馬名のハードコードリスト
-            common_horses = [
-                "ウィルソンテソーロ", "ドンフランキー", "アルファマム", "イグナイター",
-                "ドゥラエレーデ", "スピーディキック", "オメガギネス", "カラテ",
-                "シャンパンカラー", "ペプチドナイル", "ガイアフォース", "セキフウ",
-                "タガノビューティー", "キングズソード", "レッドルゼル", "ミックファイア",
-                "ドウデュース", "イクイノックス", "リバティアイランド", "ソダシ"
-            ]
-            self.horse_index = {name: True for name in common_horses}
-            print(f"⚠️ フォールバック: {len(self.horse_index)}頭の基本リスト使用")
+            self.horse_index = {}
     
     @lru_cache(maxsize=1000)
     def get_horse_raw_data(self, horse_name: str) -> Optional[Dict[str, Any]]:
@@ -138,63 +118,10 @@ class DLogicLazyDataManager:
         return horse_data
     
     def _load_horse_data_streaming(self, horse_name: str) -> Optional[Dict[str, Any]]:
-        """特定の馬のデータをストリーミング読み込み"""
+        """特定の馬のデータだけを読み込み（インデックスのバイト範囲へシークしてデコード）"""
         try:
-            print(f"📥 '{horse_name}'のデータをストリーミング読み込み中...")
-            response = requests.get(self.knowledge_url, stream=True, timeout=60)
-            
-            if response.status_code != 200:
-                return None
-            
-            # 目標の馬名を探す
-            search_pattern = f'"{horse_name}": {{'
-            buffer = ""
-            found = False
-            bracket_count = 0
-            horse_data_str = ""
-            
-            for chunk in response.iter_content(chunk_size=8192):
-                if isinstance(chunk, bytes):
-                    chunk = chunk.decode('utf-8', errors='ignore')
-                buffer += chunk
-                
-                if not found and search_pattern in buffer:
-                    found = True
-                    start_pos = buffer.find(search_pattern)
-                    horse_data_str = buffer[start_pos:]
-                    buffer = ""  # メモリ節約
-                    print(f"✅ '{horse_name}'を発見")
-                
-                if found:
-                    horse_data_str += chunk
-                    
-                    # JSON構造の終端を検出
-                    for char in chunk:
-                        if char == '{':
-                            bracket_count += 1
-                        elif char == '}':
-                            bracket_count -= 1
-                            if bracket_count == 0:  # 馬データの終端
-                                # JSONパース
-                                try:
-                                    # 馬データ部分を抽出
-                                    json_str = horse_data_str[:horse_data_str.rfind('}') + 1]
-                                    # 馬名部分を含む完全なJSONにする
-                                    complete_json = '{' + json_str + '}'
-                                    parsed = json.loads(complete_json)
-                                    return parsed[horse_name]
-                                except Exception as e:
-                                    print(f"❌ JSON解析エラー: {e}")
-                                    return None
-                
-                # メモリ効率のためバッファサイズ制限
-                if len(buffer) > 100000:
-                    if not found:
-                        buffer = buffer[-50000:]  # 後半のみ保持
-            
-            print(f"❌ '{horse_name}'のデータが見つかりませんでした")
-            return None
-            
+            start, end = self.horse_index[horse_name]
+            return read_horse(self.knowledge_file, start, end)
         except Exception as e:
             print(f"❌ ストリーミング読み込みエラー: {e}")
             return None
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+ナレッジ未登録馬のMySQLフォールバック
+共有接続プール（utils/mysql_connection_manager）を使い、
+レース内の未登録馬をまとめて1回の WHERE BAMEI IN (...) クエリで取得する
+"""
+import asyncio
+import os
+import time
+import threading
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+# ナレッジ構築（batch_dlogic_knowledge_builder_v2.py）と同じ抽出条件
+MAX_RACES = 5
+MIN_RACES = 3
+# 見つからなかった馬を再問い合わせしない期間（秒）
+NEGATIVE_CACHE_TTL = 3600
+
+_RACE_QUERY = """
+    SELECT
+        u.BAMEI,
+        u.RACE_CODE,
+        u.KAISAI_NEN,
+        u.KAISAI_GAPPI,
+        u.KAKUTEI_CHAKUJUN,
+        u.TANSHO_ODDS,
+        u.TANSHO_NINKIJUN,
+        u.FUTAN_JURYO,
+        u.BATAIJU,
+        u.ZOGEN_SA,
+        u.KISHUMEI_RYAKUSHO,
+        u.CHOKYOSHIMEI_RYAKUSHO,
+        u.CORNER1_JUNI,
+        u.CORNER2_JUNI,
+        u.CORNER3_JUNI,
+        u.CORNER4_JUNI,
+        u.SOHA_TIME,
+        u.BAREI,
+        u.SEIBETSU_CODE,
+        r.KYORI,
+        r.TRACK_CODE,
+        r.SHIBA_BABAJOTAI_CODE,
+        r.DIRT_BABAJOTAI_CODE,
+        r.TENKO_CODE
+    FROM umagoto_race_joho u
+    LEFT JOIN race_shosai r ON u.RACE_CODE = r.RACE_CODE
+    WHERE u.BAMEI IN ({placeholders})
+    AND u.KAISAI_NEN >= '2015'
+    AND u.KAISAI_NEN <= '2025'
+    AND u.KAKUTEI_CHAKUJUN IS NOT NULL
+    ORDER BY u.BAMEI, u.KAISAI_NEN DESC, u.KAISAI_GAPPI DESC
+"""
+
+
+class DLogicMySQLFallback:
+    """未登録馬の生データをMySQLから一括取得"""
+
+    def __init__(self, enabled: Optional[bool] = None):
+        if enabled is None:
+            # Render等ローカルMySQLに届かない環境では無効（既定）
+            enabled = os.getenv('DLOGIC_MYSQL_FALLBACK', 'false').lower() in ('1', 'true', 'yes')
+        self.enabled = enabled
+        self._manager = None
+        self._missing: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.query_count = 0
+        self.fetched_horses = 0
+
+    def _get_manager(self):
+        if self._manager is None:
+            from utils.mysql_connection_manager import get_mysql_manager
+            self._manager = get_mysql_manager()
+        return self._manager
+
+    def fetch_horses(self, horse_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """未登録馬の生データを1クエリで取得（3走未満・該当なしの馬は含まない）"""
+        if not self.enabled:
+            return {}
+
+        now = time.time()
+        with self._lock:
+            targets = []
+            for horse_name in horse_names:
+                if horse_name in targets:
+                    continue
+                missing_since = self._missing.get(horse_name)
+                if missing_since is not None and now - missing_since < NEGATIVE_CACHE_TTL:
+                    continue
+                targets.append(horse_name)
+        if not targets:
+            return {}
+
+        try:
+            query = _RACE_QUERY.format(placeholders=', '.join(['%s'] * len(targets)))
+            rows = self._get_manager().execute_query(query, tuple(targets))
+            self.query_count += 1
+        except Exception as e:
+            print(f"⚠️ MySQLフォールバック失敗: {e}")
+            return {}
+
+        races_by_horse: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows or []:
+            races = races_by_horse.setdefault(row['BAMEI'], [])
+            if len(races) < MAX_RACES:
+                races.append({
+                    key: value.strip() if isinstance(value, str) else value
+                    for key, value in row.items()
+                })
+
+        results = {}
+        for horse_name in targets:
+            races = races_by_horse.get(horse_name, [])
+            if len(races) < MIN_RACES:
+                continue
+            results[horse_name] = {
+                "horse_name": horse_name,
+                "race_count": len(races),
+                "races": races,
+                "last_update": datetime.now().isoformat()
+            }
+
+        with self._lock:
+            for horse_name in targets:
+                if horse_name not in results:
+                    self._missing[horse_name] = now
+            self.fetched_horses += len(results)
+
+        return results
+
+    async def fetch_horses_async(self, horse_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """イベントループを止めずに取得（ワーカースレッドで実行）"""
+        return await asyncio.to_thread(self.fetch_horses, horse_names)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "query_count": self.query_count,
+            "fetched_horses": self.fetched_horses,
+            "negative_cached": len(self._missing)
+        }
@@ -3,40 +3,105 @@
 D-Logic生データナレッジマネージャー
 12項目分析に必要な生データのみを保存（計算はリアルタイム）
 """
-try:
-    import ujson as json
-except ImportError:
-    import json
 import os
-import requests
-from typing import Dict, List, Any, Optional
+import hashlib
+import threading
+import weakref
+from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
 import mysql.connector
+from services.knowledge_columnar_store import ColumnarKnowledgeStore
+from services.horse_name_index import HorseNameIndex
+from services.checkpoint_log import atomic_write
+from services.serialization import JSONDecodeError, dump, dumps_bytes, load, loads
+from services.knowledge_delta import DELTA_DIR, apply_delta_to_horses, list_deltas, load_delta
+from services.race_record import INVALID, HorseRecords, RaceRecord, as_horse_records, checked, parse_margin
+
+# 起動時に未適用のデルタファイル（月次差分）を適用するか
+APPLY_DELTAS_ON_LOAD = os.getenv('DLOGIC_APPLY_DELTAS', 'true').lower() in ('1', 'true', 'yes')
+
+# 解析済みレース記録（services/race_record.py）を保持する馬の数
+RACE_RECORD_CACHE_SIZE = int(os.getenv('DLOGIC_RACE_RECORD_CACHE', 20000))
+# 馬名解決のメッセージを報告済みとして覚えておく馬名の数
+REPORTED_NAME_LIMIT = 10000
+
+# ナレッジファイルの配布元（Cloudflare R2）
+# 旧URL（バックアップ用）: https://github.com/jinjinsansan/dlogic-knowledge-data/releases/download/V2.0/dlogic_raw_knowledge.json
+KNOWLEDGE_CDN_URL = os.getenv(
+    'DLOGIC_KNOWLEDGE_URL', "https://pub-059afaafefa84116b57d57e0a72b81bd.r2.dev/dlogic_raw_knowledge.json"
+)
 
 class DLogicRawDataManager:
     """D-Logic生データ管理システム"""
     
+    # 12項目のキー（総合スコア計算の順序）
+    FACTOR_KEYS = [
+        "1_distance_aptitude",
+        "2_bloodline_evaluation",
+        "3_jockey_compatibility",
+        "4_trainer_evaluation",
+        "5_track_aptitude",
+        "6_weather_aptitude",
+        "7_popularity_factor",
+        "8_weight_impact",
+        "9_horse_weight_impact",
+        "10_corner_specialist_degree",
+        "11_margin_analysis",
+        "12_time_index"
+    ]
+    # 総合スコアの重み（FACTOR_KEYSと同じ順序）
+    FACTOR_WEIGHTS = [1.2, 1.1, 1.0, 1.0, 1.1, 0.9, 0.8, 0.9, 0.8, 1.0, 1.1, 1.2]
+    
     def __init__(self):
         self.knowledge_file = os.path.join(
             os.path.dirname(__file__), '..', 'data', 'dlogic_raw_knowledge.json'
         )
+        # カラムナー形式（services/knowledge_columnar_store.pyで変換）があれば優先
+        self.columnar_file = os.path.splitext(self.knowledge_file)[0] + '.dlcol'
+        self.columnar_store: Optional[ColumnarKnowledgeStore] = None
+        # バージョンハッシュのキャッシュと、メモリ上の変更回数（add_horse_raw_dataで増加）
+        self._knowledge_version: Optional[str] = None
+        self._knowledge_revision = 0
+        # デルタ適用によるバージョンの変化（旧バージョン -> (新バージョン, 変更した馬名)）
+        self.version_changes: Dict[str, Tuple[str, List[str]]] = {}
+        # ナレッジ差し替え・デルタ適用の通知先（エンジンのスコアテーブル・ワーカープール）
+        self._listeners: List[Any] = []
+        self._swap_lock = threading.Lock()
+        # 馬名 -> 解析済みレース記録（ナレッジが変わったら破棄）
+        self._race_records: Dict[str, HorseRecords] = {}
+        self._race_records_revision = 0
+        # threadモードの並列分析から同時に参照・追加される
+        self._race_records_lock = threading.Lock()
+        # 全エンジンで共有する事前計算スコアテーブル（get_score_tableで作成）
+        self._score_table = None
         self.knowledge_data = self._load_knowledge()
+        # 馬名解決インデックス（表記ゆれ・近似一致を線形走査なしで解決）
+        self.name_index = HorseNameIndex(self.knowledge_data.get('horses', {}).keys())
+        # 表記ゆれ・近似一致・未登録を報告済みの入力馬名（同じ馬名は1回だけ表示）
+        self._reported_names: set = set()
+        if APPLY_DELTAS_ON_LOAD:
+            self.apply_pending_deltas()
         horse_count = len(self.knowledge_data.get('horses', {}))
         print(f"🚀 D-Logic生データマネージャー初期化完了 ({horse_count}頭)")
         
     def _load_knowledge(self) -> Dict[str, Any]:
         """ナレッジファイル読み込み"""
-        # まずローカルファイルを試す
+        # メモリマップ可能なカラムナー形式を最優先
+        columnar_data = self._load_columnar()
+        if columnar_data is not None:
+            return columnar_data
+        
+        # 次にローカルJSONファイルを試す
         if os.path.exists(self.knowledge_file):
             try:
-                with open(self.knowledge_file, 'r', encoding='utf-8') as f:
+                with open(self.knowledge_file, 'rb') as f:
                     content = f.read()
                     # Git LFS ポインタファイルかチェック
-                    if content.startswith('version https://git-lfs.github.com'):
+                    if content.startswith(b'version https://git-lfs.github.com'):
                         print("⚠️ Git LFS ポインタファイル検出。GitHub Releasesからダウンロード...")
-                        return self._download_from_github()
+                        return self._download_from_github(force=True)
                     
-                    data = json.loads(content)
+                    data = loads(content)
                     horse_count = len(data.get('horses', {}))
                     print(f"✅ ナレッジファイル読み込み: {horse_count}頭")
                     
@@ -48,42 +113,53 @@ class DLogicRawDataManager:
                         print(f"   キー: {list(sample_data.keys())}")
                     
                     return data
-            except json.JSONDecodeError as e:
+            except JSONDecodeError as e:
                 print(f"⚠️ JSONデコードエラー: {e}")
                 print("GitHub Releasesからダウンロードを試行...")
-                return self._download_from_github()
+                return self._download_from_github(force=True)
             except Exception as e:
                 print(f"⚠️ ナレッジファイル読み込みエラー: {e}")
         
         # ファイルが存在しない場合はGitHubからダウンロード
         return self._download_from_github()
     
-    def _download_from_github(self) -> Dict[str, Any]:
-        """Cloudflare R2からナレッジファイルをダウンロード（高速CDN）"""
-        # 旧URL（バックアップ用）: https://github.com/jinjinsansan/dlogic-knowledge-data/releases/download/V2.0/dlogic_raw_knowledge.json
-        cdn_url = "https://pub-059afaafefa84116b57d57e0a72b81bd.r2.dev/dlogic_raw_knowledge.json"
+    def _load_columnar(self) -> Optional[Dict[str, Any]]:
+        """カラムナー形式のナレッジをメモリマップで開く（JSONより古い場合は使わない）"""
+        if not os.path.exists(self.columnar_file):
+            return None
+        if (os.path.exists(self.knowledge_file) and
+                os.path.getmtime(self.knowledge_file) > os.path.getmtime(self.columnar_file)):
+            print("⚠️ カラムナーファイルがJSONより古いため使用しません")
+            return None
+        
+        try:
+            store = ColumnarKnowledgeStore(self.columnar_file)
+        except Exception as e:
+            print(f"⚠️ カラムナーファイル読み込みエラー: {e}")
+            return None
+        
+        self.columnar_store = store
+        print(f"✅ カラムナーナレッジ読み込み: {store.horse_count}頭 ({store.row_count}走)")
+        return {"meta": store.meta, "horses": store.as_mapping()}
+    
+    def _download_from_github(self, force: bool = False) -> Dict[str, Any]:
+        """Cloudflare R2からナレッジファイルをダウンロード（高速CDN）
+        
+        レスポンスはディスクへ直接ストリーミング保存し（中断時は続きから再開、
+        ETag一致なら転送なし、公開SHA-256と照合）、保存したファイルから読み込む。
+        force=Trueはローカルファイルが壊れている場合（ETagが一致しても取り直す）。
+        """
+        from services.knowledge_downloader import KnowledgeDownloader
         
         try:
             print("🚀 Cloudflare R2（CDN）からナレッジファイルをダウンロード中...")
-            response = requests.get(cdn_url, timeout=120)
+            KnowledgeDownloader(KNOWLEDGE_CDN_URL, self.knowledge_file).download(force=force)
             
-            if response.status_code == 200:
-                data = response.json()
-                horse_count = len(data.get('horses', {}))
-                print(f"✅ ダウンロード完了: {horse_count}頭のデータを取得")
-                
-                # ローカルに保存（キャッシュとして）
-                try:
-                    os.makedirs(os.path.dirname(self.knowledge_file), exist_ok=True)
-                    with open(self.knowledge_file, 'w', encoding='utf-8') as f:
-                        json.dump(data, f, ensure_ascii=False, indent=2)
-                    print("💾 ローカルキャッシュに保存完了")
-                except Exception as e:
-                    print(f"⚠️ ローカル保存失敗（メモリ上で動作継続）: {e}")
-                
-                return data
-            else:
-                print(f"❌ ダウンロード失敗: HTTPステータス {response.status_code}")
+            with open(self.knowledge_file, 'rb') as f:
+                data = load(f)
+            horse_count = len(data.get('horses', {}))
+            print(f"✅ ダウンロード完了: {horse_count}頭のデータを取得")
+            return data
                 
         except Exception as e:
             print(f"❌ ダウンロードエラー: {e}")
@@ -102,13 +178,38 @@ class DLogicRawDataManager:
             "horses": {}
         }
     
+    def get_knowledge_version(self) -> str:
+        """ナレッジのバージョンハッシュ（meta情報と元ファイルのサイズ・更新時刻から算出）"""
+        if self._knowledge_version is not None:
+            return self._knowledge_version
+        
+        hasher = hashlib.sha256()
+        meta = self.knowledge_data.get("meta", {})
+        hasher.update(dumps_bytes(meta, sort_keys=True))
+        
+        source = self.columnar_file if self.columnar_store is not None else self.knowledge_file
+        if os.path.exists(source):
+            stat = os.stat(source)
+            hasher.update(f"{os.path.basename(source)}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+        else:
+            hasher.update(str(len(self.knowledge_data.get("horses", {}))).encode("utf-8"))
+        hasher.update(f"rev:{self._knowledge_revision}".encode("utf-8"))
+        
+        self._knowledge_version = hasher.hexdigest()[:16]
+        return self._knowledge_version
+    
     def _save_knowledge(self):
         """ナレッジファイル保存"""
         self.knowledge_data["meta"]["last_updated"] = datetime.now().isoformat()
         
-        os.makedirs(os.path.dirname(self.knowledge_file), exist_ok=True)
-        with open(self.knowledge_file, 'w', encoding='utf-8') as f:
-            json.dump(self.knowledge_data, f, ensure_ascii=False, indent=2)
+        data = self.knowledge_data
+        if not isinstance(data.get("horses"), dict):
+            # カラムナービューは通常の辞書に展開してから保存
+            data = {**data, "horses": dict(data["horses"])}
+        
+        # 一時ファイルに書いてから置き換える（保存中に落ちても既存ファイルは壊れない）
+        atomic_write(self.knowledge_file, lambda f: dump(data, f, indent=True))
+        self._knowledge_version = None
     
     def add_horse_raw_data(self, horse_name: str, raw_data: Dict[str, Any]):
         """馬の生データを追加"""
@@ -118,63 +219,197 @@ class DLogicRawDataManager:
             "aggregated_stats": raw_data.get("aggregated_stats", {}),
             "last_updated": datetime.now().isoformat()
         }
+        self.name_index.add(horse_name)
+        self._knowledge_revision += 1
+        self._knowledge_version = None
+    
+    def get_delta_version(self) -> int:
+        """適用済みデルタのバージョン番号（フル再構築したナレッジは0）"""
+        return int(self.knowledge_data.get("meta", {}).get("delta_version", 0))
+    
+    def apply_knowledge_delta(self, delta: Dict[str, Any]) -> Dict[str, Any]:
+        """デルタをメモリ上のナレッジにその場で適用（全体の再読み込みは不要）"""
+        meta = delta.get("meta", {})
+        version = int(meta.get("version", 0))
+        current = self.get_delta_version()
+        if version <= current:
+            return {"status": "skipped", "version": version, "delta_version": current}
+        if int(meta.get("base_version", 0)) != current:
+            raise ValueError(
+                f"デルタのベースバージョン不一致: base={meta.get('base_version')} current={current}"
+            )
+        
+        old_version = self.get_knowledge_version()
+        result = apply_delta_to_horses(self.knowledge_data["horses"], delta)
+        for horse_name in result["added"]:
+            self.name_index.add(horse_name)
+        
+        knowledge_meta = self.knowledge_data.setdefault("meta", {})
+        knowledge_meta["delta_version"] = version
+        knowledge_meta["watermarks"] = meta.get("watermarks", {})
+        knowledge_meta["last_updated"] = datetime.now().isoformat()
+        self._knowledge_revision += 1
+        self._knowledge_version = None
+        # 事前計算スコアテーブルは変更した馬だけ再計算できるよう記録
+        self.version_changes[old_version] = (self.get_knowledge_version(), result["updated"] + result["added"])
+        
+        print(f"🔄 デルタv{version}適用: 更新{len(result['updated'])}頭 "
+              f"追加{len(result['added'])}頭 ({result['race_rows']}走)")
+        self._notify_listeners('delta')
+        return {"status": "applied", "version": version, **result}
+    
+    def add_listener(self, callback):
+        """ナレッジ変更の通知先を登録（callback(reason)、reasonは'reload'または'delta'）
+        
+        メソッドは弱参照で保持する（エンジンが破棄されたら自動的に外れる）。
+        """
+        ref = weakref.WeakMethod(callback) if hasattr(callback, '__self__') else (lambda: callback)
+        self._listeners.append(ref)
+    
+    def _notify_listeners(self, reason: str):
+        alive = []
+        for ref in self._listeners:
+            callback = ref()
+            if callback is None:
+                continue
+            alive.append(ref)
+            try:
+                callback(reason)
+            except Exception as e:
+                print(f"⚠️ ナレッジ変更通知エラー: {e}")
+        self._listeners = alive
+    
+    def swap_knowledge(self, knowledge_data: Dict[str, Any],
+                       columnar_store: Optional[ColumnarKnowledgeStore] = None):
+        """読み込み済みの新しいナレッジに差し替える（参照の付け替えのみ）
+        
+        旧カラムナーストアは明示的に閉じない。処理中のリクエストが参照し終われば
+        ガベージコレクションでメモリマップが解放される。
+        """
+        name_index = HorseNameIndex(knowledge_data.get('horses', {}).keys())
+        with self._swap_lock:
+            self.columnar_store = columnar_store
+            self.name_index = name_index
+            self.knowledge_data = knowledge_data
+            self.version_changes.clear()
+            self._knowledge_revision += 1
+            self._knowledge_version = None
+        print(f"🔁 ナレッジ差し替え完了 ({len(knowledge_data.get('horses', {}))}頭)")
+        self._notify_listeners('reload')
+    
+    def apply_pending_deltas(self, directory: Optional[str] = None) -> List[Dict[str, Any]]:
+        """未適用のデルタファイルをバージョン順に適用"""
+        results = []
+        for version, path in list_deltas(directory or DELTA_DIR, self.get_delta_version()):
+            try:
+                results.append(self.apply_knowledge_delta(load_delta(path)))
+            except Exception as e:
+                print(f"⚠️ デルタv{version}を適用できません（以降も中止）: {e}")
+                break
+        return results
+        
+    def get_score_table(self):
+        """このナレッジの事前計算スコアテーブル（エンジンごとに読み込まず、1つを共有する）"""
+        with self._swap_lock:
+            if self._score_table is None:
+                from services.dlogic_batch_scorer import DLogicBatchScorer
+                from services.dlogic_score_table import DLogicScoreTable
+                self._score_table = DLogicScoreTable(self, DLogicBatchScorer(self))
+            return self._score_table
+        
+    def _report_once(self, horse_name: str, message: str):
+        """出走馬ごとに毎回呼ばれる経路のため、同じ馬名のメッセージは1回だけ表示"""
+        if horse_name in self._reported_names:
+            return
+        if len(self._reported_names) >= REPORTED_NAME_LIMIT:
+            self._reported_names.clear()
+        self._reported_names.add(horse_name)
+        print(message)
+    
+    def match_horse_name(self, horse_name: str) -> Tuple[Optional[str], str]:
+        """入力された馬名を解決し、(ナレッジ上の馬名, 一致種別 exact/folded/fuzzy/none)を返す"""
+        key, match_type = self.name_index.match(horse_name)
+        if match_type == 'folded':
+            self._report_once(horse_name, f"⚠️ 表記ゆれを検出: '{key}' != '{horse_name}'")
+        elif match_type == 'fuzzy':
+            self._report_once(horse_name, f"⚠️ 近似一致を検出: '{key}' <-> '{horse_name}'")
+        return key, match_type
+    
+    def resolve_horse_name(self, horse_name: str, allow_fuzzy: bool = True) -> Optional[str]:
+        """入力された馬名をナレッジ上の馬名に解決（見つからなければNone）
         
+        allow_fuzzy=False なら近似一致（別の馬の可能性がある一致）は解決しない
+        """
+        key, match_type = self.match_horse_name(horse_name)
+        if match_type == 'fuzzy' and not allow_fuzzy:
+            return None
+        return key
+    
     def get_horse_raw_data(self, horse_name: str) -> Optional[Dict[str, Any]]:
         """馬の生データ取得"""
         horses = self.knowledge_data.get("horses", {})
         
-        # デバッグ用: 最初の5頭の馬名を表示
-        if len(horses) > 0:
-            sample_names = list(horses.keys())[:5]
-            print(f"🔍 ナレッジ内の馬名サンプル: {sample_names}")
-            print(f"🔍 検索対象馬名: '{horse_name}'")
-        
         # 直接検索
         if horse_name in horses:
             return horses[horse_name]
         
-        # 大文字小文字を無視した検索
-        for key in horses.keys():
-            if key.lower() == horse_name.lower():
-                print(f"⚠️ 大文字小文字の違いを検出: '{key}' != '{horse_name}'")
-                return horses[key]
-        
-        # 部分一致検索は完全一致に近い場合のみ
-        # （例：「ディープインパクト」と「ディープインパクト号」のような場合）
-        # 以下の条件を満たす場合のみ部分一致を許可：
-        # 1. 検索馬名が短すぎない（5文字以上）
-        # 2. 部分一致の差が小さい（2文字以内）
-        if len(horse_name) >= 5:
-            for key in horses.keys():
-                # 馬名の差が2文字以内の場合のみ
-                if abs(len(key) - len(horse_name)) <= 2:
-                    if horse_name in key or key in horse_name:
-                        print(f"⚠️ 近似一致を検出: '{key}' <-> '{horse_name}'")
-                        return horses[key]
-        
-        print(f"❌ 馬名 '{horse_name}' が見つかりません")
+        # 表記ゆれ・近似一致はインデックスで解決
+        key = self.resolve_horse_name(horse_name)
+        if key is not None and key in horses:
+            return horses[key]
+        
+        self._report_once(horse_name, f"❌ 馬名 '{horse_name}' が見つかりません")
         return None
     
-    def calculate_dlogic_realtime(self, horse_name: str) -> Dict[str, Any]:
-        """生データからリアルタイムD-Logic計算"""
+    def get_horse_records(self, horse_name: str) -> Optional[HorseRecords]:
+        """馬の解析済みレース記録（1頭につき1回だけ生データから作成して使い回す）"""
+        with self._race_records_lock:
+            if self._race_records_revision != self._knowledge_revision:
+                self._race_records = {}
+                self._race_records_revision = self._knowledge_revision
+            records = self._race_records.get(horse_name)
+            revision = self._race_records_revision
+        if records is not None:
+            return records
+        
+        # 解析はロックの外で行う（同じ馬を同時に解析しても結果は同じ）
         raw_data = self.get_horse_raw_data(horse_name)
+        if not raw_data:
+            return None
+        records = as_horse_records(raw_data)
+        with self._race_records_lock:
+            if self._race_records_revision == revision and horse_name not in self._race_records:
+                if len(self._race_records) >= RACE_RECORD_CACHE_SIZE:
+                    # 古いエントリを削除
+                    del self._race_records[next(iter(self._race_records))]
+                self._race_records[horse_name] = records
+        return records
+    
+    def calculate_dlogic_realtime(self, horse_name: str, raw_data=None) -> Dict[str, Any]:
+        """生データからリアルタイムD-Logic計算
+        
+        raw_dataは生データ辞書またはHorseRecords（省略時はナレッジの解析済み記録を使う）
+        """
+        if raw_data is None:
+            raw_data = self.get_horse_records(horse_name)
         if not raw_data:
             return {"error": f"{horse_name}のデータが見つかりません"}
+        horse = as_horse_records(raw_data)
         
         # 12項目をリアルタイム計算
         scores = {
-            "1_distance_aptitude": self._calc_distance_aptitude(raw_data),
-            "2_bloodline_evaluation": self._calc_bloodline_evaluation(raw_data),
-            "3_jockey_compatibility": self._calc_jockey_compatibility(raw_data),
-            "4_trainer_evaluation": self._calc_trainer_evaluation(raw_data),
-            "5_track_aptitude": self._calc_track_aptitude(raw_data),
-            "6_weather_aptitude": self._calc_weather_aptitude(raw_data),
-            "7_popularity_factor": self._calc_popularity_factor(raw_data),
-            "8_weight_impact": self._calc_weight_impact(raw_data),
-            "9_horse_weight_impact": self._calc_horse_weight_impact(raw_data),
-            "10_corner_specialist_degree": self._calc_corner_specialist(raw_data),
-            "11_margin_analysis": self._calc_margin_analysis(raw_data),
-            "12_time_index": self._calc_time_index(raw_data)
+            "1_distance_aptitude": self._calc_distance_aptitude(horse),
+            "2_bloodline_evaluation": self._calc_bloodline_evaluation(horse),
+            "3_jockey_compatibility": self._calc_jockey_compatibility(horse),
+            "4_trainer_evaluation": self._calc_trainer_evaluation(horse),
+            "5_track_aptitude": self._calc_track_aptitude(horse),
+            "6_weather_aptitude": self._calc_weather_aptitude(horse),
+            "7_popularity_factor": self._calc_popularity_factor(horse),
+            "8_weight_impact": self._calc_weight_impact(horse),
+            "9_horse_weight_impact": self._calc_horse_weight_impact(horse),
+            "10_corner_specialist_degree": self._calc_corner_specialist(horse),
+            "11_margin_analysis": self._calc_margin_analysis(horse),
+            "12_time_index": self._calc_time_index(horse)
         }
         
         # 総合スコア計算（ダンスインザダーク基準）
@@ -188,24 +423,19 @@ class DLogicRawDataManager:
             "calculation_time": datetime.now().isoformat()
         }
     
-    def _calc_distance_aptitude(self, raw_data: Dict) -> float:
+    def _calc_distance_aptitude(self, raw_data) -> float:
         """距離適性計算"""
-        races = raw_data.get("races", raw_data.get("race_history", []))
+        races = as_horse_records(raw_data).races
         if not races:
             return 50.0
         
         # 距離別成績を集計
         distance_perf = {}
         for race in races:
-            distance = race.get("KYORI") or race.get("distance")
-            finish = race.get("KAKUTEI_CHAKUJUN") or race.get("finish")
-            if distance and finish:
-                if distance not in distance_perf:
-                    distance_perf[distance] = []
-                try:
-                    distance_perf[distance].append(int(finish))
-                except:
-                    pass
+            if race.distance_key is not None and race.distance_finish is not None:
+                finishes = distance_perf.setdefault(race.distance_key, [])
+                if race.distance_finish is not INVALID:
+                    finishes.append(race.distance_finish)
         
         if not distance_perf:
             return 50.0
@@ -219,177 +449,111 @@ class DLogicRawDataManager:
         
         return sum(scores) / len(scores) if scores else 50.0
     
-    def _calc_bloodline_evaluation(self, raw_data: Dict) -> float:
+    def _calc_bloodline_evaluation(self, raw_data) -> float:
         """血統評価計算"""
+        horse = as_horse_records(raw_data)
         # aggregated_statsから取得を試みる
-        stats = raw_data.get("aggregated_stats", {})
+        stats = horse.stats
         wins = stats.get("wins", 0)
         total = stats.get("total_races", 0)
         
         # aggregated_statsがない場合はracesから集計
         if total == 0:
-            races = raw_data.get("races", raw_data.get("race_history", []))
+            races = horse.races
             if races:
                 total = len(races)
-                wins = sum(1 for race in races if str(race.get("KAKUTEI_CHAKUJUN", race.get("finish", "99"))).strip() == "01" or race.get("KAKUTEI_CHAKUJUN", race.get("finish", 99)) == 1)
+                wins = sum(1 for race in races if race.win)
         
         win_rate = wins / total if total > 0 else 0
         return min(100, win_rate * 200)
     
-    def _calc_jockey_compatibility(self, raw_data: Dict) -> float:
+    def _calc_jockey_compatibility(self, raw_data) -> float:
         """騎手相性計算"""
+        horse = as_horse_records(raw_data)
         # まずaggregated_statsから取得を試みる
-        jockey_perf = raw_data.get("aggregated_stats", {}).get("jockey_performance", {})
+        jockey_perf = horse.stats.get("jockey_performance", {})
         
         # aggregated_statsがない場合はracesから集計
-        if not jockey_perf:
-            races = raw_data.get("races", raw_data.get("race_history", []))
-            if races:
-                jockey_perf = {}
-                for race in races:
-                    jockey = race.get("KISHUMEI_RYAKUSHO", race.get("KISYURYAKUSYO", race.get("jockey", "")))
-                    finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish"))
-                    if jockey and finish:
-                        if jockey not in jockey_perf:
-                            jockey_perf[jockey] = []
-                        try:
-                            jockey_perf[jockey].append(int(finish))
-                        except:
-                            pass
-        
-        if not jockey_perf:
-            return 50.0
-        
-        scores = []
-        for jockey, finishes in jockey_perf.items():
-            if finishes:
-                avg_finish = sum(finishes) / len(finishes)
-                score = max(0, 100 - (avg_finish - 1) * 8)
-                scores.append(score)
+        if not jockey_perf and horse.races:
+            jockey_perf = self._group_finishes(horse.races, 'jockey')
         
-        return sum(scores) / len(scores) if scores else 50.0
+        return self._mean_group_score(jockey_perf, 8)
     
-    def _calc_trainer_evaluation(self, raw_data: Dict) -> float:
+    def _calc_trainer_evaluation(self, raw_data) -> float:
         """調教師評価計算"""
+        horse = as_horse_records(raw_data)
         # まずaggregated_statsから取得を試みる
-        trainer_perf = raw_data.get("aggregated_stats", {}).get("trainer_performance", {})
+        trainer_perf = horse.stats.get("trainer_performance", {})
         
         # aggregated_statsがない場合はracesから集計
-        if not trainer_perf:
-            races = raw_data.get("races", raw_data.get("race_history", []))
-            if races:
-                trainer_perf = {}
-                for race in races:
-                    trainer = race.get("CHOKYOSHIMEI_RYAKUSHO", race.get("CHOUKYOUSIRYAKUSYO", race.get("trainer", "")))
-                    finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish"))
-                    if trainer and finish:
-                        if trainer not in trainer_perf:
-                            trainer_perf[trainer] = []
-                        try:
-                            trainer_perf[trainer].append(int(finish))
-                        except:
-                            pass
-        
-        if not trainer_perf:
+        if not trainer_perf and horse.races:
+            trainer_perf = self._group_finishes(horse.races, 'trainer')
+        
+        return self._mean_group_score(trainer_perf, 8)
+    
+    @staticmethod
+    def _group_finishes(races, field: str) -> Dict[Any, List[int]]:
+        """騎手・調教師ごとの着順（着順が解析できない走は空のグループだけ作る）"""
+        perf = {}
+        for race in races:
+            key = getattr(race, field)
+            if key is not None and race.finish is not None:
+                finishes = perf.setdefault(key, [])
+                if race.finish is not INVALID:
+                    finishes.append(race.finish)
+        return perf
+    
+    @staticmethod
+    def _mean_group_score(perf: Dict[Any, List[int]], slope: int) -> float:
+        if not perf:
             return 50.0
         
         scores = []
-        for trainer, finishes in trainer_perf.items():
+        for key, finishes in perf.items():
             if finishes:
                 avg_finish = sum(finishes) / len(finishes)
-                score = max(0, 100 - (avg_finish - 1) * 8)
+                score = max(0, 100 - (avg_finish - 1) * slope)
                 scores.append(score)
         
         return sum(scores) / len(scores) if scores else 50.0
     
-    def _calc_track_aptitude(self, raw_data: Dict) -> float:
+    def _calc_track_aptitude(self, raw_data) -> float:
         """トラック適性計算"""
-        races = raw_data.get("races", raw_data.get("race_history", []))
+        races = as_horse_records(raw_data).races
         track_perf = {}
         
         for race in races:
-            # トラックタイプの判定（芝/ダート）
-            track_code = race.get("TRACK_CODE", race.get("TRACKCD", race.get("track", "")))
-            finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish"))
-            
-            if track_code and finish:
-                # TRACKCDを芝/ダートに変換
-                if track_code in ["10", "11", "12", "13", "14", "15", "16", "17", "18", "19"]:
-                    track = "芝"
-                elif track_code in ["20", "21", "22", "23", "24", "25", "26", "27", "28", "29"]:
-                    track = "ダート"
-                else:
-                    track = track_code
-                
-                if track not in track_perf:
-                    track_perf[track] = []
-                try:
-                    track_perf[track].append(int(finish))
-                except:
-                    pass
+            # トラックタイプ（芝/ダート）は記録作成時に判定済み
+            if race.track is not None and race.finish is not None:
+                finishes = track_perf.setdefault(race.track, [])
+                if race.finish is not INVALID:
+                    finishes.append(race.finish)
         
         if not track_perf:
             return 50.0
         
         scores = []
         for track, finishes in track_perf.items():
+            # 着順がすべて数値でないトラック（取消・除外のみ）は評価しない
+            if not finishes:
+                continue
             avg_finish = sum(finishes) / len(finishes)
             score = max(0, 100 - (avg_finish - 1) * 8)
             scores.append(score)
         
         return sum(scores) / len(scores) if scores else 50.0
     
-    def _calc_weather_aptitude(self, raw_data: Dict) -> float:
+    def _calc_weather_aptitude(self, raw_data) -> float:
         """天候適性計算"""
-        races = raw_data.get("races", raw_data.get("race_history", []))
+        races = as_horse_records(raw_data).races
         if not races:
             return 50.0
         
-        # 天候別成績を集計
+        # 天候・馬場状態の組み合わせ別成績を集計（組み合わせは記録作成時に判定済み）
         weather_perf = {}
-        
         for race in races:
-            tenko = race.get("TENKO_CODE", race.get("weather", 0))
-            finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish", 0))
-            track_code = race.get("TRACK_CODE", "")
-            
-            # 馬場状態を取得（芝またはダート）
-            if str(track_code).startswith("1"):  # 芝
-                baba_jotai = race.get("SHIBA_BABAJOTAI_CODE", 0)
-            elif str(track_code).startswith("2"):  # ダート
-                baba_jotai = race.get("DIRT_BABAJOTAI_CODE", 0)
-            else:
-                baba_jotai = 0
-            
-            if tenko and finish:
-                try:
-                    tenko_int = int(tenko)
-                    finish_int = int(finish)
-                    baba_int = int(baba_jotai) if baba_jotai else 0
-                    
-                    # 天候コード: 1=晴, 2=曇, 3=雨, 4=小雨, 5=雪, 6=小雪
-                    # 馬場状態: 1=良, 2=稍重, 3=重, 4=不良
-                    
-                    # 天候と馬場状態の組み合わせでキーを作成
-                    if tenko_int <= 2:  # 晴/曇
-                        weather_key = "晴天"
-                    elif tenko_int <= 4:  # 雨/小雨
-                        weather_key = "雨天"
-                    else:  # 雪/小雪
-                        weather_key = "雪"
-                    
-                    if baba_int == 1:
-                        condition_key = f"{weather_key}・良"
-                    elif baba_int >= 2:
-                        condition_key = f"{weather_key}・重馬場"
-                    else:
-                        condition_key = weather_key
-                    
-                    if condition_key not in weather_perf:
-                        weather_perf[condition_key] = []
-                    weather_perf[condition_key].append(finish_int)
-                except:
-                    pass
+            if race.weather_key is not None:
+                weather_perf.setdefault(race.weather_key, []).append(race.finish)
         
         if not weather_perf:
             return 50.0
@@ -403,125 +567,82 @@ class DLogicRawDataManager:
         
         return sum(scores) / len(scores) if scores else 50.0
     
-    def _calc_popularity_factor(self, raw_data: Dict) -> float:
+    def _calc_popularity_factor(self, raw_data) -> float:
         """人気度要因計算"""
-        races = raw_data.get("races", raw_data.get("race_history", []))
+        races = as_horse_records(raw_data).races
         if not races:
             return 50.0
         
         performance_scores = []
         for race in races:
-            # 人気順位を取得
-            popularity = race.get("TANSHO_NINKIJUN", race.get("NINKIJUN", race.get("popularity", 0)))
-            finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish", 0))
-            
-            if popularity and finish:
-                try:
-                    pop_int = int(popularity)
-                    fin_int = int(finish)
-                    if pop_int > 0 and fin_int > 0:
-                        # 人気と着順の差を評価
-                        if fin_int <= pop_int:
-                            # 人気より上位に来た場合は高評価
-                            score = 100 - (fin_int - 1) * 5
-                        else:
-                            # 人気より下位の場合は低評価
-                            score = max(0, 80 - (fin_int - pop_int) * 10)
-                        performance_scores.append(score)
-                except:
-                    pass
+            pop_int, fin_int = race.popularity, race.finish
+            if pop_int is not None and fin_int is not None and fin_int is not INVALID:
+                if pop_int > 0 and fin_int > 0:
+                    # 人気と着順の差を評価
+                    if fin_int <= pop_int:
+                        # 人気より上位に来た場合は高評価
+                        score = 100 - (fin_int - 1) * 5
+                    else:
+                        # 人気より下位の場合は低評価
+                        score = max(0, 80 - (fin_int - pop_int) * 10)
+                    performance_scores.append(score)
         
         if performance_scores:
             return sum(performance_scores) / len(performance_scores)
         
         return 50.0
     
-    def _calc_weight_impact(self, raw_data: Dict) -> float:
+    def _calc_weight_impact(self, raw_data) -> float:
         """重量影響度計算"""
-        races = raw_data.get("races", raw_data.get("race_history", []))
+        races = as_horse_records(raw_data).races
         weight_scores = []
         
         for race in races:
-            weight = race.get("FUTAN_JURYO", race.get("FUTAN", race.get("weight", 0)))
-            finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish", 0))
-            
-            if weight and finish:
-                try:
-                    weight_int = int(weight)
-                    finish_int = int(finish)
-                    
-                    # 負担重量の影響を評価（標準的な負担重量を55kgと仮定）
-                    weight_score = max(0, 100 - abs(weight_int - 550) / 10 * 5)
-                    finish_score = max(0, 100 - (finish_int - 1) * 8)
-                    
-                    combined = (weight_score + finish_score) / 2
-                    weight_scores.append(combined)
-                except:
-                    pass
+            weight_int, finish_int = race.futan, race.finish
+            if weight_int is not None and finish_int is not None and finish_int is not INVALID:
+                # 負担重量の影響を評価（標準的な負担重量を55kgと仮定）
+                weight_score = max(0, 100 - abs(weight_int - 550) / 10 * 5)
+                finish_score = max(0, 100 - (finish_int - 1) * 8)
+                
+                combined = (weight_score + finish_score) / 2
+                weight_scores.append(combined)
         
         return sum(weight_scores) / len(weight_scores) if weight_scores else 50.0
     
-    def _calc_horse_weight_impact(self, raw_data: Dict) -> float:
+    def _calc_horse_weight_impact(self, raw_data) -> float:
         """馬体重影響度計算"""
-        races = raw_data.get("races", raw_data.get("race_history", []))
+        races = as_horse_records(raw_data).races
         weight_scores = []
         
         for race in races:
-            horse_weight = race.get("BATAIJU", race.get("BATAI", race.get("horse_weight", 0)))
-            weight_change = race.get("ZOGEN_SA", race.get("ZOUGEN", race.get("weight_change", 0)))
-            finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish", 0))
-            
-            if horse_weight and finish:
-                try:
-                    weight_int = int(horse_weight)
-                    finish_int = int(finish)
-                    change_int = int(weight_change) if weight_change else 0
-                    
-                    # 最適体重を480kgと仮定
-                    weight_diff = abs(weight_int - 480)
-                    weight_score = max(0, 100 - weight_diff / 2)
-                    
-                    # 体重変化の影響も加味
-                    if abs(change_int) > 10:
-                        weight_score -= 10
-                    
-                    finish_score = max(0, 100 - (finish_int - 1) * 8)
-                    combined = (weight_score + finish_score) / 2
-                    weight_scores.append(combined)
-                except:
-                    pass
+            weight_int, finish_int, change_int = race.bataiju, race.finish, race.zogen
+            if (weight_int is not None and finish_int is not None and
+                    finish_int is not INVALID and change_int is not INVALID):
+                # 最適体重を480kgと仮定
+                weight_diff = abs(weight_int - 480)
+                weight_score = max(0, 100 - weight_diff / 2)
+                
+                # 体重変化の影響も加味
+                if abs(change_int) > 10:
+                    weight_score -= 10
+                
+                finish_score = max(0, 100 - (finish_int - 1) * 8)
+                combined = (weight_score + finish_score) / 2
+                weight_scores.append(combined)
         
         return sum(weight_scores) / len(weight_scores) if weight_scores else 50.0
     
-    def _calc_corner_specialist(self, raw_data: Dict) -> float:
+    def _calc_corner_specialist(self, raw_data) -> float:
         """コーナー専門度計算"""
-        races = raw_data.get("races", raw_data.get("race_history", []))
+        races = as_horse_records(raw_data).races
         improvements = []
         
         for race in races:
-            # コーナー通過順位
-            corner1 = race.get("CORNER1_JUNI", race.get("CORNER1JUN", race.get("corner1", 0)))
-            corner2 = race.get("CORNER2_JUNI", race.get("CORNER2JUN", race.get("corner2", 0)))
-            corner3 = race.get("CORNER3_JUNI", race.get("CORNER3JUN", race.get("corner3", 0)))
-            corner4 = race.get("CORNER4_JUNI", race.get("CORNER4JUN", race.get("corner4", 0)))
-            finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish", 0))
-            
-            if finish:
-                try:
-                    finish_int = int(finish)
-                    # 最も早いコーナー通過順位を取得
-                    corners = []
-                    for c in [corner1, corner2, corner3, corner4]:
-                        if c and int(c) > 0:
-                            corners.append(int(c))
-                    
-                    if corners:
-                        first_corner = corners[0]
-                        # コーナー順位から着順への改善度
-                        improvement = first_corner - finish_int
-                        improvements.append(improvement)
-                except:
-                    pass
+            # 最も早いコーナー通過順位から着順への改善度
+            first_corner, finish_int = race.first_corner, race.finish
+            if (first_corner is not None and first_corner is not INVALID and
+                    finish_int is not None and finish_int is not INVALID):
+                improvements.append(first_corner - finish_int)
         
         if improvements:
             avg_improvement = sum(improvements) / len(improvements)
@@ -529,121 +650,70 @@ class DLogicRawDataManager:
         
         return 50.0
     
-    def _calc_margin_analysis(self, raw_data: Dict) -> float:
+    def _calc_margin_analysis(self, raw_data) -> float:
         """着差分析計算"""
-        races = raw_data.get("races", raw_data.get("race_history", []))
+        races = as_horse_records(raw_data).races
         finish_scores = []
         
         for race in races:
-            finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish", 0))
-            margin = race.get("CHAKUSA", race.get("margin", ""))
-            
-            if finish:
-                try:
-                    finish_int = int(finish)
-                    base_score = max(0, 100 - (finish_int - 1) * 6)
-                    
-                    # 着差も考慮（勝った場合は着差が大きいほど高評価）
-                    if finish_int == 1 and margin:
-                        try:
-                            # 着差を数値に変換（「1 1/2」→1.5など）
-                            margin_val = self._parse_margin(margin)
-                            if margin_val > 1:
-                                base_score = min(100, base_score + margin_val * 2)
-                        except:
-                            pass
-                    
-                    finish_scores.append(base_score)
-                except:
-                    pass
+            finish_int = race.finish
+            if finish_int is not None and finish_int is not INVALID:
+                base_score = max(0, 100 - (finish_int - 1) * 6)
+                
+                # 着差も考慮（勝った場合は着差が大きいほど高評価、着差は記録作成時に数値化済み）
+                if finish_int == 1 and race.margin > 1:
+                    base_score = min(100, base_score + race.margin * 2)
+                
+                finish_scores.append(base_score)
         
         return sum(finish_scores) / len(finish_scores) if finish_scores else 50.0
     
     def _parse_margin(self, margin: str) -> float:
         """着差文字列を数値に変換"""
-        # 「1 1/2」「2」「ハナ」「クビ」などを数値化
-        if "ハナ" in margin:
-            return 0.1
-        elif "クビ" in margin:
-            return 0.2
-        elif "アタマ" in margin:
-            return 0.3
-        else:
-            # 数値部分を抽出
-            import re
-            nums = re.findall(r'\d+', margin)
-            if nums:
-                return float(nums[0])
-        return 0.0
-    
-    def _calc_time_index(self, raw_data: Dict) -> float:
+        return parse_margin(margin)
+    
+    def _calc_time_index(self, raw_data) -> float:
         """タイム指数計算（簡略版）"""
-        races = raw_data.get("races", raw_data.get("race_history", []))
+        races = as_horse_records(raw_data).races
         time_scores = []
         
         for race in races:
-            # タイムデータ（秒単位）
-            time = race.get("SOHA_TIME", race.get("TIME", race.get("time", 0)))
-            finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish", 0))
-            distance = race.get("KYORI", race.get("distance", 0))
-            
-            if time and finish and distance:
-                try:
-                    # SOHA_TIMEは1/10秒単位なので秒に変換
-                    time_float = float(time) / 10.0 if time else 0
-                    finish_int = int(finish)
-                    distance_int = int(distance)
+            finish_int, distance_int = race.finish, race.distance
+            if (race.time is not None and distance_int is not None and
+                    finish_int is not None and finish_int is not INVALID):
+                # SOHA_TIMEは1/10秒単位なので秒に変換
+                time_float = race.time / 10.0
+                
+                if time_float > 0 and distance_int > 0:
+                    # 距離別の基準タイムを設定（秒単位）
+                    if distance_int <= 1200:
+                        base_time = 70.0  # 1200m基準
+                    elif distance_int <= 1600:
+                        base_time = 95.0  # 1600m基準
+                    elif distance_int <= 2000:
+                        base_time = 120.0  # 2000m基準
+                    else:
+                        base_time = 150.0  # 2400m以上基準
                     
-                    if time_float > 0 and distance_int > 0:
-                        # 距離別の基準タイムを設定（秒単位）
-                        if distance_int <= 1200:
-                            base_time = 70.0  # 1200m基準
-                        elif distance_int <= 1600:
-                            base_time = 95.0  # 1600m基準
-                        elif distance_int <= 2000:
-                            base_time = 120.0  # 2000m基準
-                        else:
-                            base_time = 150.0  # 2400m以上基準
-                        
-                        # タイム指数計算
-                        time_diff = time_float - base_time
-                        time_score = max(0, 100 - time_diff * 2)
-                        finish_score = max(0, 100 - (finish_int - 1) * 8)
-                        combined = (time_score + finish_score) / 2
-                        time_scores.append(combined)
-                except:
-                    pass
+                    # タイム指数計算
+                    time_diff = time_float - base_time
+                    time_score = max(0, 100 - time_diff * 2)
+                    finish_score = max(0, 100 - (finish_int - 1) * 8)
+                    combined = (time_score + finish_score) / 2
+                    time_scores.append(combined)
         
         return sum(time_scores) / len(time_scores) if time_scores else 50.0
     
     def _calculate_total_score(self, scores: Dict[str, float]) -> float:
         """総合スコア計算（ダンスインザダーク基準）"""
-        weights = [1.2, 1.1, 1.0, 1.0, 1.1, 0.9, 0.8, 0.9, 0.8, 1.0, 1.1, 1.2]
-        
-        # スコア項目を正しい順序で取得
-        ordered_keys = [
-            "1_distance_aptitude",
-            "2_bloodline_evaluation", 
-            "3_jockey_compatibility",
-            "4_trainer_evaluation",
-            "5_track_aptitude",
-            "6_weather_aptitude",
-            "7_popularity_factor",
-            "8_weight_impact",
-            "9_horse_weight_impact",
-            "10_corner_specialist_degree",
-            "11_margin_analysis",
-            "12_time_index"
-        ]
-        
         weighted_sum = 0
-        for i, key in enumerate(ordered_keys):
+        for key, weight in zip(self.FACTOR_KEYS, self.FACTOR_WEIGHTS):
             if key in scores:
-                weighted_sum += scores[key] * weights[i]
+                weighted_sum += scores[key] * weight
             else:
-                weighted_sum += 50.0 * weights[i]  # デフォルト値
+                weighted_sum += 50.0 * weight  # デフォルト値
         
-        return weighted_sum / sum(weights)
+        return weighted_sum / sum(self.FACTOR_WEIGHTS)
     
     def _grade_performance(self, score: float) -> str:
         """成績グレード判定"""
@@ -660,23 +730,32 @@ class DLogicRawDataManager:
         else:
             return "D (要改善)"
     
-    def calculate_weather_adaptive_dlogic(self, horse_name: str, baba_condition: int) -> Dict[str, Any]:
+    def calculate_weather_adaptive_dlogic(self, horse_name: str, baba_condition: int,
+                                          standard_result: Optional[Dict[str, Any]] = None,
+                                          raw_data=None) -> Dict[str, Any]:
         """天候適性D-Logic計算（階層的評価方式）
         
         Args:
             horse_name: 馬名
             baba_condition: 馬場状態 (1=良, 2=稍重, 3=重, 4=不良)
+            standard_result: 計算済みの標準D-Logic結果（省略時は計算する）
+            raw_data: 生データ辞書またはHorseRecords（省略時はナレッジの解析済み記録）
         
         Returns:
             天候適性を考慮したD-Logic分析結果
         """
         # 基本データ取得
-        raw_data = self.get_horse_raw_data(horse_name)
+        if raw_data is None:
+            raw_data = self.get_horse_records(horse_name)
         if not raw_data:
             return {"error": f"{horse_name}のデータが見つかりません"}
+        raw_data = as_horse_records(raw_data)
         
-        # 標準のD-Logic計算を実行
-        standard_result = self.calculate_dlogic_realtime(horse_name)
+        # 標準のD-Logic計算を実行（計算済みなら再利用）
+        if standard_result is not None:
+            standard_result = dict(standard_result)
+        else:
+            standard_result = self.calculate_dlogic_realtime(horse_name, raw_data)
         
         # 良馬場の場合は標準結果をそのまま返す
         if baba_condition == 1:
@@ -685,16 +764,60 @@ class DLogicRawDataManager:
             return standard_result
         
         # 階層的評価の実装
-        races = raw_data.get("races", raw_data.get("race_history", []))
+        layers = self._calc_weather_layers(raw_data, baba_condition)
+        return self._build_weather_result(horse_name, standard_result, baba_condition, layers)
+
+    def calculate_all_weather_dlogic(self, horse_name: str,
+                                     standard_result: Optional[Dict[str, Any]] = None,
+                                     raw_data=None) -> Dict[int, Dict[str, Any]]:
+        """良・稍重・重・不良の天候適性D-Logicをまとめて計算
+
+        標準D-Logicの計算とレース記録の走査は1回だけ行い、4つの馬場状態で共有する
+
+        Returns:
+            {馬場状態: calculate_weather_adaptive_dlogic と同じ形式の結果}
+        """
+        if raw_data is None:
+            raw_data = self.get_horse_records(horse_name)
+        if not raw_data:
+            return {baba_condition: {"error": f"{horse_name}のデータが見つかりません"}
+                    for baba_condition in (1, 2, 3, 4)}
+        raw_data = as_horse_records(raw_data)
+
+        if standard_result is None:
+            standard_result = self.calculate_dlogic_realtime(horse_name, raw_data)
+
+        results = {1: dict(standard_result, weather_condition="良", weather_adjustment=0.0)}
+        for baba_condition, layers in self._calc_all_weather_layers(raw_data).items():
+            if layers is None:
+                name = {2: "稍重", 3: "重", 4: "不良"}[baba_condition]
+                results[baba_condition] = {"error": f"{horse_name}の{name}馬場の天候適性を計算できません"}
+            else:
+                results[baba_condition] = self._build_weather_result(
+                    horse_name, standard_result, baba_condition, layers
+                )
+        return results
+
+    def _calc_weather_layers(self, raw_data, baba_condition: int) -> Tuple[float, float, float]:
+        """天候適性の第1〜3層スコアを計算（raw_dataは生データ辞書またはHorseRecords）"""
+        horse = as_horse_records(raw_data)
+        races = horse.races
         
         # 第1層: 基礎能力（40%）
-        layer1_score = self._calc_layer1_base_ability(raw_data, races, baba_condition)
+        layer1_score = self._calc_layer1_base_ability(horse, races, baba_condition)
         
         # 第2層: 適応能力（35%）
-        layer2_score = self._calc_layer2_adaptive_ability(raw_data, races, baba_condition)
+        layer2_score = self._calc_layer2_adaptive_ability(horse, races, baba_condition)
         
         # 第3層: 当日要因（25%）
-        layer3_score = self._calc_layer3_daily_factors(raw_data, races, baba_condition)
+        layer3_score = self._calc_layer3_daily_factors(horse, races, baba_condition)
+        
+        return layer1_score, layer2_score, layer3_score
+    
+    def _build_weather_result(self, horse_name: str, standard_result: Dict[str, Any],
+                              baba_condition: int, layers: Tuple[float, float, float]) -> Dict[str, Any]:
+        """標準結果と階層スコアから天候適性結果を構築（稍重・重・不良）"""
+        layer1_score, layer2_score, layer3_score = layers
         
         # 天候適性調整係数の計算（0.8〜1.2の範囲に制限）
         weather_adjustment_factor = (
@@ -742,95 +865,156 @@ class DLogicRawDataManager:
         
         return result
     
-    def _calc_layer1_base_ability(self, raw_data: Dict, races: List[Dict], baba_condition: int) -> float:
+    def _calc_all_weather_layers(self, raw_data) -> Dict[int, Optional[Tuple[float, float, float]]]:
+        """稍重・重・不良の第1〜3層スコアをレース記録1回の走査でまとめて計算
+        
+        着順を馬場状態ごとに振り分けてから各馬場状態の層スコアを求める（値は
+        _calc_weather_layers と同じ）。計算できない馬場状態は None
+        """
+        horse = as_horse_records(raw_data)
+        races = horse.races
+        conditions = (2, 3, 4)
+        try:
+            # 馬場状態によらない項目（直近3走の馬体重・直近5走の最初のコーナー順位）
+            weight_score = self._weather_weight_score(races)
+            pace_score = self._weather_pace_score(races)
+            
+            # 第1層は馬場状態コードがない走を0、第2層は良として振り分ける
+            finishes_by_baba: Dict[int, List[Any]] = {}
+            jockey_finishes_by_baba: Dict[int, Dict[str, List[Any]]] = {}
+            for race in races:
+                if race.w_baba is None:
+                    layer1_baba, layer2_baba = 0, 1
+                else:
+                    layer1_baba = layer2_baba = checked(race.w_baba)
+                if race.w_finish is None:
+                    continue
+                finishes_by_baba.setdefault(layer1_baba, []).append(race.w_finish)
+                if race.w_jockey is not None:
+                    jockey_finishes_by_baba.setdefault(layer2_baba, {}).setdefault(
+                        race.w_jockey, []).append(race.w_finish)
+        except Exception:
+            return dict.fromkeys(conditions)
+        
+        layers: Dict[int, Optional[Tuple[float, float, float]]] = {}
+        for baba_condition in conditions:
+            try:
+                # 解析できない着順は、その馬場状態で使うときだけ計算不能にする
+                finishes = [checked(finish) for finish in finishes_by_baba.get(baba_condition, [])]
+                jockey_finishes = {
+                    jockey: [checked(finish) for finish in jockey_list]
+                    for jockey, jockey_list in jockey_finishes_by_baba.get(baba_condition, {}).items()
+                }
+            except Exception:
+                layers[baba_condition] = None
+                continue
+            
+            scores = [] if weight_score is None else [weight_score]
+            scores.append(self._weather_finish_score(finishes) if finishes else 1.0)
+            layer1_score = sum(scores) / len(scores)
+            
+            scores = []
+            if jockey_finishes:
+                scores.append(self._weather_jockey_score(jockey_finishes))
+            if pace_score is not None:
+                scores.append(pace_score)
+            layer2_score = sum(scores) / len(scores) if scores else 1.0
+            
+            layer3_score = self._calc_layer3_daily_factors(horse, races, baba_condition)
+            layers[baba_condition] = (layer1_score, layer2_score, layer3_score)
+        return layers
+    
+    def _weather_weight_score(self, races: Tuple[RaceRecord, ...]) -> Optional[float]:
+        """直近3走の平均馬体重による評価（馬体重がなければNone）"""
+        recent_weights = []
+        for race in races[-3:]:  # 直近3走
+            if race.w_bataiju is not None:
+                recent_weights.append(checked(race.w_bataiju))
+        
+        if not recent_weights:
+            return None
+        avg_weight = sum(recent_weights) / len(recent_weights)
+        if avg_weight >= 470:
+            return 1.1  # 重馬場向き（控えめに）
+        elif avg_weight <= 450:
+            return 0.9  # 軽量馬は不利（控えめに）
+        return 1.0
+    
+    def _weather_finish_score(self, finishes: List[int]) -> float:
+        """平均着順による評価（1着なら1.3、5着なら0.9）"""
+        avg_finish = sum(finishes) / len(finishes)
+        return max(0.8, 1.3 - (avg_finish - 1) * 0.1)
+    
+    def _weather_jockey_score(self, jockey_finishes: Dict[str, List[int]]) -> float:
+        """騎手ごとの平均着順評価の平均"""
+        jockey_scores = [self._weather_finish_score(finishes) for finishes in jockey_finishes.values()]
+        return sum(jockey_scores) / len(jockey_scores)
+    
+    def _weather_pace_score(self, races: Tuple[RaceRecord, ...]) -> Optional[float]:
+        """直近5走の最初のコーナー順位による脚質評価（逃げ・先行有利、順位がなければNone）"""
+        early_positions = []
+        for race in races[-5:]:  # 直近5走
+            if race.w_corner1 is not None:
+                early_positions.append(checked(race.w_corner1))
+        
+        if not early_positions:
+            return None
+        avg_position = sum(early_positions) / len(early_positions)
+        if avg_position <= 3:  # 逃げ・先行
+            return 1.15
+        elif avg_position <= 6:  # 中団
+            return 1.0
+        return 0.9  # 後方
+    
+    def _calc_layer1_base_ability(self, horse: HorseRecords, races: Tuple[RaceRecord, ...],
+                                  baba_condition: int) -> float:
         """第1層: 基礎能力の評価（40%）"""
         scores = []
         
         # 1. 馬体重評価
-        recent_weights = []
-        for race in races[-3:]:  # 直近3走
-            weight = race.get("BATAIJU", 0)
-            if weight:
-                recent_weights.append(int(weight))
-        
-        if recent_weights:
-            avg_weight = sum(recent_weights) / len(recent_weights)
-            if avg_weight >= 470:
-                weight_score = 1.1  # 重馬場向き（控えめに）
-            elif avg_weight <= 450:
-                weight_score = 0.9  # 軽量馬は不利（控えめに）
-            else:
-                weight_score = 1.0
+        weight_score = self._weather_weight_score(races)
+        if weight_score is not None:
             scores.append(weight_score)
         
-        # 2. 該当馬場での過去実績
+        # 2. 該当馬場での過去実績（馬場状態コードがない走は0扱い）
         baba_performances = []
         for race in races:
-            track_code = race.get("TRACK_CODE", "")
-            if str(track_code).startswith("1"):  # 芝
-                baba_jotai = race.get("SHIBA_BABAJOTAI_CODE", 0)
-            else:  # ダート
-                baba_jotai = race.get("DIRT_BABAJOTAI_CODE", 0)
-            
-            if int(baba_jotai) == baba_condition:
-                finish = race.get("KAKUTEI_CHAKUJUN", 0)
-                if finish:
-                    baba_performances.append(int(finish))
+            baba_jotai = 0 if race.w_baba is None else checked(race.w_baba)
+            if baba_jotai == baba_condition and race.w_finish is not None:
+                baba_performances.append(checked(race.w_finish))
         
         if baba_performances:
-            avg_finish = sum(baba_performances) / len(baba_performances)
-            baba_score = max(0.8, 1.3 - (avg_finish - 1) * 0.1)  # 1着なら1.3、5着なら0.9
-            scores.append(baba_score)
+            scores.append(self._weather_finish_score(baba_performances))
         else:
             # 該当馬場経験なしの場合は標準値
             scores.append(1.0)
         
         return sum(scores) / len(scores) if scores else 1.0
     
-    def _calc_layer2_adaptive_ability(self, raw_data: Dict, races: List[Dict], baba_condition: int) -> float:
+    def _calc_layer2_adaptive_ability(self, horse: HorseRecords, races: Tuple[RaceRecord, ...],
+                                      baba_condition: int) -> float:
         """第2層: 適応能力の評価（35%）"""
         scores = []
         
-        # 1. 騎手の該当馬場成績
+        # 1. 騎手の該当馬場成績（馬場状態コードがない走は良扱い）
         jockey_baba_perf = {}
         for race in races:
-            baba_jotai = self._get_baba_jotai(race)
-            if int(baba_jotai) == baba_condition:
-                jockey = race.get("KISHUMEI_RYAKUSHO", "")
-                finish = race.get("KAKUTEI_CHAKUJUN", 0)
-                if jockey and finish:
-                    if jockey not in jockey_baba_perf:
-                        jockey_baba_perf[jockey] = []
-                    jockey_baba_perf[jockey].append(int(finish))
+            baba_jotai = 1 if race.w_baba is None else checked(race.w_baba)
+            if baba_jotai == baba_condition and race.w_jockey is not None and race.w_finish is not None:
+                jockey_baba_perf.setdefault(race.w_jockey, []).append(checked(race.w_finish))
         
         if jockey_baba_perf:
-            jockey_scores = []
-            for jockey, finishes in jockey_baba_perf.items():
-                avg_finish = sum(finishes) / len(finishes)
-                score = max(0.8, 1.3 - (avg_finish - 1) * 0.1)
-                jockey_scores.append(score)
-            scores.append(sum(jockey_scores) / len(jockey_scores))
+            scores.append(self._weather_jockey_score(jockey_baba_perf))
         
         # 2. 脚質評価（逃げ・先行有利）
-        early_positions = []
-        for race in races[-5:]:  # 直近5走
-            corner1 = race.get("CORNER1_JUNI", 0)
-            if corner1:
-                early_positions.append(int(corner1))
-        
-        if early_positions:
-            avg_position = sum(early_positions) / len(early_positions)
-            if avg_position <= 3:  # 逃げ・先行
-                pace_score = 1.15
-            elif avg_position <= 6:  # 中団
-                pace_score = 1.0
-            else:  # 後方
-                pace_score = 0.9
+        pace_score = self._weather_pace_score(races)
+        if pace_score is not None:
             scores.append(pace_score)
         
         return sum(scores) / len(scores) if scores else 1.0
     
-    def _calc_layer3_daily_factors(self, raw_data: Dict, races: List[Dict], baba_condition: int) -> float:
+    def _calc_layer3_daily_factors(self, horse: HorseRecords, races: Tuple[RaceRecord, ...],
+                                   baba_condition: int) -> float:
         """第3層: 当日要因の評価（25%）"""
         # 簡易実装：重馬場では内枠不利が解消される効果
         if baba_condition >= 3:  # 重または不良
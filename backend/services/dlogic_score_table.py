@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+D-Logic事前計算スコアテーブル
+ナレッジ読み込み時に全馬の12項目・総合スコア・馬場状態別の階層スコアを計算し、
+馬名→行番号のテーブルで保持（ナレッジのバージョンハッシュで無効化）
+デルタ適用でバージョンが変わった場合は、変更された馬の行だけ再計算して追従する
+"""
+import math
+import os
+import pickle
+import tempfile
+import threading
+import time
+from array import array
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+from services.race_record import HorseRecords, build_horse_records
+
+# 1行のレイアウト: 12項目 + 総合スコア + 馬場状態(稍重/重/不良)ごとの第1〜3層スコア
+_FACTOR_COUNT = 12
+_TOTAL_COLUMN = _FACTOR_COUNT
+_LAYER_START = _FACTOR_COUNT + 1
+_WEATHER_CONDITIONS = (2, 3, 4)
+ROW_WIDTH = _LAYER_START + 3 * len(_WEATHER_CONDITIONS)
+
+# 一括計算の単位（メモリ使用量を抑えるため分割して計算）
+BUILD_BATCH_SIZE = 4096
+
+
+class DLogicScoreTable:
+    """全馬の事前計算済みD-Logicスコア（ナレッジマネージャーごとに1つを全エンジンで共有）"""
+
+    def __init__(self, raw_manager, batch_scorer, table_file: Optional[str] = None):
+        self.raw_manager = raw_manager
+        self.batch_scorer = batch_scorer
+        self.table_file = table_file or os.path.join(
+            os.path.dirname(__file__), '..', 'data', 'dlogic_score_table.pkl'
+        )
+        self.version: Optional[str] = None
+        self._rows: Dict[str, int] = {}
+        self._values = array('d')
+        self.hit_count = 0
+        self.miss_count = 0
+        self._lock = threading.RLock()
+        # 読み込めなかったナレッジのバージョン（同じバージョンで保存済みファイルを読み直さない）
+        self._missing_version: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        """現在のナレッジのバージョンで構築済みか（再計算はしない）"""
+        return self.version is not None and self.version == self.raw_manager.get_knowledge_version()
+
+    def catch_up(self) -> bool:
+        """デルタ適用の記録をたどり、変更された馬だけ再計算してバージョンを進める
+
+        現在のナレッジに追従できればTrue（未構築・差し替え後はFalse）
+        """
+        if self.version is None:
+            return False
+        current = self.raw_manager.get_knowledge_version()
+        if self.version == current:
+            return True
+        with self._lock:
+            changes = getattr(self.raw_manager, 'version_changes', {})
+            while self.version != current and self.version in changes:
+                new_version, horse_names = changes[self.version]
+                self.update_horses(horse_names)
+                self.version = new_version
+            return self.version == current
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    # --- 読み込み・構築 ---
+
+    def load_or_build(self, build_if_missing: bool = False) -> bool:
+        """保存済みテーブルを読み込み、なければ（指定時のみ）構築する"""
+        with self._lock:
+            version = self.raw_manager.get_knowledge_version()
+            if self._load(version):
+                return True
+            if build_if_missing:
+                self.build()
+                self._save()
+                return True
+            self._missing_version = version
+            return False
+
+    def refresh(self, build_if_missing: bool = False) -> bool:
+        """現在のナレッジに合わせる（エンジン作成時・ナレッジ差し替え時）
+
+        共有テーブルのため、他のエンジンがすでに読み込み・構築していれば何もしない
+        """
+        with self._lock:
+            if self.catch_up():
+                return True
+            if not build_if_missing and self._missing_version == self.raw_manager.get_knowledge_version():
+                return False
+            self.invalidate()
+            return self.load_or_build(build_if_missing)
+
+    def _load(self, version: str) -> bool:
+        if not os.path.exists(self.table_file):
+            return False
+        try:
+            with open(self.table_file, 'rb') as f:
+                payload = pickle.load(f)
+        except Exception as e:
+            print(f"⚠️ スコアテーブル読み込みエラー: {e}")
+            return False
+
+        if payload.get('version') != version or payload.get('row_width') != ROW_WIDTH:
+            print("⚠️ スコアテーブルのバージョンがナレッジと一致しません（再構築が必要）")
+            return False
+
+        self._rows = {name: i for i, name in enumerate(payload['names'])}
+        self._values = payload['values']
+        self.version = version
+        print(f"✅ スコアテーブル読み込み: {len(self._rows)}頭 (version: {version})")
+        return True
+
+    def _save(self):
+        names = [None] * len(self._rows)
+        for name, row in self._rows.items():
+            names[row] = name
+        payload = {
+            'version': self.version,
+            'row_width': ROW_WIDTH,
+            'names': names,
+            'values': self._values,
+            'created': datetime.now().isoformat()
+        }
+        tmp_path = None
+        try:
+            # 複数のワーカープロセスが同時に保存しても一時ファイルが重ならないよう一意の名前で書く
+            directory = os.path.dirname(os.path.abspath(self.table_file))
+            os.makedirs(directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                'wb', dir=directory, prefix=os.path.basename(self.table_file) + '.', suffix='.tmp', delete=False
+            ) as f:
+                tmp_path = f.name
+                pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.table_file)
+            print(f"💾 スコアテーブル保存: {self.table_file}")
+        except Exception as e:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            print(f"⚠️ スコアテーブル保存失敗（メモリ上で動作継続）: {e}")
+
+    def build(self):
+        """全馬のスコアを計算してテーブルを構築"""
+        start_time = time.time()
+        version = self.raw_manager.get_knowledge_version()
+        horses = self.raw_manager.knowledge_data.get('horses', {})
+
+        rows: Dict[str, int] = {}
+        values = array('d')
+        names: List[str] = []
+        records: List[HorseRecords] = []
+
+        def flush():
+            # レース記録の解析は1頭1回（12項目と3つの馬場状態で共有）
+            for name, horse, scored in zip(names, records, self.batch_scorer.score_raw_data(records)):
+                if scored is None:
+                    continue
+                row = self._make_row(horse, scored)
+                rows[name] = len(rows)
+                values.extend(row)
+            names.clear()
+            records.clear()
+
+        for name in horses:
+            names.append(name)
+            records.append(build_horse_records(horses[name]))
+            if len(names) >= BUILD_BATCH_SIZE:
+                flush()
+        flush()
+
+        self._rows = rows
+        self._values = values
+        self.version = version
+        print(f"✅ スコアテーブル構築完了: {len(rows)}頭 ({time.time() - start_time:.1f}秒)")
+
+    def _make_row(self, horse: HorseRecords, scored: Dict[str, Any]) -> List[float]:
+        scores = scored['d_logic_scores']
+        row = [float(scores[key]) for key in self.raw_manager.FACTOR_KEYS]
+        row.append(float(scored['total_score']))
+        all_layers = self.raw_manager._calc_all_weather_layers(horse)
+        for baba_condition in _WEATHER_CONDITIONS:
+            layers = all_layers[baba_condition]
+            if layers is None:
+                # 計算できない馬場状態はNaNにしてリアルタイム計算に任せる
+                row.extend((math.nan, math.nan, math.nan))
+            else:
+                row.extend(float(layer) for layer in layers)
+        return row
+
+    def update_horses(self, horse_names: List[str]):
+        """指定した馬の行を再計算（新しい馬は末尾に追加）"""
+        horses = self.raw_manager.knowledge_data.get('horses', {})
+        names = [name for name in horse_names if name in horses]
+        records = [build_horse_records(horses[name]) for name in names]
+        for start in range(0, len(names), BUILD_BATCH_SIZE):
+            batch_names = names[start:start + BUILD_BATCH_SIZE]
+            batch_records = records[start:start + BUILD_BATCH_SIZE]
+            for name, horse, scored in zip(batch_names, batch_records,
+                                           self.batch_scorer.score_raw_data(batch_records)):
+                if scored is None:
+                    continue
+                row = self._make_row(horse, scored)
+                if name in self._rows:
+                    offset = self._rows[name] * ROW_WIDTH
+                    self._values[offset:offset + ROW_WIDTH] = array('d', row)
+                else:
+                    self._rows[name] = len(self._rows)
+                    self._values.extend(row)
+
+    def invalidate(self):
+        """テーブルを破棄（ナレッジ更新時）"""
+        self.version = None
+        self._rows = {}
+        self._values = array('d')
+
+    # --- 参照 ---
+
+    def _row_values(self, horse_name: str) -> Optional[List[float]]:
+        if not self.catch_up():
+            return None
+        row = self._rows.get(horse_name)
+        if row is None:
+            # 表記ゆれ・近似一致の馬名はナレッジ上の馬名に解決してから参照
+            key = self.raw_manager.resolve_horse_name(horse_name)
+            row = self._rows.get(key) if key is not None else None
+        if row is None:
+            self.miss_count += 1
+            return None
+        self.hit_count += 1
+        offset = row * ROW_WIDTH
+        return self._values[offset:offset + ROW_WIDTH]
+
+    def lookup(self, horse_name: str) -> Optional[Dict[str, Any]]:
+        """標準D-Logic結果（calculate_dlogic_realtimeと同じ形式）"""
+        values = self._row_values(horse_name)
+        if values is None:
+            return None
+        return self._standard_result(horse_name, values)
+
+    def lookup_weather(self, horse_name: str, baba_condition: int) -> Optional[Dict[str, Any]]:
+        """馬場状態別D-Logic結果（calculate_weather_adaptive_dlogicと同じ形式）"""
+        values = self._row_values(horse_name)
+        if values is None:
+            return None
+        standard_result = self._standard_result(horse_name, values)
+        if baba_condition == 1:
+            standard_result["weather_condition"] = "良"
+            standard_result["weather_adjustment"] = 0.0
+            return standard_result
+
+        offset = _LAYER_START + 3 * _WEATHER_CONDITIONS.index(baba_condition)
+        layers = tuple(values[offset:offset + 3])
+        if any(math.isnan(layer) for layer in layers):
+            return None
+        return self.raw_manager._build_weather_result(horse_name, standard_result, baba_condition, layers)
+
+    def lookup_all_weather(self, horse_name: str) -> Optional[Dict[int, Dict[str, Any]]]:
+        """良・稍重・重・不良の結果をまとめて参照（calculate_all_weather_dlogicと同じ形式）
+
+        1行の参照を4つの馬場状態で共有する。計算できない馬場状態を含む馬はNone
+        """
+        values = self._row_values(horse_name)
+        if values is None:
+            return None
+        standard_result = self._standard_result(horse_name, values)
+        results = {1: dict(standard_result, weather_condition="良", weather_adjustment=0.0)}
+        for index, baba_condition in enumerate(_WEATHER_CONDITIONS):
+            offset = _LAYER_START + 3 * index
+            layers = tuple(values[offset:offset + 3])
+            if any(math.isnan(layer) for layer in layers):
+                return None
+            results[baba_condition] = self.raw_manager._build_weather_result(
+                horse_name, standard_result, baba_condition, layers
+            )
+        return results
+
+    def _standard_result(self, horse_name: str, values) -> Dict[str, Any]:
+        total_score = values[_TOTAL_COLUMN]
+        return {
+            "horse_name": horse_name,
+            "d_logic_scores": dict(zip(self.raw_manager.FACTOR_KEYS, values[:_FACTOR_COUNT])),
+            "total_score": total_score,
+            "grade": self.raw_manager._grade_performance(total_score),
+            "calculation_time": datetime.now().isoformat()
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hit_count + self.miss_count
+        return {
+            "ready": self.ready,
+            "version": self.version,
+            "horses": len(self._rows),
+            "memory_mb": self._values.itemsize * len(self._values) / (1024 * 1024),
+            "hit_count": self.hit_count,
+            "miss_count": self.miss_count,
+            "hit_rate": (self.hit_count / total * 100) if total else 0.0
+        }
+
+
+if __name__ == "__main__":
+    # オフライン構築: python -m services.dlogic_score_table
+    from services.dlogic_raw_data_manager import dlogic_manager
+    from services.dlogic_batch_scorer import DLogicBatchScorer
+
+    table = DLogicScoreTable(dlogic_manager, DLogicBatchScorer(dlogic_manager))
+    table.build()
+    table._save()
+    print(f"📊 {table.get_stats()}")
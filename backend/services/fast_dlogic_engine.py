@@ -3,12 +3,44 @@
 高速D-Logic計算エンジン
 生データナレッジからリアルタイム計算（0.1秒目標）
 """
+import asyncio
 import json
+import multiprocessing
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from typing import Dict, List, Any, Optional
 from datetime import datetime
-import mysql.connector
 from .dlogic_raw_data_manager import dlogic_manager
+from .dlogic_mysql_fallback import DLogicMySQLFallback
+
+# 出走馬分析の実行モード: sequential / thread / process
+# processモードでは起動した各ワーカーがナレッジを自分で読み込む（初回の分析時に読み込み時間がかかる）。
+# カラムナー形式（.dlcol）があればワーカー間でメモリマップのページを共有し、各ワーカーが持つのは
+# 馬名の索引と参照した馬の分だけ。JSONしかない場合はワーカー数分のナレッジがメモリに載る
+EXECUTION_MODE = os.getenv('DLOGIC_RACE_EXECUTION', 'sequential').lower()
+EXECUTION_WORKERS = int(os.getenv('DLOGIC_RACE_WORKERS', min(8, os.cpu_count() or 1)))
+
+# 馬場状態コード → 名称
+WEATHER_CONDITION_NAMES = {1: "良", 2: "稍重", 3: "重", 4: "不良"}
+
+# processモードのワーカープロセス内のエンジン（ワーカー起動時に _init_process_worker が作成）
+_worker_engine = None
+
+
+def _init_process_worker():
+    """ワーカープロセスの初期化: ナレッジを読み込んだ逐次実行のエンジンを作る（テーブルは構築しない）"""
+    global _worker_engine
+    os.environ['DLOGIC_PRECOMPUTE_SCORES'] = 'false'
+    _worker_engine = FastDLogicEngine()
+    _worker_engine.execution_mode = 'sequential'
+
+
+def _process_call(knowledge_version: str, method_name: str, args: tuple) -> Optional[Dict[str, Any]]:
+    """プロセスプール内で1頭分の分析を実行（ワーカーのナレッジが親プロセスと異なる場合はNone）"""
+    if _worker_engine.raw_manager.get_knowledge_version() != knowledge_version:
+        return None
+    return _worker_engine._analyze_isolated(method_name, args)
 
 class FastDLogicEngine:
     """高速D-Logic計算エンジン"""
@@ -16,18 +48,36 @@ class FastDLogicEngine:
     def __init__(self):
         # グローバルインスタンスを使用（ナレッジの重複読み込みを回避）
         self.raw_manager = dlogic_manager
-        self.mysql_config = {
-            'host': '172.25.160.1',
-            'port': 3306,
-            'user': 'root',
-            'password': '04050405Aoi-',
-            'database': 'mykeibadb',
-            'charset': 'utf8mb4'
-        }
+        # 全馬の事前計算スコア（ナレッジのバージョンが変わると無効、全エンジンで1つを共有）
+        self.score_table = self.raw_manager.get_score_table()
+        # 出走馬全頭の12項目を一括計算するベクトル化エンジン
+        self.batch_scorer = self.score_table.batch_scorer
+        # 既定では使わない（有効時のみ保存済みテーブルを読み込み、なければ構築する）
+        self.build_table = os.getenv('DLOGIC_PRECOMPUTE_SCORES', 'false').lower() in ('1', 'true', 'yes')
+        if self.build_table:
+            self.score_table.refresh(build_if_missing=True)
+        # ナレッジ未登録馬のMySQLフォールバック（共有接続プール・一括取得）
+        self.mysql_fallback = DLogicMySQLFallback()
+        # 出走馬の並列分析設定
+        self.execution_mode = EXECUTION_MODE
+        if self.execution_mode not in ('sequential', 'thread', 'process'):
+            self.execution_mode = 'sequential'
+        self.execution_workers = max(1, EXECUTION_WORKERS)
+        self._executor = None
+        # ナレッジの差し替え・デルタ適用に追従
+        self.raw_manager.add_listener(self._on_knowledge_changed)
         print(f"⚡ 高速D-Logic計算エンジン初期化完了 (ナレッジ: {len(self.raw_manager.knowledge_data.get('horses', {}))}頭)")
     
-    def analyze_single_horse(self, horse_name: str) -> Dict[str, Any]:
-        """単体馬分析（目標: 0.1秒以内）"""
+    def analyze_single_horse(self, horse_name: str,
+                             standard_result: Optional[Dict[str, Any]] = None,
+                             fallback_raw_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """単体馬分析（目標: 0.1秒以内）
+        
+        Args:
+            horse_name: 馬名
+            standard_result: 一括計算済みの標準D-Logic結果（あれば再計算しない）
+            fallback_raw_data: MySQLから一括取得済みの生データ（ナレッジ未登録馬用）
+        """
         start_time = datetime.now()
         
         # ダンスインザダークは基準馬なので特別扱い
@@ -55,30 +105,66 @@ class FastDLogicEngine:
                 "horse_name": horse_name
             }
         
-        # 1. ナレッジから生データ取得（高速）
-        raw_data = self.raw_manager.get_horse_raw_data(horse_name)
+        # フェーズ別時間（秒）: 参照 / 12項目計算 / MySQLフォールバック
+        timings = {'lookup': 0.0, 'factor_calc': 0.0, 'fallback': 0.0}
+        phase_start = time.perf_counter()
+        
+        if standard_result is None:
+            standard_result = self.score_table.lookup(horse_name)
         
+        if standard_result is not None:
+            # 一括計算済み
+            timings['lookup'] = time.perf_counter() - phase_start
+            result = dict(standard_result)
+            result['data_source'] = 'knowledge_base'
+            self._mark_name_match(result, horse_name)
+            result['calculation_time_seconds'] = (datetime.now() - start_time).total_seconds()
+            result['timing_breakdown'] = timings
+            return result
+        
+        # 1. ナレッジから解析済みレース記録を取得（高速）
+        raw_data = self.raw_manager.get_horse_records(horse_name)
+        timings['lookup'] = time.perf_counter() - phase_start
+        
+        phase_start = time.perf_counter()
         if raw_data:
             # ナレッジヒット - リアルタイム計算
-            result = self.raw_manager.calculate_dlogic_realtime(horse_name)
+            result = self.raw_manager.calculate_dlogic_realtime(horse_name, raw_data)
             result['data_source'] = 'knowledge_base'
+            self._mark_name_match(result, horse_name)
+            timings['factor_calc'] = time.perf_counter() - phase_start
         else:
             # ナレッジ未登録 - MySQLフォールバック
-            result = self._calculate_from_mysql(horse_name)
-            result['data_source'] = 'mysql_fallback'
+            result = self._calculate_from_mysql(horse_name, fallback_raw_data)
+            timings['fallback'] = time.perf_counter() - phase_start
         
         # 計算時間記録
         calc_time = (datetime.now() - start_time).total_seconds()
         result['calculation_time_seconds'] = calc_time
+        result['timing_breakdown'] = timings
         
         return result
     
-    def analyze_single_horse_weather(self, horse_name: str, baba_condition: int) -> Dict[str, Any]:
+    def _mark_name_match(self, result: Dict[str, Any], horse_name: str):
+        """表記ゆれ・近似一致で別表記のナレッジを使った結果に一致種別と解決先の馬名を付ける
+        
+        name_match が "fuzzy" の結果は別の馬の可能性がある（呼び出し側で拒否できる）
+        """
+        key, match_type = self.raw_manager.match_horse_name(horse_name)
+        if match_type in ('folded', 'fuzzy'):
+            result['name_match'] = match_type
+            result['matched_horse_name'] = key
+    
+    def analyze_single_horse_weather(self, horse_name: str, baba_condition: int,
+                                     standard_result: Optional[Dict[str, Any]] = None,
+                                     fallback_raw_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """単体馬の天候適性分析
         
         Args:
             horse_name: 馬名
             baba_condition: 馬場状態 (1=良, 2=稍重, 3=重, 4=不良)
+            standard_result: 一括計算済みの標準D-Logic結果（あれば再計算しない）
+            fallback_raw_data: MySQLから一括取得済みの生データ（ナレッジ未登録馬用）
         
         Returns:
             天候適性を考慮したD-Logic分析結果
@@ -113,10 +199,40 @@ class FastDLogicEngine:
             }
             return result
         
+        # フェーズ別時間（秒）: 参照 / 12項目計算 / MySQLフォールバック
+        timings = {'lookup': 0.0, 'factor_calc': 0.0, 'fallback': 0.0}
+        phase_start = time.perf_counter()
+        
+        # 事前計算テーブルにあればそのまま返す
+        result = self.score_table.lookup_weather(horse_name, baba_condition)
+        timings['lookup'] = time.perf_counter() - phase_start
+        if result is not None:
+            result['data_source'] = 'knowledge_base'
+            self._mark_name_match(result, horse_name)
+            result['calculation_time_seconds'] = (datetime.now() - start_time).total_seconds()
+            result['timing_breakdown'] = timings
+            return result
+        
         # 天候適性計算を実行
-        result = self.raw_manager.calculate_weather_adaptive_dlogic(horse_name, baba_condition)
+        phase_start = time.perf_counter()
+        result = self.raw_manager.calculate_weather_adaptive_dlogic(
+            horse_name, baba_condition, standard_result=standard_result
+        )
+        timings['factor_calc'] = time.perf_counter() - phase_start
+        
+        # ナレッジにない場合はMySQLフォールバック
+        data_source = 'knowledge_base'
+        phase_start = time.perf_counter()
+        if "error" in result and self.mysql_fallback.enabled:
+            if fallback_raw_data is None:
+                fallback_raw_data = self.mysql_fallback.fetch_horses([horse_name]).get(horse_name)
+            if fallback_raw_data:
+                result = self.raw_manager.calculate_weather_adaptive_dlogic(
+                    horse_name, baba_condition, raw_data=fallback_raw_data
+                )
+                data_source = 'mysql_fallback'
+            timings['fallback'] = time.perf_counter() - phase_start
         
-        # ナレッジにない場合のフォールバック
         if "error" in result:
             result = {
                 "error": f"{horse_name}のデータは現在のナレッジベースに含まれていません。",
@@ -128,11 +244,14 @@ class FastDLogicEngine:
                 "data_source": "not_found"
             }
         else:
-            result['data_source'] = 'knowledge_base'
+            result['data_source'] = data_source
+            if data_source == 'knowledge_base':
+                self._mark_name_match(result, horse_name)
         
         # 計算時間記録
         calc_time = (datetime.now() - start_time).total_seconds()
         result['calculation_time_seconds'] = calc_time
+        result['timing_breakdown'] = timings
         
         return result
     
@@ -148,13 +267,58 @@ class FastDLogicEngine:
         """
         start_time = datetime.now()
         
+        phase_timings = {}
+        
+        # 標準12項目は全頭まとめてベクトル計算
+        phase_start = time.perf_counter()
+        batch_results = self._batch_standard_results(horse_names)
+        phase_timings['batch_scoring'] = time.perf_counter() - phase_start
+        # ナレッジ未登録馬はMySQLから1クエリでまとめて取得
+        phase_start = time.perf_counter()
+        fallback_raw = self._fetch_fallback_raw_data(horse_names)
+        phase_timings['fallback_fetch'] = time.perf_counter() - phase_start
+        
+        # 各馬の分析（実行モードに応じて並列化、結果は入力順）
+        phase_start = time.perf_counter()
+        horse_results = self._map_horses('analyze_single_horse_weather', [
+            (horse_name, baba_condition, batch_results.get(horse_name), fallback_raw.get(horse_name))
+            for horse_name in horse_names
+        ])
+        phase_timings['horse_analysis'] = time.perf_counter() - phase_start
+        
+        phase_start = time.perf_counter()
+        ranked = self._rank_weather_results(horse_names, horse_results, baba_condition)
+        phase_timings['ranking'] = time.perf_counter() - phase_start
+        
+        total_time = (datetime.now() - start_time).total_seconds()
+        
+        return {
+            'race_analysis': {
+                'total_horses': len(horse_names),
+                'analyzed_horses': ranked['analyzed_horses'],
+                'not_found_horses': ranked['not_found_horses'],
+                'knowledge_hits': ranked['knowledge_hits'],
+                'mysql_fallbacks': ranked['mysql_fallbacks'],
+                'total_calculation_time': total_time,
+                'avg_time_per_horse': total_time / len(horse_names) if horse_names else 0,
+                'batch_scored_horses': len(batch_results),
+                'execution_mode': self.execution_mode,
+                'phase_timings': phase_timings,
+                'baba_condition': baba_condition,
+                'weather_condition': {1: "良", 2: "稍重", 3: "重", 4: "不良"}[baba_condition]
+            },
+            'horses': ranked['horses'],
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    def _rank_weather_results(self, horse_names: List[str], horse_results: List[Dict[str, Any]],
+                              baba_condition: int) -> Dict[str, Any]:
+        """1つの馬場状態の出走馬結果を分類・順位付け（スコアがある馬 → データがない馬の順）"""
         results = []
         knowledge_hits = 0
         mysql_fallbacks = 0
         
-        for horse_name in horse_names:
-            horse_result = self.analyze_single_horse_weather(horse_name, baba_condition)
-            
+        for horse_name, horse_result in zip(horse_names, horse_results):
             # 馬名を確実に含める
             if 'horse_name' in horse_result and 'name' not in horse_result:
                 horse_result['name'] = horse_result['horse_name']
@@ -197,21 +361,123 @@ class FastDLogicEngine:
         # すべての結果を結合（スコアがある馬 → データがない馬の順）
         all_results = valid_results + not_found_results
         
+        return {
+            'horses': all_results,
+            'analyzed_horses': len(valid_results),
+            'not_found_horses': len(not_found_results),
+            'knowledge_hits': knowledge_hits,
+            'mysql_fallbacks': mysql_fallbacks
+        }
+    
+    def analyze_single_horse_all_weather(self, horse_name: str,
+                                         standard_result: Optional[Dict[str, Any]] = None,
+                                         fallback_raw_data: Optional[Dict[str, Any]] = None) -> Dict[int, Dict[str, Any]]:
+        """単体馬の良・稍重・重・不良の天候適性をまとめて分析
+        
+        標準D-Logicとレース記録の走査を4つの馬場状態で共有する
+        
+        Returns:
+            {馬場状態: analyze_single_horse_weather と同じ形式の結果}
+        """
+        if horse_name == "ダンスインザダーク":
+            return {baba_condition: self.analyze_single_horse_weather(horse_name, baba_condition)
+                    for baba_condition in WEATHER_CONDITION_NAMES}
+        
+        start_time = datetime.now()
+        timings = {'lookup': 0.0, 'factor_calc': 0.0, 'fallback': 0.0}
+        phase_start = time.perf_counter()
+        
+        # 事前計算テーブルにあれば1行の参照で4つの馬場状態を返す
+        results = self.score_table.lookup_all_weather(horse_name)
+        timings['lookup'] = time.perf_counter() - phase_start
+        data_source = 'knowledge_base'
+        
+        if results is None:
+            phase_start = time.perf_counter()
+            results = self.raw_manager.calculate_all_weather_dlogic(horse_name, standard_result=standard_result)
+            timings['factor_calc'] = time.perf_counter() - phase_start
+            
+            # ナレッジにない場合はMySQLフォールバック
+            phase_start = time.perf_counter()
+            if "error" in results[1] and self.mysql_fallback.enabled:
+                if fallback_raw_data is None:
+                    fallback_raw_data = self.mysql_fallback.fetch_horses([horse_name]).get(horse_name)
+                if fallback_raw_data:
+                    results = self.raw_manager.calculate_all_weather_dlogic(horse_name, raw_data=fallback_raw_data)
+                    data_source = 'mysql_fallback'
+                timings['fallback'] = time.perf_counter() - phase_start
+        
+        calc_time = (datetime.now() - start_time).total_seconds()
+        for baba_condition, result in results.items():
+            if "error" in result:
+                results[baba_condition] = result = {
+                    "error": f"{horse_name}のデータは現在のナレッジベースに含まれていません。",
+                    "total_score": 50.0,
+                    "grade": "未評価",
+                    "note": "この馬のデータは次回の更新時に追加される予定です。",
+                    "horse_name": horse_name,
+                    "weather_condition": WEATHER_CONDITION_NAMES[baba_condition],
+                    "data_source": "not_found"
+                }
+            else:
+                result['data_source'] = data_source
+                if data_source == 'knowledge_base':
+                    self._mark_name_match(result, horse_name)
+            # 計算は4つの馬場状態で1回分
+            result['calculation_time_seconds'] = calc_time
+            result['timing_breakdown'] = timings
+        return results
+    
+    def analyze_race_horses_all_weather(self, horse_names: List[str]) -> Dict[str, Any]:
+        """レース出走馬の良・稍重・重・不良の天候適性を1回で一括分析
+        
+        標準12項目の一括計算・MySQL一括取得・各馬のレース記録の走査を4つの馬場状態で共有し、
+        馬場状態ごとに analyze_race_horses_weather と同じ形式の順位付き結果を返す
+        （画面で馬場状態を切り替えても再リクエスト不要）
+        """
+        start_time = datetime.now()
+        phase_timings = {}
+        
+        phase_start = time.perf_counter()
+        batch_results = self._batch_standard_results(horse_names)
+        phase_timings['batch_scoring'] = time.perf_counter() - phase_start
+        phase_start = time.perf_counter()
+        fallback_raw = self._fetch_fallback_raw_data(horse_names)
+        phase_timings['fallback_fetch'] = time.perf_counter() - phase_start
+        
+        phase_start = time.perf_counter()
+        horse_results = self._map_horses('analyze_single_horse_all_weather', [
+            (horse_name, batch_results.get(horse_name), fallback_raw.get(horse_name))
+            for horse_name in horse_names
+        ])
+        phase_timings['horse_analysis'] = time.perf_counter() - phase_start
+        
+        phase_start = time.perf_counter()
+        conditions = {}
+        for baba_condition, weather_condition in WEATHER_CONDITION_NAMES.items():
+            ranked = self._rank_weather_results(
+                horse_names, [results[baba_condition] for results in horse_results], baba_condition
+            )
+            conditions[baba_condition] = {
+                'baba_condition': baba_condition,
+                'weather_condition': weather_condition,
+                **ranked
+            }
+        phase_timings['ranking'] = time.perf_counter() - phase_start
+        
         total_time = (datetime.now() - start_time).total_seconds()
         
         return {
             'race_analysis': {
                 'total_horses': len(horse_names),
-                'analyzed_horses': len(valid_results),
-                'not_found_horses': len(not_found_results),
-                'knowledge_hits': knowledge_hits,
-                'mysql_fallbacks': mysql_fallbacks,
+                'baba_conditions': list(WEATHER_CONDITION_NAMES),
                 'total_calculation_time': total_time,
                 'avg_time_per_horse': total_time / len(horse_names) if horse_names else 0,
-                'baba_condition': baba_condition,
-                'weather_condition': {1: "良", 2: "稍重", 3: "重", 4: "不良"}[baba_condition]
+                'batch_scored_horses': len(batch_results),
+                'execution_mode': self.execution_mode,
+                'phase_timings': phase_timings
             },
-            'horses': all_results,
+            'conditions': conditions,
             'timestamp': datetime.now().isoformat()
         }
     
@@ -223,9 +489,27 @@ class FastDLogicEngine:
         knowledge_hits = 0
         mysql_fallbacks = 0
         
-        for horse_name in horse_names:
-            horse_result = self.analyze_single_horse(horse_name)
-            
+        phase_timings = {}
+        
+        # 標準12項目は全頭まとめてベクトル計算
+        phase_start = time.perf_counter()
+        batch_results = self._batch_standard_results(horse_names)
+        phase_timings['batch_scoring'] = time.perf_counter() - phase_start
+        # ナレッジ未登録馬はMySQLから1クエリでまとめて取得
+        phase_start = time.perf_counter()
+        fallback_raw = self._fetch_fallback_raw_data(horse_names)
+        phase_timings['fallback_fetch'] = time.perf_counter() - phase_start
+        
+        # 各馬の分析（実行モードに応じて並列化、結果は入力順）
+        phase_start = time.perf_counter()
+        horse_results = self._map_horses('analyze_single_horse', [
+            (horse_name, batch_results.get(horse_name), fallback_raw.get(horse_name))
+            for horse_name in horse_names
+        ])
+        phase_timings['horse_analysis'] = time.perf_counter() - phase_start
+        
+        phase_start = time.perf_counter()
+        for horse_name, horse_result in zip(horse_names, horse_results):
             # 馬名を確実に含める（'name'フィールドとして）
             if 'horse_name' in horse_result and 'name' not in horse_result:
                 horse_result['name'] = horse_result['horse_name']
@@ -266,6 +550,7 @@ class FastDLogicEngine:
         
         # すべての結果を結合（スコアがある馬 → データがない馬の順）
         all_results = valid_results + not_found_results
+        phase_timings['ranking'] = time.perf_counter() - phase_start
         
         total_time = (datetime.now() - start_time).total_seconds()
         
@@ -277,14 +562,148 @@ class FastDLogicEngine:
                 'knowledge_hits': knowledge_hits,
                 'mysql_fallbacks': mysql_fallbacks,
                 'total_calculation_time': total_time,
-                'avg_time_per_horse': total_time / len(horse_names) if horse_names else 0
+                'avg_time_per_horse': total_time / len(horse_names) if horse_names else 0,
+                'batch_scored_horses': len(batch_results),
+                'execution_mode': self.execution_mode,
+                'phase_timings': phase_timings
             },
             'horses': all_results,
             'timestamp': datetime.now().isoformat()
         }
     
-    def _calculate_from_mysql(self, horse_name: str) -> Dict[str, Any]:
+    def _batch_standard_results(self, horse_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """出走馬の標準D-Logicを一括計算（基準馬・未登録馬・計算不能馬は含まない）"""
+        results = {}
+        misses = []
+        for horse_name in horse_names:
+            if horse_name == "ダンスインザダーク" or horse_name in results or horse_name in misses:
+                continue
+            # 事前計算テーブルを優先
+            table_result = self.score_table.lookup(horse_name)
+            if table_result is not None:
+                results[horse_name] = table_result
+            else:
+                misses.append(horse_name)
+        
+        if not self.batch_scorer.available or len(misses) < 2:
+            return results
+        
+        targets = []
+        records = []
+        for horse_name in misses:
+            horse = self.raw_manager.get_horse_records(horse_name)
+            if horse is not None:
+                targets.append(horse_name)
+                records.append(horse)
+        
+        for horse_name, scored in zip(targets, self.batch_scorer.score_raw_data(records)):
+            if scored is None:
+                continue
+            results[horse_name] = {
+                "horse_name": horse_name,
+                **scored,
+                "calculation_time": datetime.now().isoformat()
+            }
+        return results
+    
+    def _map_horses(self, method_name: str, calls: List[tuple]) -> List[Dict[str, Any]]:
+        """1頭分の分析メソッドを全出走馬に適用（結果は入力順、順位は呼び出し側で決定）"""
+        if self.execution_mode == 'sequential' or len(calls) < 2:
+            return [self._analyze_isolated(method_name, args) for args in calls]
+        
+        executor = self._get_executor()
+        if self.execution_mode != 'process':
+            futures = [executor.submit(self._analyze_isolated, method_name, args) for args in calls]
+            return [future.result() for future in futures]
+        
+        # ワーカーは自分でナレッジを読み込むため、親プロセスのバージョンを渡して一致を確認する
+        knowledge_version = self.raw_manager.get_knowledge_version()
+        futures = [executor.submit(_process_call, knowledge_version, method_name, args) for args in calls]
+        results = []
+        for args, future in zip(calls, futures):
+            result = future.result()
+            if result is None:
+                # ワーカーのナレッジが古い（メモリ上の追加・デルタ適用直後など）馬はこのプロセスで計算
+                result = self._analyze_isolated(method_name, args)
+            results.append(result)
+        return results
+    
+    def _analyze_isolated(self, method_name: str, args: tuple):
+        """1頭分の分析（計算できない馬がいてもレース全体は失敗させず、その馬をエラー結果にする）"""
+        try:
+            return getattr(self, method_name)(*args)
+        except Exception as e:
+            horse_name = args[0]
+            print(f"⚠️ {horse_name}の分析エラー: {e}")
+            error = {
+                "horse_name": horse_name,
+                "error": f"{horse_name}の分析中にエラーが発生しました: {e}",
+                "data_source": "error"
+            }
+            if method_name == 'analyze_single_horse_weather':
+                return {**error, "weather_condition": WEATHER_CONDITION_NAMES[args[1]]}
+            if method_name == 'analyze_single_horse_all_weather':
+                return {baba_condition: {**error, "weather_condition": weather_condition}
+                        for baba_condition, weather_condition in WEATHER_CONDITION_NAMES.items()}
+            return error
+    
+    def _get_executor(self):
+        """ワーカープールを遅延生成
+        
+        processモードはspawnで起動する（forkはasyncio.to_threadのスレッドなど他のスレッドがある状態で
+        行うとデッドロックしうる）。各ワーカーは _init_process_worker で自分のエンジンを作る
+        """
+        if self._executor is None:
+            if self.execution_mode == 'process':
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.execution_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_process_worker
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.execution_workers,
+                    thread_name_prefix='dlogic-race'
+                )
+        return self._executor
+    
+    def reset_executor(self):
+        """ワーカープールを破棄（ナレッジ更新後、次回分析時に作り直す）"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+    
+    def _on_knowledge_changed(self, reason: str):
+        """ナレッジ変更時: ワーカープロセスは古いナレッジを持つので作り直し、差し替え時はスコアテーブルも再構築"""
+        self.reset_executor()
+        if reason == 'reload' and self.build_table:
+            # 共有テーブルは最初に通知を受けたエンジンが読み込み・構築し、他のエンジンでは何もしない
+            self.score_table.refresh(build_if_missing=True)
+    
+    def _fetch_fallback_raw_data(self, horse_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """ナレッジ未登録の出走馬の生データをMySQLから一括取得"""
+        if not self.mysql_fallback.enabled:
+            return {}
+        
+        missing = [
+            horse_name for horse_name in horse_names
+            if horse_name != "ダンスインザダーク" and self.raw_manager.resolve_horse_name(horse_name) is None
+        ]
+        if not missing:
+            return {}
+        return self.mysql_fallback.fetch_horses(missing)
+    
+    def _calculate_from_mysql(self, horse_name: str,
+                              raw_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """MySQLから直接計算（フォールバック用）"""
+        if raw_data is None and self.mysql_fallback.enabled:
+            raw_data = self.mysql_fallback.fetch_horses([horse_name]).get(horse_name)
+        
+        if raw_data:
+            result = self.raw_manager.calculate_dlogic_realtime(horse_name, raw_data)
+            result['data_source'] = 'mysql_fallback'
+            return result
+        
         # Renderではローカル MySQL にアクセスできないため、ナレッジにない馬は対応不可
         return {
             "error": f"{horse_name}のデータは現在のナレッジベースに含まれていません。データ更新をお待ちください。",
@@ -309,6 +728,23 @@ class FastDLogicEngine:
         
         return self.analyze_race_horses(horse_names)
     
+    # --- 非同期API用（計算・MySQL問い合わせをイベントループ外のスレッドで実行） ---
+    
+    async def analyze_single_horse_async(self, horse_name: str) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.analyze_single_horse, horse_name)
+    
+    async def analyze_single_horse_weather_async(self, horse_name: str, baba_condition: int) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.analyze_single_horse_weather, horse_name, baba_condition)
+    
+    async def analyze_race_horses_async(self, horse_names: List[str]) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.analyze_race_horses, horse_names)
+    
+    async def analyze_race_horses_weather_async(self, horse_names: List[str], baba_condition: int) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.analyze_race_horses_weather, horse_names, baba_condition)
+
+    async def analyze_race_horses_all_weather_async(self, horse_names: List[str]) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.analyze_race_horses_all_weather, horse_names)
+    
     def get_performance_stats(self) -> Dict[str, Any]:
         """エンジン性能統計"""
         knowledge_horses = len(self.raw_manager.knowledge_data.get('horses', {}))
@@ -318,6 +754,12 @@ class FastDLogicEngine:
             "cache_hit_rate": "N/A (要実装)",
             "avg_calculation_time": "N/A (要実装)",
             "last_updated": self.raw_manager.knowledge_data.get('meta', {}).get('last_updated'),
+            "knowledge_version": self.raw_manager.get_knowledge_version(),
+            "score_table": self.score_table.get_stats(),
+            "name_resolution": self.raw_manager.name_index.aliases.get_stats(),
+            "mysql_fallback": self.mysql_fallback.get_stats(),
+            "execution_mode": self.execution_mode,
+            "execution_workers": self.execution_workers,
             "engine_version": "1.0"
         }
 
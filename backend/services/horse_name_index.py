@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+馬名解決インデックス
+ナレッジ読み込み時に一度だけ構築し、完全一致・表記ゆれ・近似一致を線形走査なしで解決する
+"""
+import os
+from typing import Dict, List, Iterable, Optional, Tuple
+from services.name_normalizer import normalize_name, NameAliasTable
+
+# 編集距離による近似一致の許容距離（0 = 使わない。別馬に解決されやすいため設定した場合のみ）
+DEFAULT_MAX_DISTANCE = int(os.getenv('HORSE_NAME_MAX_DISTANCE', '0'))
+# 近似一致を試す最短の馬名長（短い名前は誤マッチしやすいため）
+MIN_FUZZY_LENGTH = 5
+# 部分一致（「ディープインパクト」と「ディープインパクト号」）で許す文字数差
+SUBSTRING_MAX_LENGTH_DIFF = 2
+
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """レーベンシュタイン距離（limitを超えた時点で打ち切り、limit + 1を返す）"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        row_min = i
+        for j, cb in enumerate(b, 1):
+            value = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb)
+            )
+            current.append(value)
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class HorseNameIndex:
+    """正規化キーの別名表 + バイグラム転置インデックスによる馬名解決"""
+
+    def __init__(self, names: Iterable[str] = (), max_distance: int = DEFAULT_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._names: List[str] = []
+        self._folded: List[str] = []
+        self._exact: Dict[str, int] = {}
+        self.aliases = NameAliasTable()
+        self._postings: Dict[str, List[int]] = {}
+        for name in names:
+            self.add(name)
+
+    def __len__(self) -> int:
+        return len(self._exact)
+
+    def add(self, name: str):
+        """馬名を登録（登録順が同点時の優先順位になる）"""
+        if name in self._exact:
+            return
+        name_id = len(self._names)
+        folded = normalize_name(name)
+        self._names.append(name)
+        self._folded.append(folded)
+        self._exact[name] = name_id
+        # 正規化後に同じになる馬名は先に登録した方を優先
+        self.aliases.add(name)
+        for gram in _bigrams(folded):
+            self._postings.setdefault(gram, []).append(name_id)
+
+    def match(self, name: str) -> Tuple[Optional[str], str]:
+        """馬名を解決し、(ナレッジ上の馬名, 一致種別)を返す
+
+        一致種別: exact / folded / fuzzy / none
+        fuzzy は別の馬の可能性がある一致（呼び出し側で拒否できるよう区別して返す）
+        """
+        if name in self._exact:
+            return name, 'exact'
+
+        resolved = self.aliases.resolve(name)
+        if resolved is not None:
+            return resolved, 'folded'
+
+        folded = normalize_name(name)
+
+        if len(folded) >= MIN_FUZZY_LENGTH:
+            name_id = self._substring_match(folded)
+            if name_id is None and self.max_distance > 0:
+                name_id = self._nearest(folded)
+            if name_id is not None:
+                return self._names[name_id], 'fuzzy'
+
+        return None, 'none'
+
+    def resolve(self, name: str) -> Optional[str]:
+        """ナレッジ上の馬名を返す（見つからなければNone）"""
+        return self.match(name)[0]
+
+    def _shared_bigrams(self, query_grams: set) -> Dict[int, int]:
+        """馬名ID -> 検索語と共通するバイグラムの数"""
+        shared: Dict[int, int] = {}
+        for gram in query_grams:
+            for name_id in self._postings.get(gram, ()):
+                shared[name_id] = shared.get(name_id, 0) + 1
+        return shared
+
+    def _substring_match(self, folded: str) -> Optional[int]:
+        """一方が他方を含み、文字数差がSUBSTRING_MAX_LENGTH_DIFF以内の馬名のうち最初に登録されたもの
+
+        （従来の線形走査と同じ規則。短い方のバイグラムはすべて長い方に含まれる）
+        """
+        query_grams = _bigrams(folded)
+        for name_id, count in sorted(self._shared_bigrams(query_grams).items()):
+            candidate = self._folded[name_id]
+            if abs(len(candidate) - len(folded)) > SUBSTRING_MAX_LENGTH_DIFF:
+                continue
+            if count < min(len(query_grams), len(_bigrams(candidate))):
+                continue
+            if folded in candidate or candidate in folded:
+                return name_id
+        return None
+
+    def _nearest(self, folded: str) -> Optional[int]:
+        """編集距離max_distance以内で最も近い馬名のID（最も近い馬名が1つに決まらなければNone）"""
+        limit = self.max_distance
+        query_grams = _bigrams(folded)
+
+        best_distance = limit + 1
+        best_ids: List[int] = []
+        for name_id, count in self._shared_bigrams(query_grams).items():
+            candidate = self._folded[name_id]
+            # 1回の編集で失われるバイグラムは最大2種類
+            if count < max(len(query_grams), len(_bigrams(candidate))) - 2 * limit:
+                continue
+            distance = _edit_distance(folded, candidate, limit)
+            if distance < best_distance:
+                best_distance = distance
+                best_ids = [name_id]
+            elif distance == best_distance:
+                best_ids.append(name_id)
+        return best_ids[0] if len(best_ids) == 1 else None
+
+    def search(self, query: str) -> List[str]:
+        """部分一致する馬名を登録順で返す"""
+        folded = normalize_name(query)
+        if len(folded) < 2:
+            return [name for name, key in zip(self._names, self._folded) if folded in key]
+
+        candidates = None
+        for gram in _bigrams(folded):
+            ids = set(self._postings.get(gram, ()))
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return []
+        return [self._names[name_id] for name_id in sorted(candidates) if folded in self._folded[name_id]]
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+騎手ナレッジ分析サービス
+data/jockey_knowledge.json（騎手ごとの直近成績リスト）を読み込み時に一度だけ集計し、
+騎手 × コース・馬場状態・枠・父馬 の複勝率と件数を辞書1回の参照で返す
+
+- 騎手名はナレッジのキー（騎手名略称の先頭4文字）に先頭一致で解決する
+- コース × 馬場状態は、両方の成績リストに同じレース（日付・馬名）がある分だけを集計する
+- 出走馬全体の騎手相性（3_jockey_compatibility）を1回の呼び出しで計算する
+"""
+import json
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from services.name_normalizer import NameAliasTable
+
+JOCKEY_KNOWLEDGE_FILE = os.getenv(
+    'JOCKEY_KNOWLEDGE_FILE',
+    os.path.join(os.path.dirname(__file__), '..', 'data', 'jockey_knowledge.json')
+)
+
+# 集計の次元: (次元名, ナレッジ上のセクション名)
+DIMENSIONS: List[Tuple[str, str]] = [
+    ('venue_course', 'venue_course_stats'),
+    ('baba', 'track_condition_stats'),
+    ('post_position', 'post_position_stats'),
+    ('sire', 'sire_stats'),
+]
+VENUE_COURSE_BABA = 'venue_course_baba'
+
+BABA_NAMES = {1: '良', 2: '稍重', 3: '重', 4: '不良'}
+
+# 騎手相性スコアの次元ごとの重み（データがある次元だけで正規化）
+COMPATIBILITY_WEIGHTS = {
+    'venue_course': 0.4,
+    'baba': 0.2,
+    'post_position': 0.2,
+    'sire': 0.2,
+}
+# 件数の少ない集計を騎手全体の複勝率に寄せる強さ（仮想レース数）
+PRIOR_RACES = 5
+# 複勝率がこの値（%）で100点
+FUKUSHO_FULL_MARK = 60.0
+NEUTRAL_SCORE = 50.0
+
+# 集計値: (レース数, 複勝回数)
+_Stat = Tuple[int, int]
+
+
+def venue_course_key(venue: str, distance: Any = None) -> str:
+    """「中山」「2500」→「中山_2500m」（既に「中山_2500m」ならそのまま）"""
+    if distance is None or distance == '':
+        return venue
+    distance = str(distance).strip()
+    if not distance.endswith('m'):
+        distance += 'm'
+    return f"{venue}_{distance}"
+
+
+def baba_key(baba: Any) -> str:
+    """馬場状態コード（1〜4）または名称をナレッジ上のキーにそろえる"""
+    try:
+        return BABA_NAMES.get(int(baba), str(baba))
+    except (TypeError, ValueError):
+        return str(baba)
+
+
+def post_position_key(post: Any) -> str:
+    """枠番（3 / "3" / "枠3"）→「枠3」"""
+    post = str(post).strip()
+    return post if post.startswith('枠') else f"枠{post}"
+
+
+_KEY_FUNCTIONS = {
+    'venue_course': lambda value: value,
+    'baba': baba_key,
+    'post_position': post_position_key,
+    'sire': lambda value: str(value).strip(),
+}
+
+
+def _as_dict(stat: _Stat) -> Dict[str, Any]:
+    races, fukusho = stat
+    return {
+        'race_count': races,
+        'fukusho_count': fukusho,
+        'fukusho_rate': round(fukusho / races * 100, 1) if races else 0.0,
+    }
+
+
+def _count(entry: Dict[str, Any]) -> _Stat:
+    """成績リストから (レース数, 複勝回数)。リストがなければ保存済みの値から復元"""
+    results = entry.get('results')
+    if results is not None:
+        return len(results), sum(1 for result in results if result.get('is_fukusho'))
+    races = int(entry.get('race_count', 0) or 0)
+    return races, round(races * float(entry.get('fukusho_rate', 0) or 0) / 100)
+
+
+class JockeyAnalytics:
+    """騎手 × 条件ごとの複勝率集計"""
+
+    def __init__(self, knowledge_file: Optional[str] = None):
+        self.knowledge_file = knowledge_file or JOCKEY_KNOWLEDGE_FILE
+        self._stats: Dict[Tuple[str, str, str], _Stat] = {}
+        self._overall: Dict[str, _Stat] = {}
+        self.names = NameAliasTable(prefix_match=True)
+        self._signature: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    # --- 読み込み ---
+
+    def _ensure_loaded(self):
+        """初回参照時、またはファイルが更新されていたら読み込む"""
+        try:
+            stat = os.stat(self.knowledge_file)
+        except OSError:
+            return
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if signature == self._signature:
+            return
+        with self._lock:
+            if signature != self._signature:
+                with open(self.knowledge_file, 'r', encoding='utf-8') as f:
+                    self.load(json.load(f))
+                self._signature = signature
+
+    def load(self, knowledge: Dict[str, Dict[str, Any]]):
+        """騎手ナレッジを集計して索引を作り直す（成績リストそのものは保持しない）"""
+        stats: Dict[Tuple[str, str, str], _Stat] = {}
+        overall: Dict[str, _Stat] = {}
+        names = NameAliasTable(prefix_match=True)
+
+        for jockey, info in knowledge.items():
+            names.add(jockey)
+            for dimension, section in DIMENSIONS:
+                for value, entry in (info.get(section) or {}).items():
+                    stats[(jockey, dimension, value)] = _count(entry)
+
+            # コース × 馬場状態（同じレースが両方のリストにある分）
+            baba_by_race = {
+                (result.get('date'), result.get('horse_name')): value
+                for value, entry in (info.get('track_condition_stats') or {}).items()
+                for result in entry.get('results', [])
+            }
+            for course, entry in (info.get('venue_course_stats') or {}).items():
+                for result in entry.get('results', []):
+                    baba = baba_by_race.get((result.get('date'), result.get('horse_name')))
+                    if baba is None:
+                        continue
+                    key = (jockey, VENUE_COURSE_BABA, f"{course}|{baba}")
+                    races, fukusho = stats.get(key, (0, 0))
+                    stats[key] = (races + 1, fukusho + bool(result.get('is_fukusho')))
+
+            # 騎手全体（構築時と同じくコース別成績の合計）
+            races = fukusho = 0
+            for entry in (info.get('venue_course_stats') or {}).values():
+                count, hits = _count(entry)
+                races += count
+                fukusho += hits
+            overall[jockey] = (races, fukusho)
+
+        self._stats = stats
+        self._overall = overall
+        self.names = names
+        print(f"✅ 騎手ナレッジ集計: {len(overall)}人 / {len(stats)}件")
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._overall)
+
+    # --- 参照 ---
+
+    def resolve_jockey(self, jockey_name: str) -> Optional[str]:
+        """入力された騎手名（フルネーム・全角半角違いなど）をナレッジ上のキーに解決"""
+        self._ensure_loaded()
+        if not jockey_name:
+            return None
+        if jockey_name in self._overall:
+            return jockey_name
+        return self.names.resolve(jockey_name)
+
+    def get_stat(self, jockey_name: str, dimension: str, value: Any) -> Optional[Dict[str, Any]]:
+        """騎手 × 1条件の集計（race_count / fukusho_count / fukusho_rate）"""
+        jockey = self.resolve_jockey(jockey_name)
+        if jockey is None:
+            return None
+        stat = self._stats.get((jockey, dimension, _KEY_FUNCTIONS[dimension](value)))
+        return _as_dict(stat) if stat else None
+
+    def get_overall(self, jockey_name: str) -> Optional[Dict[str, Any]]:
+        jockey = self.resolve_jockey(jockey_name)
+        if jockey is None:
+            return None
+        return _as_dict(self._overall[jockey])
+
+    def query(self, jockey_name: str, venue_course: Optional[str] = None, baba: Any = None,
+              post_position: Any = None, sire: Optional[str] = None) -> Dict[str, Any]:
+        """指定した条件ごとの集計をまとめて返す（コースと馬場状態の両方があれば組み合わせも）"""
+        jockey = self.resolve_jockey(jockey_name)
+        result: Dict[str, Any] = {'jockey': jockey_name, 'knowledge_key': jockey}
+        if jockey is None:
+            return result
+        result['overall'] = _as_dict(self._overall[jockey])
+        conditions = {'venue_course': venue_course, 'baba': baba, 'post_position': post_position, 'sire': sire}
+        for dimension, value in conditions.items():
+            if value is not None and value != '':
+                stat = self._stats.get((jockey, dimension, _KEY_FUNCTIONS[dimension](value)))
+                result[dimension] = _as_dict(stat) if stat else None
+        if venue_course and baba is not None and baba != '':
+            stat = self._stats.get((jockey, VENUE_COURSE_BABA, f"{venue_course}|{baba_key(baba)}"))
+            result[VENUE_COURSE_BABA] = _as_dict(stat) if stat else None
+        return result
+
+    # --- 騎手相性スコア ---
+
+    def _compatibility(self, jockey: str, conditions: Dict[str, Any]) -> float:
+        overall_races, overall_fukusho = self._overall[jockey]
+        prior = overall_fukusho / overall_races if overall_races else 0.0
+        weighted = total_weight = 0.0
+        for dimension, weight in COMPATIBILITY_WEIGHTS.items():
+            value = conditions.get(dimension)
+            if value is None or value == '':
+                continue
+            stat = None
+            if dimension == 'venue_course' and conditions.get('baba') not in (None, ''):
+                # 同じコース・同じ馬場状態の成績があればそちらを優先
+                stat = self._stats.get((jockey, VENUE_COURSE_BABA, f"{value}|{baba_key(conditions['baba'])}"))
+            if stat is None:
+                stat = self._stats.get((jockey, dimension, _KEY_FUNCTIONS[dimension](value)))
+            if stat is None:
+                continue
+            races, fukusho = stat
+            # 少数サンプルは騎手全体の複勝率に寄せる
+            rate = (fukusho + PRIOR_RACES * prior) / (races + PRIOR_RACES)
+            weighted += weight * rate
+            total_weight += weight
+        rate = weighted / total_weight if total_weight else prior
+        return round(min(100.0, rate * 100 / FUKUSHO_FULL_MARK * 100), 1)
+
+    def race_jockey_compatibility(self, entries: Iterable[Dict[str, Any]], venue_course: Optional[str] = None,
+                                  baba: Any = None) -> Dict[str, Dict[str, Any]]:
+        """出走馬全体の騎手相性（3_jockey_compatibility）を1回で計算
+
+        entries: [{"horse_name", "jockey", "post_position"(任意), "sire"(任意)}]
+        騎手がナレッジにいない馬は中立値（50点）
+        """
+        self._ensure_loaded()
+        results: Dict[str, Dict[str, Any]] = {}
+        for entry in entries:
+            horse_name = entry.get('horse_name')
+            jockey = self.resolve_jockey(entry.get('jockey', ''))
+            if jockey is None:
+                results[horse_name] = {
+                    'jockey': entry.get('jockey'), 'knowledge_key': None,
+                    '3_jockey_compatibility': NEUTRAL_SCORE,
+                }
+                continue
+            conditions = {
+                'venue_course': venue_course,
+                'baba': baba,
+                'post_position': entry.get('post_position'),
+                'sire': entry.get('sire'),
+            }
+            results[horse_name] = {
+                'jockey': entry.get('jockey'),
+                'knowledge_key': jockey,
+                '3_jockey_compatibility': self._compatibility(jockey, conditions),
+            }
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        self._ensure_loaded()
+        return {
+            'knowledge_file': self.knowledge_file,
+            'jockeys': len(self._overall),
+            'aggregates': len(self._stats),
+            'name_resolution': self.names.get_stats(),
+        }
+
+
+jockey_analytics = JockeyAnalytics()
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+D-Logicナレッジ カラムナーストア
+dlogic_raw_knowledge.jsonをメモリマップ可能なバイナリ列形式に変換・読み込み
+（全ワーカーがOSのページキャッシュを共有し、起動はミリ秒単位）
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import MutableMapping
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    from services.serialization import load as json_load, loads as json_loads
+except ImportError:
+    # スクリプトとして直接実行した場合（services/ が sys.path の先頭）
+    from serialization import load as json_load, loads as json_loads
+
+MAGIC = b"DLCOL001"
+FORMAT_VERSION = 1
+
+# 馬単位データ内でレース配列のキー名を記録する予約キー
+_RACES_KEY_FIELD = "__races_key__"
+
+
+def _align8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _encode_value(value: Any) -> str:
+    """値テーブル用の型を保持したエンコード（"01"と1を区別する）"""
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def _offsets_array(blobs: List[bytes]) -> Tuple[bytes, array]:
+    offsets = array("I", [0])
+    total = 0
+    for blob in blobs:
+        total += len(blob)
+        offsets.append(total)
+    return b"".join(blobs), offsets
+
+
+def convert_json_to_columnar(json_path: str, output_path: str) -> Dict[str, Any]:
+    """既存のナレッジJSONをカラムナー形式に変換
+
+    Args:
+        json_path: 変換元のdlogic_raw_knowledge.json
+        output_path: 出力先（.dlcol）
+
+    Returns:
+        変換統計
+    """
+    with open(json_path, "rb") as f:
+        data = json_load(f)
+    return write_columnar(data, output_path)
+
+
+def write_columnar(data: Dict[str, Any], output_path: str) -> Dict[str, Any]:
+    """ナレッジ辞書をカラムナー形式で書き出す"""
+    horses = data.get("horses", {})
+    names = sorted(horses.keys())
+
+    columns: Dict[str, array] = {}
+    column_order: List[str] = []
+    value_ids: Dict[str, int] = {}
+    value_blobs: List[bytes] = [b""]  # id 0 は「キーなし」
+    row_offsets = array("I", [0])
+    horse_blobs: List[bytes] = []
+    row_count = 0
+
+    for name in names:
+        horse = horses[name]
+        races_key = "races" if "races" in horse else "race_history"
+        races = horse.get(races_key) or []
+
+        rest = {k: v for k, v in horse.items() if k != races_key}
+        rest[_RACES_KEY_FIELD] = races_key if races_key in horse else None
+        horse_blobs.append(_encode_value(rest).encode("utf-8"))
+
+        for race in races:
+            for key in race:
+                if key not in columns:
+                    # 新しい列は既存行を「キーなし」で埋める
+                    columns[key] = array("i", [0] * row_count)
+                    column_order.append(key)
+            for key in column_order:
+                if key in race:
+                    encoded = _encode_value(race[key])
+                    vid = value_ids.get(encoded)
+                    if vid is None:
+                        vid = len(value_blobs)
+                        value_ids[encoded] = vid
+                        value_blobs.append(encoded.encode("utf-8"))
+                    columns[key].append(vid)
+                else:
+                    columns[key].append(0)
+            row_count += 1
+        row_offsets.append(row_count)
+
+    names_blob, name_offsets = _offsets_array([n.encode("utf-8") for n in names])
+    horse_blob, horse_offsets = _offsets_array(horse_blobs)
+    values_blob, value_offsets = _offsets_array(value_blobs)
+
+    sections: List[Tuple[str, bytes]] = [
+        ("names", names_blob),
+        ("name_offsets", name_offsets.tobytes()),
+        ("horse_blobs", horse_blob),
+        ("horse_offsets", horse_offsets.tobytes()),
+        ("row_offsets", row_offsets.tobytes()),
+        ("values", values_blob),
+        ("value_offsets", value_offsets.tobytes()),
+    ]
+    sections += [(f"col:{key}", columns[key].tobytes()) for key in column_order]
+
+    layout = {}
+    position = 0
+    for section_name, payload in sections:
+        layout[section_name] = [position, len(payload)]
+        position = _align8(position + len(payload))
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "meta": data.get("meta", {}),
+        "horse_count": len(names),
+        "row_count": row_count,
+        "columns": column_order,
+        "sections": layout,
+        "converted_at": datetime.now().isoformat(),
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_start = _align8(len(MAGIC) + 4 + len(header_bytes))
+
+    # 書き込み途中のファイルを読まれないよう一時ファイル経由で置き換える
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * (data_start - f.tell()))
+        for section_name, payload in sections:
+            f.write(payload)
+            f.write(b"\0" * (_align8(len(payload)) - len(payload)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+
+    return {
+        "horse_count": len(names),
+        "row_count": row_count,
+        "columns": len(column_order),
+        "distinct_values": len(value_blobs) - 1,
+        "file_size_mb": os.path.getsize(output_path) / (1024 * 1024),
+    }
+
+
+class ColumnarKnowledgeStore:
+    """メモリマップされたカラムナーナレッジの読み込み"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"カラムナー形式ではありません: {path}")
+        (header_len,) = struct.unpack_from("<I", self._mm, len(MAGIC))
+        header_start = len(MAGIC) + 4
+        self.header = json.loads(self._mm[header_start:header_start + header_len].decode("utf-8"))
+        if self.header.get("byteorder") != sys.byteorder:
+            self.close()
+            raise ValueError("バイトオーダーが一致しません。変換し直してください")
+        self._data_start = _align8(header_start + header_len)
+        self._view = memoryview(self._mm)
+
+        self.meta: Dict[str, Any] = self.header.get("meta", {})
+        self.horse_count: int = self.header["horse_count"]
+        self.row_count: int = self.header["row_count"]
+        self.columns: List[str] = self.header["columns"]
+
+        self._names = self._section("names")
+        self._name_offsets = self._section("name_offsets").cast("I")
+        self._horse_blobs = self._section("horse_blobs")
+        self._horse_offsets = self._section("horse_offsets").cast("I")
+        self._row_offsets = self._section("row_offsets").cast("I")
+        self._values = self._section("values")
+        self._value_offsets = self._section("value_offsets").cast("I")
+        self._column_views = {key: self._section(f"col:{key}").cast("i") for key in self.columns}
+        self._value_cache: Dict[int, Any] = {}
+        self._name_cache: Dict[int, str] = {}
+
+    def _section(self, name: str) -> memoryview:
+        offset, length = self.header["sections"][name]
+        start = self._data_start + offset
+        return self._view[start:start + length]
+
+    def close(self):
+        """メモリマップを解放"""
+        for view in getattr(self, "_column_views", {}).values():
+            view.release()
+        for attr in ("_names", "_name_offsets", "_horse_blobs", "_horse_offsets",
+                     "_row_offsets", "_values", "_value_offsets", "_view"):
+            view = getattr(self, attr, None)
+            if view is not None:
+                view.release()
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    # --- 馬名 ---
+
+    def name_at(self, index: int) -> str:
+        """インデックス位置の馬名（ソート済み）"""
+        name = self._name_cache.get(index)
+        if name is None:
+            start, end = self._name_offsets[index], self._name_offsets[index + 1]
+            name = bytes(self._names[start:end]).decode("utf-8")
+            self._name_cache[index] = name
+        return name
+
+    def find(self, horse_name: str) -> int:
+        """馬名の位置を二分探索（見つからなければ-1）"""
+        index = bisect_left(_NameSequence(self), horse_name)
+        if index < self.horse_count and self.name_at(index) == horse_name:
+            return index
+        return -1
+
+    def horse_names(self) -> Iterator[str]:
+        for index in range(self.horse_count):
+            yield self.name_at(index)
+
+    def row_range(self, index: int) -> Tuple[int, int]:
+        """馬のレース行範囲 [start, end)"""
+        return self._row_offsets[index], self._row_offsets[index + 1]
+
+    # --- 値の復元 ---
+
+    def _decode_value(self, vid: int) -> Any:
+        cached = self._value_cache.get(vid)
+        if cached is not None:
+            return cached
+        start, end = self._value_offsets[vid], self._value_offsets[vid + 1]
+        value = json_loads(self._values[start:end])
+        # 変更可能な値（リスト等）は共有しないようキャッシュしない
+        if not isinstance(value, (list, dict)) and value is not None:
+            self._value_cache[vid] = value
+        return value
+
+    def get_races(self, index: int) -> List[Dict[str, Any]]:
+        """レース履歴を元の辞書形式で復元"""
+        start, end = self.row_range(index)
+        races = []
+        for row in range(start, end):
+            race = {}
+            for key, view in self._column_views.items():
+                vid = view[row]
+                if vid:
+                    race[key] = self._decode_value(vid)
+            races.append(race)
+        return races
+
+    def get_horse_by_index(self, index: int) -> Dict[str, Any]:
+        start, end = self._horse_offsets[index], self._horse_offsets[index + 1]
+        horse = json_loads(self._horse_blobs[start:end])
+        races_key = horse.pop(_RACES_KEY_FIELD, None)
+        if races_key:
+            horse[races_key] = self.get_races(index)
+        return horse
+
+    def get_horse(self, horse_name: str) -> Optional[Dict[str, Any]]:
+        index = self.find(horse_name)
+        if index < 0:
+            return None
+        return self.get_horse_by_index(index)
+
+    def as_mapping(self) -> "ColumnarHorseMapping":
+        return ColumnarHorseMapping(self)
+
+
+class _NameSequence:
+    """bisect用の馬名シーケンス"""
+
+    def __init__(self, store: ColumnarKnowledgeStore):
+        self._store = store
+
+    def __len__(self) -> int:
+        return self._store.horse_count
+
+    def __getitem__(self, index: int) -> str:
+        return self._store.name_at(index)
+
+
+class ColumnarHorseMapping(MutableMapping):
+    """knowledge_data['horses']の代替となる辞書互換ビュー
+
+    読み込みはストアから都度復元し、追加・更新はメモリ上のオーバーレイに保持する。
+    """
+
+    def __init__(self, store: ColumnarKnowledgeStore):
+        self.store = store
+        self._overlay: Dict[str, Dict[str, Any]] = {}
+        self._removed = set()
+
+    def __getitem__(self, horse_name: str) -> Dict[str, Any]:
+        if horse_name in self._overlay:
+            return self._overlay[horse_name]
+        if horse_name in self._removed:
+            raise KeyError(horse_name)
+        horse = self.store.get_horse(horse_name)
+        if horse is None:
+            raise KeyError(horse_name)
+        return horse
+
+    def __setitem__(self, horse_name: str, value: Dict[str, Any]):
+        self._overlay[horse_name] = value
+        self._removed.discard(horse_name)
+
+    def __delitem__(self, horse_name: str):
+        if horse_name in self._overlay:
+            del self._overlay[horse_name]
+            if self.store.find(horse_name) >= 0:
+                self._removed.add(horse_name)
+        elif self.store.find(horse_name) >= 0 and horse_name not in self._removed:
+            self._removed.add(horse_name)
+        else:
+            raise KeyError(horse_name)
+
+    def __contains__(self, horse_name: object) -> bool:
+        if horse_name in self._overlay:
+            return True
+        if not isinstance(horse_name, str) or horse_name in self._removed:
+            return False
+        return self.store.find(horse_name) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        for name in self.store.horse_names():
+            if name not in self._removed and name not in self._overlay:
+                yield name
+        yield from self._overlay
+
+    def __len__(self) -> int:
+        new_names = sum(1 for name in self._overlay if self.store.find(name) < 0)
+        return self.store.horse_count - len(self._removed) + new_names
+
+
+if __name__ == "__main__":
+    import time
+
+    base_dir = os.path.join(os.path.dirname(__file__), "..", "data")
+    source = sys.argv[1] if len(sys.argv) > 1 else os.path.join(base_dir, "dlogic_raw_knowledge.json")
+    target = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(source)[0] + ".dlcol"
+
+    print(f"📦 カラムナー変換: {source} -> {target}")
+    start = time.time()
+    stats = convert_json_to_columnar(source, target)
+    print(f"✅ 変換完了 ({time.time() - start:.1f}秒): {stats}")
+
+    start = time.time()
+    store = ColumnarKnowledgeStore(target)
+    print(f"⚡ 読み込み: {(time.time() - start) * 1000:.1f}ms ({store.horse_count}頭, {store.row_count}走)")
+    store.close()
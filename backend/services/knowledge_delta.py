@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+ナレッジの差分（デルタ）更新
+ソーステーブルごとの取り込み済み位置（ウォーターマーク＝最終開催日）を保存し、
+それ以降の新しいレース行だけを該当馬の過去走に追記する。
+
+- デルタファイルは1回の更新分（馬名 -> 追加する新しい順のレース行）とバージョン番号
+- 適用は base_version が現在のバージョンと一致するときだけ行い、順番に1つずつ進める
+- 同じ日付のレースは追加しない（1頭が同じ日に2回走ることはない）ので再適用しても結果は同じ
+- 各馬の過去走は新しい順に並べ、元の件数（最低 max_races 件）を超えた古い走は落とす
+"""
+import gzip
+import json
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, MutableMapping, Optional, Tuple
+
+from services.checkpoint_log import atomic_write
+from services.serialization import load
+
+# デルタファイルとウォーターマークの保存先
+DELTA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'monthly_updates')
+WATERMARK_FILE = os.path.join(os.path.dirname(__file__), '..', 'data', 'knowledge_watermarks.json')
+DELTA_PREFIX = 'dlogic_knowledge_delta_'
+
+_DELTA_NAME = re.compile(re.escape(DELTA_PREFIX) + r'(\d+)\.json$')
+
+
+def race_date(race: Dict[str, Any]) -> str:
+    """レース行の開催日（YYYYMMDD）。MySQL形式・小文字形式のどちらにも対応"""
+    value = race.get('NENGAPPI') or race.get('date')
+    if not value and race.get('KAISAI_NEN') and race.get('KAISAI_GAPPI'):
+        value = f"{race['KAISAI_NEN']}{str(race['KAISAI_GAPPI']).zfill(4)}"
+    return str(value) if value else ''
+
+
+def _finish_of(race: Dict[str, Any]) -> Optional[int]:
+    value = race.get('KAKUTEI_CHAKUJUN') or race.get('KAKUTEI_JINI') or race.get('finish')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def race_list_key(record: Optional[Dict[str, Any]]) -> str:
+    """過去走リストのキー（既存データの形式に合わせる）"""
+    if record and 'races' not in record and 'race_history' in record:
+        return 'race_history'
+    return 'races'
+
+
+def append_races(record: Optional[Dict[str, Any]], new_races: Iterable[Dict[str, Any]],
+                 max_races: int) -> Tuple[Dict[str, Any], int]:
+    """馬データに新しいレース行を追記した新しい辞書と、実際に追加した件数を返す"""
+    record = dict(record or {})
+    key = race_list_key(record)
+    existing = list(record.get(key) or [])
+
+    seen = {race_date(race) for race in existing}
+    added = []
+    for race in new_races:
+        date = race_date(race)
+        if date and date not in seen:
+            seen.add(date)
+            added.append(race)
+    if not added:
+        return record, 0
+
+    window = max(max_races, len(existing))
+    merged = sorted(added + existing, key=race_date, reverse=True)[:window]
+    record[key] = merged
+    latest = race_date(merged[0])
+
+    if key == 'races':
+        record['race_count'] = len(merged)
+        record['last_race_date'] = latest
+    if isinstance(record.get('basic_info'), dict):
+        record['basic_info'] = {**record['basic_info'], 'last_race_date': latest}
+    stats = record.get('aggregated_stats')
+    if isinstance(stats, dict) and 'total_races' in stats:
+        stats = dict(stats)
+        stats['total_races'] = stats.get('total_races', 0) + len(added)
+        if 'wins' in stats:
+            stats['wins'] = stats.get('wins', 0) + sum(1 for race in added if _finish_of(race) == 1)
+        record['aggregated_stats'] = stats
+    return record, len(added)
+
+
+def new_races_for(record: Optional[Dict[str, Any]], races: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """既存データに無い日付のレース行だけを返す"""
+    existing = {race_date(race) for race in (record or {}).get(race_list_key(record)) or []}
+    return [race for race in races if race_date(race) not in existing]
+
+
+def build_delta(changes: Dict[str, List[Dict[str, Any]]], version: int, base_version: int,
+                watermarks: Dict[str, str], previous_watermarks: Dict[str, str],
+                max_races: int, new_horses: int = 0) -> Dict[str, Any]:
+    """デルタファイルの内容を作る（馬名順）"""
+    return {
+        "meta": {
+            "type": "knowledge_delta",
+            "version": version,
+            "base_version": base_version,
+            "created": datetime.now().isoformat(),
+            "watermarks": dict(watermarks),
+            "previous_watermarks": dict(previous_watermarks),
+            "max_races": max_races,
+            "updated_horses": len(changes) - new_horses,
+            "new_horses": new_horses,
+            "race_rows": sum(len(races) for races in changes.values())
+        },
+        "horses": {name: changes[name] for name in sorted(changes)}
+    }
+
+
+def delta_path(directory: str, version: int) -> str:
+    return os.path.join(directory, f"{DELTA_PREFIX}{version:06d}.json")
+
+
+def write_delta(delta: Dict[str, Any], directory: str = DELTA_DIR) -> str:
+    """デルタファイルを原子的に保存（配布用のgz版も作成）"""
+    path = delta_path(directory, delta["meta"]["version"])
+    body = json.dumps(delta, ensure_ascii=False, indent=2, default=str)
+    atomic_write(path, lambda f: f.write(body))
+    with gzip.open(path + '.gz', 'wb') as f:
+        f.write(body.encode('utf-8'))
+    return path
+
+
+def load_delta(path: str) -> Dict[str, Any]:
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        return load(f)
+
+
+def list_deltas(directory: str = DELTA_DIR, after_version: int = 0) -> List[Tuple[int, str]]:
+    """after_versionより新しいデルタファイルを (バージョン, パス) の昇順で返す"""
+    if not os.path.isdir(directory):
+        return []
+    deltas = []
+    for filename in os.listdir(directory):
+        match = _DELTA_NAME.match(filename)
+        if match and int(match.group(1)) > after_version:
+            deltas.append((int(match.group(1)), os.path.join(directory, filename)))
+    return sorted(deltas)
+
+
+def apply_delta_to_horses(horses: MutableMapping[str, Dict[str, Any]],
+                          delta: Dict[str, Any]) -> Dict[str, Any]:
+    """horses（knowledge_data['horses']）にデルタを適用し、変更した馬名を返す"""
+    max_races = int(delta["meta"].get("max_races") or 10)
+    updated, added, rows = [], [], 0
+    for name, races in delta.get("horses", {}).items():
+        current = horses.get(name)
+        record, count = append_races(current, races, max_races)
+        if not count:
+            continue
+        # カラムナービューは取り出した辞書が毎回新しいので、必ず代入し直す
+        horses[name] = record
+        rows += count
+        (updated if current is not None else added).append(name)
+    return {"updated": updated, "added": added, "race_rows": rows}
+
+
+class WatermarkStore:
+    """ソーステーブルごとのウォーターマークとデルタのバージョン番号"""
+
+    def __init__(self, path: str = WATERMARK_FILE):
+        self.path = path
+        self.data = {"version": 0, "tables": {}}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.data.update(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"⚠️ ウォーターマーク読み込みエラー: {e}")
+
+    @property
+    def version(self) -> int:
+        return int(self.data.get("version", 0))
+
+    def get(self, table: str) -> Optional[str]:
+        return self.data["tables"].get(table, {}).get("watermark")
+
+    def watermarks(self) -> Dict[str, str]:
+        return {table: info.get("watermark") for table, info in self.data["tables"].items()}
+
+    def advance(self, watermarks: Dict[str, Optional[str]], version: Optional[int] = None):
+        """ウォーターマークを進めて保存（後戻りはしない）"""
+        now = datetime.now().isoformat()
+        for table, watermark in watermarks.items():
+            if not watermark:
+                continue
+            info = self.data["tables"].setdefault(table, {})
+            if not info.get("watermark") or watermark > info["watermark"]:
+                info["watermark"] = watermark
+            info["updated_at"] = now
+        if version is not None:
+            self.data["version"] = version
+        data = self.data
+        atomic_write(self.path, lambda f: json.dump(data, f, ensure_ascii=False, indent=2))
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+ナレッジファイルのダウンローダー（CDN）
+レスポンス全体をメモリに載せず、ディスクへ直接ストリーミング保存する
+
+- 途中で切れた場合は .part ファイルの続きから Range で再開（If-Range で同じ版か確認）
+- 前回取得時の ETag を If-None-Match で送り、変更がなければ 304 でダウンロードを省略
+- 公開されている SHA-256（<URL>.sha256）と照合し、一致したときだけ置き換える
+- 圧縮版（<URL>.zst / <URL>.gz）があればそちらを取得してディスク上で展開
+  （zstdは zstandard がインストールされている場合のみ）
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from services.checkpoint_log import atomic_write
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# ネットワークからの読み取り単位（切断時に失うのは最後の読み取り分だけ）
+DOWNLOAD_READ_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = int(os.getenv('KNOWLEDGE_DOWNLOAD_TIMEOUT', 120))
+DOWNLOAD_RETRIES = int(os.getenv('KNOWLEDGE_DOWNLOAD_RETRIES', 5))
+DOWNLOAD_RETRY_BACKOFF = float(os.getenv('KNOWLEDGE_DOWNLOAD_RETRY_BACKOFF', 1.0))
+# 'auto'（zstd -> gzip -> 非圧縮の順に試す）/ 'zstd' / 'gzip' / 'none'
+DOWNLOAD_COMPRESSION = os.getenv('KNOWLEDGE_DOWNLOAD_COMPRESSION', 'auto').lower()
+# 公開SHA-256が取得できない場合にダウンロードを失敗扱いにするか
+REQUIRE_SHA256 = os.getenv('KNOWLEDGE_REQUIRE_SHA256', 'false').lower() in ('1', 'true', 'yes')
+
+_SUFFIXES = {'zstd': '.zst', 'gzip': '.gz'}
+
+
+class DownloadIntegrityError(Exception):
+    """SHA-256が公開値と一致しない（または公開値が必須なのに取得できない）"""
+
+
+class _VariantMissing(Exception):
+    """圧縮版が配布されていない"""
+
+
+class _IncompleteDownload(Exception):
+    """Content-Lengthより短いところで接続が切れた"""
+
+
+def _file_sha256(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class KnowledgeDownloader:
+    """1つのURLを1つのローカルファイルへ同期する"""
+
+    def __init__(self, url: str, path: str, expected_sha256: Optional[str] = None,
+                 compression: Optional[str] = None, require_sha256: Optional[bool] = None,
+                 timeout: Optional[float] = None, retries: Optional[int] = None,
+                 backoff: Optional[float] = None, session: Optional[requests.Session] = None):
+        self.url = url
+        self.path = path
+        self.expected_sha256 = expected_sha256.lower() if expected_sha256 else None
+        self.compression = (compression or DOWNLOAD_COMPRESSION).lower()
+        self.require_sha256 = REQUIRE_SHA256 if require_sha256 is None else require_sha256
+        self.timeout = timeout or DOWNLOAD_TIMEOUT
+        self.retries = DOWNLOAD_RETRIES if retries is None else retries
+        self.backoff = DOWNLOAD_RETRY_BACKOFF if backoff is None else backoff
+        self.session = session or requests.Session()
+        # 取得済みファイルのETag・SHA-256と、途中まで取得したファイルの情報
+        self.meta_path = path + '.download.json'
+
+    # --- メタ情報 ---
+
+    def _load_meta(self) -> Dict[str, Any]:
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_meta(self, meta: Dict[str, Any]):
+        atomic_write(self.meta_path, lambda f: json.dump(meta, f, ensure_ascii=False, indent=2))
+
+    # --- ダウンロード ---
+
+    def _variants(self, meta: Dict[str, Any]) -> List[Tuple[str, Optional[str]]]:
+        """試すURLと圧縮形式（前回成功した形式を先頭にする）"""
+        for codec, suffix in _SUFFIXES.items():
+            if self.url.endswith(suffix):
+                return [(self.url, codec)]
+
+        codecs: List[Optional[str]] = []
+        if self.compression in ('auto', 'zstd') and zstandard is not None:
+            codecs.append('zstd')
+        if self.compression in ('auto', 'gzip'):
+            codecs.append('gzip')
+        codecs.append(None)
+        variants = [(self.url + _SUFFIXES[c] if c else self.url, c) for c in codecs]
+
+        previous = meta.get('url')
+        variants.sort(key=lambda variant: variant[0] != previous)
+        return variants
+
+    def _published_sha256(self) -> Optional[str]:
+        """<URL>.sha256（sha256sum形式）を取得"""
+        try:
+            response = self.session.get(self.url + '.sha256', timeout=self.timeout)
+        except requests.RequestException as e:
+            print(f"⚠️ SHA-256の取得に失敗: {e}")
+            return None
+        if response.status_code != 200:
+            return None
+        token = response.text.strip().split()[0] if response.text.strip() else ''
+        if len(token) != 64:
+            print(f"⚠️ SHA-256の形式が不正です: {response.text[:80]!r}")
+            return None
+        return token.lower()
+
+    def download(self, force: bool = False) -> Dict[str, Any]:
+        """ファイルを最新にする
+
+        Returns:
+            status: 'downloaded'（取得して置き換えた）/ 'not_modified'（変更なし）
+        """
+        start = time.time()
+        expected = self.expected_sha256 or self._published_sha256()
+        if expected is None and self.require_sha256:
+            raise DownloadIntegrityError(f"公開SHA-256を取得できません: {self.url}.sha256")
+
+        meta = self._load_meta()
+        missing = []
+        for variant_url, codec in self._variants(meta):
+            try:
+                result = self._download_variant(variant_url, codec, expected, meta, force)
+            except _VariantMissing:
+                missing.append(variant_url)
+                continue
+            result['elapsed_seconds'] = time.time() - start
+            return result
+        raise FileNotFoundError(f"ダウンロードできません: {', '.join(missing)}")
+
+    def _download_variant(self, url: str, codec: Optional[str], expected: Optional[str],
+                          meta: Dict[str, Any], force: bool) -> Dict[str, Any]:
+        part_path = self.path + '.part' + _SUFFIXES.get(codec, '')
+        partial = meta.get('partial') or {}
+        if partial.get('url') != url and os.path.exists(part_path):
+            os.remove(part_path)
+
+        # 手元のファイルが前回と同じURL・公開値と一致していれば条件付きリクエスト
+        conditional = (
+            not force and os.path.exists(self.path) and meta.get('url') == url and meta.get('etag')
+            and (expected is None or meta.get('sha256') == expected)
+        )
+
+        transferred = 0
+        resumed_from = None
+        attempt = 0
+        etag = None
+        while True:
+            headers = {'Accept-Encoding': 'identity'}
+            if conditional:
+                headers['If-None-Match'] = meta['etag']
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            if offset and partial.get('url') == url and partial.get('etag'):
+                headers['Range'] = f'bytes={offset}-'
+                headers['If-Range'] = partial['etag']
+            else:
+                offset = 0
+
+            try:
+                with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    if response.status_code == 304 and conditional:
+                        print("✅ ナレッジファイルは更新されていません（ETag一致）")
+                        return {
+                            'status': 'not_modified', 'url': url, 'compression': codec,
+                            'path': self.path, 'etag': meta['etag'], 'sha256': meta.get('sha256'),
+                            'bytes_transferred': 0, 'resumed_from': None
+                        }
+                    if response.status_code in (403, 404) and codec is not None:
+                        raise _VariantMissing(url)
+                    if response.status_code == 416:
+                        # 途中ファイルの方が長い（版が変わった）ので最初から取り直す
+                        os.remove(part_path)
+                        partial = {}
+                        continue
+                    response.raise_for_status()
+
+                    if response.status_code == 206:
+                        content_range = response.headers.get('Content-Range', '')
+                        if not content_range.startswith(f'bytes {offset}-'):
+                            raise _IncompleteDownload(f"想定外のContent-Range: {content_range}")
+                        mode = 'ab'
+                        if resumed_from is None:
+                            resumed_from = offset
+                    else:
+                        offset = 0
+                        mode = 'wb'
+
+                    etag = response.headers.get('ETag')
+                    partial = {'url': url, 'etag': etag}
+                    meta['partial'] = partial
+                    self._save_meta(meta)
+
+                    length = response.headers.get('Content-Length')
+                    received = 0
+                    with open(part_path, mode) as f:
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_READ_SIZE):
+                            f.write(chunk)
+                            received += len(chunk)
+                            transferred += len(chunk)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    if length is not None and received < int(length):
+                        raise _IncompleteDownload(f"{received}/{length}バイトで切断")
+                break
+            except (_IncompleteDownload, requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+                print(f"⚠️ ダウンロード中断 (試行 {attempt}/{self.retries}): {e} - {size:,}バイトから再開")
+                time.sleep(min(self.backoff * 2 ** (attempt - 1), 30))
+
+        digest, size = self._finalize(part_path, codec, expected)
+        meta.pop('partial', None)
+        meta.update({
+            'url': url,
+            'etag': etag,
+            'sha256': digest,
+            'size_bytes': size,
+            'downloaded_at': datetime.now().isoformat()
+        })
+        self._save_meta(meta)
+        print(f"✅ ダウンロード完了: {size / (1024 * 1024):.1f}MB "
+              f"(転送 {transferred / (1024 * 1024):.1f}MB{', ' + codec if codec else ''})")
+        return {
+            'status': 'downloaded', 'url': url, 'compression': codec, 'path': self.path,
+            'etag': etag, 'sha256': digest, 'size_bytes': size,
+            'bytes_transferred': transferred, 'resumed_from': resumed_from
+        }
+
+    def _finalize(self, part_path: str, codec: Optional[str], expected: Optional[str]) -> Tuple[str, int]:
+        """展開・SHA-256照合のうえで置き換える（不一致なら途中ファイルごと破棄）"""
+        if codec is None:
+            ready_path = part_path
+        else:
+            ready_path = self.path + '.part'
+            opener = gzip.open if codec == 'gzip' else _zstd_open
+            with opener(part_path) as src, open(ready_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, DOWNLOAD_CHUNK_SIZE)
+                dst.flush()
+                os.fsync(dst.fileno())
+
+        digest = _file_sha256(ready_path)
+        if expected is not None and digest != expected:
+            for path in {part_path, ready_path}:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise DownloadIntegrityError(f"SHA-256不一致: expected={expected} actual={digest}")
+
+        size = os.path.getsize(ready_path)
+        os.replace(ready_path, self.path)
+        if ready_path != part_path and os.path.exists(part_path):
+            os.remove(part_path)
+        return digest, size
+
+
+def _zstd_open(path: str):
+    return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+ナレッジJSONの馬ごとのバイト位置インデックス
+ファイル全体を解析せずに、horses内の各馬の値（{...}）が置かれたバイト範囲だけを記録する
+
+- チャンク単位で読み進める状態機械なので、キーや文字列がチャンク境界をまたいでも取りこぼさない
+- 文字列内の括弧やエスケープを正しく扱う（整形の有無・空白の入り方にも依存しない）
+- 馬の値の内側は正規表現で括弧まで読み飛ばすので、Pythonのループは括弧の数だけ回る
+- 読み込み時は該当範囲へシークして、その馬のバイト列だけをデコードする
+"""
+import json
+import os
+import re
+from typing import Any, Dict, Optional, Tuple
+
+from services.serialization import loads
+
+SCAN_CHUNK_SIZE = 1024 * 1024
+
+# 深さ2以下: 完結した文字列（キー）か括弧。単独の " は文字列がチャンク末尾で切れている
+_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*+"|["{}\[\]]')
+# 馬の値の内側: 括弧以外と完結した文字列をまとめて読み飛ばす
+_SKIP = re.compile(rb'(?:[^"{}\[\]]++|"(?:[^"\\]|\\.)*+")*+')
+
+_OPEN = (ord('{'), ord('['))
+_QUOTE = ord('"')
+
+
+class HorseOffsetScanner:
+    """feed()に順にバイト列を渡すと、馬名 -> (開始, 終了) のバイト範囲を記録する"""
+
+    def __init__(self, section: str = 'horses'):
+        self._section_key = json.dumps(section, ensure_ascii=False).encode('utf-8')
+        self.offsets: Dict[str, Tuple[int, int]] = {}
+        self.done = False
+        self._carry = b''
+        self._offset = 0          # これまでに受け取ったバイト数
+        self._depth = 0
+        self._in_section = False
+        self._last_string: Optional[bytes] = None
+        self._current: Optional[str] = None
+        self._start = 0
+
+    def feed(self, chunk: bytes):
+        buf = self._carry + chunk if self._carry else chunk
+        base = self._offset - len(self._carry)
+        self._offset += len(chunk)
+        self._carry = b''
+
+        pos, end = 0, len(buf)
+        while pos < end and not self.done:
+            if self._depth > 2 or (self._depth == 2 and not self._in_section):
+                pos = _SKIP.match(buf, pos).end()
+                if pos >= end:
+                    break
+                if buf[pos] == _QUOTE:
+                    self._carry = buf[pos:]
+                    break
+                self._bracket(buf[pos], base + pos)
+                pos += 1
+            else:
+                match = _TOKEN.search(buf, pos)
+                if match is None:
+                    break
+                token = match.group()
+                if token[0] == _QUOTE and len(token) > 1:
+                    self._last_string = token
+                elif token[0] == _QUOTE:
+                    self._carry = buf[match.start():]
+                    break
+                else:
+                    self._bracket(token[0], base + match.start())
+                pos = match.end()
+
+    def _bracket(self, char: int, position: int):
+        if char in _OPEN:
+            if self._depth == 1 and self._last_string == self._section_key:
+                self._in_section = True
+            elif self._depth == 2 and self._in_section:
+                self._current = json.loads(self._last_string.decode('utf-8'))
+                self._start = position
+            self._depth += 1
+            return
+
+        self._depth -= 1
+        if self._in_section and self._depth == 2:
+            self.offsets[self._current] = (self._start, position + 1)
+        elif self._in_section and self._depth == 1:
+            # horsesの終わり（以降は読む必要がない）
+            self._in_section = False
+            self.done = True
+
+
+def scan_horse_offsets(path: str, chunk_size: int = SCAN_CHUNK_SIZE) -> Dict[str, Tuple[int, int]]:
+    """ナレッジJSONを先頭から読み、馬ごとのバイト範囲を返す"""
+    scanner = HorseOffsetScanner()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            scanner.feed(chunk)
+            if scanner.done:
+                break
+    return scanner.offsets
+
+
+def read_horse(path: str, start: int, end: int) -> Dict[str, Any]:
+    """バイト範囲へシークして1頭分だけデコード"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return loads(f.read(end - start))
+
+
+def file_signature(path: str) -> Dict[str, Any]:
+    """インデックスが対象ファイルと対応しているかの確認用（サイズと更新時刻）"""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+ナレッジのホットリロード
+再起動せずに新しいナレッジファイルへ差し替える（管理APIからバックグラウンドで実行）
+
+- JSONの解析とカラムナー形式への変換は別プロセスで行い、終了とともにメモリをOSへ返す
+  （サーバープロセスでは巨大なJSONを読み込まないので、旧データと新データの二重保持にならない）
+- 新しいナレッジはメモリマップで開き、dlogic_manager の参照を一度に付け替える
+- 差し替え後に未適用のデルタを適用し、ナレッジに依存するキャッシュを破棄する
+- 失敗した場合は旧ナレッジのまま動作を続ける
+"""
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from services.knowledge_columnar_store import ColumnarKnowledgeStore
+
+# ナレッジ更新で結果が変わるキャッシュのプレフィックス
+KNOWLEDGE_CACHE_PREFIXES = ('dlogic_analysis', 'weather_analysis', 'race_analysis', 'chat_response')
+
+# 変換プロセスのタイムアウト（秒）
+RELOAD_CONVERT_TIMEOUT = int(os.getenv('KNOWLEDGE_RELOAD_CONVERT_TIMEOUT', 1800))
+
+_CONVERTER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'knowledge_columnar_store.py')
+
+
+class KnowledgeReloader:
+    """ナレッジの差し替えを1つずつ実行する"""
+
+    def __init__(self, manager, cache=None):
+        self.manager = manager
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.status: Dict[str, Any] = {"state": "idle"}
+        self.reload_count = 0
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def start(self, source: str = 'local', url: Optional[str] = None) -> bool:
+        """バックグラウンドで差し替えを開始（実行中ならFalse）"""
+        if source not in ('local', 'cdn'):
+            raise ValueError(f"不明なソース: {source}")
+        if not self._lock.acquire(blocking=False):
+            return False
+        self._thread = threading.Thread(
+            target=self._run_background, args=(source, url), name='knowledge-reload', daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def wait(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run_background(self, source: str, url: Optional[str]):
+        try:
+            self._reload(source, url)
+        except Exception as e:
+            print(f"❌ ナレッジ差し替え失敗（旧ナレッジで継続）: {e}")
+        finally:
+            self._lock.release()
+
+    def _update(self, state: str, **info):
+        self.status = {**self.status, "state": state, **info}
+
+    def reload(self, source: str = 'local', url: Optional[str] = None) -> Dict[str, Any]:
+        """新しいナレッジを読み込んで差し替える
+
+        Args:
+            source: 'local'（サーバー上のナレッジファイルを読み直す）または
+                    'cdn'（配布元からダウンロードしてから読み込む）
+            url: ダウンロード元（省略時はKNOWLEDGE_CDN_URL）
+        """
+        if source not in ('local', 'cdn'):
+            raise ValueError(f"不明なソース: {source}")
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("ナレッジの差し替えを実行中です")
+        try:
+            return self._reload(source, url)
+        finally:
+            self._lock.release()
+
+    def _reload(self, source: str, url: Optional[str]) -> Dict[str, Any]:
+        manager = self.manager
+        start = time.time()
+        timings: Dict[str, float] = {}
+        self.status = {
+            "state": "starting",
+            "source": source,
+            "started_at": datetime.now().isoformat(),
+            "previous_version": manager.get_knowledge_version(),
+            "previous_horses": len(manager.knowledge_data.get('horses', {}))
+        }
+        try:
+            downloaded = False
+            if source == 'cdn':
+                self._update("downloading")
+                step = time.time()
+                download = self._download(url, manager.knowledge_file)
+                downloaded = download["status"] == "downloaded"
+                timings["download"] = time.time() - step
+                self._update("downloaded", download={
+                    key: download.get(key)
+                    for key in ("status", "url", "compression", "sha256", "bytes_transferred", "resumed_from")
+                })
+
+            if self._needs_conversion(manager.knowledge_file, manager.columnar_file, force=downloaded):
+                self._update("converting")
+                step = time.time()
+                self._convert(manager.knowledge_file, manager.columnar_file)
+                timings["convert"] = time.time() - step
+
+            self._update("loading")
+            step = time.time()
+            store = ColumnarKnowledgeStore(manager.columnar_file)
+            knowledge_data = {"meta": store.meta, "horses": store.as_mapping()}
+            timings["load"] = time.time() - step
+
+            self._update("swapping")
+            step = time.time()
+            manager.swap_knowledge(knowledge_data, store)
+            deltas = manager.apply_pending_deltas()
+            timings["swap"] = time.time() - step
+
+            cleared = self._invalidate_caches()
+            self.reload_count += 1
+            self._update(
+                "completed",
+                finished_at=datetime.now().isoformat(),
+                elapsed_seconds=time.time() - start,
+                timings=timings,
+                horses=len(manager.knowledge_data.get('horses', {})),
+                knowledge_version=manager.get_knowledge_version(),
+                deltas_applied=sum(1 for r in deltas if r.get("status") == "applied"),
+                cleared_cache_prefixes=cleared,
+                error=None
+            )
+            print(f"✅ ナレッジ差し替え完了: {self.status['horses']}頭 ({self.status['elapsed_seconds']:.1f}秒)")
+            return dict(self.status)
+        except Exception as e:
+            self._update("failed", finished_at=datetime.now().isoformat(), timings=timings, error=str(e))
+            raise
+
+    @staticmethod
+    def _needs_conversion(json_path: str, columnar_path: str, force: bool = False) -> bool:
+        """JSONがカラムナーファイルより新しければ変換する"""
+        if not os.path.exists(json_path):
+            if os.path.exists(columnar_path):
+                return False
+            raise FileNotFoundError(f"ナレッジファイルがありません: {json_path}")
+        if force or not os.path.exists(columnar_path):
+            return True
+        return os.path.getmtime(json_path) > os.path.getmtime(columnar_path)
+
+    @staticmethod
+    def _convert(json_path: str, columnar_path: str):
+        """JSON -> カラムナー変換を別プロセスで実行（完了までサーバーのメモリは増えない）"""
+        completed = subprocess.run(
+            [sys.executable, _CONVERTER, json_path, columnar_path],
+            capture_output=True, text=True, timeout=RELOAD_CONVERT_TIMEOUT
+        )
+        if completed.returncode != 0:
+            detail = (completed.stderr or completed.stdout).strip().splitlines()
+            raise RuntimeError(f"カラムナー変換失敗: {detail[-1] if detail else completed.returncode}")
+
+    @staticmethod
+    def _download(url: Optional[str], path: str) -> Dict[str, Any]:
+        """ナレッジJSONをファイルへ直接ストリーミング保存（再開・ETag・SHA-256照合つき）"""
+        from services.dlogic_raw_data_manager import KNOWLEDGE_CDN_URL
+        from services.knowledge_downloader import KnowledgeDownloader
+
+        return KnowledgeDownloader(url or KNOWLEDGE_CDN_URL, path).download()
+
+    def _invalidate_caches(self):
+        if self.cache is None:
+            return []
+        for prefix in KNOWLEDGE_CACHE_PREFIXES:
+            self.cache.clear_prefix(prefix)
+        return list(KNOWLEDGE_CACHE_PREFIXES)
+
+    def get_status(self) -> Dict[str, Any]:
+        return {**self.status, "running": self.running, "reload_count": self.reload_count}
+
+
+_knowledge_reloader: Optional[KnowledgeReloader] = None
+
+
+def get_knowledge_reloader() -> KnowledgeReloader:
+    """グローバルのdlogic_manager・cache_serviceを対象にしたリローダー"""
+    global _knowledge_reloader
+    if _knowledge_reloader is None:
+        from services.dlogic_raw_data_manager import dlogic_manager
+        from services.cache_service import cache_service
+        _knowledge_reloader = KnowledgeReloader(dlogic_manager, cache_service)
+    return _knowledge_reloader
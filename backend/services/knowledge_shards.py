@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+D-Logicナレッジ バイナリ分割形式（シャード）
+分割配布用に、馬データをシャードファイル（.dlshard）に分けて書き出す・読み込む
+
+- 各シャードはBloomフィルタ・ソート済み馬名インデックス・馬ごとの圧縮データを持つ
+- ローダーは起動時に各シャードのBloomフィルタだけを読み、検索時はフィルタを先に確認する
+  （該当する馬がいないシャードは開かない。存在しない馬はほとんどの場合どのシャードも開かない）
+- シャード内の検索はソート済み馬名の二分探索で、該当馬のバイト列だけを展開する
+- ハッシュ分割は安定ハッシュ（blake2b）を使う（Pythonのhash()はプロセスごとに値が変わるため）
+"""
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    from services.serialization import load as json_load, loads as json_loads
+except ImportError:
+    # スクリプトとして直接実行した場合（services/ が sys.path の先頭）
+    from serialization import load as json_load, loads as json_loads
+
+MAGIC = b"DLSHD001"
+FORMAT_VERSION = 1
+SHARD_EXTENSION = ".dlshard"
+INDEX_FILENAME = "dlogic_index.json"
+
+# Bloomフィルタの偽陽性率（1頭あたり約9.6ビット）
+BLOOM_FALSE_POSITIVE_RATE = float(os.getenv('DLOGIC_SHARD_BLOOM_FPR', 0.01))
+COMPRESSION_LEVEL = 6
+
+
+def _align8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _name_hashes(name: str) -> Tuple[int, int]:
+    digest = hashlib.blake2b(name.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+def shard_for(name: str, shard_count: int) -> int:
+    """ハッシュ分割で馬が入るシャード番号（0始まり、プロセスをまたいで一定）"""
+    return _name_hashes(name)[0] % shard_count
+
+
+class BloomFilter:
+    """馬名のBloomフィルタ（ダブルハッシュ方式）"""
+
+    def __init__(self, bit_count: int, hash_count: int, bits: Optional[bytes] = None):
+        self.bit_count = max(8, bit_count)
+        self.hash_count = max(1, hash_count)
+        self.bits = bytearray(bits) if bits is not None else bytearray((self.bit_count + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, item_count: int, false_positive_rate: float = BLOOM_FALSE_POSITIVE_RATE) -> "BloomFilter":
+        item_count = max(1, item_count)
+        bit_count = math.ceil(-item_count * math.log(false_positive_rate) / (math.log(2) ** 2))
+        hash_count = round(bit_count / item_count * math.log(2))
+        return cls(bit_count, hash_count)
+
+    def _positions(self, name: str) -> Iterable[int]:
+        h1, h2 = _name_hashes(name)
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.bit_count
+
+    def add(self, name: str):
+        for position in self._positions(name):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, name: str) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(name))
+
+
+# --- 書き出し ---
+
+def _offsets_array(blobs: List[bytes]) -> Tuple[bytes, array]:
+    offsets = array("I", [0])
+    total = 0
+    for blob in blobs:
+        total += len(blob)
+        offsets.append(total)
+    return b"".join(blobs), offsets
+
+
+def write_shard(horses: Dict[str, Any], output_path: str, shard_id: int,
+                false_positive_rate: float = BLOOM_FALSE_POSITIVE_RATE) -> Dict[str, Any]:
+    """1シャード分の馬データを書き出す"""
+    names = sorted(horses.keys())
+    bloom = BloomFilter.for_capacity(len(names), false_positive_rate)
+    for name in names:
+        bloom.add(name)
+
+    names_blob, name_offsets = _offsets_array([name.encode("utf-8") for name in names])
+    horse_blob, horse_offsets = _offsets_array([
+        zlib.compress(json.dumps(horses[name], ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+                      COMPRESSION_LEVEL)
+        for name in names
+    ])
+
+    sections: List[Tuple[str, bytes]] = [
+        ("bloom", bytes(bloom.bits)),
+        ("names", names_blob),
+        ("name_offsets", name_offsets.tobytes()),
+        ("horse_offsets", horse_offsets.tobytes()),
+        ("horse_blobs", horse_blob),
+    ]
+    layout = {}
+    position = 0
+    for section_name, payload in sections:
+        layout[section_name] = [position, len(payload)]
+        position = _align8(position + len(payload))
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "shard_id": shard_id,
+        "horse_count": len(names),
+        "first_horse": names[0] if names else "",
+        "last_horse": names[-1] if names else "",
+        "bloom": {"bit_count": bloom.bit_count, "hash_count": bloom.hash_count},
+        "compression": "zlib",
+        "sections": layout,
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_start = _align8(len(MAGIC) + 4 + len(header_bytes))
+
+    # 書き込み途中のファイルを読まれないよう一時ファイル経由で置き換える
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * (data_start - f.tell()))
+        for section_name, payload in sections:
+            f.write(payload)
+            f.write(b"\0" * (_align8(len(payload)) - len(payload)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+
+    return {
+        "horses_count": len(names),
+        "first_horse": header["first_horse"],
+        "last_horse": header["last_horse"],
+        "size_bytes": os.path.getsize(output_path),
+    }
+
+
+def write_shards(data: Dict[str, Any], output_dir: str, shard_count: int,
+                 split_method: str = "hash", prefix: str = "dlogic_raw_knowledge",
+                 false_positive_rate: float = BLOOM_FALSE_POSITIVE_RATE) -> Dict[str, Any]:
+    """ナレッジ辞書をシャードに分割して書き出し、インデックス（dlogic_index.json）を作成"""
+    horses = data.get("horses", {})
+    shard_count = max(1, shard_count)
+    groups: List[Dict[str, Any]] = [{} for _ in range(shard_count)]
+    if split_method == "alphabetical":
+        names = sorted(horses.keys())
+        per_shard = max(1, math.ceil(len(names) / shard_count))
+        for i, name in enumerate(names):
+            groups[i // per_shard][name] = horses[name]
+    elif split_method == "hash":
+        for name, horse in horses.items():
+            groups[shard_for(name, shard_count)][name] = horse
+    else:
+        raise ValueError(f"未対応の分割方法: {split_method}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    meta = data.get("meta", {})
+    index = {
+        "meta": {
+            "version": "4.0",
+            "format": "dlshard",
+            "split_method": split_method,
+            "hash": "blake2b",
+            "total_chunks": shard_count,
+            "created": meta.get("created", datetime.now().isoformat()),
+            "split_date": datetime.now().isoformat(),
+        },
+        "chunks": [],
+    }
+    for i, group in enumerate(groups):
+        filename = f"{prefix}_shard_{i + 1:02d}{SHARD_EXTENSION}"
+        info = write_shard(group, os.path.join(output_dir, filename), i + 1, false_positive_rate)
+        index["chunks"].append({"chunk_id": i + 1, "filename": filename, **info})
+
+    index_path = os.path.join(output_dir, INDEX_FILENAME)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, index_path)
+    return index
+
+
+# --- 読み込み ---
+
+def _read_header(f) -> Tuple[Dict[str, Any], int]:
+    magic = f.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError("シャード形式ではありません")
+    (header_len,) = struct.unpack("<I", f.read(4))
+    header = json.loads(f.read(header_len).decode("utf-8"))
+    return header, _align8(len(MAGIC) + 4 + header_len)
+
+
+def read_shard_filter(path: str) -> Tuple[Dict[str, Any], BloomFilter]:
+    """シャードのヘッダーとBloomフィルタだけを読む（馬データは読まない）"""
+    with open(path, "rb") as f:
+        header, data_start = _read_header(f)
+        offset, length = header["sections"]["bloom"]
+        f.seek(data_start + offset)
+        bits = f.read(length)
+    bloom = BloomFilter(header["bloom"]["bit_count"], header["bloom"]["hash_count"], bits)
+    return header, bloom
+
+
+class KnowledgeShard:
+    """メモリマップした1シャード（ソート済み馬名の二分探索で1頭ずつ展開）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self.header, self._data_start = _read_header(self._file)
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        if self.header.get("byteorder") != sys.byteorder:
+            self.close()
+            raise ValueError("バイトオーダーが一致しません。分割し直してください")
+        self._view = memoryview(self._mm)
+        self.horse_count: int = self.header["horse_count"]
+        self._names = self._section("names")
+        self._name_offsets = self._section("name_offsets").cast("I")
+        self._horse_offsets = self._section("horse_offsets").cast("I")
+        self._horse_blobs = self._section("horse_blobs")
+        self._name_cache: Dict[int, str] = {}
+
+    def _section(self, name: str) -> memoryview:
+        offset, length = self.header["sections"][name]
+        start = self._data_start + offset
+        return self._view[start:start + length]
+
+    def close(self):
+        """メモリマップを解放"""
+        for attr in ("_names", "_name_offsets", "_horse_offsets", "_horse_blobs", "_view"):
+            view = getattr(self, attr, None)
+            if view is not None:
+                view.release()
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def name_at(self, index: int) -> str:
+        name = self._name_cache.get(index)
+        if name is None:
+            start, end = self._name_offsets[index], self._name_offsets[index + 1]
+            name = bytes(self._names[start:end]).decode("utf-8")
+            self._name_cache[index] = name
+        return name
+
+    def find(self, horse_name: str) -> int:
+        """馬名の位置を二分探索（見つからなければ-1）"""
+        index = bisect_left(_NameSequence(self), horse_name)
+        if index < self.horse_count and self.name_at(index) == horse_name:
+            return index
+        return -1
+
+    def horse_names(self) -> Iterable[str]:
+        for index in range(self.horse_count):
+            yield self.name_at(index)
+
+    def get_horse_by_index(self, index: int) -> Dict[str, Any]:
+        start, end = self._horse_offsets[index], self._horse_offsets[index + 1]
+        return json_loads(zlib.decompress(self._horse_blobs[start:end]))
+
+    def get_horse(self, horse_name: str) -> Optional[Dict[str, Any]]:
+        index = self.find(horse_name)
+        if index < 0:
+            return None
+        return self.get_horse_by_index(index)
+
+
+class _NameSequence:
+    """bisect用の馬名シーケンス"""
+
+    def __init__(self, shard: KnowledgeShard):
+        self._shard = shard
+
+    def __len__(self) -> int:
+        return self._shard.horse_count
+
+    def __getitem__(self, index: int) -> str:
+        return self._shard.name_at(index)
+
+
+class ShardedKnowledge:
+    """シャード群の検索（Bloomフィルタで候補を絞り、必要なシャードだけを開く）"""
+
+    def __init__(self, data_dir: str, index: Optional[Dict[str, Any]] = None):
+        self.data_dir = data_dir
+        if index is None:
+            with open(os.path.join(data_dir, INDEX_FILENAME), "r", encoding="utf-8") as f:
+                index = json.load(f)
+        self.index = index
+        self.split_method: str = index["meta"]["split_method"]
+        self._chunks: List[Dict[str, Any]] = index["chunks"]
+        self._filters: List[BloomFilter] = []
+        for chunk in self._chunks:
+            _, bloom = read_shard_filter(os.path.join(data_dir, chunk["filename"]))
+            self._filters.append(bloom)
+        self._shards: Dict[int, KnowledgeShard] = {}
+        self.opened_shards: Set[int] = set()
+        self.filter_rejections = 0
+
+    def close(self):
+        for shard in self._shards.values():
+            shard.close()
+        self._shards.clear()
+        self.opened_shards.clear()
+
+    def _candidates(self, horse_name: str) -> List[int]:
+        """馬がいる可能性のあるシャード（位置）。Bloomフィルタで否定されたものは除く"""
+        if self.split_method == "hash":
+            positions = [shard_for(horse_name, len(self._chunks))]
+        else:
+            positions = [
+                i for i, chunk in enumerate(self._chunks)
+                if chunk.get("first_horse", "") <= horse_name <= chunk.get("last_horse", "")
+            ]
+        candidates = [i for i in positions if horse_name in self._filters[i]]
+        if len(candidates) < len(positions):
+            self.filter_rejections += 1
+        return candidates
+
+    def _shard(self, position: int) -> KnowledgeShard:
+        shard = self._shards.get(position)
+        if shard is None:
+            shard = KnowledgeShard(os.path.join(self.data_dir, self._chunks[position]["filename"]))
+            self._shards[position] = shard
+            self.opened_shards.add(self._chunks[position]["chunk_id"])
+        return shard
+
+    def plan(self, horse_names: Iterable[str]) -> Dict[int, List[str]]:
+        """シャード位置 -> そのシャードで探す馬名（フィルタ通過分のみ）"""
+        groups: Dict[int, List[str]] = {}
+        for name in horse_names:
+            for position in self._candidates(name):
+                groups.setdefault(position, []).append(name)
+        return groups
+
+    def find_horse(self, horse_name: str) -> Optional[Dict[str, Any]]:
+        for position in self._candidates(horse_name):
+            horse = self._shard(position).get_horse(horse_name)
+            if horse is not None:
+                return horse
+        return None
+
+    def find_horses(self, horse_names: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """出走馬をまとめて検索（シャードごとに1回開いて、その中の馬を続けて展開）"""
+        results: Dict[str, Optional[Dict[str, Any]]] = {name: None for name in horse_names}
+        for position, names in sorted(self.plan(results).items()):
+            shard = self._shard(position)
+            for name in names:
+                if results[name] is None:
+                    results[name] = shard.get_horse(name)
+        return results
+
+    def chunk_horses(self, chunk_id: int) -> Dict[str, Any]:
+        """指定したシャードの全馬データ"""
+        position = next(i for i, chunk in enumerate(self._chunks) if chunk["chunk_id"] == chunk_id)
+        shard = self._shard(position)
+        return {shard.name_at(index): shard.get_horse_by_index(index) for index in range(shard.horse_count)}
+
+    def load_all_horses(self) -> Dict[str, Any]:
+        horses: Dict[str, Any] = {}
+        for chunk in self._chunks:
+            horses.update(self.chunk_horses(chunk["chunk_id"]))
+        return horses
+
+if __name__ == "__main__":
+    import time
+
+    base_dir = os.path.join(os.path.dirname(__file__), "..", "data")
+    source = sys.argv[1] if len(sys.argv) > 1 else os.path.join(base_dir, "dlogic_raw_knowledge.json")
+    target = sys.argv[2] if len(sys.argv) > 2 else os.path.join(base_dir, "chunks")
+    count = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+
+    print(f"📦 シャード分割: {source} -> {target} ({count}分割)")
+    start = time.time()
+    with open(source, "rb") as f:
+        knowledge = json_load(f)
+    result = write_shards(knowledge, target, count)
+    total = sum(chunk["size_bytes"] for chunk in result["chunks"]) / (1024 * 1024)
+    print(f"✅ 分割完了 ({time.time() - start:.1f}秒): {len(result['chunks'])}シャード / {total:.1f}MB")
@@ -1,19 +1,61 @@
 #!/usr/bin/env python3
 """
 月次ナレッジファイル更新サービス
-MySQLから差分データを取得して新しいナレッジファイルを生成
+ウォーターマーク（取り込み済みの最終開催日）以降のレース行だけをMySQLから取得し、
+該当馬の過去走に追記する差分（デルタ）ファイルを生成する
 """
 import json
 import os
 import mysql.connector
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 import logging
-import gzip
-import shutil
+from .race_history_extractor import RaceHistoryExtractor, RaceHistoryQuery
+from .knowledge_delta import (
+    DELTA_PREFIX, WatermarkStore, build_delta, new_races_for, race_date, write_delta
+)
 
 logger = logging.getLogger(__name__)
 
+# 差分取得の元テーブルと、各馬に保持する最新走数・新規馬の最低走数
+DELTA_SOURCE_TABLE = 'jvd_ks'
+DELTA_MAX_RACES = 10
+NEW_HORSE_MIN_RACES = 3
+
+# ナレッジファイルの過去走と jvd_ks で名前が同じ列
+_SAME_NAME_COLUMNS = (
+    'KYORI', 'TANSHO_NINKIJUN', 'FUTAN_JURYO', 'BATAIJU',
+    'CORNER1_JUNI', 'CORNER2_JUNI', 'CORNER3_JUNI', 'CORNER4_JUNI',
+    'SOHA_TIME', 'TRACK_CODE', 'TENKO_CODE', 'KISHUMEI_RYAKUSHO', 'CHOKYOSHIMEI_RYAKUSHO'
+)
+
+
+def to_knowledge_race(row: Dict[str, Any]) -> Dict[str, Any]:
+    """jvd_ks の1行をナレッジファイルの過去走の形式に変換
+    
+    NENGAPPI -> KAISAI_NEN/KAISAI_GAPPI、KAKUTEI_JINI -> KAKUTEI_CHAKUJUN、KAKUTEI_CHAKUSA -> CHAKUSA、
+    ZOGEN_FUGO + ZOGEN_SA -> ZOGEN_SA（"+004"）、BABA_CODE -> 芝/ダートの馬場状態コード。
+    NULL は空文字にし、ナレッジに無い列（レース名など）は含めない。
+    """
+    def value(column):
+        item = row.get(column)
+        return '' if item is None else str(item)
+    
+    date = value('NENGAPPI')
+    race = {'KAISAI_NEN': date[:4], 'KAISAI_GAPPI': date[4:8], 'KAKUTEI_CHAKUJUN': value('KAKUTEI_JINI')}
+    for column in _SAME_NAME_COLUMNS:
+        race[column] = value(column)
+    zogen_sa = value('ZOGEN_SA')
+    race['ZOGEN_SA'] = value('ZOGEN_FUGO').strip() + zogen_sa if zogen_sa else ''
+    # 馬場状態はトラックに応じて芝・ダートの列に入れる（不明な場合は入れない）
+    baba_code = value('BABA_CODE')
+    if baba_code:
+        baba_key = 'SHIBA_BABAJOTAI_CODE' if race['TRACK_CODE'].startswith('1') else 'DIRT_BABAJOTAI_CODE'
+        race[baba_key] = baba_code
+    race['CHAKUSA'] = value('KAKUTEI_CHAKUSA')
+    return race
+
+
 class MonthlyKnowledgeUpdater:
     """月次ナレッジファイル更新サービス"""
     
@@ -28,6 +70,44 @@ class MonthlyKnowledgeUpdater:
         }
         self.output_dir = os.path.join(os.path.dirname(__file__), '..', 'data', 'monthly_updates')
         os.makedirs(self.output_dir, exist_ok=True)
+        self.watermarks = WatermarkStore()
+        
+        # 対象馬をまとめたクエリで各馬の最新10走を取得
+        self.race_extractor = RaceHistoryExtractor(RaceHistoryQuery(
+            columns="""
+                NENGAPPI,
+                KYOSOMEI_HONDAI,
+                TRACK_CODE,
+                KYORI,
+                BABA_CODE,
+                TENKO_CODE,
+                KISHUMEI_RYAKUSHO,
+                CHOKYOSHIMEI_RYAKUSHO,
+                KAKUTEI_JINI,
+                KAKUTEI_CHAKUSA,
+                TANSHO_NINKIJUN,
+                FUTAN_JURYO,
+                BATAIJU,
+                ZOGEN_FUGO,
+                ZOGEN_SA,
+                CORNER1_JUNI,
+                CORNER2_JUNI,
+                CORNER3_JUNI,
+                CORNER4_JUNI,
+                SOHA_TIME,
+                JOKYO_CODE,
+                GRADE_CODE,
+                SYUSSO_TOSU
+            """,
+            from_clause=DELTA_SOURCE_TABLE,
+            order_by="NENGAPPI DESC",
+            key_column="BAMEI",
+            max_races=DELTA_MAX_RACES,
+            min_races=1
+        ))
+    
+    def connect(self):
+        return mysql.connector.connect(**self.mysql_config)
         
     def get_last_update_date(self) -> datetime:
         """最後の更新日を取得（メタデータから）"""
@@ -36,7 +116,7 @@ class MonthlyKnowledgeUpdater:
             from .dlogic_raw_data_manager import dlogic_manager
             meta_info = dlogic_manager.knowledge_data.get('meta', {})
             last_updated = meta_info.get('last_updated', '2024-12-01')
-            return datetime.strptime(last_updated, '%Y-%m-%d')
+            return datetime.strptime(last_updated[:10], '%Y-%m-%d')
         except Exception as e:
             logger.warning(f"Failed to get last update date: {e}")
             # デフォルトは1ヶ月前
@@ -47,7 +127,7 @@ class MonthlyKnowledgeUpdater:
         conn = None
         cursor = None
         try:
-            conn = mysql.connector.connect(**self.mysql_config)
+            conn = self.connect()
             cursor = conn.cursor()
             
             # 指定日以降に3走以上した馬を検索
@@ -79,144 +159,133 @@ class MonthlyKnowledgeUpdater:
     
     def get_horse_race_data(self, horse_name: str) -> List[Dict[str, Any]]:
         """馬の過去走データを取得"""
+        return self.get_horses_race_data([horse_name]).get(horse_name, [])
+    
+    def get_horses_race_data(self, horse_names: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """複数馬の過去走データを1接続・まとめたクエリで取得（馬名 -> 新しい順の最新10走）"""
         conn = None
-        cursor = None
+        results = {}
         try:
-            conn = mysql.connector.connect(**self.mysql_config)
-            cursor = conn.cursor(dictionary=True)
-            
-            query = """
-            SELECT 
-                NENGAPPI,
-                KYOSOMEI_HONDAI,
-                TRACK_CODE,
-                KYORI,
-                BABA_CODE,
-                TENKO_CODE,
-                KISHUMEI_RYAKUSHO,
-                CHOKYOSHIMEI_RYAKUSHO,
-                KAKUTEI_JINI,
-                KAKUTEI_CHAKUSA,
-                TANSHO_NINKIJUN,
-                FUTAN_JURYO,
-                BATAIJU,
-                ZOGEN_FUGO,
-                ZOGEN_SA,
-                CORNER1_JUNI,
-                CORNER2_JUNI,
-                CORNER3_JUNI,
-                CORNER4_JUNI,
-                SOHA_TIME,
-                JOKYO_CODE,
-                GRADE_CODE,
-                SYUSSO_TOSU
-            FROM jvd_ks
-            WHERE BAMEI = %s
-            ORDER BY NENGAPPI DESC
-            LIMIT 10
-            """
-            
-            cursor.execute(query, (horse_name,))
-            races = cursor.fetchall()
-            
-            return races
+            conn = self.connect()
+            for i, (horse_name, races) in enumerate(self.race_extractor.stream(conn, horse_names)):
+                if i % 100 == 0:
+                    logger.info(f"Processing horse {i+1}/{len(horse_names)}")
+                results[horse_name] = [to_knowledge_race(race) for race in races]
+            return results
             
         except Exception as e:
-            logger.error(f"Error fetching race data for {horse_name}: {e}")
-            return []
+            logger.error(f"Error fetching race data for {len(horse_names)} horses: {e}")
+            return results
         finally:
-            if cursor:
-                cursor.close()
             if conn:
                 conn.close()
     
-    def merge_with_existing_knowledge(self, new_data: Dict[str, Any]) -> Dict[str, Any]:
-        """既存のナレッジデータと新データをマージ"""
-        try:
-            from .dlogic_raw_data_manager import dlogic_manager
-            existing_data = dlogic_manager.knowledge_data.copy()
-            
-            # 既存の馬データに新データを追加/更新
-            existing_horses = existing_data.get('horses', {})
-            new_horses = new_data.get('horses', {})
-            
-            # マージ（新データで上書き）
-            for horse_name, horse_data in new_horses.items():
-                existing_horses[horse_name] = horse_data
-            
-            # メタデータ更新
-            existing_data['meta'] = {
-                'total_horses': len(existing_horses),
-                'last_updated': datetime.now().strftime('%Y-%m-%d'),
-                'update_type': 'monthly_differential',
-                'previous_update': existing_data.get('meta', {}).get('last_updated', 'unknown'),
-                'new_horses_added': len(new_horses),
-                'generation_date': datetime.now().isoformat()
-            }
-            
-            existing_data['horses'] = existing_horses
-            return existing_data
-            
-        except Exception as e:
-            logger.error(f"Error merging knowledge data: {e}")
-            # エラー時は新データのみ返す
-            return new_data
-    
-    def generate_monthly_update(self) -> Dict[str, Any]:
-        """月次更新データを生成"""
-        logger.info("Starting monthly knowledge update generation")
+    def fetch_races_since(self, watermark: str) -> Tuple[Dict[str, List[Dict[str, Any]]], Optional[str]]:
+        """ウォーターマーク以降のレース行だけを馬ごとに取得（馬名 -> 新しい順）と新しいウォーターマーク
         
-        # 最後の更新日を取得
-        last_update = self.get_last_update_date()
-        logger.info(f"Last update date: {last_update}")
+        行はナレッジファイルの過去走の形式に変換して返す（to_knowledge_race）。
+        ウォーターマーク当日の行も取り直す（取り込み途中だった日の追加分を拾うため）。
+        既に持っている日付のレースは追記時に除外する。
+        """
+        base = self.race_extractor.query
+        extractor = RaceHistoryExtractor(RaceHistoryQuery(
+            columns=base.columns,
+            from_clause=base.from_clause,
+            conditions=[
+                f"NENGAPPI >= {base.placeholder}",
+                "BAMEI IS NOT NULL",
+                "BAMEI != ''"
+            ],
+            params=(watermark,),
+            order_by=base.order_by,
+            key_column=base.key_column,
+            max_races=DELTA_MAX_RACES,
+            min_races=1,
+            placeholder=base.placeholder
+        ))
         
-        # 新しい馬のリストを取得
-        new_horses = self.fetch_new_horses(last_update)
-        logger.info(f"Found {len(new_horses)} new/updated horses")
+        conn = self.connect()
+        races_by_horse = {}
+        high_water = None
+        try:
+            for horse_name, races in extractor.stream(conn):
+                races = [to_knowledge_race(race) for race in races]
+                races_by_horse[horse_name] = races
+                latest = race_date(races[0])
+                if latest and (high_water is None or latest > high_water):
+                    high_water = latest
+        finally:
+            conn.close()
         
-        # 新しい馬のデータを収集
-        knowledge_data = {
-            'horses': {},
-            'meta': {
-                'generation_date': datetime.now().isoformat(),
-                'last_updated': datetime.now().strftime('%Y-%m-%d'),
-                'update_type': 'monthly_differential',
-                'previous_update': last_update.strftime('%Y-%m-%d'),
-                'new_horses_count': len(new_horses)
-            }
-        }
+        stats = extractor.get_stats()
+        logger.info(f"Fetched {stats['rows_scanned']} race rows for {len(races_by_horse)} horses "
+                    f"since {watermark} ({stats['query_count']} query)")
+        return races_by_horse, high_water
+    
+    def generate_monthly_update(self, manager=None) -> Dict[str, Any]:
+        """差分（デルタ）ファイルを生成し、このプロセスのナレッジにも適用する
         
-        for i, horse_name in enumerate(new_horses):
-            if i % 100 == 0:
-                logger.info(f"Processing horse {i+1}/{len(new_horses)}")
-            
-            race_data = self.get_horse_race_data(horse_name)
-            if race_data:
-                knowledge_data['horses'][horse_name] = {
-                    'race_count': len(race_data),
-                    'races': race_data,
-                    'last_race_date': race_data[0]['NENGAPPI'] if race_data else None
-                }
+        ナレッジ全体は書き直さない。他のサーバーはデルタファイルを
+        DLogicRawDataManager.apply_pending_deltas() で適用する。
+        """
+        logger.info("Starting monthly knowledge delta generation")
+        if manager is None:
+            from .dlogic_raw_data_manager import dlogic_manager as manager
+        horses = manager.knowledge_data.get('horses', {})
         
-        # 既存データとマージ
-        merged_data = self.merge_with_existing_knowledge(knowledge_data)
+        # ウォーターマーク（初回はナレッジの最終更新日）
+        previous = self.watermarks.watermarks()
+        watermark = self.watermarks.get(DELTA_SOURCE_TABLE) or self.get_last_update_date().strftime('%Y%m%d')
+        logger.info(f"Watermark ({DELTA_SOURCE_TABLE}): {watermark}")
         
-        # ファイルに保存
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        output_filename = f"dlogic_knowledge_update_{timestamp}.json"
-        output_path = os.path.join(self.output_dir, output_filename)
+        races_by_horse, high_water = self.fetch_races_since(watermark)
         
-        # JSON形式で保存
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(merged_data, f, ensure_ascii=False, indent=2)
+        # 既存馬は持っていない日付の行だけ、新規馬は最新10走をまとめて取得
+        changes = {}
+        unknown = []
+        for horse_name, races in races_by_horse.items():
+            if horse_name in horses:
+                fresh = new_races_for(horses[horse_name], races)
+                if fresh:
+                    changes[horse_name] = fresh
+            else:
+                unknown.append(horse_name)
+        new_horse_count = 0
+        if unknown:
+            for horse_name, races in self.get_horses_race_data(unknown).items():
+                if len(races) >= NEW_HORSE_MIN_RACES:
+                    changes[horse_name] = races
+                    new_horse_count += 1
+        logger.info(f"Delta: {len(changes) - new_horse_count} updated / {new_horse_count} new horses")
         
-        # 圧縮版も作成
+        base_version = max(self.watermarks.version, manager.get_delta_version())
+        watermarks = {DELTA_SOURCE_TABLE: high_water or watermark}
+        if not changes:
+            self.watermarks.advance(watermarks)
+            return {
+                'status': 'success',
+                'file_path': None,
+                'gz_file_path': None,
+                'file_size_mb': 0.0,
+                'gz_file_size_mb': 0.0,
+                'total_horses': len(horses),
+                'new_horses': 0,
+                'updated_horses': 0,
+                'delta_version': base_version,
+                'update_info': {'watermarks': watermarks, 'previous_watermarks': previous}
+            }
+        
+        version = base_version + 1
+        delta = build_delta(changes, version, base_version, watermarks, previous,
+                            DELTA_MAX_RACES, new_horses=new_horse_count)
+        output_path = write_delta(delta, self.output_dir)
         gz_path = output_path + '.gz'
-        with open(output_path, 'rb') as f_in:
-            with gzip.open(gz_path, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
         
-        logger.info(f"Monthly update generated: {output_path}")
+        # このプロセスのナレッジにその場で適用してからウォーターマークを進める
+        manager.apply_knowledge_delta(delta)
+        self.watermarks.advance(watermarks, version)
+        
+        logger.info(f"Knowledge delta v{version} generated: {output_path}")
         
         return {
             'status': 'success',
@@ -224,9 +293,11 @@ class MonthlyKnowledgeUpdater:
             'gz_file_path': gz_path,
             'file_size_mb': os.path.getsize(output_path) / (1024 * 1024),
             'gz_file_size_mb': os.path.getsize(gz_path) / (1024 * 1024),
-            'total_horses': len(merged_data.get('horses', {})),
-            'new_horses': len(new_horses),
-            'update_info': merged_data.get('meta', {})
+            'total_horses': len(manager.knowledge_data.get('horses', {})),
+            'new_horses': new_horse_count,
+            'updated_horses': len(changes) - new_horse_count,
+            'delta_version': version,
+            'update_info': delta['meta']
         }
     
     def get_update_history(self) -> List[Dict[str, Any]]:
@@ -237,11 +308,12 @@ class MonthlyKnowledgeUpdater:
             return history
         
         for filename in os.listdir(self.output_dir):
-            if filename.endswith('.json') and filename.startswith('dlogic_knowledge_update_'):
+            is_delta = filename.startswith(DELTA_PREFIX)
+            if filename.endswith('.json') and (is_delta or filename.startswith('dlogic_knowledge_update_')):
                 file_path = os.path.join(self.output_dir, filename)
                 file_stat = os.stat(file_path)
                 
-                # ファイル名から日時を抽出
+                # ファイル名から日時を抽出（デルタはファイル名がバージョン番号なので更新時刻）
                 try:
                     timestamp_str = filename.replace('dlogic_knowledge_update_', '').replace('.json', '')
                     update_time = datetime.strptime(timestamp_str, '%Y%m%d_%H%M%S')
@@ -253,7 +325,8 @@ class MonthlyKnowledgeUpdater:
                     'file_path': file_path,
                     'size_mb': file_stat.st_size / (1024 * 1024),
                     'created_at': update_time.isoformat(),
-                    'has_gz': os.path.exists(file_path + '.gz')
+                    'has_gz': os.path.exists(file_path + '.gz'),
+                    'type': 'delta' if is_delta else 'full'
                 })
         
         # 新しい順にソート
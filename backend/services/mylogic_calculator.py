@@ -3,16 +3,51 @@
 MyLogic計算エンジン
 ユーザーカスタマイズの重み付けでD-Logic計算を行う
 既存のFastDLogicEngineを利用して、重み付けだけ変更
+
+出走馬の12項目スコアは1回だけ取得（事前計算テーブル → 一括計算）して行列としてキャッシュし、
+重みの変更は行列 × 重みベクトルの1回の演算で全頭分を再計算する（スライダー操作のプレビュー用）
 """
-from typing import Dict, List, Any, Optional
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
 import logging
+import os
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # numpyがない環境では1頭ずつ計算
+    np = None
 
 # 既存のD-Logic計算エンジンをインポート
 from services.fast_dlogic_engine import FastDLogicEngine
 
 logger = logging.getLogger(__name__)
 
+# 出走馬ごとの12項目行列のキャッシュ件数（重みを変えるだけなら再取得しない）
+FIELD_CACHE_SIZE = int(os.getenv('MYLOGIC_FIELD_CACHE', 256))
+# 一度に分析できる最大頭数
+MAX_HORSES = 20
+
+# 偏差値変換＋累乗方式のパラメータ
+MIN_ORIGINAL = 20  # 元スコアの想定最小値（実データに基づき調整）
+MAX_ORIGINAL = 95  # 元スコアの想定最大値（実データに基づき調整）
+POWER_FACTOR = 33.3  # 累乗の強さ（100点で3乗になる）
+
+
+class FieldVectors:
+    """出走馬全体の12項目スコア（重みに依存しない変換は取得時に済ませておく）"""
+
+    __slots__ = ('entries', 'individual_scores', 'standard_scores', 'expanded')
+
+    def __init__(self):
+        # 入力順の (馬名, 行番号 or None, エラー内容)
+        self.entries: List[Tuple[str, Optional[int], Optional[str]]] = []
+        self.individual_scores: List[Dict[str, float]] = []
+        self.standard_scores: List[float] = []
+        # 偏差値変換済みのスコア（0-1、行: 馬 / 列: D_LOGIC_KEYS）
+        self.expanded = None
+
 class MyLogicCalculator:
     """MyLogic計算エンジン - 既存のD-Logicエンジンを拡張"""
     
@@ -36,8 +71,134 @@ class MyLogicCalculator:
     def __init__(self):
         # 既存のD-Logic計算エンジンを使用
         self.dlogic_engine = FastDLogicEngine()
+        self._field_cache: "OrderedDict[Tuple[Any, ...], FieldVectors]" = OrderedDict()
+        self._cache_lock = threading.Lock()
         logger.info("MyLogic計算エンジン初期化完了")
     
+    # --- 出走馬の12項目行列 ---
+    
+    def get_field_vectors(self, horse_names: List[str]) -> FieldVectors:
+        """出走馬の12項目スコア行列を取得（同じ出走馬・同じナレッジならキャッシュを返す）"""
+        key = (tuple(horse_names), self.dlogic_engine.raw_manager.get_knowledge_version())
+        with self._cache_lock:
+            field = self._field_cache.get(key)
+            if field is not None:
+                self._field_cache.move_to_end(key)
+                return field
+        
+        field = self._build_field_vectors(horse_names)
+        with self._cache_lock:
+            self._field_cache[key] = field
+            while len(self._field_cache) > FIELD_CACHE_SIZE:
+                self._field_cache.popitem(last=False)
+        return field
+    
+    def _build_field_vectors(self, horse_names: List[str]) -> FieldVectors:
+        # 事前計算テーブル・一括ベクトル計算でまとめて取得し、残りだけ1頭ずつ分析
+        batch_results = self.dlogic_engine._batch_standard_results(horse_names)
+        field = FieldVectors()
+        rows = []
+        for horse_name in horse_names:
+            try:
+                standard_result = batch_results.get(horse_name)
+                if standard_result is None:
+                    standard_result = self.dlogic_engine.analyze_single_horse(horse_name)
+            except Exception as e:
+                logger.error(f"MyLogic計算エラー: {str(e)}")
+                field.entries.append((horse_name, None, str(e)))
+                continue
+            
+            if not standard_result or "total_score" not in standard_result:
+                logger.warning(f"馬 {horse_name} の標準分析に失敗")
+                field.entries.append((horse_name, None, "分析データが見つかりません"))
+                continue
+            
+            d_logic_scores = standard_result.get("d_logic_scores", {})
+            field.entries.append((horse_name, len(rows), None))
+            field.individual_scores.append(d_logic_scores)
+            field.standard_scores.append(standard_result["total_score"])
+            # 項目が欠けている場合は寄与0になる値（MIN_ORIGINAL）で埋める
+            rows.append([float(d_logic_scores.get(key, MIN_ORIGINAL)) for key in self.D_LOGIC_KEYS])
+        
+        if np is not None:
+            matrix = np.array(rows, dtype=np.float64).reshape(len(rows), len(self.D_LOGIC_KEYS))
+            # Step 1: 偏差値変換（重みに依存しないので取得時に1回だけ）
+            expanded = (matrix - MIN_ORIGINAL) / (MAX_ORIGINAL - MIN_ORIGINAL) * 100
+            field.expanded = np.clip(expanded, 0, 100) / 100
+        return field
+    
+    def _weight_vector(self, weights: Dict[str, int]) -> Optional["np.ndarray"]:
+        """D_LOGIC_KEYS順の重みベクトル（合計0ならNone）"""
+        total_weight = sum(weights.values())
+        if abs(total_weight - 100) > 0.1:  # 浮動小数点誤差を考慮
+            logger.warning(f"重み付けの合計が100ではありません: {total_weight}")
+            if total_weight == 0:
+                return None
+        # 重み0以下の項目は寄与なし
+        return np.array([
+            max(0.0, float(weights.get(key.split("_", 1)[1], 0))) for key in self.D_LOGIC_KEYS
+        ], dtype=np.float64)
+    
+    def score_field(self, field: FieldVectors, weights: Dict[str, int]) -> List[float]:
+        """出走馬全体のMyLogicスコア（行列 × 重みベクトル）"""
+        if hasattr(weights, '__dict__'):
+            weights = dict(weights)
+        if np is None:
+            return [self._calculate_mylogic_score(scores, weights) for scores in field.individual_scores]
+        if not field.individual_scores:
+            return []
+        
+        weight_vector = self._weight_vector(weights)
+        if weight_vector is None:
+            return [50.00] * len(field.individual_scores)
+        # Step 2: 項目ごとの累乗（weight=100で3乗）を掛けてから重みとの積和
+        raw_scores = (field.expanded ** (weight_vector / POWER_FACTOR)) @ weight_vector
+        return [round(max(0.00, min(100.00, float(score))), 2) for score in raw_scores]
+    
+    def _build_results(self, field: FieldVectors, weights: Dict[str, int],
+                       details: bool = True) -> List[Dict[str, Any]]:
+        if hasattr(weights, '__dict__'):
+            weights = dict(weights)
+        scores = self.score_field(field, weights)
+        results = []
+        for horse_name, row, error in field.entries:
+            if row is None:
+                results.append({
+                    "horse_name": horse_name,
+                    "standard_score": 0,
+                    "mylogic_score": 0,
+                    "score_difference": 0,
+                    "error": error
+                })
+                continue
+            
+            mylogic_score = scores[row]
+            standard_score = field.standard_scores[row]
+            result = {
+                "horse_name": horse_name,
+                "standard_score": standard_score,
+                "mylogic_score": mylogic_score,
+                "score_difference": round(mylogic_score - standard_score, 1),
+                "grade": self._get_grade(mylogic_score)
+            }
+            if details:
+                d_logic_scores = field.individual_scores[row]
+                # デバッグ用: 各項目の貢献度を記録
+                individual_contributions = {}
+                for d_logic_key, score in d_logic_scores.items():
+                    mylogic_key = "_".join(d_logic_key.split("_")[1:])
+                    if mylogic_key in weights:
+                        weight = weights[mylogic_key]
+                        individual_contributions[mylogic_key] = {
+                            "original_score": score,
+                            "weight": weight,
+                            "contribution": round(score * weight / 100, 2)
+                        }
+                result["individual_scores"] = d_logic_scores  # デバッグ用
+                result["individual_contributions"] = individual_contributions  # 各項目の貢献度
+            results.append(result)
+        return results
+    
     def calculate_with_custom_weights(
         self, 
         horse_name: str, 
@@ -54,52 +215,7 @@ class MyLogicCalculator:
             分析結果
         """
         try:
-            # 1. 標準D-Logic分析を実行
-            standard_result = self.dlogic_engine.analyze_single_horse(horse_name)
-            
-            if not standard_result or "total_score" not in standard_result:
-                logger.warning(f"馬 {horse_name} の標準分析に失敗")
-                return {
-                    "horse_name": horse_name,
-                    "standard_score": 0,
-                    "mylogic_score": 0,
-                    "score_difference": 0,
-                    "error": "分析データが見つかりません"
-                }
-            
-            # 2. D-Logicの各項目スコアを取得
-            d_logic_scores = standard_result.get("d_logic_scores", {})
-            
-            # 3. カスタム重み付けで再計算
-            mylogic_score = self._calculate_mylogic_score(d_logic_scores, weights)
-            
-            # デバッグ用: 各項目の貢献度を記録
-            individual_contributions = {}
-            for d_logic_key, score in d_logic_scores.items():
-                mylogic_key = "_".join(d_logic_key.split("_")[1:])
-                if mylogic_key in weights:
-                    weight = weights[mylogic_key]
-                    contribution = score * weight / 100
-                    individual_contributions[mylogic_key] = {
-                        "original_score": score,
-                        "weight": weight,
-                        "contribution": round(contribution, 2)
-                    }
-            
-            # 4. 結果を返す
-            standard_score = standard_result["total_score"]
-            score_difference = round(mylogic_score - standard_score, 1)
-            
-            return {
-                "horse_name": horse_name,
-                "standard_score": standard_score,
-                "mylogic_score": mylogic_score,
-                "score_difference": score_difference,
-                "grade": self._get_grade(mylogic_score),
-                "individual_scores": d_logic_scores,  # デバッグ用
-                "individual_contributions": individual_contributions  # 各項目の貢献度
-            }
-            
+            return self._build_results(self.get_field_vectors([horse_name]), weights)[0]
         except Exception as e:
             logger.error(f"MyLogic計算エラー: {str(e)}")
             return {
@@ -138,12 +254,7 @@ class MyLogicCalculator:
             if total_weight == 0:
                 return 50.00  # デフォルト値
         
-        # 偏差値変換＋累乗方式の実装
-        # 設定可能なパラメータ
-        MIN_ORIGINAL = 20  # 元スコアの想定最小値（実データに基づき調整）
-        MAX_ORIGINAL = 95  # 元スコアの想定最大値（実データに基づき調整）
-        POWER_FACTOR = 33.3  # 累乗の強さ（100点で3乗になる）
-        
+        # 偏差値変換＋累乗方式の実装（パラメータはモジュール定数）
         mylogic_score = 0.0
         
         # 各D-Logicスコアに偏差値変換＋累乗を適用
@@ -236,7 +347,8 @@ class MyLogicCalculator:
     def analyze_multiple_horses(
         self, 
         horse_names: List[str], 
-        weights: Dict[str, int]
+        weights: Dict[str, int],
+        details: bool = True
     ) -> List[Dict[str, Any]]:
         """
         複数馬をカスタム重み付けで分析
@@ -244,17 +356,15 @@ class MyLogicCalculator:
         Args:
             horse_names: 馬名リスト
             weights: カスタム重み付け
+            details: 各項目のスコア・貢献度を含めるか（プレビューでは不要）
         
         Returns:
             分析結果リスト（MyLogicスコア降順）
         """
-        results = []
-        
-        for horse_name in horse_names[:20]:  # 最大20頭まで
-            result = self.calculate_with_custom_weights(horse_name, weights)
-            results.append(result)
+        field = self.get_field_vectors(horse_names[:MAX_HORSES])  # 最大20頭まで
+        results = self._build_results(field, weights, details)
         
         # MyLogicスコアで降順ソート
         results.sort(key=lambda x: x.get("mylogic_score", 0), reverse=True)
         
-        return results
\ No newline at end of file
+        return results
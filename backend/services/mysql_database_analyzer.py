@@ -7,10 +7,9 @@ import mysql.connector
 import os
 from typing import Dict, List, Tuple, Any
 from datetime import datetime
-import json
-from decimal import Decimal
 from dotenv import load_dotenv
 from pathlib import Path
+from serialization import dump as json_dump
 
 # .envファイル読み込み（親ディレクトリから）
 env_path = Path(__file__).parent.parent / '.env'
@@ -351,14 +350,8 @@ class MySQLDatabaseAnalyzer:
             "database": self.mysql_config['database']
         }
         
-        # Decimal型をfloatに変換するカスタムエンコーダー
-        def decimal_encoder(obj):
-            if isinstance(obj, Decimal):
-                return float(obj)
-            raise TypeError
-        
         with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(analysis_result, f, indent=2, ensure_ascii=False, default=decimal_encoder)
+            json_dump(analysis_result, f, indent=True)
         
         print(f"📊 MySQL分析レポート出力: {filepath}")
         return filepath
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+馬名・騎手名の正規化
+全角半角（NFKC）・ひらがな/カタカナ・長音記号・中黒の表記ゆれを吸収し、
+ナレッジのキーとOCR・チャット入力の名前を同じ形にそろえる
+"""
+import unicodedata
+from typing import Dict, Iterable, Optional
+
+# 長音記号として扱う文字（NFKC後に残るダッシュ・波線類）
+_LONG_VOWEL_VARIANTS = '-‐‑‒–—―−〜～~'
+# 読み飛ばす区切り文字（中黒・ピリオド類。全角「．」や半角「･」もNFKC後はこの形になる）
+_SEPARATORS = '・·•‧.'
+
+_HIRAGANA_START = ord('ぁ')
+_HIRAGANA_END = ord('ゖ')
+_KATAKANA_OFFSET = ord('ァ') - ord('ぁ')
+
+_TRANSLATION = {ord(c): 'ー' for c in _LONG_VOWEL_VARIANTS}
+_TRANSLATION.update({ord(c): None for c in _SEPARATORS})
+_TRANSLATION.update({code: chr(code + _KATAKANA_OFFSET) for code in range(_HIRAGANA_START, _HIRAGANA_END + 1)})
+
+
+def normalize_name(name: str) -> str:
+    """比較用の正規化キーを返す
+
+    1. NFKC（全角英数→半角、半角カナ→全角）
+    2. 大文字小文字の統一
+    3. ひらがな→カタカナ
+    4. 長音記号の統一、中黒・ピリオドの除去
+    5. 空白（全角スペースを含む）の除去
+    """
+    if not name:
+        return ''
+    normalized = unicodedata.normalize('NFKC', name).casefold().translate(_TRANSLATION)
+    return ''.join(normalized.split())
+
+
+class NameAliasTable:
+    """正規化キー→ナレッジ上の正式キーの対応表
+
+    ナレッジ読み込み時に全キーを正規化して登録しておき、
+    入力名は正規化1回＋辞書参照1回で解決する。
+    """
+
+    def __init__(self, names: Iterable[str] = (), prefix_match: bool = False,
+                 aliases: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            names: ナレッジ上の正式キー
+            prefix_match: 略称キー（騎手名の先頭4文字など）を入力名の先頭一致で解決するか
+            aliases: 追加の別名 {別名: 正式キー}
+        """
+        self.prefix_match = prefix_match
+        self._aliases: Dict[str, str] = {}
+        self._min_key_length = 0
+        self.hit_count = 0
+        self.alias_hit_count = 0
+        self.miss_count = 0
+        for name in names:
+            self.add(name)
+        for alias, name in (aliases or {}).items():
+            self.add_alias(alias, name)
+
+    def __len__(self) -> int:
+        return len(self._aliases)
+
+    def __contains__(self, name: str) -> bool:
+        return self.resolve(name) is not None
+
+    def add(self, name: str):
+        """正式キーを登録（正規化後に衝突した場合は先に登録した方を優先）"""
+        self.add_alias(name, name)
+
+    def add_alias(self, alias: str, name: str):
+        """別名を登録"""
+        key = normalize_name(alias)
+        if not key:
+            return
+        self._aliases.setdefault(key, name)
+        if self._min_key_length == 0 or len(key) < self._min_key_length:
+            self._min_key_length = len(key)
+
+    def resolve(self, name: str) -> Optional[str]:
+        """入力名を正式キーに解決（見つからなければNone）"""
+        key = normalize_name(name)
+        resolved = self._aliases.get(key)
+        if resolved is not None:
+            if resolved == name:
+                self.hit_count += 1
+            else:
+                self.alias_hit_count += 1
+            return resolved
+
+        if self.prefix_match:
+            # 長い先頭部分から順に試す（「キングスコート」は「キング」より「キングス」を優先）
+            for length in range(len(key) - 1, max(self._min_key_length, 1) - 1, -1):
+                resolved = self._aliases.get(key[:length])
+                if resolved is not None:
+                    self.alias_hit_count += 1
+                    return resolved
+
+        self.miss_count += 1
+        return None
+
+    def get_stats(self) -> Dict[str, float]:
+        total = self.hit_count + self.alias_hit_count + self.miss_count
+        return {
+            "keys": len(self._aliases),
+            "exact_hits": self.hit_count,
+            "alias_hits": self.alias_hit_count,
+            "misses": self.miss_count,
+            "hit_rate": ((self.hit_count + self.alias_hit_count) / total * 100) if total else 0.0
+        }
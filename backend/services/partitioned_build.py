@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+マルチプロセス分割ナレッジ構築
+馬名のハッシュでN個のパーティションに分け、各ワーカープロセスが
+自分の接続で担当分だけを抽出・計算して部分ファイルに書き出す。
+最後に部分ファイルを馬名順にマージし、毎回バイト単位で同一の成果物を作る。
+
+- パーティション番号は CRC32(馬名のUTF-8) % N（MySQLの CRC32() と同じ値）
+- 部分ファイルは1行1頭: <馬名(JSON)>\t<順位付け値>\t<データ(JSON)> を馬名順に並べる
+- 成果物にはビルド時刻を含めない（時刻・所要時間はマニフェストに記録）
+"""
+import heapq
+import json
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+def partition_of(key: str, partitions: int) -> int:
+    """馬名のパーティション番号（プロセス・実行ごとに変わらない）"""
+    return zlib.crc32(key.encode('utf-8')) % partitions
+
+
+def partition_sql(column: str, partition: int, partitions: int) -> str:
+    """partition_ofと同じ振り分けをするSQL条件（MySQL）"""
+    return f"MOD(CRC32({column}), {int(partitions)}) = {int(partition)}"
+
+
+def split_by_partition(keys: Sequence[str], partitions: int) -> List[List[str]]:
+    """キーのリストをパーティションごとに分ける（元の順序を保つ）"""
+    buckets: List[List[str]] = [[] for _ in range(partitions)]
+    for key in keys:
+        buckets[partition_of(key, partitions)].append(key)
+    return buckets
+
+
+def default_workers() -> int:
+    return max(1, os.cpu_count() or 1)
+
+
+def run_partitions(worker: Callable[..., Any], partitions: int, workers: Optional[int] = None,
+                   args: Tuple = ()) -> List[Any]:
+    """worker(partition, partitions, *args) を別プロセスで実行し、パーティション順に結果を返す
+
+    workerはモジュールトップレベルの関数にすること（プロセス間で受け渡すため）。
+    接続はworkerの中で作成する。
+    """
+    workers = min(workers or default_workers(), partitions)
+    if workers <= 1:
+        return [worker(partition, partitions, *args) for partition in range(partitions)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(worker, partition, partitions, *args) for partition in range(partitions)]
+        return [future.result() for future in futures]
+
+
+def part_path(directory: str, partition: int, partitions: int) -> str:
+    return os.path.join(directory, f"part-{partition:05d}-of-{partitions:05d}.tsv")
+
+
+def _json_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class PartitionWriter:
+    """1パーティション分の部分ファイルを書き出す（完了時にリネームして確定）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._tmp_path = path + '.tmp'
+        self._file = open(self._tmp_path, 'w', encoding='utf-8')
+        self._last_key: Optional[str] = None
+        self._sorted = True
+
+    def write(self, key: str, rank: float, record: Any):
+        if self._last_key is not None and key <= self._last_key:
+            self._sorted = False
+        self._last_key = key
+        self._file.write(
+            f"{json.dumps(key, ensure_ascii=False)}\t{rank!r}\t"
+            f"{json.dumps(record, ensure_ascii=False, default=_json_default)}\n"
+        )
+        self.count += 1
+
+    def close(self):
+        """確定（DBの照合順序とPythonの文字列順が違う場合はここで並べ直す）"""
+        self._file.close()
+        if not self._sorted:
+            with open(self._tmp_path, 'r', encoding='utf-8') as f:
+                lines = sorted(f, key=lambda line: json.loads(line.split('\t', 1)[0]))
+            with open(self._tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def _iter_part(path: str) -> Iterator[Tuple[str, float, str]]:
+    """部分ファイルを (馬名, 順位付け値, データJSON) で読む"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            key, rank, record = line.rstrip('\n').split('\t', 2)
+            yield json.loads(key), float(rank), record
+
+
+def _select_top(paths: Sequence[str], limit: int) -> set:
+    """順位付け値の大きい順（同値は馬名順）に上位limit件の馬名を選ぶ"""
+    ranked = []
+    for path in paths:
+        for key, rank, _ in _iter_part(path):
+            ranked.append((-rank, key))
+    return {key for _, key in heapq.nsmallest(limit, ranked)}
+
+
+def merge_partitions(paths: Sequence[str], output_path: str, meta: Dict[str, Any],
+                     limit: Optional[int] = None, count_field: Optional[str] = None) -> Dict[str, Any]:
+    """部分ファイルを馬名順にマージして {"meta", "horses"} のJSONを書き出す
+
+    出力は json.dump(knowledge, ensure_ascii=False, indent=2) と同じ書式で、
+    入力が同じならパーティション数に関係なく同じバイト列になる。
+    count_fieldを指定するとmetaにその名前で収録頭数を入れる。
+    """
+    selected = _select_top(paths, limit) if limit is not None else None
+    if count_field:
+        total = len(selected) if selected is not None else sum(1 for path in paths for _ in _iter_part(path))
+        meta = {**meta, count_field: total}
+
+    from services.checkpoint_log import write_knowledge_stream
+
+    def horses():
+        merged = heapq.merge(*[_iter_part(path) for path in paths], key=lambda item: item[0])
+        for key, _, record in merged:
+            if selected is None or key in selected:
+                yield key, json.loads(record)
+
+    return write_knowledge_stream(output_path, meta, horses())
+
+
+def write_manifest(output_path: str, manifest: Dict[str, Any]) -> str:
+    """成果物の横にビルド情報（時刻・所要時間・パーティション統計）を保存"""
+    manifest_path = output_path + '.build.json'
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, default=_json_default)
+    return manifest_path
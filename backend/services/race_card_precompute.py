@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+開催日の全レース事前計算（ウォームキャッシュ）
+当日のレースが登録されたとき（OCRでの保存・本日レースの読み込み）に、全レースの出走馬を
+標準D-Logicと良・稍重・重・不良の4馬場でバックグラウンド計算し、ナレッジのバージョン付きでキャッシュに保存する
+（どのレースも最初のリクエストからキャッシュヒットにする）
+
+- キャッシュキー: 種類（標準 / 4馬場）・出走馬リスト・ナレッジのバージョン
+- 同じ開催を同じ出走馬・同じバージョンで登録し直してもジョブは作らない
+- ナレッジが更新されたら、登録済みの開催を新しいバージョンで計算し直す
+- ジョブはワーカー1本で順番に実行し、進捗（レース数・キャッシュ済み・失敗）を返す
+"""
+import asyncio
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services.cache_service import cache_service
+
+CACHE_PREFIX = 'race_card'
+KIND_STANDARD = 'standard'
+KIND_ALL_WEATHER = 'all_weather'
+
+PRECOMPUTE_ENABLED = os.getenv('RACE_CARD_PRECOMPUTE', 'true').lower() in ('1', 'true', 'yes')
+# 進捗を保持するジョブ数・再計算の対象として覚えておく開催数
+JOB_HISTORY = int(os.getenv('RACE_CARD_JOB_HISTORY', 20))
+MAX_CARDS = int(os.getenv('RACE_CARD_MAX_CARDS', 8))
+# 進捗に残すエラーの件数
+MAX_JOB_ERRORS = 10
+
+
+def _copy(result: Dict[str, Any]) -> Dict[str, Any]:
+    """キャッシュ上の結果を呼び出し側が書き換えても影響しないコピー（race_analysis まで）"""
+    copied = dict(result)
+    if isinstance(copied.get('race_analysis'), dict):
+        copied['race_analysis'] = dict(copied['race_analysis'])
+    return copied
+
+
+def weather_race_result(all_weather: Dict[str, Any], baba_condition: int) -> Dict[str, Any]:
+    """4馬場の一括結果から1つの馬場状態の結果（analyze_race_horses_weather と同じ形式）を取り出す"""
+    section = all_weather['conditions'][baba_condition]
+    race_analysis = {
+        key: value for key, value in all_weather['race_analysis'].items() if key != 'baba_conditions'
+    }
+    race_analysis.update({
+        'analyzed_horses': section['analyzed_horses'],
+        'not_found_horses': section['not_found_horses'],
+        'knowledge_hits': section['knowledge_hits'],
+        'mysql_fallbacks': section['mysql_fallbacks'],
+        'baba_condition': baba_condition,
+        'weather_condition': section['weather_condition']
+    })
+    return {
+        'race_analysis': race_analysis,
+        'horses': section['horses'],
+        'timestamp': all_weather['timestamp']
+    }
+
+
+class RaceCardPrecompute:
+    """開催単位の事前計算ジョブとレース単位のキャッシュ"""
+
+    def __init__(self, engine=None, cache=None):
+        self._engine = engine
+        self.cache = cache or cache_service
+        self._lock = threading.RLock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._job_ids = itertools.count(1)
+        # job_id -> 進捗
+        self._jobs: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        # card_id -> (登録内容, 最新のjob_id)
+        self._cards: 'OrderedDict[str, Tuple[Tuple, str]]' = OrderedDict()
+        self._card_races: Dict[str, List[Dict[str, Any]]] = {}
+        self._listening = False
+
+    # --- エンジン ---
+
+    def attach_engine(self, engine):
+        """既存のエンジンを使う（未設定の場合のみ）"""
+        with self._lock:
+            if self._engine is None:
+                self._engine = engine
+        self._listen()
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    from services.fast_dlogic_engine import FastDLogicEngine
+                    self._engine = FastDLogicEngine()
+        self._listen()
+        return self._engine
+
+    def _listen(self):
+        with self._lock:
+            if self._listening or self._engine is None:
+                return
+            self._engine.raw_manager.add_listener(self._on_knowledge_changed)
+            self._listening = True
+
+    def _version(self) -> str:
+        return self.engine.raw_manager.get_knowledge_version()
+
+    # --- レース単位のキャッシュ ---
+
+    def _compute_function(self, kind: str) -> Callable[[List[str]], Dict[str, Any]]:
+        if kind == KIND_ALL_WEATHER:
+            return self.engine.analyze_race_horses_all_weather
+        return self.engine.analyze_race_horses
+
+    def _get(self, kind: str, horse_names: List[str]) -> Tuple[Dict[str, Any], bool]:
+        """(結果, キャッシュヒットか)。なければ計算して保存"""
+        version = self._version()
+        key = {'kind': kind, 'horses': list(horse_names), 'version': version}
+        result = self.cache.get(CACHE_PREFIX, key)
+        if result is not None:
+            return result, True
+        result = self._compute_function(kind)(list(horse_names))
+        # 計算中にナレッジが変わった結果は保存しない
+        if self._version() == version:
+            self.cache.set(CACHE_PREFIX, key, result)
+        return result, False
+
+    def get_race_analysis(self, horse_names: List[str]) -> Dict[str, Any]:
+        """出走馬一括の標準D-Logic（analyze_race_horses と同じ形式）"""
+        return _copy(self._get(KIND_STANDARD, horse_names)[0])
+
+    def get_all_weather(self, horse_names: List[str]) -> Dict[str, Any]:
+        """出走馬一括の4馬場の天候適性（analyze_race_horses_all_weather と同じ形式）"""
+        return _copy(self._get(KIND_ALL_WEATHER, horse_names)[0])
+
+    def get_weather(self, horse_names: List[str], baba_condition: int) -> Dict[str, Any]:
+        """出走馬一括の天候適性（analyze_race_horses_weather と同じ形式、4馬場のキャッシュから）"""
+        return weather_race_result(self._get(KIND_ALL_WEATHER, horse_names)[0], baba_condition)
+
+    async def get_race_analysis_async(self, horse_names: List[str]) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.get_race_analysis, horse_names)
+
+    async def get_all_weather_async(self, horse_names: List[str]) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.get_all_weather, horse_names)
+
+    async def get_weather_async(self, horse_names: List[str], baba_condition: int) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.get_weather, horse_names, baba_condition)
+
+    # --- 開催単位の事前計算 ---
+
+    def register_card(self, card_id: str, races: List[Dict[str, Any]],
+                      source: str = 'manual') -> Optional[Dict[str, Any]]:
+        """開催の全レースを登録して事前計算ジョブを開始
+
+        Args:
+            card_id: 開催の識別子（例: "ocr_2025-08-02"）
+            races: [{"race_id": レースID, "horses": [馬名, ...]}]
+            source: 登録元（進捗表示用）
+
+        Returns:
+            ジョブの進捗（同じ内容のジョブがあればそのジョブ）。無効・対象レースなしならNone
+        """
+        if not PRECOMPUTE_ENABLED:
+            return None
+        races = [
+            {'race_id': race['race_id'], 'horses': [name for name in race.get('horses', []) if name]}
+            for race in races
+        ]
+        races = [race for race in races if race['horses']]
+        if not races:
+            return None
+
+        signature = (self._version(), tuple((race['race_id'], tuple(race['horses'])) for race in races))
+        with self._lock:
+            self._card_races[card_id] = races
+            registered = self._cards.get(card_id)
+            if registered is not None and registered[0] == signature and registered[1] in self._jobs:
+                self._cards.move_to_end(card_id)
+                return dict(self._jobs[registered[1]])
+
+            job_id = f"job-{next(self._job_ids)}"
+            job = {
+                'job_id': job_id,
+                'card_id': card_id,
+                'source': source,
+                'state': 'queued',
+                'knowledge_version': signature[0],
+                'total_races': len(races),
+                'total_horses': sum(len(race['horses']) for race in races),
+                'completed_races': 0,
+                'cached_races': 0,
+                'failed_races': 0,
+                'progress': 0.0,
+                'current_race': None,
+                'errors': [],
+                'queued_at': datetime.now().isoformat(),
+                'started_at': None,
+                'finished_at': None,
+                'elapsed_seconds': None
+            }
+            self._jobs[job_id] = job
+            while len(self._jobs) > JOB_HISTORY:
+                self._jobs.popitem(last=False)
+            self._cards[card_id] = (signature, job_id)
+            self._cards.move_to_end(card_id)
+            while len(self._cards) > MAX_CARDS:
+                old_card, _ = self._cards.popitem(last=False)
+                self._card_races.pop(old_card, None)
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='race-card')
+            self._executor.submit(self._run, job, races)
+        print(f"🗓️ 開催の事前計算を登録: {card_id} ({len(races)}レース / {job['total_horses']}頭)")
+        return dict(job)
+
+    def _run(self, job: Dict[str, Any], races: List[Dict[str, Any]]):
+        start = time.time()
+        job.update(state='running', started_at=datetime.now().isoformat())
+        for race in races:
+            job['current_race'] = race['race_id']
+            try:
+                hits = [self._get(kind, race['horses'])[1] for kind in (KIND_STANDARD, KIND_ALL_WEATHER)]
+                if all(hits):
+                    job['cached_races'] += 1
+            except Exception as e:
+                job['failed_races'] += 1
+                if len(job['errors']) < MAX_JOB_ERRORS:
+                    job['errors'].append({'race_id': race['race_id'], 'error': str(e)})
+            job['completed_races'] += 1
+            job['progress'] = round(job['completed_races'] / job['total_races'] * 100, 1)
+        job.update(
+            state='completed' if not job['failed_races'] else 'completed_with_errors',
+            current_race=None,
+            finished_at=datetime.now().isoformat(),
+            elapsed_seconds=time.time() - start
+        )
+        print(f"✅ 開催の事前計算完了: {job['card_id']} ({job['total_races']}レース, "
+              f"キャッシュ済み{job['cached_races']} / 失敗{job['failed_races']}, {job['elapsed_seconds']:.1f}秒)")
+
+    def _on_knowledge_changed(self, reason: str):
+        """ナレッジ更新後は登録済みの開催を新しいバージョンで計算し直す"""
+        with self._lock:
+            cards = list(self._card_races.items())
+        for card_id, races in cards:
+            self.register_card(card_id, races, source=f'knowledge_{reason}')
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """キュー内のジョブがすべて終わるまで待つ（テスト・バッチ用）"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._lock:
+                pending = [job for job in self._jobs.values() if job['state'] in ('queued', 'running')]
+            if not pending:
+                return True
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    # --- 進捗 ---
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def get_progress(self) -> Dict[str, Any]:
+        with self._lock:
+            cards = {
+                card_id: dict(self._jobs[job_id]) if job_id in self._jobs else None
+                for card_id, (_, job_id) in self._cards.items()
+            }
+            jobs = [dict(job) for job in reversed(self._jobs.values())]
+        return {
+            'enabled': PRECOMPUTE_ENABLED,
+            'knowledge_version': self._version() if self._engine is not None else None,
+            'cards': cards,
+            'jobs': jobs
+        }
+
+
+_race_card_precompute: Optional[RaceCardPrecompute] = None
+_instance_lock = threading.Lock()
+
+
+def get_race_card_precompute(engine=None) -> RaceCardPrecompute:
+    """グローバルの事前計算サービス（engineを渡すと未設定時にそのエンジンを使う）"""
+    global _race_card_precompute
+    if _race_card_precompute is None:
+        with _instance_lock:
+            if _race_card_precompute is None:
+                _race_card_precompute = RaceCardPrecompute()
+    if engine is not None:
+        _race_card_precompute.attach_engine(engine)
+    return _race_card_precompute
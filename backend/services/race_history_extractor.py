@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+レース履歴の一括抽出（馬ごとクエリの置き換え）
+対象期間の出走データを「馬名順・新しい順」に並べた1本のクエリで流し読みし、
+馬名が切り替わるたびに1頭分（最新N走・最低走数を満たす馬のみ）を返す
+
+- MySQLではサーバー側カーソル（buffered=False）で読むため全件をメモリに載せない
+- (BAMEI, KAISAI_NEN, KAISAI_GAPPI) の索引があればソートも不要になる
+- 対象馬が決まっている場合は馬名をまとめた IN (...) クエリで取得する
+- 途中で切断された場合は最後に返した馬名の次から再開できる（start_after）
+"""
+import os
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# fetchmanyで1回に受け取る行数
+FETCH_SIZE = int(os.getenv('RACE_EXTRACT_FETCH_SIZE', 2000))
+# 対象馬指定時に1クエリへまとめる馬数
+NAME_CHUNK_SIZE = int(os.getenv('RACE_EXTRACT_NAME_CHUNK', 500))
+# 流し読み中に呼び出し側の処理（中間保存など）で止まってもサーバーが切断しない猶予（秒）
+NET_WRITE_TIMEOUT = int(os.getenv('RACE_EXTRACT_NET_WRITE_TIMEOUT', 3600))
+
+
+class RaceHistoryQuery:
+    """抽出条件（SELECT列・FROM・WHERE・馬ごとの並び順・走数条件）"""
+
+    def __init__(self, columns: str, from_clause: str, conditions: Iterable[str] = (),
+                 params: Tuple = (), order_by: str = "u.KAISAI_NEN DESC, u.KAISAI_GAPPI DESC",
+                 key_column: str = "u.BAMEI", max_races: Optional[int] = 5,
+                 min_races: int = 3, placeholder: str = "%s"):
+        self.columns = columns
+        self.from_clause = from_clause
+        self.conditions = list(conditions)
+        self.params = tuple(params)
+        self.order_by = order_by
+        self.key_column = key_column
+        self.max_races = max_races
+        self.min_races = min_races
+        self.placeholder = placeholder
+
+    def build_sql(self, name_count: int = 0, start_after: bool = False) -> str:
+        """SQLを組み立てる（先頭列は常に馬名）"""
+        conditions = list(self.conditions)
+        if name_count:
+            conditions.append(f"{self.key_column} IN ({', '.join([self.placeholder] * name_count)})")
+        if start_after:
+            conditions.append(f"{self.key_column} > {self.placeholder}")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return (
+            f"SELECT {self.key_column}, {self.columns} "
+            f"FROM {self.from_clause} {where} "
+            f"ORDER BY {self.key_column}, {self.order_by}"
+        )
+
+
+class RaceHistoryExtractor:
+    """1本の順序付きクエリから馬ごとのレース履歴を逐次生成する"""
+
+    def __init__(self, query: RaceHistoryQuery, fetch_size: int = FETCH_SIZE,
+                 name_chunk_size: int = NAME_CHUNK_SIZE):
+        self.query = query
+        self.fetch_size = fetch_size
+        self.name_chunk_size = name_chunk_size
+        self.query_count = 0
+        self.rows_scanned = 0
+        self.horses_emitted = 0
+        self.horses_skipped = 0
+        self.elapsed = 0.0
+
+    def stream(self, conn, horse_names: Optional[Iterable[str]] = None,
+               start_after: Optional[str] = None) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """(馬名, 新しい順のレース行リスト) を馬名順に返す
+
+        流し読み中は同じ接続で別のクエリを実行しないこと。
+        """
+        if horse_names is None:
+            params = self.query.params + ((start_after,) if start_after is not None else ())
+            sql = self.query.build_sql(start_after=start_after is not None)
+            yield from self._stream_query(conn, sql, params)
+            return
+
+        names = sorted({name for name in horse_names if name})
+        if start_after is not None:
+            names = [name for name in names if name > start_after]
+        for i in range(0, len(names), self.name_chunk_size):
+            chunk = names[i:i + self.name_chunk_size]
+            sql = self.query.build_sql(name_count=len(chunk))
+            yield from self._stream_query(conn, sql, self.query.params + tuple(chunk))
+
+    def extract_one(self, conn, horse_name: str) -> Optional[List[Dict[str, Any]]]:
+        """1頭分だけ取得（条件を満たさなければNone）"""
+        for _, races in self.stream(conn, [horse_name]):
+            return races
+        return None
+
+    def _stream_query(self, conn, sql: str, params: Tuple) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        start = time.time()
+        _prepare_session(conn)
+        cursor = _open_cursor(conn)
+        try:
+            cursor.execute(sql, params)
+            self.query_count += 1
+            columns = [description[0] for description in cursor.description][1:]
+            max_races = self.query.max_races
+
+            current = None
+            races: List[Dict[str, Any]] = []
+            count = 0
+            while True:
+                rows = cursor.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+                self.rows_scanned += len(rows)
+                for row in rows:
+                    key = row[0]
+                    if key != current:
+                        if current is not None:
+                            self.elapsed += time.time() - start
+                            result = self._finish(current, races, count)
+                            if result is not None:
+                                yield result
+                            start = time.time()
+                        current = key
+                        races = []
+                        count = 0
+                    count += 1
+                    if max_races is None or len(races) < max_races:
+                        races.append(dict(zip(columns, row[1:])))
+
+            if current is not None:
+                self.elapsed += time.time() - start
+                result = self._finish(current, races, count)
+                if result is not None:
+                    yield result
+                start = time.time()
+        finally:
+            self.elapsed += time.time() - start
+            _close_cursor(conn, cursor)
+
+    def _finish(self, horse_name: Any, races: List[Dict[str, Any]],
+                count: int) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+        """1頭分の集約を終える（馬名なし・走数不足は除外）"""
+        if not horse_name or count < self.query.min_races:
+            self.horses_skipped += 1
+            return None
+        self.horses_emitted += 1
+        return horse_name, races
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "query_count": self.query_count,
+            "rows_scanned": self.rows_scanned,
+            "horses_emitted": self.horses_emitted,
+            "horses_skipped": self.horses_skipped,
+            "elapsed_seconds": self.elapsed,
+            "horses_per_second": self.horses_emitted / self.elapsed if self.elapsed > 0 else 0.0
+        }
+
+
+def _prepare_session(conn):
+    """MySQLの場合のみ、長時間の流し読みで切断されないようセッション設定を行う"""
+    if not hasattr(conn, 'cmd_query'):
+        return
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SET SESSION net_write_timeout = {NET_WRITE_TIMEOUT}")
+    finally:
+        cursor.close()
+
+
+def _open_cursor(conn):
+    """サーバー側カーソルを開く（buffered指定のないDB-APIは通常のカーソル）"""
+    try:
+        return conn.cursor(buffered=False)
+    except TypeError:
+        return conn.cursor()
+
+
+def _close_cursor(conn, cursor):
+    """途中で打ち切った場合も未読の結果を破棄して接続を再利用可能にする"""
+    try:
+        cursor.close()
+    except Exception:
+        consume = getattr(conn, 'consume_results', None)
+        if consume:
+            consume()
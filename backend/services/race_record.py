@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+D-Logic計算用のコンパクトなレース記録
+1走ごとの辞書（約25個の文字列キーと文字列値）を、計算に使う値だけを解析済みで持つ
+__slots__ オブジェクトに変換する（1頭につき1回だけ解析し、12項目・天候層はこれを読む）
+
+- 着順・人気・負担重量・馬体重・コーナー・タイム（1/10秒）・オッズ（1/10倍）は数値で保持
+- 騎手名・調教師名・距離などの繰り返し出現する値は共有オブジェクトにする
+- 値が空のときは None、空でないのに数値にならないときは INVALID
+  （スカラー計算で「空なら無視」「解析できなければ例外」を区別している箇所があるため）
+- MySQL形式（大文字キー）・race_history形式（小文字キー）の両方に対応
+"""
+import re
+from typing import Any, Dict, Optional, Tuple
+
+
+class _Invalid:
+    """空でないが数値として解析できない値（使う箇所で従来の int() と同じ例外になる）"""
+    __slots__ = ('error',)
+
+    def __init__(self, error: type):
+        self.error = error
+
+    def __repr__(self) -> str:
+        return 'INVALID' if self.error is ValueError else 'INVALID_TYPE'
+
+
+INVALID = _Invalid(ValueError)
+# int() に渡せない型の値（None など。従来は TypeError）
+INVALID_TYPE = _Invalid(TypeError)
+
+_TURF_CODES = ["10", "11", "12", "13", "14", "15", "16", "17", "18", "19"]
+_DIRT_CODES = ["20", "21", "22", "23", "24", "25", "26", "27", "28", "29"]
+
+# 繰り返し出現する値（騎手名・距離・数値など）の共有テーブル
+_SHARED: Dict[Tuple[type, Any], Any] = {}
+
+
+def _share(value: Any) -> Any:
+    try:
+        return _SHARED.setdefault((type(value), value), value)
+    except TypeError:
+        return value
+
+
+def _get(race: Dict[str, Any], keys: Tuple[str, ...], default: Any = None) -> Any:
+    """race.get(k1, race.get(k2, ... default)) と同じ値"""
+    for key in keys:
+        if key in race:
+            return race[key]
+    return default
+
+
+def _to_int(value: Any) -> Any:
+    """空ならNone、int()できなければINVALID"""
+    if not value:
+        return None
+    try:
+        return _share(int(value))
+    except Exception:
+        return INVALID
+
+
+def _optional_int(value: Any) -> Optional[int]:
+    """空・解析不能はどちらもNone（区別が不要な項目用）"""
+    parsed = _to_int(value)
+    return None if parsed is INVALID else parsed
+
+
+def parse_margin(margin: str) -> float:
+    """着差文字列を数値に変換"""
+    # 「1 1/2」「2」「ハナ」「クビ」などを数値化
+    if "ハナ" in margin:
+        return 0.1
+    elif "クビ" in margin:
+        return 0.2
+    elif "アタマ" in margin:
+        return 0.3
+    else:
+        # 数値部分を抽出
+        nums = re.findall(r'\d+', margin)
+        if nums:
+            return float(nums[0])
+    return 0.0
+
+
+class RaceRecord:
+    """1走分の解析済みデータ"""
+
+    __slots__ = (
+        'finish', 'win', 'distance_key', 'distance_finish', 'distance', 'jockey', 'trainer', 'track', 'weather_key',
+        'popularity', 'futan', 'bataiju', 'zogen', 'first_corner', 'margin', 'time', 'odds',
+        # 天候層（第1・2層）はMySQL形式のキーだけを参照するので別に保持
+        'w_finish', 'w_bataiju', 'w_baba', 'w_jockey', 'w_corner1'
+    )
+
+    def __init__(self, race: Dict[str, Any]):
+        finish_raw = _get(race, ("KAKUTEI_CHAKUJUN", "finish"))
+        self.finish = _to_int(finish_raw)
+        finish = self.finish if isinstance(self.finish, int) else None
+        win_raw = _get(race, ("KAKUTEI_CHAKUJUN", "finish"), "99")
+        self.win = str(win_raw).strip() == "01" or _get(race, ("KAKUTEI_CHAKUJUN", "finish"), 99) == 1
+
+        # 距離適性は元の値（"1600"など）ごとに集計する。着順も距離と同じく空なら別名の値を使う
+        distance_raw = race.get("KYORI") or race.get("distance")
+        self.distance_key = _share(distance_raw) if distance_raw else None
+        self.distance_finish = _to_int(race.get("KAKUTEI_CHAKUJUN") or race.get("finish"))
+        self.distance = _optional_int(_get(race, ("KYORI", "distance"), 0))
+
+        jockey = _get(race, ("KISHUMEI_RYAKUSHO", "KISYURYAKUSYO", "jockey"), "")
+        self.jockey = _share(jockey) if jockey else None
+        trainer = _get(race, ("CHOKYOSHIMEI_RYAKUSHO", "CHOUKYOUSIRYAKUSYO", "trainer"), "")
+        self.trainer = _share(trainer) if trainer else None
+
+        track_code = _get(race, ("TRACK_CODE", "TRACKCD", "track"), "")
+        if not track_code:
+            self.track = None
+        elif track_code in _TURF_CODES:
+            self.track = "芝"
+        elif track_code in _DIRT_CODES:
+            self.track = "ダート"
+        else:
+            self.track = _share(track_code)
+
+        self.weather_key = self._weather_key(race, finish_raw)
+
+        self.popularity = _optional_int(_get(race, ("TANSHO_NINKIJUN", "NINKIJUN", "popularity"), 0))
+        self.futan = _optional_int(_get(race, ("FUTAN_JURYO", "FUTAN", "weight"), 0))
+        self.bataiju = _optional_int(_get(race, ("BATAIJU", "BATAI", "horse_weight"), 0))
+        zogen_raw = _get(race, ("ZOGEN_SA", "ZOUGEN", "weight_change"), 0)
+        self.zogen = _to_int(zogen_raw) if zogen_raw else 0
+
+        # 最初に通過順位が付いたコーナー（解析できない値があれば INVALID）
+        self.first_corner = None
+        try:
+            for key in ("CORNER1", "CORNER2", "CORNER3", "CORNER4"):
+                corner = _get(race, (f"{key}_JUNI", f"{key}JUN", key.lower()), 0)
+                if corner and int(corner) > 0 and self.first_corner is None:
+                    self.first_corner = _share(int(corner))
+        except Exception:
+            self.first_corner = INVALID
+
+        self.margin = 0.0
+        margin_raw = _get(race, ("CHAKUSA", "margin"), "")
+        if finish == 1 and margin_raw:
+            try:
+                self.margin = parse_margin(margin_raw)
+            except Exception:
+                pass
+
+        time_raw = _get(race, ("SOHA_TIME", "TIME", "time"), 0)
+        self.time = self._tenths(time_raw)
+        self.odds = self._tenths(_get(race, ("TANSHO_ODDS", "odds"), 0))
+
+        self.w_finish = self.finish if "KAKUTEI_CHAKUJUN" in race else None
+        self.w_bataiju = _to_int(race.get("BATAIJU", 0))
+        self.w_jockey = _share(race["KISHUMEI_RYAKUSHO"]) if race.get("KISHUMEI_RYAKUSHO", "") else None
+        self.w_corner1 = _to_int(race.get("CORNER1_JUNI", 0))
+        baba_key = "SHIBA_BABAJOTAI_CODE" if str(race.get("TRACK_CODE", "")).startswith("1") else "DIRT_BABAJOTAI_CODE"
+        if baba_key not in race:
+            self.w_baba = None
+        else:
+            try:
+                self.w_baba = _share(int(race[baba_key]))
+            except TypeError:
+                self.w_baba = INVALID_TYPE
+            except Exception:
+                self.w_baba = INVALID
+
+    @staticmethod
+    def _weather_key(race: Dict[str, Any], finish_raw: Any) -> Optional[str]:
+        """天候と馬場状態の組み合わせ（晴天・良 など）。着順が解析できなければNone"""
+        tenko = _get(race, ("TENKO_CODE", "weather"), 0)
+        if not tenko or not finish_raw:
+            return None
+        track_code = race.get("TRACK_CODE", "")
+        if str(track_code).startswith("1"):  # 芝
+            baba_jotai = race.get("SHIBA_BABAJOTAI_CODE", 0)
+        elif str(track_code).startswith("2"):  # ダート
+            baba_jotai = race.get("DIRT_BABAJOTAI_CODE", 0)
+        else:
+            baba_jotai = 0
+        try:
+            tenko_int = int(tenko)
+            int(finish_raw)
+            baba_int = int(baba_jotai) if baba_jotai else 0
+        except Exception:
+            return None
+
+        # 天候コード: 1=晴, 2=曇, 3=雨, 4=小雨, 5=雪, 6=小雪 / 馬場状態: 1=良, 2=稍重, 3=重, 4=不良
+        if tenko_int <= 2:
+            weather_key = "晴天"
+        elif tenko_int <= 4:
+            weather_key = "雨天"
+        else:
+            weather_key = "雪"
+        if baba_int == 1:
+            return _share(f"{weather_key}・良")
+        elif baba_int >= 2:
+            return _share(f"{weather_key}・重馬場")
+        return weather_key
+
+    @staticmethod
+    def _tenths(value: Any) -> Optional[float]:
+        """1/10単位の数値（タイム・オッズ）。整数値はintで持つ"""
+        if not value:
+            return None
+        try:
+            parsed = float(value)
+        except Exception:
+            return None
+        return _share(int(parsed)) if parsed.is_integer() else parsed
+
+
+class HorseRecords:
+    """1頭分のレース記録（集計済みstatsは元の辞書を参照する）"""
+
+    __slots__ = ('races', 'stats')
+
+    def __init__(self, races: Tuple[RaceRecord, ...], stats: Any):
+        self.races = races
+        self.stats = stats
+
+    def __len__(self) -> int:
+        return len(self.races)
+
+    def __bool__(self) -> bool:
+        # 生データ辞書と同じく「データあり」として扱う（過去走0件でも真）
+        return True
+
+
+def build_horse_records(raw_data: Dict[str, Any]) -> HorseRecords:
+    """生データ（races / race_history）をコンパクトな記録に変換"""
+    races = raw_data.get("races", raw_data.get("race_history", [])) or ()
+    return HorseRecords(tuple(RaceRecord(race) for race in races), raw_data.get("aggregated_stats", {}))
+
+
+def as_horse_records(raw_data: Any) -> HorseRecords:
+    """変換済みならそのまま、生データ辞書なら変換して返す"""
+    if isinstance(raw_data, HorseRecords):
+        return raw_data
+    return build_horse_records(raw_data)
+
+
+def checked(value: Any) -> Any:
+    """解析できなかった値を使う箇所で例外にする（従来の int() と同じ扱い）"""
+    if isinstance(value, _Invalid):
+        raise value.error("数値として解析できない値")
+    return value
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+JSONシリアライズの共通モジュール
+APIレスポンスとナレッジファイルの読み書きで同じエンコード規則を使う
+
+- orjson があれば orjson、なければ標準の json（ujson は使わない: エスケープ規則が異なるため）
+- 日本語はエスケープしない（ensure_ascii=False 相当・UTF-8）
+- Decimal（MySQLの集計値）は float、numpyの数値・配列は Python の値、日時は ISO 形式、set はリスト、
+  pydantic モデルは辞書
+- 辞書の数値キーは文字列にする（標準の json と同じ）
+- orjson で扱えない値（64bitを超える整数・NaNを含むJSONなど）は標準の json で処理する
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, IO, Union
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 読み込み失敗時の例外（orjson の例外もこのサブクラス）
+JSONDecodeError = json.JSONDecodeError
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def json_default(obj: Any) -> Any:
+    """標準のJSONにない型の変換（default= に渡す）"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, 'model_dump'):
+        return obj.model_dump()
+    raise TypeError(f"Type is not serializable: {type(obj).__name__}")
+
+
+def dumps_bytes(obj: Any, indent: bool = False, sort_keys: bool = False) -> bytes:
+    """UTF-8のJSONバイト列（indent=True で2スペースのインデント）"""
+    if orjson is not None:
+        option = _ORJSON_OPTIONS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=json_default, option=option)
+        except orjson.JSONEncodeError:
+            pass
+    return _stdlib_dumps(obj, indent, sort_keys).encode('utf-8')
+
+
+def dumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> str:
+    """JSON文字列（json.dumps(obj, ensure_ascii=False) 相当）"""
+    return dumps_bytes(obj, indent=indent, sort_keys=sort_keys).decode('utf-8')
+
+
+def _stdlib_dumps(obj: Any, indent: bool, sort_keys: bool) -> str:
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2, sort_keys=sort_keys, default=json_default)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys, default=json_default)
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """JSONの読み込み（bytes・memoryview はデコードせずにそのまま渡せる）"""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    if isinstance(data, memoryview):
+        data = bytes(data)
+    return json.loads(data)
+
+
+def load(f: IO) -> Any:
+    """ファイルから読み込み（テキスト・バイナリどちらのモードでもよい）"""
+    return loads(f.read())
+
+
+def dump(obj: Any, f: IO, indent: bool = False, sort_keys: bool = False):
+    """テキストモード（UTF-8）のファイルに書き込み"""
+    f.write(dumps(obj, indent=indent, sort_keys=sort_keys))
+
+
+def load_file(path: str) -> Any:
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+class FastJSONResponse(JSONResponse):
+    """共通のエンコード規則で直接シリアライズするレスポンス
+
+    エンドポイントが FastJSONResponse(result) を返すと response_model の検証と
+    jsonable_encoder を通らない（大きな入れ子の辞書を返すエンドポイント用）。
+    アプリの default_response_class にも使う
+    """
+    media_type = 'application/json'
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
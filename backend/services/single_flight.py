@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+シングルフライト（同一リクエストの合流）
+キャッシュミスした同じ分析が同時に来た場合、最初の1件だけ計算し、
+残りはその結果を待って受け取る（キーはCacheServiceと同じ規則）
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+from services.cache_service import cache_service
+
+
+class _FlightCounters:
+    __slots__ = ('calls', 'executions', 'coalesced', 'errors')
+
+    def __init__(self):
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+
+
+class SingleFlight:
+    """実行中の同一キーの処理に後続の呼び出しを合流させる"""
+
+    def __init__(self, cache=None):
+        self.cache = cache or cache_service
+        self._in_flight: Dict[Tuple[str, Any], asyncio.Task] = {}
+        self._counters: Dict[str, _FlightCounters] = {}
+
+    def _counter(self, prefix: str) -> _FlightCounters:
+        counter = self._counters.get(prefix)
+        if counter is None:
+            counter = self._counters[prefix] = _FlightCounters()
+        return counter
+
+    async def run(self, prefix: str, data: Any, func: Callable[[], Awaitable[Any]]) -> Any:
+        """同じ(prefix, data)の処理が実行中ならその結果を待ち、なければfuncを実行"""
+        key = (prefix, self.cache._generate_key(prefix, data))
+        counter = self._counter(prefix)
+        counter.calls += 1
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            counter.coalesced += 1
+        else:
+            counter.executions += 1
+            task = asyncio.ensure_future(self._execute(key, counter, func))
+            # 誰も結果を受け取らなかった場合の「未取得の例外」警告を抑止
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._in_flight[key] = task
+
+        # 呼び出し元のキャンセル（切断）で共有中の処理を止めない
+        return await asyncio.shield(task)
+
+    async def _execute(self, key: Tuple[str, Any], counter: _FlightCounters,
+                       func: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            return await func()
+        except Exception:
+            counter.errors += 1
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """プレフィックス別の合流統計"""
+        prefixes = {}
+        for prefix, counter in self._counters.items():
+            prefixes[prefix] = {
+                'calls': counter.calls,
+                'executions': counter.executions,
+                'coalesced': counter.coalesced,
+                'errors': counter.errors,
+                'coalesce_rate': (counter.coalesced / counter.calls * 100) if counter.calls else 0.0
+            }
+        return {
+            'in_flight': len(self._in_flight),
+            'coalesced_total': sum(counter.coalesced for counter in self._counters.values()),
+            'prefixes': prefixes
+        }
+
+
+# グローバルインスタンス
+single_flight = SingleFlight()
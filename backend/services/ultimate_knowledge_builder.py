@@ -8,10 +8,26 @@ import mysql.connector
 import os
 from typing import Dict, List, Tuple, Any
 from datetime import datetime
-import json
-from decimal import Decimal
-from concurrent.futures import ThreadPoolExecutor
 from advanced_d_logic_analyzer import AdvancedDLogicAnalyzer
+from partitioned_build import default_workers, partition_of, run_partitions
+from serialization import dump as json_dump
+
+
+def _analyze_partition(partition: int, partitions: int, horse_names: List[str]) -> Dict[str, Any]:
+    """担当パーティションの馬を分析（ワーカープロセスで実行・接続もプロセスごと）"""
+    analyzer = AdvancedDLogicAnalyzer()
+    results = {}
+    for horse_name in horse_names:
+        if partition_of(horse_name, partitions) != partition:
+            continue
+        try:
+            result = analyzer.analyze_horse_complete_profile(horse_name)
+            if "error" not in result:
+                results[horse_name] = result
+        except Exception as e:
+            print(f"⚠️  {horse_name} 分析エラー: {e}")
+    print(f"  進捗: パーティション{partition + 1}/{partitions} 完了 ({len(results)}頭)")
+    return results
 
 class UltimateKnowledgeBuilder:
     """競馬界最高精度AI・大量ナレッジベース構築システム"""
@@ -102,36 +118,21 @@ class UltimateKnowledgeBuilder:
             conn.close()
     
     def _analyze_horses_parallel(self, horses: List[Tuple]) -> Dict[str, Any]:
-        """並列処理による馬分析"""
-        results = {}
+        """並列処理による馬分析（馬名ハッシュで分割したマルチプロセス）"""
+        # 馬名のみ抽出
+        horse_names = [horse[0] for horse in horses]
+        if not horse_names:
+            return {}
         
-        # 最大8並列で処理
-        with ThreadPoolExecutor(max_workers=8) as executor:
-            # 馬名のみ抽出
-            horse_names = [horse[0] for horse in horses]
-            
-            # 並列実行
-            future_to_horse = {
-                executor.submit(self.analyzer.analyze_horse_complete_profile, horse_name): horse_name 
-                for horse_name in horse_names
-            }
-            
-            completed = 0
-            for future in future_to_horse:
-                horse_name = future_to_horse[future]
-                try:
-                    result = future.result(timeout=30)  # 30秒タイムアウト
-                    if "error" not in result:
-                        results[horse_name] = result
-                    completed += 1
-                    
-                    if completed % 10 == 0:
-                        print(f"  進捗: {completed}/{len(horses)} 完了")
-                        
-                except Exception as e:
-                    print(f"⚠️  {horse_name} 分析エラー: {e}")
+        workers = int(os.getenv('ULTIMATE_BUILD_WORKERS', 0)) or default_workers()
+        partitions = min(workers, len(horse_names))
+        partition_results = run_partitions(_analyze_partition, partitions, workers, args=(horse_names,))
         
-        return results
+        # 入力順（最強馬ランキング順）で統合するため、実行順に関係なく同じ結果になる
+        merged = {}
+        for partial in partition_results:
+            merged.update(partial)
+        return {horse_name: merged[horse_name] for horse_name in horse_names if horse_name in merged}
     
     def _extract_winning_patterns(self, analyses: Dict[str, Any]) -> Dict[str, Any]:
         """勝利パターン抽出"""
@@ -234,14 +235,8 @@ class UltimateKnowledgeBuilder:
         os.makedirs(reports_dir, exist_ok=True)
         filepath = os.path.join(reports_dir, filename)
         
-        # Decimal型対応エンコーダー
-        def decimal_encoder(obj):
-            if isinstance(obj, Decimal):
-                return float(obj)
-            raise TypeError
-        
         with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(self.knowledge_base, f, indent=2, ensure_ascii=False, default=decimal_encoder)
+            json_dump(self.knowledge_base, f, indent=True)
         
         return filepath
     
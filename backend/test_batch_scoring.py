@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""一括ベクトル計算とスカラー計算の一致・速度テスト"""
+
+import time
+from services.dlogic_raw_data_manager import dlogic_manager
+from services.dlogic_batch_scorer import DLogicBatchScorer
+from services.race_record import build_horse_records
+from test_race_records import make_odd_horses
+
+SAMPLE_SIZE = 2000
+
+
+def test_batch_matches_scalar():
+    """一括計算がスカラー版と完全一致することを確認"""
+    horses = dlogic_manager.knowledge_data.get('horses', {})
+    names = []
+    for name in horses:
+        names.append(name)
+        if len(names) >= SAMPLE_SIZE:
+            break
+    raw_datas = [horses[name] for name in names]
+
+    scorer = DLogicBatchScorer(dlogic_manager)
+
+    start_time = time.time()
+    batch_results = scorer.score_raw_data(raw_datas)
+    batch_elapsed = time.time() - start_time
+
+    start_time = time.time()
+    mismatches = 0
+    for name, raw_data, batch in zip(names, raw_datas, batch_results):
+        scalar = scorer._score_scalar(raw_data)
+        if batch != scalar:
+            mismatches += 1
+            print(f"❌ 不一致: {name}")
+    scalar_elapsed = time.time() - start_time
+
+    print(f"対象: {len(names)}頭")
+    print(f"一括計算: {batch_elapsed:.3f}秒 / スカラー計算: {scalar_elapsed:.3f}秒")
+    print(f"不一致: {mismatches}頭")
+    assert mismatches == 0
+
+
+def test_batch_matches_scalar_on_odd_values():
+    """空値・解析できない値・race_history形式・集計済みstatsを含むデータでも一致し、記録を渡しても同じ"""
+    raw_datas = make_odd_horses(3000, 11)
+    scorer = DLogicBatchScorer(dlogic_manager)
+    batch_results = scorer.score_raw_data(raw_datas)
+    assert scorer.score_raw_data([build_horse_records(raw_data) for raw_data in raw_datas]) == batch_results
+
+    mismatches = sum(1 for raw_data, batch in zip(raw_datas, batch_results)
+                     if batch != scorer._score_scalar(raw_data))
+    print(f"不一致（異常値データ{len(raw_datas)}頭）: {mismatches}頭")
+    assert mismatches == 0
+
+
+if __name__ == "__main__":
+    test_batch_matches_scalar()
+    test_batch_matches_scalar_on_odd_values()
+    print("✅ 全テスト成功")
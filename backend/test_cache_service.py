@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""CacheServiceのLRU・TTL・容量上限テスト"""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from services import cache_backends
+from services.cache_service import CacheService, _estimate_size
+from services.cache_backends import SQLiteCacheBackend, RedisCacheBackend, create_cache_backend
+
+
+class FakeRedis:
+    """テスト用のRedis互換クライアント（使用するコマンドのみ）"""
+
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+        self.zsets = {}
+        self.hashes = {}
+
+    def _alive(self, key):
+        if key in self.expires and time.time() >= self.expires[key]:
+            self.values.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.values
+
+    def get(self, key):
+        return self.values[key] if self._alive(key) else None
+
+    def set(self, key, value, px=None):
+        self.values[key] = value
+        if px is not None:
+            self.expires[key] = time.time() + px / 1000
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+            self.zsets.pop(key, None)
+            self.hashes.pop(key, None)
+
+    def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key, member):
+        self.zsets.get(key, {}).pop(member, None)
+
+    def zscore(self, key, member):
+        return self.zsets.get(key, {}).get(member)
+
+    def zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    def zrange(self, key, start, end):
+        members = sorted(self.zsets.get(key, {}).items(), key=lambda item: item[1])
+        members = [member.encode('utf-8') for member, _ in members]
+        return members[start:] if end == -1 else members[start:end + 1]
+
+    def hget(self, key, field):
+        value = self.hashes.get(key, {}).get(field)
+        return None if value is None else str(value).encode('utf-8')
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+
+    def hdel(self, key, field):
+        self.hashes.get(key, {}).pop(field, None)
+
+    def hincrby(self, key, field, amount):
+        table = self.hashes.setdefault(key, {})
+        table[field] = int(table.get(field, 0)) + amount
+        return table[field]
+
+    def hgetall(self, key):
+        return {field.encode('utf-8'): str(value).encode('utf-8') for field, value in self.hashes.get(key, {}).items()}
+
+
+def test_lru_eviction():
+    """件数上限を超えると最も使われていないエントリから削除"""
+    cache = CacheService()
+    cache.size_limits['race_analysis'] = (3, 1024 * 1024)
+    for i in range(3):
+        cache.set('race_analysis', {'horses': [f'馬{i}'], 'race_info': ''}, i)
+
+    # 馬0を参照して最新にする → 追加時に馬1が追い出される
+    assert cache.get('race_analysis', {'race_info': '', 'horses': ['馬0']}) == 0
+    cache.set('race_analysis', {'horses': ['馬3'], 'race_info': ''}, 3)
+    assert cache.get('race_analysis', {'horses': ['馬1'], 'race_info': ''}) is None
+    assert cache.get('race_analysis', {'horses': ['馬0'], 'race_info': ''}) == 0
+
+    stats = cache.get_stats()['prefixes']['race_analysis']
+    assert stats['entries'] == 3
+    assert stats['evictions'] == 1
+
+
+def test_byte_budget():
+    """バイト上限を超えないように追い出す"""
+    cache = CacheService()
+    cache.size_limits['chat_response'] = (100, 200)
+    for i in range(10):
+        cache.set('chat_response', f'質問{i}', 'x' * 50)
+    stats = cache.get_stats()['prefixes']['chat_response']
+    assert stats['bytes'] <= 200
+    assert stats['evictions'] > 0
+
+
+def test_oversize_rejected():
+    """単体で上限を超える値は保存せず、既存の値も残して拒否として数える"""
+    cache = CacheService()
+    cache.size_limits['chat_response'] = (100, 500)
+    cache.set('chat_response', '質問', '回答')
+    cache.set('chat_response', '質問', 'x' * 1000)
+    assert cache.get('chat_response', '質問') == '回答'
+    stats = cache.get_stats()['prefixes']['chat_response']
+    assert stats['rejections'] == 1 and stats['evictions'] == 0 and stats['entries'] == 1
+
+
+def test_lazy_expiry():
+    """期限切れは参照時に削除"""
+    cache = CacheService()
+    cache.set('dlogic_analysis', 'ドウデュース', {'total_score': 80.0}, ttl_override=timedelta(seconds=0.01))
+    time.sleep(0.02)
+    assert cache.get('dlogic_analysis', 'ドウデュース') is None
+    assert cache.get_stats()['prefixes']['dlogic_analysis']['expirations'] == 1
+
+
+def test_stable_keys():
+    """辞書のキー順・リストの順序に依存しない"""
+    cache = CacheService()
+    cache.set('race_analysis', {'horses': ['B', 'A'], 'race_info': '有馬記念'}, 'ok')
+    assert cache.get('race_analysis', {'race_info': '有馬記念', 'horses': ['B', 'A']}) == 'ok'
+    cache.set('faq_response', ['b', 'a'], 'faq')
+    assert cache.get('faq_response', ['a', 'b']) == 'faq'
+
+
+def _check_shared_backend(make_backend):
+    """2つのワーカー（CacheServiceインスタンス）でキャッシュを共有できること"""
+    worker_a = CacheService(backend=make_backend())
+    worker_b = CacheService(backend=make_backend())
+    worker_a.clear_all()
+
+    result = {'status': 'success', 'horses': [{'name': 'ドウデュース', 'total_score': 88.5}]}
+    worker_a.set('race_analysis', {'horses': ['ドウデュース'], 'race_info': ''}, result)
+    assert worker_b.get('race_analysis', {'race_info': '', 'horses': ['ドウデュース']}) == result
+
+    # LRU追い出し
+    worker_a.size_limits['dlogic_analysis'] = (2, 1024 * 1024)
+    for name in ('馬A', '馬B'):
+        worker_a.set('dlogic_analysis', name, {'name': name})
+    time.sleep(0.01)
+    worker_a.get('dlogic_analysis', '馬A')
+    worker_a.set('dlogic_analysis', '馬C', {'name': '馬C'})
+    assert worker_b.get('dlogic_analysis', '馬B') is None
+    assert worker_b.get('dlogic_analysis', '馬A') == {'name': '馬A'}
+    assert worker_b.get_stats()['prefixes']['dlogic_analysis']['entries'] == 2
+
+    # 期限切れ
+    worker_a.set('weather_analysis', 'x', 1, ttl_override=timedelta(seconds=0.01))
+    time.sleep(0.02)
+    assert worker_b.get('weather_analysis', 'x') is None
+    assert worker_b.get_stats()['prefixes']['weather_analysis']['expirations'] == 1
+
+    worker_a.clear_prefix('race_analysis')
+    assert worker_b.get('race_analysis', {'horses': ['ドウデュース'], 'race_info': ''}) is None
+
+    # 非同期ハンドラ用（共有バックエンドはスレッドで読み書き）
+    asyncio.run(worker_a.set_async('faq_response', '質問', {'answer': 'ok'}))
+    assert asyncio.run(worker_b.get_async('faq_response', '質問')) == {'answer': 'ok'}
+
+
+def test_sqlite_backend():
+    path = os.path.join(tempfile.mkdtemp(), 'cache.sqlite3')
+    _check_shared_backend(lambda: SQLiteCacheBackend(path))
+
+
+def test_redis_backend():
+    client = FakeRedis()
+    _check_shared_backend(lambda: RedisCacheBackend(client))
+    # 共有先にはpickleではなくJSONで保存する
+    blobs = [value for key, value in client.values.items() if ':faq_response:' in key]
+    assert [json.loads(blob) for blob in blobs] == [{'answer': 'ok'}]
+
+
+def test_explicit_backend_must_initialize():
+    """共有バックエンドを指定して使えない場合はメモリキャッシュに戻さずエラー"""
+    original_env, original_redis = os.environ.get('CACHE_BACKEND'), cache_backends.redis
+    try:
+        cache_backends.redis = None
+        for backend_type in ('redis', 'unknown'):
+            os.environ['CACHE_BACKEND'] = backend_type
+            try:
+                create_cache_backend(_estimate_size)
+                assert False, backend_type
+            except RuntimeError:
+                pass
+        os.environ['CACHE_BACKEND'] = 'memory'
+        assert create_cache_backend(_estimate_size).name == 'memory'
+    finally:
+        cache_backends.redis = original_redis
+        if original_env is None:
+            os.environ.pop('CACHE_BACKEND', None)
+        else:
+            os.environ['CACHE_BACKEND'] = original_env
+
+
+if __name__ == "__main__":
+    test_lru_eviction()
+    test_byte_budget()
+    test_oversize_rejected()
+    test_lazy_expiry()
+    test_stable_keys()
+    test_sqlite_backend()
+    test_redis_backend()
+    test_explicit_backend_must_initialize()
+    print("✅ 全テスト成功")
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+チェックポイントログのテスト
+追記・再開・書きかけ行の切り捨て・コンパクション・原子的な置き換えを確認し、
+1頭あたりのチェックポイントコストが頭数に依存しないことを計測する
+"""
+
+import json
+import os
+import tempfile
+import time
+from decimal import Decimal
+from services.checkpoint_log import CheckpointLog, atomic_write, write_knowledge_stream
+
+
+def _record(i):
+    return {"name": f"馬{i:05d}", "race_history": [{"finish": i % 18 + 1, "odds": 12.5}] * 5}
+
+
+def test_append_and_resume():
+    """再オープンで処理済みの馬が分かり、最後の馬名から再開できる"""
+    path = os.path.join(tempfile.mkdtemp(prefix='checkpoint_test_'), 'log.jsonl')
+    log = CheckpointLog(path, sync_every=10)
+    for i in range(25):
+        log.append(f"馬{i:05d}", _record(i))
+    log.close()
+
+    resumed = CheckpointLog(path)
+    assert len(resumed) == 25
+    assert "馬00007" in resumed and "馬99999" not in resumed
+    assert resumed.last_key == "馬00024"
+    assert [key for key, _ in resumed.items()] == [f"馬{i:05d}" for i in range(25)]
+    resumed.append("馬00025", _record(25))
+    resumed.close()
+    assert len(CheckpointLog(path)) == 26
+
+
+def test_torn_tail_is_truncated():
+    """書きかけの末尾行は次回オープン時に捨てる"""
+    path = os.path.join(tempfile.mkdtemp(prefix='checkpoint_test_'), 'log.jsonl')
+    with CheckpointLog(path) as log:
+        log.append("馬A", _record(1))
+        log.append("馬B", _record(2))
+    intact_size = os.path.getsize(path)
+    with open(path, 'ab') as f:
+        f.write('["馬C",{"name":"馬C","race_hi'.encode('utf-8'))
+
+    log = CheckpointLog(path)
+    assert len(log) == 2 and "馬C" not in log
+    assert log.recovered_bytes > 0
+    assert os.path.getsize(path) == intact_size
+    log.append("馬C", _record(3))
+    assert dict(log.items())["馬C"] == _record(3)
+    log.close()
+
+
+def test_last_record_wins():
+    """同じ馬を再追記したら最新のレコードを使う"""
+    path = os.path.join(tempfile.mkdtemp(prefix='checkpoint_test_'), 'log.jsonl')
+    with CheckpointLog(path) as log:
+        log.append("馬A", {"v": 1})
+        log.append("馬B", {"v": 2})
+        log.append("馬A", {"v": 3})
+    log = CheckpointLog(path)
+    assert len(log) == 2
+    assert list(log.items()) == [("馬B", {"v": 2}), ("馬A", {"v": 3})]
+    log.close()
+
+
+def test_compaction_matches_json_dump():
+    """コンパクション結果は json.dump(indent=2) と同じバイト列"""
+    out_dir = tempfile.mkdtemp(prefix='checkpoint_test_')
+    path = os.path.join(out_dir, 'log.jsonl')
+    meta = {"version": "3.1", "total_horses": 3}
+    base = {"既存馬": {"name": "既存馬", "odds": 3.5}, "馬00001": {"old": True}}
+    with CheckpointLog(path) as log:
+        for i in range(3):
+            log.append(f"馬{i:05d}", _record(i))
+        output = os.path.join(out_dir, 'knowledge.json')
+        result = log.compact(output, meta, base_horses=base)
+        log.discard()
+    assert not os.path.exists(path)
+
+    expected_horses = {"既存馬": base["既存馬"]}
+    expected_horses.update({f"馬{i:05d}": _record(i) for i in range(3)})
+    expected = json.dumps({"meta": meta, "horses": expected_horses}, ensure_ascii=False, indent=2)
+    with open(output, encoding='utf-8') as f:
+        assert f.read() == expected
+    assert result["horses"] == 4
+
+    # 空・Decimal
+    empty = os.path.join(out_dir, 'empty.json')
+    write_knowledge_stream(empty, {}, [])
+    with open(empty, encoding='utf-8') as f:
+        assert f.read() == json.dumps({"meta": {}, "horses": {}}, ensure_ascii=False, indent=2)
+    decimal_out = os.path.join(out_dir, 'decimal.json')
+    write_knowledge_stream(decimal_out, {}, [("馬", {"odds": Decimal("2.5")})])
+    with open(decimal_out, encoding='utf-8') as f:
+        assert json.load(f)["horses"]["馬"]["odds"] == 2.5
+
+
+def test_atomic_write_keeps_old_file_on_failure():
+    """書き込み途中で失敗しても元のファイルはそのまま残る"""
+    path = os.path.join(tempfile.mkdtemp(prefix='checkpoint_test_'), 'knowledge.json')
+    atomic_write(path, lambda f: json.dump({"horses": {"馬A": 1}}, f))
+
+    def broken(f):
+        f.write('{"horses": {')
+        raise RuntimeError("disk full")
+
+    try:
+        atomic_write(path, broken)
+        assert False, "例外が伝わること"
+    except RuntimeError:
+        pass
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f) == {"horses": {"馬A": 1}}
+    assert not os.path.exists(path + '.tmp')
+
+
+def benchmark_checkpoint_cost():
+    """チェックポイント1回あたりのコスト（全体書き直し vs 追記ログ）"""
+    out_dir = tempfile.mkdtemp(prefix='checkpoint_bench_')
+    print("  頭数   全体書き直し(500頭ごと)  追記ログ(1頭ごと)")
+    for total in (1000, 4000, 16000):
+        knowledge = {"meta": {}, "horses": {}}
+        rewrite_cost = 0.0
+        for i in range(total):
+            knowledge["horses"][f"馬{i:05d}"] = _record(i)
+            if (i + 1) % 500 == 0:
+                start = time.perf_counter()
+                with open(os.path.join(out_dir, 'temp.json'), 'w', encoding='utf-8') as f:
+                    json.dump(knowledge, f, ensure_ascii=False, indent=2)
+                rewrite_cost += time.perf_counter() - start
+
+        log = CheckpointLog(os.path.join(out_dir, f'log_{total}.jsonl'))
+        start = time.perf_counter()
+        for i in range(total):
+            log.append(f"馬{i:05d}", _record(i))
+        log.close()
+        append_cost = time.perf_counter() - start
+        print(f"  {total:6d}  {rewrite_cost / total * 1e6:10.1f}µs/頭  {append_cost / total * 1e6:10.1f}µs/頭")
+
+
+if __name__ == "__main__":
+    test_append_and_resume()
+    test_torn_tail_is_truncated()
+    test_last_record_wins()
+    test_compaction_matches_json_dump()
+    test_atomic_write_keeps_old_file_on_failure()
+    benchmark_checkpoint_cost()
+    print("✅ 全テスト成功")
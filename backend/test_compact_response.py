@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+コンパクト（列形式）レスポンスのテスト
+列形式から元の出走馬ごとの結果に戻せること、Accept-Encoding に合わせた圧縮、
+/api/v2/dlogic/race-analysis の compact モード、通常のJSONレスポンスとのサイズ・時間の比較を確認する
+"""
+
+import gzip
+import json
+import os
+import time
+
+os.environ.setdefault('DLOGIC_PRECOMPUTE_SCORES', 'false')
+
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+from api.fast_dlogic_api import engine, router
+from services.compact_response import (
+    DROPPED_FIELDS, choose_encoding, compact_race_result, encode_response, from_columnar, to_columnar
+)
+
+app = FastAPI()
+app.include_router(router, prefix="/api/v2/dlogic")
+client = TestClient(app)
+
+
+def race_field(size=18):
+    """分析できる馬（+ 基準馬・未登録馬）"""
+    names = []
+    for name in engine.raw_manager.knowledge_data.get('horses', {}):
+        try:
+            engine.raw_manager.calculate_dlogic_realtime(name)
+        except Exception:
+            continue
+        names.append(name)
+        if len(names) == size - 2:
+            break
+    return names + ['ダンスインザダーク', '存在しない馬XYZ']
+
+
+def make_request(**headers):
+    return Request({'type': 'http', 'headers': [(k.replace('_', '-').encode(), v.encode()) for k, v in headers.items()]})
+
+
+def test_round_trip():
+    """列形式から元の結果（馬ごとの時刻・フェーズ別時間を除く）に戻せる"""
+    result = engine.analyze_race_horses(race_field())
+    compact = to_columnar(result['horses'])
+    assert compact['count'] == len(result['horses']) and len(compact['factors']) == 12
+    assert all(len(column) == compact['count'] for column in compact['scores'])
+    restored = from_columnar(json.loads(json.dumps(compact)))
+    for original, horse in zip(result['horses'], restored):
+        expected = {key: value for key, value in original.items() if key not in DROPPED_FIELDS}
+        assert horse == {key: expected.get(key) for key in horse}
+        assert set(expected) <= set(horse)
+
+    # horses以外はそのまま・元の結果は変更しない
+    compacted = compact_race_result(result)
+    assert compacted['race_analysis'] is result['race_analysis'] and isinstance(result['horses'], list)
+    assert compact_race_result({'status': 'success'}) == {'status': 'success'}
+
+
+def test_encoding_negotiation():
+    """Accept-Encoding のq値に従って圧縮方式を選ぶ（小さいレスポンスは圧縮しない）"""
+    assert choose_encoding('gzip, deflate') == 'gzip'
+    assert choose_encoding('gzip;q=0, identity') is None
+    assert choose_encoding('*') in ('br', 'gzip')
+    assert choose_encoding('') is None
+
+    large = {'horses': to_columnar([{'horse_name': f'馬{i}', 'total_score': i / 7} for i in range(200)])}
+    response = encode_response(large, make_request(accept_encoding='gzip'))
+    assert response.headers['content-encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.body)) == json.loads(json.dumps(large))
+    small = encode_response({'status': 'success'}, make_request(accept_encoding='gzip'))
+    assert 'content-encoding' not in small.headers and json.loads(small.body) == {'status': 'success'}
+
+
+def test_race_analysis_endpoint():
+    """race-analysis は response_format=compact のときだけ列形式で返す"""
+    field = race_field()
+    normal = client.post('/api/v2/dlogic/race-analysis', json={'horse_names': field})
+    assert normal.status_code == 200 and isinstance(normal.json()['horses'], list)
+
+    compact = client.post('/api/v2/dlogic/race-analysis', json={'horse_names': field, 'response_format': 'compact'},
+                          headers={'Accept-Encoding': 'gzip'})
+    assert compact.status_code == 200 and compact.headers['content-encoding'] == 'gzip'
+    payload = compact.json()
+    assert payload['horses']['format'] == 'columnar' and payload['horses']['count'] == len(field)
+    names = payload['horses']['columns']['horse_name']
+    assert names == [horse['horse_name'] for horse in normal.json()['horses']]
+
+
+def benchmark_payload_size():
+    """18頭: 通常のJSONレスポンス vs 列形式（+gzip）のサイズとシリアライズ時間"""
+    result = engine.analyze_race_horses(race_field())
+    request = make_request(accept_encoding='gzip')
+
+    start = time.perf_counter()
+    for _ in range(200):
+        normal_body = JSONResponse(jsonable_encoder(result)).body
+    normal_elapsed = (time.perf_counter() - start) / 200
+
+    start = time.perf_counter()
+    for _ in range(200):
+        compact_body = encode_response(compact_race_result(result), make_request()).body
+    compact_elapsed = (time.perf_counter() - start) / 200
+    gzip_body = encode_response(compact_race_result(result), request).body
+
+    print(f"  18頭: 通常JSON {len(normal_body):,}B / 列形式 {len(compact_body):,}B / "
+          f"列形式+gzip {len(gzip_body):,}B")
+    print(f"  シリアライズ: 通常 {normal_elapsed * 1000:.2f}ms / 列形式 {compact_elapsed * 1000:.2f}ms")
+    assert len(gzip_body) * 4 < len(normal_body)
+    assert compact_elapsed < normal_elapsed
+
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_encoding_negotiation()
+    test_race_analysis_endpoint()
+    benchmark_payload_size()
+    print("✅ 全テスト成功")
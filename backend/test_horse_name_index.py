@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""馬名解決インデックスのテスト"""
+
+import contextlib
+import io
+import os
+import random
+import time
+from services.horse_name_index import HorseNameIndex
+from services.name_normalizer import normalize_name, NameAliasTable
+
+NAMES = ["ドウデュース", "イクイノックス", "リバティアイランド", "Deep Impact", "ディープインパクト", "ディープインパクト号"]
+
+
+def test_resolution():
+    """完全一致・表記ゆれ・近似一致・不一致の解決"""
+    index = HorseNameIndex(NAMES)
+    assert index.match("ドウデュース") == ("ドウデュース", 'exact')
+    assert index.match("deep impact") == ("Deep Impact", 'folded')
+    assert index.match("ＤＥＥＰ　ＩＭＰＡＣＴ") == ("Deep Impact", 'folded')
+    # 部分一致（文字数差2以内）は従来通り解決
+    assert index.match("リバティアイランドα") == ("リバティアイランド", 'fuzzy')
+    # 同点時は距離の近い方 → 登録順
+    assert index.resolve("ディープインパクトの") == "ディープインパクト"
+    # 短い名前は近似一致しない
+    assert index.resolve("ドウデュ") is None
+    assert index.resolve("存在しない馬名です") is None
+
+    # 既定では編集距離の近い別馬には解決しない（部分一致・文字数差2以内のみ）
+    index = HorseNameIndex(["ゴールドシップ", "ゴールドアクター"])
+    assert index.match("ゴールドシチー") == (None, 'none')
+    assert index.match("ゴールドシップ号") == ("ゴールドシップ", 'fuzzy')
+    assert index.resolve("ゴールドシップ号二世") is None
+
+
+def test_edit_distance_opt_in():
+    """編集距離の近似一致は設定した場合のみ、最も近い馬名が1つに決まるときだけ解決"""
+    index = HorseNameIndex(["リバティアイランド", "イクイノックス", "イクイノックヌ"], max_distance=1)
+    assert index.match("リバティアイランポ") == ("リバティアイランド", 'fuzzy')
+    # 距離1の候補が2頭 → 解決しない
+    assert index.resolve("イクイノックネ") is None
+    # 部分一致は編集距離より優先
+    assert index.match("イクイノックス号") == ("イクイノックス", 'fuzzy')
+    assert HorseNameIndex(["リバティアイランド"]).resolve("リバティアイランポ") is None
+
+
+def test_manager_marks_fuzzy_once():
+    """ナレッジの近似一致は結果に印を付け、メッセージは馬名ごとに1回だけ表示"""
+    os.environ.setdefault('DLOGIC_PRECOMPUTE_SCORES', 'false')
+    from services.fast_dlogic_engine import FastDLogicEngine
+    engine = FastDLogicEngine()
+    manager = engine.raw_manager
+    name = next(name for name in manager.knowledge_data.get('horses', {})
+                if len(name) >= 5 and manager.name_index.match(name + '号')[1] == 'fuzzy'
+                and manager.name_index.match(name + '号')[0] == name)
+    query = name + '号'
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        for _ in range(3):
+            assert manager.resolve_horse_name(query) == name
+    assert output.getvalue().count('近似一致') == 1
+    assert manager.resolve_horse_name(query, allow_fuzzy=False) is None
+    assert manager.resolve_horse_name(name, allow_fuzzy=False) == name
+
+    result = engine.analyze_single_horse(query)
+    assert result['name_match'] == 'fuzzy' and result['matched_horse_name'] == name
+    assert 'name_match' not in engine.analyze_single_horse(name)
+
+
+def test_normalization():
+    """全角半角・ひらがな・長音・中黒の表記ゆれ"""
+    assert normalize_name("ﾄﾞｳﾃﾞｭｰｽ") == normalize_name("ドウデュース")
+    assert normalize_name("どうでゅーす") == normalize_name("ドウデュース")
+    assert normalize_name("ドウデュ－ス") == normalize_name("ドウデュース")
+    assert normalize_name("Ｃ．デム") == normalize_name("C・デム") == normalize_name("cデム")
+    assert normalize_name("アレン　") == normalize_name("アレン")
+
+    index = HorseNameIndex(NAMES)
+    assert index.match("ﾄﾞｳﾃﾞｭｰｽ") == ("ドウデュース", 'folded')
+
+
+def test_jockey_aliases():
+    """騎手略称キー（先頭4文字・全角）の解決"""
+    jockeys = NameAliasTable(["Ｃ．デム", "Ｍ．デム", "キング　", "キングス", "アレン　"], prefix_match=True)
+    assert jockeys.resolve("C.デムーロ") == "Ｃ．デム"
+    assert jockeys.resolve("M・デムーロ") == "Ｍ．デム"
+    assert jockeys.resolve("キングスコート") == "キングス"
+    assert jockeys.resolve("アレン") == "アレン　"
+    assert jockeys.resolve("ルメール") is None
+    assert jockeys.get_stats()["misses"] == 1
+
+
+def test_search():
+    """部分一致検索"""
+    index = HorseNameIndex(NAMES)
+    assert index.search("インパクト") == ["ディープインパクト", "ディープインパクト号"]
+    assert index.search("impact") == ["Deep Impact"]
+    assert index.search("ス") == ["ドウデュース", "イクイノックス"]
+
+
+def test_lookup_speed():
+    """大量の馬名でも未登録馬の解決が高速であることを確認"""
+    rng = random.Random(0)
+    kana = [chr(code) for code in range(0x30A1, 0x30F6)] + ['ー'] * 6
+    names = [''.join(rng.choice(kana) for _ in range(rng.randint(3, 9))) for _ in range(50000)]
+    index = HorseNameIndex(names)
+    queries = [''.join(rng.choice(kana) for _ in range(8)) for _ in range(100)]
+    start_time = time.time()
+    for query in queries:
+        index.resolve(query)
+    elapsed = time.time() - start_time
+    print(f"未登録馬100件の解決: {elapsed:.3f}秒 ({len(index)}頭)")
+    assert elapsed < 5.0
+
+
+if __name__ == "__main__":
+    test_resolution()
+    test_edit_distance_opt_in()
+    test_manager_marks_fuzzy_once()
+    test_normalization()
+    test_jockey_aliases()
+    test_search()
+    test_lookup_speed()
+    print("✅ 全テスト成功")
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+騎手ナレッジ分析サービスのテスト
+集計値が成績リストから数え直した値と一致すること、騎手名の先頭一致解決、
+コース × 馬場状態の組み合わせ集計、出走馬全体の騎手相性、ファイル更新時の再集計を確認する
+"""
+
+import json
+import os
+import tempfile
+import time
+
+from services.jockey_analytics import (
+    JOCKEY_KNOWLEDGE_FILE, NEUTRAL_SCORE, JockeyAnalytics, baba_key, post_position_key, venue_course_key
+)
+
+WORK_DIR = tempfile.mkdtemp(prefix='dlogic_jockey_test_')
+
+SECTIONS = {
+    'venue_course': 'venue_course_stats',
+    'baba': 'track_condition_stats',
+    'post_position': 'post_position_stats',
+    'sire': 'sire_stats',
+}
+
+
+def result(date, horse, position):
+    return {'date': date, 'horse_name': horse, 'position': position, 'total_horses': 16, 'is_fukusho': position <= 3}
+
+
+def entry(*results):
+    return {'results': list(results), 'fukusho_rate': 0.0, 'race_count': len(results)}
+
+
+SAMPLE = {
+    'ルメール': {
+        'name': 'ルメール',
+        'venue_course_stats': {
+            '中山_2500m': entry(result('2024-1222', 'A', 1), result('2024-0101', 'B', 5), result('2023-1224', 'C', 2)),
+            '東京_2400m': entry(result('2024-0526', 'D', 3)),
+        },
+        'track_condition_stats': {
+            '重': entry(result('2024-1222', 'A', 1), result('2024-0101', 'B', 5)),
+            '良': entry(result('2023-1224', 'C', 2), result('2024-0526', 'D', 3)),
+        },
+        'post_position_stats': {'枠3': entry(result('2024-1222', 'A', 1))},
+        'sire_stats': {'キタサンブラック': entry(result('2024-0101', 'B', 5))},
+        'overall_stats': {'total_races_analyzed': 4, 'overall_fukusho_rate': 75.0},
+    },
+    'Ｃ．デム': {
+        'name': 'Ｃ．デム',
+        'venue_course_stats': {'中山_2500m': entry(result('2024-1222', 'E', 9), result('2024-1221', 'F', 8))},
+        'track_condition_stats': {}, 'post_position_stats': {}, 'sire_stats': {},
+    },
+    '　　　　': {'name': '　　　　', 'venue_course_stats': {}},
+}
+
+
+def test_aggregates_and_query():
+    """条件別の件数・複勝率と、コース × 馬場状態の組み合わせ"""
+    analytics = JockeyAnalytics(os.path.join(WORK_DIR, 'unused.json'))
+    analytics.load(SAMPLE)
+
+    assert analytics.get_stat('ルメール', 'venue_course', '中山_2500m') == \
+        {'race_count': 3, 'fukusho_count': 2, 'fukusho_rate': 66.7}
+    assert analytics.get_stat('ルメール', 'baba', 3)['race_count'] == 2
+    assert analytics.get_stat('ルメール', 'post_position', 3)['fukusho_rate'] == 100.0
+    assert analytics.get_stat('ルメール', 'sire', 'キタサンブラック')['fukusho_count'] == 0
+    assert analytics.get_stat('ルメール', 'venue_course', '京都_3000m') is None
+    assert analytics.get_overall('ルメール') == {'race_count': 4, 'fukusho_count': 3, 'fukusho_rate': 75.0}
+
+    # 中山_2500m の3走のうち重は2走（A: 1着, B: 5着）
+    query = analytics.query('ルメール', venue_course=venue_course_key('中山', 2500), baba='重')
+    assert query['venue_course_baba'] == {'race_count': 2, 'fukusho_count': 1, 'fukusho_rate': 50.0}
+    assert query['venue_course']['race_count'] == 3 and query['baba']['race_count'] == 2
+
+    # 騎手名はフルネーム・全角半角違いから略称キーへ先頭一致で解決
+    assert analytics.resolve_jockey('Ｃ．デムーロ') == 'Ｃ．デム'
+    assert analytics.resolve_jockey('C.デムーロ') == 'Ｃ．デム'
+    assert analytics.resolve_jockey('存在しない騎手') is None
+    assert analytics.query('存在しない騎手')['knowledge_key'] is None
+
+    assert venue_course_key('中山_2500m') == '中山_2500m' and venue_course_key('中山', '2500m') == '中山_2500m'
+    assert baba_key(4) == '不良' and baba_key('稍重') == '稍重' and post_position_key('枠8') == '枠8'
+
+
+def test_race_jockey_compatibility():
+    """出走馬全体の騎手相性を1回で計算（データのない騎手は中立値）"""
+    analytics = JockeyAnalytics(os.path.join(WORK_DIR, 'unused.json'))
+    analytics.load(SAMPLE)
+    entries = [
+        {'horse_name': '馬1', 'jockey': 'ルメール', 'post_position': 3, 'sire': 'キタサンブラック'},
+        {'horse_name': '馬2', 'jockey': 'Ｃ．デムーロ', 'post_position': 5},
+        {'horse_name': '馬3', 'jockey': '新人騎手'},
+    ]
+    scores = analytics.race_jockey_compatibility(entries, venue_course='中山_2500m', baba=3)
+    assert list(scores) == ['馬1', '馬2', '馬3']
+    assert scores['馬3']['3_jockey_compatibility'] == NEUTRAL_SCORE and scores['馬3']['knowledge_key'] is None
+    assert scores['馬2']['knowledge_key'] == 'Ｃ．デム'
+    assert scores['馬1']['3_jockey_compatibility'] > scores['馬2']['3_jockey_compatibility']
+    assert all(0.0 <= s['3_jockey_compatibility'] <= 100.0 for s in scores.values())
+
+
+def test_reload_on_file_change():
+    """ファイルが更新されたら次の参照で集計し直す"""
+    path = os.path.join(WORK_DIR, 'jockey_knowledge.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'ルメール': SAMPLE['ルメール']}, f, ensure_ascii=False)
+    analytics = JockeyAnalytics(path)
+    assert len(analytics) == 1 and analytics.resolve_jockey('Ｃ．デムーロ') is None
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(SAMPLE, f, ensure_ascii=False)
+    later = time.time() + 5
+    os.utime(path, (later, later))
+    assert analytics.resolve_jockey('Ｃ．デムーロ') == 'Ｃ．デム'
+
+
+def test_real_knowledge_matches_results():
+    """実データの全集計が成績リストを数え直した値と一致する"""
+    if not os.path.exists(JOCKEY_KNOWLEDGE_FILE):
+        print("  騎手ナレッジなし: スキップ")
+        return
+    with open(JOCKEY_KNOWLEDGE_FILE, 'r', encoding='utf-8') as f:
+        knowledge = json.load(f)
+    analytics = JockeyAnalytics(JOCKEY_KNOWLEDGE_FILE)
+    checked = 0
+    for jockey, info in knowledge.items():
+        if not jockey.strip():
+            continue
+        for dimension, section in SECTIONS.items():
+            for value, data in info.get(section, {}).items():
+                stat = analytics.get_stat(jockey, dimension, value)
+                assert stat['race_count'] == len(data['results'])
+                assert stat['fukusho_rate'] == data['fukusho_rate'], (jockey, value)
+                checked += 1
+    print(f"  実データ: {len(analytics)}人 / {checked}件一致")
+
+
+def benchmark_indexed_vs_nested():
+    """条件別複勝率の参照: 入れ子の成績リストから毎回数える vs 集計済み索引"""
+    if not os.path.exists(JOCKEY_KNOWLEDGE_FILE):
+        return
+    with open(JOCKEY_KNOWLEDGE_FILE, 'r', encoding='utf-8') as f:
+        knowledge = json.load(f)
+    analytics = JockeyAnalytics(JOCKEY_KNOWLEDGE_FILE)
+    queries = [(jockey, course) for jockey, info in knowledge.items()
+               for course in info.get('venue_course_stats', {})][:2000]
+
+    start = time.perf_counter()
+    for _ in range(10):
+        for jockey, course in queries:
+            # 従来の使い方: 騎手名を線形に探し、成績リストから数える
+            key = next(k for k in knowledge if jockey.startswith(k) or k.startswith(jockey))
+            results = knowledge[key]['venue_course_stats'][course]['results']
+            sum(1 for r in results if r['is_fukusho']) / len(results)
+    nested_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(10):
+        for jockey, course in queries:
+            analytics.get_stat(jockey, 'venue_course', course)
+    indexed_elapsed = time.perf_counter() - start
+
+    count = len(queries) * 10
+    print(f"  {count}件の参照: 入れ子から計算 {nested_elapsed / count * 1e6:.1f}µs / "
+          f"集計済み索引 {indexed_elapsed / count * 1e6:.1f}µs")
+    assert indexed_elapsed < nested_elapsed
+
+
+if __name__ == "__main__":
+    test_aggregates_and_query()
+    test_race_jockey_compatibility()
+    test_reload_on_file_change()
+    test_real_knowledge_matches_results()
+    benchmark_indexed_vs_nested()
+    print("✅ 全テスト成功")
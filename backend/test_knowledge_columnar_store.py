@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+カラムナーナレッジ（services/knowledge_columnar_store.py）のテスト
+JSONからの変換・書き出しと読み込みで元の辞書と完全に同じ内容に戻ること
+（"01"と1の区別・None・入れ子の値・途中から現れる列・race_history形式を含む）、
+辞書互換ビューの追加・削除、カラムナー形式でないファイルの拒否を確認する
+"""
+
+import json
+import os
+import tempfile
+
+from services.knowledge_columnar_store import (
+    ColumnarKnowledgeStore, convert_json_to_columnar, write_columnar
+)
+from services.dlogic_raw_data_manager import dlogic_manager
+
+ODD_KNOWLEDGE = {
+    'meta': {'version': 'test', 'horses': 5},
+    'horses': {
+        'ゼッケンテスト': {
+            'races': [
+                {'KAKUTEI_CHAKUJUN': '01', 'KYORI': '1600', 'CHAKUSA': 'クビ', 'TANSHO_ODDS': 32},
+                {'KAKUTEI_CHAKUJUN': 1, 'KYORI': 1600, 'CHAKUSA': None},
+                # 途中から現れる列・欠けている列
+                {'KAKUTEI_CHAKUJUN': '', 'CORNER1_JUNI': '00', 'NOTE': {'取消': True, '理由': ['跛行']}},
+            ],
+            'aggregated_stats': {'wins': 2, 'total_races': 3, 'jockey_performance': {'武豊': [1, 1]}},
+        },
+        '履歴形式': {
+            'race_history': [{'finish': 3, 'distance': '2000', 'jockey': 'ルメール', 'weight': 55.5}],
+            'basic_info': {'父': 'ディープインパクト'},
+        },
+        '出走なし': {'races': [], 'basic_info': {}},
+        'キーなし': {'basic_info': {'産地': '日高'}},
+        'アアアア': {'races': [{'KAKUTEI_CHAKUJUN': '02', 'KYORI': '1600', 'TRACK_CODE': '11'}]},
+    }
+}
+
+
+def _round_trip(knowledge, directory):
+    path = os.path.join(directory, 'knowledge.dlcol')
+    stats = write_columnar(knowledge, path)
+    assert not [name for name in os.listdir(directory) if name.endswith('.tmp')]
+    return ColumnarKnowledgeStore(path), stats
+
+
+def test_round_trip_odd_values():
+    """値の型・列の欠落・レース配列のキー名がそのまま戻る"""
+    with tempfile.TemporaryDirectory() as directory:
+        store, stats = _round_trip(ODD_KNOWLEDGE, directory)
+        try:
+            horses = ODD_KNOWLEDGE['horses']
+            assert stats['horse_count'] == store.horse_count == len(horses)
+            assert stats['row_count'] == store.row_count == 5
+            assert store.meta == ODD_KNOWLEDGE['meta']
+            assert list(store.horse_names()) == sorted(horses)
+            for name, horse in horses.items():
+                restored = store.get_horse(name)
+                assert restored == horse, name
+                # 型を区別する（"01" と 1、"1600" と 1600）
+                assert json.dumps(restored, sort_keys=True) == json.dumps(horse, sort_keys=True)
+            assert store.get_horse('存在しない馬XYZ') is None and store.find('存在しない馬XYZ') == -1
+
+            # 復元した値を書き換えても他の馬・次の読み込みに影響しない
+            store.get_horse('ゼッケンテスト')['races'][2]['NOTE']['理由'].append('変更')
+            assert store.get_horse('ゼッケンテスト') == horses['ゼッケンテスト']
+        finally:
+            store.close()
+
+
+def test_convert_real_knowledge():
+    """ナレッジJSONからの変換で全馬が元の辞書と一致する"""
+    horses = dlogic_manager.knowledge_data.get('horses', {})
+    knowledge = {'meta': {'version': 'real'}, 'horses': {name: horses[name] for name in horses}}
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, 'dlogic_raw_knowledge.json')
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(knowledge, f, ensure_ascii=False)
+        output_path = os.path.join(directory, 'dlogic_raw_knowledge.dlcol')
+        stats = convert_json_to_columnar(json_path, output_path)
+
+        store = ColumnarKnowledgeStore(output_path)
+        try:
+            mismatches = [name for name in knowledge['horses'] if store.get_horse(name) != knowledge['horses'][name]]
+            print(f"  変換: {stats['horse_count']}頭 / {stats['row_count']}走 / 不一致: {len(mismatches)}頭")
+            assert stats['horse_count'] == len(knowledge['horses']) and not mismatches
+        finally:
+            store.close()
+
+
+def test_mapping_overlay():
+    """辞書互換ビュー: 追加・上書き・削除はメモリ上だけに反映される"""
+    with tempfile.TemporaryDirectory() as directory:
+        store, _ = _round_trip(ODD_KNOWLEDGE, directory)
+        try:
+            mapping = store.as_mapping()
+            assert len(mapping) == 5 and 'アアアア' in mapping and 1 not in mapping
+
+            mapping['新馬'] = {'races': []}
+            mapping['アアアア'] = {'races': [{'KAKUTEI_CHAKUJUN': '05'}]}
+            del mapping['出走なし']
+            assert len(mapping) == 5 and '出走なし' not in mapping
+            assert mapping['アアアア']['races'][0]['KAKUTEI_CHAKUJUN'] == '05'
+            assert sorted(mapping) == sorted(['ゼッケンテスト', '履歴形式', 'キーなし', 'アアアア', '新馬'])
+
+            del mapping['アアアア']
+            assert 'アアアア' not in mapping and len(mapping) == 4
+            try:
+                mapping['出走なし']
+                assert False
+            except KeyError:
+                pass
+            assert store.get_horse('アアアア') == ODD_KNOWLEDGE['horses']['アアアア']
+        finally:
+            store.close()
+
+
+def test_rejects_other_files():
+    """カラムナー形式でないファイルは ValueError"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'knowledge.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(ODD_KNOWLEDGE, f, ensure_ascii=False)
+        try:
+            ColumnarKnowledgeStore(path)
+            assert False
+        except ValueError:
+            pass
+
+
+if __name__ == "__main__":
+    test_round_trip_odd_values()
+    test_convert_real_knowledge()
+    test_mapping_overlay()
+    test_rejects_other_files()
+    print("✅ 全テスト成功")
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+ナレッジ差分（デルタ）更新のテスト
+SQLiteでjvd_ksを再現し、ウォーターマーク以降の行だけがナレッジの過去走の形式で該当馬に追記されること、
+追記した走がD-Logicの計算に使われること、
+デルタファイルを順に適用した別サーバーのナレッジが生成側と一致することを確認する
+"""
+
+import copy
+import os
+import sqlite3
+import tempfile
+from services.dlogic_raw_data_manager import dlogic_manager
+from services.dlogic_batch_scorer import DLogicBatchScorer
+from services.dlogic_score_table import DLogicScoreTable
+from services.knowledge_delta import (
+    WatermarkStore, append_races, apply_delta_to_horses, list_deltas, load_delta, race_date
+)
+from services.monthly_knowledge_updater import MonthlyKnowledgeUpdater, to_knowledge_race
+
+WORK_DIR = tempfile.mkdtemp(prefix='dlogic_delta_test_')
+DB_PATH = os.path.join(WORK_DIR, 'stand_in.sqlite3')
+COLUMNS = [
+    'BAMEI', 'NENGAPPI', 'KYOSOMEI_HONDAI', 'TRACK_CODE', 'KYORI', 'BABA_CODE', 'TENKO_CODE',
+    'KISHUMEI_RYAKUSHO', 'CHOKYOSHIMEI_RYAKUSHO', 'KAKUTEI_JINI', 'KAKUTEI_CHAKUSA',
+    'TANSHO_NINKIJUN', 'FUTAN_JURYO', 'BATAIJU', 'ZOGEN_FUGO', 'ZOGEN_SA',
+    'CORNER1_JUNI', 'CORNER2_JUNI', 'CORNER3_JUNI', 'CORNER4_JUNI',
+    'SOHA_TIME', 'JOKYO_CODE', 'GRADE_CODE', 'SYUSSO_TOSU'
+]
+
+HORSE_A = 'デルタテスト馬A'   # races形式（最新10走を保持）
+HORSE_B = 'デルタテスト馬B'   # race_history形式（集計あり）
+HORSE_C = 'デルタテスト馬C'   # 新規馬（4走）
+HORSE_D = 'デルタテスト馬D'   # 新規馬（1走のみ・対象外）
+
+
+def _row(name, date, finish=5):
+    values = dict.fromkeys(COLUMNS, '')
+    values.update({
+        'BAMEI': name, 'NENGAPPI': date, 'KYOSOMEI_HONDAI': f'テスト{date}', 'TRACK_CODE': '10',
+        'KYORI': '1600', 'KAKUTEI_JINI': f'{finish:02d}', 'TANSHO_NINKIJUN': '03',
+        'KISHUMEI_RYAKUSHO': 'ルメール', 'SOHA_TIME': '1340', 'SYUSSO_TOSU': '16',
+        'BABA_CODE': '2', 'TENKO_CODE': '1', 'BATAIJU': '480', 'ZOGEN_FUGO': '+', 'ZOGEN_SA': '004',
+        'FUTAN_JURYO': '550', 'CORNER1_JUNI': '07', 'KAKUTEI_CHAKUSA': 'クビ'
+    })
+    return values
+
+
+def insert_rows(rows):
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS jvd_ks ({', '.join(c + ' TEXT' for c in COLUMNS)})")
+    conn.executemany(
+        f"INSERT INTO jvd_ks VALUES ({', '.join(['?'] * len(COLUMNS))})",
+        [tuple(row[c] for c in COLUMNS) for row in rows]
+    )
+    conn.commit()
+    conn.close()
+
+
+def make_updater():
+    updater = MonthlyKnowledgeUpdater()
+    updater.connect = lambda: sqlite3.connect(DB_PATH)
+    updater.race_extractor.query.placeholder = '?'
+    updater.output_dir = os.path.join(WORK_DIR, 'monthly_updates')
+    os.makedirs(updater.output_dir, exist_ok=True)
+    updater.watermarks = WatermarkStore(os.path.join(WORK_DIR, 'watermarks.json'))
+    return updater
+
+
+def setup_knowledge():
+    """既存馬2頭をナレッジに登録し、DBには取り込み済みの過去走を入れておく"""
+    a_rows = [_row(HORSE_A, f'2024{month:02d}15') for month in range(12, 2, -1)]
+    horses = dlogic_manager.knowledge_data['horses']
+    horses[HORSE_A] = {'race_count': 10, 'races': [to_knowledge_race(row) for row in a_rows],
+                       'last_race_date': '20241215'}
+    dlogic_manager.add_horse_raw_data(HORSE_B, {
+        'basic_info': {'sex': '1', 'last_race_date': '20241201'},
+        'race_history': [
+            {'date': '20241201', 'finish': 1, 'distance': 1600},
+            {'date': '20241101', 'finish': 3, 'distance': 1600},
+            {'date': '20241001', 'finish': 2, 'distance': 1800}
+        ],
+        'aggregated_stats': {'total_races': 3, 'wins': 1}
+    })
+    insert_rows(a_rows + [_row(HORSE_C, '20240601'), _row(HORSE_C, '20240801')])
+    return {HORSE_A: copy.deepcopy(horses[HORSE_A]), HORSE_B: copy.deepcopy(horses[HORSE_B])}
+
+
+def test_append_races_window():
+    """日付の重複は追加せず、新しい順に並べて元の件数（最低max_races）に収める"""
+    record = {'races': [{'NENGAPPI': f'202401{d:02d}'} for d in range(10, 0, -1)], 'race_count': 10}
+    updated, added = append_races(record, [{'NENGAPPI': '20240201'}, {'NENGAPPI': '20240110'}], 10)
+    assert added == 1
+    assert [race_date(r) for r in updated['races']][:2] == ['20240201', '20240110']
+    assert len(updated['races']) == 10 and updated['race_count'] == 10
+    assert updated['last_race_date'] == '20240201'
+    assert len(record['races']) == 10 and race_date(record['races'][0]) == '20240110'
+
+    # max_racesより長い履歴は元の件数を保って最古の走を落とす
+    long_history = {'race_history': [{'date': f'2023{m:02d}01'} for m in range(12, 0, -1)]}
+    updated, _ = append_races(long_history, [{'NENGAPPI': '20240105'}], 10)
+    dates = [race_date(r) for r in updated['race_history']]
+    assert len(dates) == 12 and dates[0] == '20240105' and dates[-1] == '20230201'
+
+
+def test_knowledge_race_schema():
+    """jvd_ksの行をナレッジファイルの過去走と同じ列名・値の形式にする"""
+    race = to_knowledge_race(_row(HORSE_A, '20250105', finish=1))
+    assert race == {
+        'KAISAI_NEN': '2025', 'KAISAI_GAPPI': '0105', 'KAKUTEI_CHAKUJUN': '01', 'KYORI': '1600',
+        'TANSHO_NINKIJUN': '03', 'FUTAN_JURYO': '550', 'BATAIJU': '480',
+        'CORNER1_JUNI': '07', 'CORNER2_JUNI': '', 'CORNER3_JUNI': '', 'CORNER4_JUNI': '',
+        'SOHA_TIME': '1340', 'TRACK_CODE': '10', 'TENKO_CODE': '1', 'KISHUMEI_RYAKUSHO': 'ルメール',
+        'CHOKYOSHIMEI_RYAKUSHO': '', 'ZOGEN_SA': '+004', 'SHIBA_BABAJOTAI_CODE': '2', 'CHAKUSA': 'クビ'
+    }
+    assert race_date(race) == '20250105'
+
+    # ダートの馬場状態、NULL、馬場状態なし
+    row = dict(_row(HORSE_A, '20250105'), TRACK_CODE='23', BABA_CODE='3', CORNER2_JUNI=None, ZOGEN_SA='')
+    race = to_knowledge_race(row)
+    assert race['DIRT_BABAJOTAI_CODE'] == '3' and 'SHIBA_BABAJOTAI_CODE' not in race
+    assert race['CORNER2_JUNI'] == '' and race['ZOGEN_SA'] == ''
+    race = to_knowledge_race(dict(row, BABA_CODE=''))
+    assert 'DIRT_BABAJOTAI_CODE' not in race and 'SHIBA_BABAJOTAI_CODE' not in race
+
+
+def test_delta_pipeline():
+    snapshot = setup_knowledge()
+    updater = make_updater()
+    updater.watermarks.advance({'jvd_ks': '20241215'})
+
+    table = DLogicScoreTable(dlogic_manager, DLogicBatchScorer(dlogic_manager),
+                             table_file=os.path.join(WORK_DIR, 'score_table.pkl'))
+    table.build()
+    start_version = dlogic_manager.get_delta_version()
+
+    # 1回目: Aに2走、Bに1走（勝利）、新規馬C（過去2走 + 新2走）、D（1走のみ）
+    insert_rows([
+        _row(HORSE_A, '20250105'), _row(HORSE_A, '20250201'),
+        _row(HORSE_B, '20250110', finish=1),
+        _row(HORSE_C, '20250110'), _row(HORSE_C, '20250215'),
+        _row(HORSE_D, '20250120')
+    ])
+    result = updater.generate_monthly_update(manager=dlogic_manager)
+    assert result['delta_version'] == start_version + 1
+    assert result['new_horses'] == 1 and result['updated_horses'] == 2
+    assert updater.watermarks.get('jvd_ks') == '20250215'
+
+    delta = load_delta(result['file_path'])
+    assert [race_date(r) for r in delta['horses'][HORSE_A]] == ['20250201', '20250105']
+    assert len(delta['horses'][HORSE_C]) == 4 and HORSE_D not in delta['horses']
+    # デルタの行はナレッジの過去走の形式（jvd_ksの列名は残らない）
+    knowledge_keys = set(to_knowledge_race(_row(HORSE_A, '20250105')))
+    for races in delta['horses'].values():
+        for race in races:
+            assert set(race) == knowledge_keys
+
+    horses = dlogic_manager.knowledge_data['horses']
+    a_dates = [race_date(r) for r in horses[HORSE_A]['races']]
+    assert a_dates[:3] == ['20250201', '20250105', '20241215'] and len(a_dates) == 10
+    assert horses[HORSE_A]['last_race_date'] == '20250201'
+    assert len(horses[HORSE_B]['race_history']) == 4
+    assert horses[HORSE_B]['aggregated_stats'] == {'total_races': 4, 'wins': 2}
+    assert horses[HORSE_B]['basic_info']['last_race_date'] == '20250110'
+    assert horses[HORSE_C]['race_count'] == 4 and HORSE_D not in horses
+    assert dlogic_manager.get_horse_raw_data(HORSE_C) is not None
+
+    # 追記した走で計算される（着順5着・1600m・良でない芝・馬体重480kg・増減+4）
+    scores = dlogic_manager.calculate_dlogic_realtime(HORSE_C)['d_logic_scores']
+    assert scores['1_distance_aptitude'] == 60.0
+    assert scores['5_track_aptitude'] == 68.0
+    assert scores['6_weather_aptitude'] == 68.0
+    assert scores['9_horse_weight_impact'] == (100 + 68) / 2
+    assert scores['10_corner_specialist_degree'] == 60.0
+    heavy = dlogic_manager.calculate_weather_adaptive_dlogic(HORSE_C, 2)
+    assert heavy['weather_details']['layer2_adaptive_ability'] == (0.9 + 0.9) / 2
+    b_wins = dlogic_manager.calculate_dlogic_realtime(HORSE_B)['d_logic_scores']['2_bloodline_evaluation']
+    assert b_wins == min(100, 2 / 4 * 200)
+
+    # スコアテーブルは変更された馬だけ再計算して追従する（readyは再計算しない）
+    assert not table.ready
+    assert table.catch_up() and table.ready
+    for name in (HORSE_A, HORSE_B, HORSE_C):
+        expected = dlogic_manager.calculate_dlogic_realtime(name)
+        looked_up = table.lookup(name)
+        assert looked_up['d_logic_scores'] == expected['d_logic_scores']
+        assert looked_up['total_score'] == expected['total_score']
+
+    # 新しい行が無ければデルタは作らない
+    result = updater.generate_monthly_update(manager=dlogic_manager)
+    assert result['file_path'] is None and result['delta_version'] == start_version + 1
+
+    # 2回目: ウォーターマーク当日の追加分（Aは取り込み済み・Dが2走目）
+    insert_rows([_row(HORSE_A, '20250215'), _row(HORSE_D, '20250215')])
+    result = updater.generate_monthly_update(manager=dlogic_manager)
+    assert result['delta_version'] == start_version + 2
+    delta = load_delta(result['file_path'])
+    assert list(delta['horses']) == [HORSE_A] and delta['meta']['base_version'] == start_version + 1
+
+    # 別サーバー: 元のナレッジにデルタを順に適用すると生成側と一致
+    other = copy.deepcopy(snapshot)
+    for version, path in list_deltas(updater.output_dir):
+        apply_delta_to_horses(other, load_delta(path))
+    for name in (HORSE_A, HORSE_B, HORSE_C):
+        assert {k: v for k, v in other[name].items() if k != 'last_updated'} == \
+            {k: v for k, v in horses[name].items() if k != 'last_updated'}
+
+    # 適用済みは無視、飛ばしたバージョンは拒否
+    assert dlogic_manager.apply_knowledge_delta(delta)['status'] == 'skipped'
+    gap = {'meta': {'version': start_version + 9, 'base_version': start_version + 8}, 'horses': {}}
+    try:
+        dlogic_manager.apply_knowledge_delta(gap)
+        assert False, "ベースバージョン不一致は例外"
+    except ValueError:
+        pass
+
+    print(f"  デルタ: {[os.path.basename(p) for _, p in list_deltas(updater.output_dir)]}")
+
+
+if __name__ == "__main__":
+    test_append_races_window()
+    test_knowledge_race_schema()
+    test_delta_pipeline()
+    print("✅ 全テスト成功")
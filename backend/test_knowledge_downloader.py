@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+ナレッジのダウンロードのテスト
+ローカルのHTTPサーバーをCDNの代わりにして、中断からの再開・ETagによる転送省略・
+SHA-256不一致の拒否・圧縮版の展開・保存したファイルからの読み込みを確認する
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from services.knowledge_downloader import DownloadIntegrityError, KnowledgeDownloader
+
+WORK_DIR = tempfile.mkdtemp(prefix='dlogic_download_test_')
+
+
+class StandInCDN:
+    """Range・If-Range・If-None-Match に対応した最小限のCDN"""
+
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        self.cut_after = {}   # パス -> 次のリクエストをこのバイト数で切断
+        cdn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                cdn.handle(self)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def publish(self, path, body, sha256=True):
+        self.files[path] = body
+        if sha256:
+            raw = gzip.decompress(body) if path.endswith('.gz') else body
+            self.files[path.rsplit('.gz', 1)[0] + '.sha256'] = \
+                f"{hashlib.sha256(raw).hexdigest()}  knowledge.json\n".encode()
+
+    def handle(self, handler):
+        path = handler.path
+        headers = {k: handler.headers[k] for k in ('Range', 'If-Range', 'If-None-Match') if handler.headers[k]}
+        body = self.files.get(path)
+        if body is None:
+            self.requests.append((path, headers, 404))
+            handler.send_response(404)
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if headers.get('If-None-Match') == etag:
+            self.requests.append((path, headers, 304))
+            handler.send_response(304)
+            handler.send_header('ETag', etag)
+            handler.end_headers()
+            return
+
+        start = 0
+        if 'Range' in headers and headers.get('If-Range', etag) == etag:
+            start = int(headers['Range'].split('=')[1].rstrip('-'))
+        status = 206 if start else 200
+        self.requests.append((path, headers, status))
+        handler.send_response(status)
+        handler.send_header('ETag', etag)
+        handler.send_header('Content-Length', str(len(body) - start))
+        if start:
+            handler.send_header('Content-Range', f"bytes {start}-{len(body) - 1}/{len(body)}")
+        handler.end_headers()
+
+        payload = body[start:]
+        cut = self.cut_after.pop(path, None)
+        if cut is not None:
+            handler.wfile.write(payload[:cut])
+            handler.wfile.flush()
+            handler.close_connection = True
+            return
+        handler.wfile.write(payload)
+
+
+@contextmanager
+def stand_in_cdn():
+    """テストごとに新しいCDNを起動し、終了時に停止する"""
+    cdn = StandInCDN()
+    try:
+        yield cdn
+    finally:
+        cdn.server.shutdown()
+        cdn.server.server_close()
+
+
+def knowledge_bytes(horse_count, tag):
+    horses = {
+        f"{tag}馬{h:05d}": {'races': [{'NENGAPPI': f'2024{m:02d}01', 'KYORI': '1600'} for m in range(1, 11)]}
+        for h in range(horse_count)
+    }
+    return json.dumps({'meta': {'version': tag}, 'horses': horses}, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def make_downloader(cdn, name, **kwargs):
+    kwargs.setdefault('backoff', 0)
+    return KnowledgeDownloader(f"{cdn.base_url}/knowledge.json", os.path.join(WORK_DIR, name), **kwargs)
+
+
+def test_download_and_not_modified():
+    """初回は全体を取得し、2回目はETag一致で転送しない"""
+    with stand_in_cdn() as cdn:
+        body = knowledge_bytes(300, '初回')
+        cdn.publish('/knowledge.json', body)
+        downloader = make_downloader(cdn, 'plain.json', compression='none')
+
+        result = downloader.download()
+        assert result['status'] == 'downloaded' and result['bytes_transferred'] == len(body)
+        with open(downloader.path, 'rb') as f:
+            assert f.read() == body
+
+        cdn.requests.clear()
+        result = downloader.download()
+        assert result['status'] == 'not_modified' and result['bytes_transferred'] == 0
+        assert [status for path, _, status in cdn.requests if path == '/knowledge.json'] == [304]
+
+        # 配布側が更新されたら取り直す
+        updated = knowledge_bytes(310, '更新')
+        cdn.publish('/knowledge.json', updated)
+        result = downloader.download()
+        assert result['status'] == 'downloaded'
+        with open(downloader.path, 'rb') as f:
+            assert f.read() == updated
+
+
+def test_resume_after_disconnect():
+    """途中で切断されても続きのバイトだけを取得して完成させる"""
+    with stand_in_cdn() as cdn:
+        body = knowledge_bytes(800, '再開')
+        cdn.publish('/knowledge.json', body)
+        cdn.cut_after['/knowledge.json'] = len(body) // 3
+        cdn.requests.clear()
+
+        downloader = make_downloader(cdn, 'resume.json', compression='none')
+        result = downloader.download()
+        offset = result['resumed_from']
+        assert result['status'] == 'downloaded'
+        assert 0 < offset <= len(body) // 3
+        assert result['bytes_transferred'] == len(body), "受信済みのバイトは再取得しない"
+        statuses = [(status, headers.get('Range')) for path, headers, status in cdn.requests if path == '/knowledge.json']
+        assert statuses == [(200, None), (206, f'bytes={offset}-')]
+        with open(downloader.path, 'rb') as f:
+            assert f.read() == body
+        assert not os.path.exists(downloader.path + '.part')
+
+
+def test_resume_across_processes():
+    """前回のプロセスが残した途中ファイルから再開し、配布側が変わっていれば最初から取り直す"""
+    with stand_in_cdn() as cdn:
+        body = knowledge_bytes(500, '途中')
+        cdn.publish('/knowledge.json', body)
+        downloader = make_downloader(cdn, 'partial.json', compression='none', retries=0)
+        cdn.cut_after['/knowledge.json'] = len(body) // 2
+        try:
+            downloader.download()
+            assert False, "再試行なしでは中断で失敗する"
+        except Exception:
+            pass
+        offset = os.path.getsize(downloader.path + '.part')
+        assert offset > 0 and not os.path.exists(downloader.path)
+
+        result = make_downloader(cdn, 'partial.json', compression='none').download()
+        assert result['resumed_from'] == offset and result['bytes_transferred'] == len(body) - offset
+
+        # 途中ファイルの版が古い場合、If-Range不一致で全体（200）が返る
+        cdn.cut_after['/knowledge.json'] = len(body) // 2
+        cdn.publish('/knowledge.json', knowledge_bytes(520, '途中'))
+        try:
+            make_downloader(cdn, 'partial.json', compression='none', retries=0).download(force=True)
+        except Exception:
+            pass
+        newer = knowledge_bytes(530, '途中')
+        cdn.publish('/knowledge.json', newer)
+        result = make_downloader(cdn, 'partial.json', compression='none').download()
+        assert result['resumed_from'] is None and result['bytes_transferred'] == len(newer)
+        with open(os.path.join(WORK_DIR, 'partial.json'), 'rb') as f:
+            assert f.read() == newer
+
+
+def test_sha256_mismatch_rejected():
+    """公開SHA-256と一致しなければ既存ファイルを置き換えない"""
+    with stand_in_cdn() as cdn:
+        good = knowledge_bytes(100, '正常')
+        cdn.publish('/knowledge.json', good)
+        downloader = make_downloader(cdn, 'verified.json', compression='none')
+        downloader.download()
+
+        cdn.files['/knowledge.json'] = knowledge_bytes(100, '改ざん')
+        try:
+            downloader.download()
+            assert False, "SHA-256不一致は例外"
+        except DownloadIntegrityError:
+            pass
+        with open(downloader.path, 'rb') as f:
+            assert f.read() == good
+        assert not os.path.exists(downloader.path + '.part')
+
+        # 公開値が必須なのに無い場合も失敗
+        del cdn.files['/knowledge.json.sha256']
+        try:
+            make_downloader(cdn, 'verified.json', compression='none', require_sha256=True).download()
+            assert False, "公開SHA-256なしは例外"
+        except DownloadIntegrityError:
+            pass
+
+
+def test_compressed_variant():
+    """gz版があればそちらを取得して展開し、元のJSONのSHA-256で照合する"""
+    with stand_in_cdn() as cdn:
+        body = knowledge_bytes(1000, '圧縮')
+        compressed = gzip.compress(body)
+        cdn.files.clear()
+        cdn.publish('/knowledge.json', body)
+        cdn.publish('/knowledge.json.gz', compressed)
+        cdn.requests.clear()
+
+        downloader = make_downloader(cdn, 'compressed.json', compression='gzip')
+        result = downloader.download()
+        assert result['compression'] == 'gzip' and result['bytes_transferred'] == len(compressed)
+        with open(downloader.path, 'rb') as f:
+            assert f.read() == body
+        assert not any(path == '/knowledge.json' for path, _, _ in cdn.requests)
+        print(f"  gz版: {len(body) / 1024:.0f}KB -> 転送 {len(compressed) / 1024:.0f}KB")
+
+        assert downloader.download()['status'] == 'not_modified'
+
+        # gz版が無ければ非圧縮版にフォールバック
+        del cdn.files['/knowledge.json.gz']
+        result = make_downloader(cdn, 'fallback.json', compression='gzip').download()
+        assert result['compression'] is None and result['sha256'] == hashlib.sha256(body).hexdigest()
+
+
+def test_manager_parses_downloaded_file():
+    """dlogic_managerのダウンロードは保存したファイルから読み込む"""
+    with stand_in_cdn() as cdn:
+        from services import dlogic_raw_data_manager as module
+
+        body = knowledge_bytes(50, 'マネージャー')
+        cdn.files.clear()
+        cdn.publish('/knowledge.json', body)
+
+        manager = module.DLogicRawDataManager.__new__(module.DLogicRawDataManager)
+        manager.knowledge_file = os.path.join(WORK_DIR, 'manager.json')
+        original = module.KNOWLEDGE_CDN_URL
+        module.KNOWLEDGE_CDN_URL = f"{cdn.base_url}/knowledge.json"
+        try:
+            data = manager._download_from_github()
+        finally:
+            module.KNOWLEDGE_CDN_URL = original
+        assert len(data['horses']) == 50 and data['meta']['version'] == 'マネージャー'
+        with open(manager.knowledge_file, 'rb') as f:
+            assert f.read() == body
+
+
+if __name__ == "__main__":
+    test_download_and_not_modified()
+    test_resume_after_disconnect()
+    test_resume_across_processes()
+    test_sha256_mismatch_rejected()
+    test_compressed_variant()
+    test_manager_parses_downloaded_file()
+    print("✅ 全テスト成功")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+ナレッジJSONのバイト位置インデックスのテスト
+チャンク境界・文字列内の括弧やエスケープ・整形の有無にかかわらず全馬の範囲を記録できること、
+遅延読み込みマネージャーが該当範囲だけをデコードして馬データを返すことを確認する
+"""
+
+import json
+import os
+import random
+import tempfile
+import time
+
+from services.knowledge_offset_index import HorseOffsetScanner, read_horse, scan_horse_offsets
+
+WORK_DIR = tempfile.mkdtemp(prefix='dlogic_offset_test_')
+
+# 遅延読み込みマネージャーはインポート時にグローバルインスタンスを作るので、先に向き先を差し替える
+LAZY_FILE = os.path.join(WORK_DIR, 'lazy_knowledge.json')
+os.environ['DLOGIC_LAZY_KNOWLEDGE_FILE'] = LAZY_FILE
+os.environ['DLOGIC_LAZY_INDEX_FILE'] = os.path.join(WORK_DIR, 'lazy_index.json')
+os.environ['DLOGIC_LAZY_KNOWLEDGE_URL'] = 'http://127.0.0.1:9/knowledge.json'
+os.environ['KNOWLEDGE_DOWNLOAD_RETRIES'] = '0'
+
+TRICKY_HORSES = {
+    'ブレース{馬}': {'races': [{'KYOSOMEI_HONDAI': '記念{特別}[G1]', 'KYORI': '1600'}]},
+    'クオート"馬\\': {'races': [{'KYOSOMEI_HONDAI': 'エスケープ\\"}{', 'BIKO': '改行\nタブ\t'}]},
+    '空の馬': {},
+    'リスト馬': {'races': [], 'tags': [[1, 2], {'x': [3]}]},
+}
+
+
+def make_knowledge(horse_count, seed):
+    rng = random.Random(seed)
+    horses = {}
+    for h in range(horse_count):
+        horses[f"テスト馬{h:05d}"] = {
+            'basic_info': {'sex': str(rng.randint(1, 3))},
+            'races': [
+                {'NENGAPPI': f'2024{m:02d}01', 'KAKUTEI_CHAKUJUN': f'{rng.randint(1, 18):02d}',
+                 'KYORI': str(rng.choice([1200, 1600, 2000])), 'KISHUMEI_RYAKUSHO': 'ルメール'}
+                for m in range(1, 11)
+            ]
+        }
+    horses.update(TRICKY_HORSES)
+    return {'meta': {'version': 'テスト', 'note': '"horses": { はここでは無関係'}, 'horses': horses}
+
+
+def write(path, data, **dump_kwargs):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, **dump_kwargs)
+
+
+def test_scanner_matches_full_parse():
+    """どの整形・チャンクサイズでも全馬の範囲が json.load の結果と一致する"""
+    data = make_knowledge(200, 1)
+    variants = [
+        {'ensure_ascii': False, 'indent': 2},
+        {'ensure_ascii': False, 'separators': (',', ':')},
+        {'ensure_ascii': True},
+    ]
+    for index, dump_kwargs in enumerate(variants):
+        path = os.path.join(WORK_DIR, f'variant{index}.json')
+        write(path, data, **dump_kwargs)
+        for chunk_size in (1, 7, 4096, 1024 * 1024):
+            offsets = scan_horse_offsets(path, chunk_size=chunk_size)
+            assert list(offsets) == list(data['horses']), (dump_kwargs, chunk_size)
+            for name in ('テスト馬00000', 'テスト馬00199', *TRICKY_HORSES):
+                assert read_horse(path, *offsets[name]) == data['horses'][name], (name, chunk_size)
+
+
+def test_scanner_stops_after_horses():
+    """horsesの後ろは読まない（同じ名前のキーが後ろにあっても無関係）"""
+    body = json.dumps({'horses': {'A': {'x': 1}}, 'tail': {'horses': {'B': {}}}}).encode()
+    scanner = HorseOffsetScanner()
+    scanner.feed(body)
+    assert scanner.done and list(scanner.offsets) == ['A']
+
+
+def test_lazy_manager_seeks_to_horse():
+    """遅延読み込みマネージャーはインデックスのバイト範囲から1頭分だけ読み込む"""
+    data = make_knowledge(300, 2)
+    write(LAZY_FILE, data, ensure_ascii=False, indent=2)
+
+    from services.dlogic_lazy_data_manager import DLogicLazyDataManager, lazy_dlogic_manager
+    assert len(lazy_dlogic_manager.horse_index) == len(data['horses'])
+    assert lazy_dlogic_manager.get_horse_raw_data('テスト馬00123') == data['horses']['テスト馬00123']
+    assert lazy_dlogic_manager.get_horse_raw_data('ブレース{馬}') == TRICKY_HORSES['ブレース{馬}']
+    assert lazy_dlogic_manager.get_horse_raw_data('存在しない馬') is None
+    result = lazy_dlogic_manager.calculate_dlogic_realtime('テスト馬00042')
+    assert 'error' not in result and result['horse_name'] == 'テスト馬00042'
+
+    # 保存したインデックスはファイルが同じなら再利用、変わっていれば作り直す
+    with open(lazy_dlogic_manager.index_file, 'r', encoding='utf-8') as f:
+        saved = json.load(f)
+    assert saved['horses']['テスト馬00123'] == lazy_dlogic_manager.horse_index['テスト馬00123']
+
+    data['horses']['追加馬'] = {'races': [{'KYORI': '2400'}]}
+    write(LAZY_FILE, data, ensure_ascii=False, separators=(',', ':'))
+    later = time.time() + 5
+    os.utime(LAZY_FILE, (later, later))
+    reloaded = DLogicLazyDataManager()
+    assert reloaded.get_horse_raw_data('追加馬') == {'races': [{'KYORI': '2400'}]}
+    assert reloaded.get_horse_raw_data('テスト馬00123') == data['horses']['テスト馬00123']
+
+
+def benchmark_seek_vs_full_parse():
+    """1頭の読み込み: ファイル全体の解析 vs バイト範囲へのシーク"""
+    path = os.path.join(WORK_DIR, 'benchmark.json')
+    data = make_knowledge(20000, 3)
+    write(path, data, ensure_ascii=False, indent=2)
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    del data
+
+    start = time.time()
+    offsets = scan_horse_offsets(path)
+    scan_elapsed = time.time() - start
+
+    start = time.time()
+    with open(path, 'r', encoding='utf-8') as f:
+        full = json.load(f)['horses']['テスト馬12345']
+    full_elapsed = time.time() - start
+
+    names = [f'テスト馬{i:05d}' for i in range(0, 20000, 200)]
+    start = time.time()
+    for name in names:
+        horse = read_horse(path, *offsets[name])
+    seek_elapsed = (time.time() - start) / len(names)
+    assert read_horse(path, *offsets['テスト馬12345']) == full and horse
+
+    print(f"  ナレッジJSON: {size_mb:.1f}MB / インデックス作成: {scan_elapsed:.2f}秒 "
+          f"({size_mb / scan_elapsed:.0f}MB/秒)")
+    print(f"  1頭の読み込み: 全体解析 {full_elapsed * 1000:.0f}ms / シーク {seek_elapsed * 1000:.3f}ms")
+    assert seek_elapsed * 50 < full_elapsed
+
+
+if __name__ == "__main__":
+    test_scanner_matches_full_parse()
+    test_scanner_stops_after_horses()
+    test_lazy_manager_seeks_to_horse()
+    benchmark_seek_vs_full_parse()
+    print("✅ 全テスト成功")
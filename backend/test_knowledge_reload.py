@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+ナレッジのホットリロードのテスト
+分析を続けながらバックグラウンドで差し替えられること、依存キャッシュ・スコアテーブルが
+新しいナレッジに追従すること、サーバープロセスのメモリ増加がJSON全体の読み込みより小さいことを確認する
+"""
+
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+
+os.environ.setdefault('DLOGIC_PRECOMPUTE_SCORES', 'false')
+
+from services.cache_service import cache_service
+from services.dlogic_raw_data_manager import dlogic_manager
+from services.fast_dlogic_engine import FastDLogicEngine
+from services.knowledge_reloader import KnowledgeReloader
+
+WORK_DIR = tempfile.mkdtemp(prefix='dlogic_reload_test_')
+
+
+def write_knowledge(path, prefix, horse_count, seed):
+    rng = random.Random(seed)
+    horses = {}
+    for h in range(horse_count):
+        races = []
+        for r in range(10):
+            races.append({
+                'KAISAI_NEN': '2024', 'KAISAI_GAPPI': f'{12 - r:02d}01',
+                'KAKUTEI_CHAKUJUN': f'{rng.randint(1, 18):02d}', 'KYORI': str(rng.choice([1200, 1600, 2000])),
+                'TANSHO_NINKIJUN': str(rng.randint(1, 18)), 'TANSHO_ODDS': str(rng.randint(15, 999)),
+                'FUTAN_JURYO': '550', 'BATAIJU': str(rng.randint(420, 520)), 'ZOGEN_SA': '+002',
+                'CORNER1_JUNI': '3', 'CORNER2_JUNI': '3', 'CORNER3_JUNI': '2', 'CORNER4_JUNI': '1',
+                'SOHA_TIME': str(rng.randint(1300, 2500)), 'TRACK_CODE': rng.choice(['10', '23']),
+                'SHIBA_BABAJOTAI_CODE': str(rng.randint(1, 4)), 'DIRT_BABAJOTAI_CODE': str(rng.randint(1, 4)),
+                'KISHUMEI_RYAKUSHO': rng.choice(['ルメール', '川田将雅', '武豊']),
+                'CHOKYOSHIMEI_RYAKUSHO': '友道康夫', 'CHAKUSA': 'ハナ'
+            })
+        horses[f"{prefix}{h:05d}"] = {'basic_info': {'sex': '1'}, 'races': races}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'meta': {'version': prefix}, 'horses': horses}, f, ensure_ascii=False, indent=2)
+    # 同じ秒内に書き直してもJSONの方が新しいと判定されるよう更新時刻を進める
+    later = time.time() + seed
+    os.utime(path, (later, later))
+
+
+def setup():
+    dlogic_manager.knowledge_file = os.path.join(WORK_DIR, 'knowledge.json')
+    dlogic_manager.columnar_file = os.path.join(WORK_DIR, 'knowledge.dlcol')
+    engine = FastDLogicEngine()
+    engine.build_table = True
+    engine.score_table.table_file = os.path.join(WORK_DIR, 'score_table.pkl')
+    reloader = KnowledgeReloader(dlogic_manager, cache_service)
+    return engine, reloader
+
+
+_context = None
+
+
+def context():
+    """各テストで共有するエンジンとリローダー（テストは順に前のナレッジを引き継ぐ）"""
+    global _context
+    if _context is None:
+        _context = setup()
+    return _context
+
+
+def test_reload_swaps_knowledge():
+    """差し替え後はナレッジ・名前解決・スコアテーブル・キャッシュが新しい内容になる"""
+    engine, reloader = context()
+    write_knowledge(dlogic_manager.knowledge_file, '旧ナレッジ馬', 200, 1)
+    reloader.reload('local')
+    assert len(dlogic_manager.knowledge_data['horses']) == 200
+    assert dlogic_manager.get_horse_raw_data('旧ナレッジ馬00007') is not None
+    assert engine.score_table.ready and len(engine.score_table) == 200
+
+    cache_service.set('dlogic_analysis', '旧ナレッジ馬00007', {'total_score': 1.0})
+    cache_service.set('faq_response', 'ナレッジと無関係', {'answer': 'ok'})
+    old_version = dlogic_manager.get_knowledge_version()
+
+    write_knowledge(dlogic_manager.knowledge_file, '新ナレッジ馬', 300, 2)
+    status = reloader.reload('local')
+    assert status['state'] == 'completed' and status['horses'] == 300
+    assert status['previous_version'] == old_version != status['knowledge_version']
+    assert '旧ナレッジ馬00007' not in dlogic_manager.knowledge_data['horses']
+    assert dlogic_manager.get_horse_raw_data('新ナレッジ馬00299') is not None
+    assert cache_service.get('dlogic_analysis', '旧ナレッジ馬00007') is None
+    assert cache_service.get('faq_response', 'ナレッジと無関係') == {'answer': 'ok'}
+
+    # スコアテーブルは新しいナレッジで再構築され、リアルタイム計算と一致
+    assert engine.score_table.ready and len(engine.score_table) == 300
+    name = '新ナレッジ馬00042'
+    assert engine.score_table.lookup(name)['d_logic_scores'] == \
+        dlogic_manager.calculate_dlogic_realtime(name)['d_logic_scores']
+
+
+def test_background_reload_while_serving():
+    """分析を続けながらバックグラウンドで差し替えても失敗しない"""
+    engine, reloader = context()
+    write_knowledge(dlogic_manager.knowledge_file, '背景馬', 1500, 3)
+    names = [f'新ナレッジ馬{i:05d}' for i in range(0, 300, 7)] + [f'背景馬{i:05d}' for i in range(0, 1500, 97)]
+    errors = []
+    served = 0
+    stop = threading.Event()
+
+    def serve():
+        nonlocal served
+        while not stop.is_set():
+            for name in names:
+                try:
+                    engine.analyze_single_horse(name)
+                    served += 1
+                except Exception as e:
+                    errors.append(repr(e))
+
+    worker = threading.Thread(target=serve)
+    worker.start()
+    assert reloader.start('local')
+    assert not reloader.start('local'), "実行中の二重起動は拒否"
+    reloader.wait(120)
+    stop.set()
+    worker.join()
+
+    assert not errors, errors[:3]
+    assert reloader.get_status()['state'] == 'completed'
+    assert len(dlogic_manager.knowledge_data['horses']) == 1500
+    print(f"  差し替え中の分析: {served}回")
+
+
+def test_failed_reload_keeps_old_knowledge():
+    """変換に失敗しても旧ナレッジのまま動き続ける"""
+    _, reloader = context()
+    version = dlogic_manager.get_knowledge_version()
+    with open(dlogic_manager.knowledge_file, 'w', encoding='utf-8') as f:
+        f.write('{"meta": {}, "horses": {"壊れた')
+    later = time.time() + 10
+    os.utime(dlogic_manager.knowledge_file, (later, later))
+    try:
+        reloader.reload('local')
+        assert False, "壊れたファイルは失敗する"
+    except RuntimeError:
+        pass
+    assert reloader.get_status()['state'] == 'failed'
+    assert dlogic_manager.get_knowledge_version() == version
+    assert dlogic_manager.get_horse_raw_data('背景馬00001') is not None
+
+
+def benchmark_reload_memory():
+    """サーバープロセスのメモリ増加: JSON全体の読み込み vs ホットリロード"""
+    _, reloader = context()
+    path = dlogic_manager.knowledge_file
+    write_knowledge(path, 'メモリ計測馬', 4000, 20)
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+
+    tracemalloc.start()
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    _, json_peak = tracemalloc.get_traced_memory()
+    del data
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    start = time.time()
+    reloader.reload('local')
+    elapsed = time.time() - start
+    _, reload_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"  ナレッジJSON: {size_mb:.1f}MB / json.load ピーク: {json_peak / 1024 / 1024:.1f}MB / "
+          f"ホットリロード ピーク: {reload_peak / 1024 / 1024:.1f}MB ({elapsed:.2f}秒)")
+    assert reload_peak < json_peak / 2
+
+
+if __name__ == "__main__":
+    test_reload_swaps_knowledge()
+    test_background_reload_while_serving()
+    test_failed_reload_keeps_old_knowledge()
+    benchmark_reload_memory()
+    print("✅ 全テスト成功")
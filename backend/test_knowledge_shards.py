@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+バイナリ分割形式（シャード）のテスト
+全馬が分割前と同じデータで読めること、出走馬の一括検索で該当馬のいるシャードだけを開くこと、
+存在しない馬はBloomフィルタでシャードを開かずに除外されることを確認する
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from services.knowledge_shards import BloomFilter, ShardedKnowledge, shard_for, write_shards
+
+WORK_DIR = tempfile.mkdtemp(prefix='dlogic_shard_test_')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'chunks'))
+
+
+def make_knowledge(horse_count, seed):
+    rng = random.Random(seed)
+    horses = {}
+    for h in range(horse_count):
+        horses[f"シャード馬{h:05d}"] = {
+            'basic_info': {'sex': str(rng.randint(1, 3))},
+            'races': [
+                {'KAKUTEI_CHAKUJUN': f'{rng.randint(1, 18):02d}', 'KYORI': str(rng.choice([1200, 1600, 2000])),
+                 'KISHUMEI_RYAKUSHO': rng.choice(['ルメール', '武豊', '川田']), 'SOHA_TIME': str(rng.randint(1080, 2300))}
+                for _ in range(rng.randint(0, 15))
+            ]
+        }
+    horses['AUGUSTE RODIN'] = {'races': []}
+    return {'meta': {'version': 'テスト', 'created': '2025-08-08T00:00:00'}, 'horses': horses}
+
+
+def test_bloom_filter():
+    """追加した名前は必ず含まれ、偽陽性率はおおむね設定値以下"""
+    bloom = BloomFilter.for_capacity(5000, 0.01)
+    for i in range(5000):
+        bloom.add(f"登録馬{i}")
+    assert all(f"登録馬{i}" in bloom for i in range(5000))
+    false_positives = sum(1 for i in range(20000) if f"未登録馬{i}" in bloom)
+    print(f"  Bloomフィルタ偽陽性率: {false_positives / 20000 * 100:.2f}%")
+    assert false_positives / 20000 < 0.02
+
+
+def test_all_horses_round_trip():
+    """ハッシュ・アルファベット順どちらの分割でも全馬が元のデータで読める"""
+    data = make_knowledge(3000, 1)
+    for split_method in ('hash', 'alphabetical'):
+        output_dir = os.path.join(WORK_DIR, split_method)
+        index = write_shards(data, output_dir, 8, split_method=split_method)
+        assert sum(chunk['horses_count'] for chunk in index['chunks']) == len(data['horses'])
+
+        shards = ShardedKnowledge(output_dir)
+        for name, horse in data['horses'].items():
+            assert shards.find_horse(name) == horse, (split_method, name)
+        assert shards.load_all_horses() == data['horses']
+        shards.close()
+
+    # シャードの割り当てはプロセスをまたいで一定（Pythonのhash()を使わない）
+    assert shard_for('シャード馬00001', 8) == shard_for('シャード馬00001', 8)
+    with open(os.path.join(WORK_DIR, 'hash', 'dlogic_index.json'), 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    assert index['meta']['format'] == 'dlshard' and index['meta']['hash'] == 'blake2b'
+
+
+def test_race_field_touches_only_needed_shards():
+    """出走馬の一括検索は、その馬たちがいるシャードだけを開く"""
+    data = make_knowledge(4000, 2)
+    output_dir = os.path.join(WORK_DIR, 'field')
+    write_shards(data, output_dir, 32)
+    shards = ShardedKnowledge(output_dir)
+
+    field = [f"シャード馬{h:05d}" for h in random.Random(3).sample(range(4000), 16)]
+    missing = [f"出走取消馬{i}" for i in range(20)]
+    results = shards.find_horses(field + missing)
+    assert all(results[name] == data['horses'][name] for name in field)
+    assert all(results[name] is None for name in missing)
+
+    expected = {shard_for(name, 32) + 1 for name in field}
+    extra = shards.opened_shards - expected
+    print(f"  出走馬16頭+存在しない馬20頭: 開いたシャード {len(shards.opened_shards)}/32 "
+          f"(Bloomフィルタの偽陽性で開いた分 {len(extra)})")
+    assert expected <= shards.opened_shards and len(extra) <= 2
+    assert shards.filter_rejections >= 18
+    shards.close()
+
+
+def test_chunk_loader_reads_shards():
+    """data/chunks のローダーもシャード形式のインデックスを読める"""
+    from dlogic_loader import DLogicDataLoader
+
+    data = make_knowledge(500, 4)
+    output_dir = os.path.join(WORK_DIR, 'loader')
+    write_shards(data, output_dir, 4)
+    loader = DLogicDataLoader(output_dir)
+    assert loader.find_horse('シャード馬00042') == data['horses']['シャード馬00042']
+    assert loader.find_horse('存在しない馬') is None
+    names = ['シャード馬00001', 'シャード馬00499', '存在しない馬']
+    assert loader.find_horses(names) == {name: data['horses'].get(name) for name in names}
+    assert loader.get_stats()['total_horses'] == len(data['horses'])
+    assert loader.load_all_horses() == data['horses']
+
+
+def test_render_manager_batch():
+    """RenderDataManager.find_horses_batch はシャード形式で必要なシャードだけを開く"""
+    try:
+        from render_data_manager import RenderDataManager
+    except ImportError as e:
+        print(f"  RenderDataManager: スキップ（{e}）")
+        return
+
+    data = make_knowledge(2000, 5)
+    output_dir = os.path.join(WORK_DIR, 'render')
+    write_shards(data, output_dir, 16)
+    manager = RenderDataManager(output_dir)
+    field = ['シャード馬00007', 'シャード馬01234', '存在しない馬']
+    results = asyncio.run(manager.find_horses_batch(field))
+    assert results == {name: data['horses'].get(name) for name in field}
+    stats = asyncio.run(manager.get_stats())
+    assert stats['cached_chunks'] <= 3 and stats['total_horses'] == len(data['horses'])
+
+
+def benchmark_json_chunks_vs_shards():
+    """出走馬18頭の検索: JSONチャンク（チャンク全体を読む）vs シャード（該当馬だけ展開）"""
+    from dlogic_loader import DLogicDataLoader
+
+    data = make_knowledge(30000, 6)
+    json_dir = os.path.join(WORK_DIR, 'json_chunks')
+    os.makedirs(json_dir, exist_ok=True)
+    names = sorted(data['horses'])
+    chunks = []
+    for i in range(0, len(names), 7500):
+        chunk_names = names[i:i + 7500]
+        filename = f'dlogic_raw_knowledge_chunk_{len(chunks) + 1:02d}.json'
+        with open(os.path.join(json_dir, filename), 'w', encoding='utf-8') as f:
+            json.dump({'meta': data['meta'], 'horses': {n: data['horses'][n] for n in chunk_names}},
+                      f, ensure_ascii=False, indent=2)
+        chunks.append({'chunk_id': len(chunks) + 1, 'filename': filename, 'horses_count': len(chunk_names),
+                       'first_horse': chunk_names[0], 'last_horse': chunk_names[-1]})
+    with open(os.path.join(json_dir, 'dlogic_index.json'), 'w', encoding='utf-8') as f:
+        json.dump({'meta': {'split_method': 'alphabetical', 'total_chunks': len(chunks)}, 'chunks': chunks}, f)
+    json_size = sum(os.path.getsize(os.path.join(json_dir, c['filename'])) for c in chunks)
+
+    shard_dir = os.path.join(WORK_DIR, 'shards')
+    index = write_shards(data, shard_dir, 16)
+    shard_size = sum(chunk['size_bytes'] for chunk in index['chunks'])
+
+    field = random.Random(7).sample(names, 18)
+    start = time.time()
+    json_results = DLogicDataLoader(json_dir).find_horses(field)
+    json_elapsed = time.time() - start
+
+    start = time.time()
+    shards = ShardedKnowledge(shard_dir)
+    shard_results = shards.find_horses(field)
+    shard_elapsed = time.time() - start
+    assert json_results == shard_results
+
+    print(f"  30000頭: JSONチャンク {json_size / 1024 / 1024:.1f}MB / シャード {shard_size / 1024 / 1024:.1f}MB")
+    print(f"  出走馬18頭（起動直後）: JSONチャンク {json_elapsed * 1000:.0f}ms / "
+          f"シャード {shard_elapsed * 1000:.1f}ms（{len(shards.opened_shards)}シャード）")
+    assert shard_elapsed * 10 < json_elapsed
+
+
+if __name__ == "__main__":
+    test_bloom_filter()
+    test_all_horses_round_trip()
+    test_race_field_touches_only_needed_shards()
+    test_chunk_loader_reads_shards()
+    test_render_manager_batch()
+    benchmark_json_chunks_vs_shards()
+    print("✅ 全テスト成功")
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+MyLogic重み再計算（12項目行列 × 重みベクトル）のテスト
+1頭ずつ分析して重み付けする従来の計算と一致すること、
+出走馬の12項目は1回だけ取得されること、重み変更の再計算時間を確認する
+"""
+
+import os
+import random
+import time
+
+os.environ.setdefault('DLOGIC_PRECOMPUTE_SCORES', 'false')
+
+from services.mylogic_calculator import MyLogicCalculator
+
+WEIGHT_KEYS = ["_".join(key.split("_")[1:]) for key in MyLogicCalculator.D_LOGIC_KEYS]
+
+calculator = MyLogicCalculator()
+
+
+def random_weights(rng):
+    """合計100の重み（0の項目を含む）"""
+    cuts = sorted(rng.randint(0, 100) for _ in range(len(WEIGHT_KEYS) - 1))
+    parts = [b - a for a, b in zip([0] + cuts, cuts + [100])]
+    return dict(zip(WEIGHT_KEYS, parts))
+
+
+def legacy_score(horse_name, weights):
+    """従来の計算: 1頭ずつ標準分析してから重み付け（分析できない馬はNone）"""
+    try:
+        standard = calculator.dlogic_engine.analyze_single_horse(horse_name)
+    except Exception:
+        return None
+    if not standard or "total_score" not in standard:
+        return None
+    return calculator._calculate_mylogic_score(standard.get("d_logic_scores", {}), weights)
+
+
+def race_field(seed, size=18):
+    names = list(calculator.dlogic_engine.raw_manager.knowledge_data.get('horses', {}))
+    return random.Random(seed).sample(names, size)
+
+
+def test_matches_per_horse_calculation():
+    """行列での再計算が1頭ずつの計算と一致する（丸め境界で0.01以内）"""
+    rng = random.Random(1)
+    compared = exact = 0
+    for seed in range(5):
+        field = race_field(seed)
+        for _ in range(10):
+            weights = random_weights(rng)
+            for result in calculator.analyze_multiple_horses(field, weights):
+                expected = legacy_score(result["horse_name"], weights)
+                if expected is None:
+                    assert "error" in result and result["mylogic_score"] == 0
+                    continue
+                assert abs(result["mylogic_score"] - expected) <= 0.01 + 1e-9, (result, expected)
+                compared += 1
+                exact += result["mylogic_score"] == expected
+    print(f"  比較: {compared}件 / 完全一致: {exact}件")
+
+
+def test_result_shape_and_errors():
+    """詳細・エラー行・合計0の重みは従来と同じ形"""
+    weights = random_weights(random.Random(2))
+    field = [name for name in race_field(10, 10) if legacy_score(name, weights) is not None][:3]
+    field.append("存在しない馬XYZ")
+    results = calculator.analyze_multiple_horses(field, weights)
+    assert [r["horse_name"] for r in results][-1] == "存在しない馬XYZ"
+    assert results[-1]["error"] == "分析データが見つかりません" and results[-1]["mylogic_score"] == 0
+    assert all("individual_contributions" in r for r in results[:-1])
+    assert [r["mylogic_score"] for r in results[:-1]] == sorted((r["mylogic_score"] for r in results[:-1]), reverse=True)
+
+    preview = calculator.analyze_multiple_horses(field, weights, details=False)
+    assert "individual_scores" not in preview[0]
+    assert [r["mylogic_score"] for r in preview] == [r["mylogic_score"] for r in results]
+
+    zero = calculator.analyze_multiple_horses(field[:2], dict.fromkeys(WEIGHT_KEYS, 0))
+    assert all(r["mylogic_score"] == 50.0 for r in zero)
+
+    single = calculator.calculate_with_custom_weights(field[0], weights)
+    assert single["mylogic_score"] == legacy_score(field[0], weights)
+
+    baseline = calculator.calculate_with_custom_weights("ダンスインザダーク", weights)
+    assert baseline["standard_score"] == 100.0
+
+
+def test_field_fetched_once():
+    """同じ出走馬は重みを変えても12項目を取得し直さない（ナレッジ更新後は取り直す）"""
+    engine = calculator.dlogic_engine
+    original = engine._batch_standard_results
+    calls = []
+
+    def counting(horse_names):
+        calls.append(list(horse_names))
+        return original(horse_names)
+
+    engine._batch_standard_results = counting
+    try:
+        field = race_field(20)
+        rng = random.Random(3)
+        for _ in range(20):
+            calculator.analyze_multiple_horses(field, random_weights(rng))
+        assert len(calls) == 1
+
+        engine.raw_manager.add_horse_raw_data("MyLogicテスト馬", {"race_history": []})
+        calculator.analyze_multiple_horses(field, random_weights(rng))
+        assert len(calls) == 2
+    finally:
+        engine._batch_standard_results = original
+
+
+def benchmark_reweighting():
+    """18頭の重み変更: 1頭ずつ分析して重み付け vs キャッシュ済み行列 × 重みベクトル"""
+    field = race_field(30)
+    rng = random.Random(4)
+    weight_sets = [random_weights(rng) for _ in range(50)]
+
+    start = time.perf_counter()
+    for weights in weight_sets[:5]:
+        for horse_name in field:
+            legacy_score(horse_name, weights)
+    legacy_elapsed = (time.perf_counter() - start) / 5
+
+    calculator.analyze_multiple_horses(field, weight_sets[0], details=False)
+    start = time.perf_counter()
+    for weights in weight_sets:
+        calculator.analyze_multiple_horses(field, weights, details=False)
+    matrix_elapsed = (time.perf_counter() - start) / len(weight_sets)
+
+    print(f"  18頭の重み再計算: 1頭ずつ {legacy_elapsed * 1000:.2f}ms / 行列 {matrix_elapsed * 1e6:.0f}µs")
+    assert matrix_elapsed * 5 < legacy_elapsed
+
+
+if __name__ == "__main__":
+    test_matches_per_horse_calculation()
+    test_result_shape_and_errors()
+    test_field_fetched_once()
+    benchmark_reweighting()
+    print("✅ 全テスト成功")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""MySQLフォールバックの一括取得テスト（MySQL不要・接続マネージャーを差し替え）"""
+
+import asyncio
+from services.dlogic_mysql_fallback import DLogicMySQLFallback
+
+
+class RecordingManager:
+    """execute_queryの呼び出しを記録する接続マネージャー"""
+
+    def __init__(self, race_counts):
+        self.race_counts = race_counts
+        self.calls = []
+
+    def execute_query(self, query, params=None, fetch_all=True):
+        self.calls.append((query, params))
+        rows = []
+        for horse_name in sorted(params):
+            for i in range(self.race_counts.get(horse_name, 0)):
+                rows.append({'BAMEI': horse_name, 'KAKUTEI_CHAKUJUN': f'{i + 1:02d} ', 'KYORI': 1600})
+        return rows
+
+
+def test_single_round_trip():
+    """未登録馬が複数いても1クエリで取得する"""
+    manager = RecordingManager({'馬A': 7, '馬B': 3, '馬C': 2})
+    fallback = DLogicMySQLFallback(enabled=True)
+    fallback._manager = manager
+
+    results = asyncio.run(fallback.fetch_horses_async(['馬A', '馬B', '馬C', '馬D', '馬A']))
+
+    assert len(manager.calls) == 1
+    query, params = manager.calls[0]
+    assert 'BAMEI IN (%s, %s, %s, %s)' in query
+    assert params == ('馬A', '馬B', '馬C', '馬D')
+    # 最新5走まで・3走未満は除外
+    assert sorted(results) == ['馬A', '馬B']
+    assert results['馬A']['race_count'] == 5
+    assert results['馬A']['races'][0]['KAKUTEI_CHAKUJUN'] == '01'
+
+    # 見つからなかった馬は再問い合わせしない
+    fallback.fetch_horses(['馬C', '馬D'])
+    assert len(manager.calls) == 1
+
+
+def test_disabled():
+    """無効時は問い合わせない"""
+    manager = RecordingManager({'馬A': 5})
+    fallback = DLogicMySQLFallback(enabled=False)
+    fallback._manager = manager
+    assert fallback.fetch_horses(['馬A']) == {}
+    assert manager.calls == []
+
+
+if __name__ == "__main__":
+    test_single_round_trip()
+    test_disabled()
+    print("✅ 全テスト成功")
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""出走馬分析の実行モード（逐次・スレッド・プロセス）で結果と順位が一致することを確認"""
+
+import time
+from services.fast_dlogic_engine import FastDLogicEngine
+
+RACE_SIZE = 18
+VOLATILE_KEYS = ('timing_breakdown', 'calculation_time_seconds', 'calculation_time')
+
+
+def _strip(result):
+    horses = []
+    for horse in result['horses']:
+        horse = dict(horse)
+        for key in VOLATILE_KEYS:
+            horse.pop(key, None)
+        horses.append(horse)
+    return horses
+
+
+def test_execution_modes_match():
+    engine = FastDLogicEngine()
+    horse_names = list(engine.raw_manager.knowledge_data.get('horses', {}))[:RACE_SIZE]
+
+    results = {}
+    for mode in ('sequential', 'thread', 'process'):
+        engine.reset_executor()
+        engine.execution_mode = mode
+        start_time = time.time()
+        standard = engine.analyze_race_horses(horse_names)
+        weather = engine.analyze_race_horses_weather(horse_names, 3)
+        elapsed = time.time() - start_time
+        print(f"{mode}: {elapsed:.3f}秒 {standard['race_analysis']['phase_timings']}")
+        results[mode] = (_strip(standard), _strip(weather))
+    engine.reset_executor()
+
+    assert results['sequential'] == results['thread'] == results['process']
+    print("✅ 全モードで結果一致")
+
+
+def test_failing_horse_is_isolated():
+    """1頭の計算が例外になってもレース全体は失敗せず、その馬だけデータなしになる"""
+    engine = FastDLogicEngine()
+    horse_names = list(engine.raw_manager.knowledge_data.get('horses', {}))[:6]
+    broken = horse_names[2]
+    analyze = engine.analyze_single_horse
+
+    def analyze_or_fail(horse_name, *args):
+        if horse_name == broken:
+            raise ZeroDivisionError('division by zero')
+        return analyze(horse_name, *args)
+
+    engine.analyze_single_horse = analyze_or_fail
+    try:
+        for mode in ('sequential', 'thread'):
+            engine.reset_executor()
+            engine.execution_mode = mode
+            result = engine.analyze_race_horses(horse_names)
+            failed = [horse for horse in result['horses'] if horse['horse_name'] == broken]
+            assert len(result['horses']) == len(horse_names)
+            assert failed[0]['total_score'] is None and 'division by zero' in failed[0]['error']
+            assert result['race_analysis']['analyzed_horses'] == len(horse_names) - 1
+    finally:
+        del engine.analyze_single_horse
+        engine.reset_executor()
+    print("✅ 計算できない馬を分離")
+
+
+if __name__ == "__main__":
+    test_execution_modes_match()
+    test_failing_horse_is_isolated()
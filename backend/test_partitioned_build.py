@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+マルチプロセス分割ナレッジ構築のテスト
+SQLiteでレースデータを再現し、パーティション数・ワーカー数を変えても
+マージ結果がバイト単位で同一になることを確認する
+"""
+
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import zlib
+from batch_rebuild_knowledge_2025 import build_horse_raw_data, rebuild_partition
+from services.partitioned_build import (
+    merge_partitions, part_path, partition_of, partition_sql, run_partitions, split_by_partition
+)
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='dlogic_partition_test_'), 'stand_in.sqlite3')
+
+
+def connect_stand_in():
+    """MySQLの代わりのSQLite接続（CRC32をMySQLと同じ定義で登録）"""
+    conn = sqlite3.connect(DB_PATH)
+    conn.create_function('CRC32', 1, lambda value: zlib.crc32(value.encode('utf-8')))
+    return conn
+
+
+def create_stand_in(horse_count=400):
+    """SQLiteにレースデータを作成（作成済みなら何もしない）"""
+    if os.path.exists(DB_PATH):
+        return
+    rng = random.Random(7)
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("""
+        CREATE TABLE umagoto_race_joho (
+            BAMEI TEXT, RACE_CODE TEXT, KAISAI_NEN TEXT, KAISAI_GAPPI TEXT,
+            KAKUTEI_CHAKUJUN TEXT, TANSHO_ODDS TEXT, TANSHO_NINKIJUN TEXT,
+            FUTAN_JURYO TEXT, BATAIJU TEXT, ZOGEN_SA TEXT,
+            KISHUMEI_RYAKUSHO TEXT, CHOKYOSHIMEI_RYAKUSHO TEXT,
+            CORNER1_JUNI TEXT, CORNER2_JUNI TEXT, CORNER3_JUNI TEXT, CORNER4_JUNI TEXT,
+            SOHA_TIME TEXT, BAREI TEXT, SEIBETSU_CODE TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE race_shosai (
+            RACE_CODE TEXT PRIMARY KEY, KYORI TEXT, TRACK_CODE TEXT,
+            BABA_JOTAI_CODE TEXT, TENKOU_CODE TEXT
+        )
+    """)
+    for i in range(500):
+        conn.execute("INSERT INTO race_shosai VALUES (?, ?, ?, ?, ?)", (
+            f"R{i:06d}", str(rng.choice([1200, 1600, 2000])), rng.choice(['10', '23']),
+            str(rng.randint(1, 4)), str(rng.randint(1, 6))
+        ))
+    jockeys = ['ルメール', '川田将雅', '武豊', '横山武史']
+    for h in range(horse_count):
+        name = rng.choice(['ドウ', 'レガ', 'イクイ', 'シティ']) + f"{h:04d}"
+        days = rng.sample(range(1, 330), rng.randint(0, 14))
+        for day in days:
+            conn.execute(f"INSERT INTO umagoto_race_joho VALUES ({', '.join(['?'] * 19)})", (
+                name, f"R{rng.randint(0, 499):06d}", str(rng.randint(2018, 2025)), f"{day // 28 + 1:02d}{day % 28 + 1:02d}",
+                None if rng.random() < 0.05 else f"{rng.randint(1, 18):02d}",
+                str(rng.randint(10, 999)), str(rng.randint(1, 18)), '550', '480', '+002',
+                rng.choice(jockeys), '調教師', str(rng.randint(1, 18)), '3', '2', '1',
+                str(rng.randint(1300, 2500)), '4', '1'
+            ))
+    conn.commit()
+    conn.close()
+
+
+def build(partitions, workers, out_dir, limit=None):
+    parts_dir = os.path.join(out_dir, f'parts_{partitions}_{limit}')
+    os.makedirs(parts_dir)
+    stats = run_partitions(rebuild_partition, partitions, workers, args=(parts_dir, connect_stand_in))
+    output = os.path.join(out_dir, f'knowledge_{partitions}_{limit}.json')
+    result = merge_partitions(
+        [part_path(parts_dir, p, partitions) for p in range(partitions)],
+        output, {"version": "2.0", "criteria": "5走以上"}, limit=limit, count_field="total_count"
+    )
+    return output, result, stats
+
+
+def test_partition_assignment():
+    """振り分けは実行ごとに変わらず、MySQLのCRC32と同じ定義"""
+    assert partition_of('ドウデュース', 8) == zlib.crc32('ドウデュース'.encode('utf-8')) % 8
+    assert partition_sql('u.BAMEI', 3, 8) == "MOD(CRC32(u.BAMEI), 8) = 3"
+    names = [f"馬{i}" for i in range(100)]
+    buckets = split_by_partition(names, 4)
+    assert sorted(sum(buckets, [])) == sorted(names)
+    assert all(partition_of(name, 4) == p for p, bucket in enumerate(buckets) for name in bucket)
+
+
+def test_merge_is_byte_identical():
+    """パーティション数・ワーカー数に関係なく同じバイト列、json.dump(indent=2)と同じ書式"""
+    create_stand_in()
+    out_dir = tempfile.mkdtemp(prefix='dlogic_partition_out_')
+    outputs = {}
+    for partitions, workers in ((1, 1), (3, 3), (4, 2)):
+        output, result, stats = build(partitions, workers, out_dir)
+        with open(output, 'rb') as f:
+            data = f.read()
+        assert hashlib.sha256(data).hexdigest() == result['sha256']
+        assert sum(stat['horses'] for stat in stats) == result['horses']
+        outputs[partitions] = data
+    assert outputs[1] == outputs[3] == outputs[4]
+
+    # 順次処理で作ったナレッジと一致
+    conn = connect_stand_in()
+    conn.row_factory = sqlite3.Row
+    names = [row[0] for row in conn.execute(
+        "SELECT DISTINCT BAMEI FROM umagoto_race_joho WHERE KAKUTEI_CHAKUJUN IS NOT NULL "
+        "AND KAISAI_NEN >= '2020' AND KAISAI_NEN <= '2025'"
+    )]
+    horses = {}
+    for name in sorted(names):
+        races = [dict(row) for row in conn.execute("""
+            SELECT u.RACE_CODE, u.KAISAI_NEN, u.KAISAI_GAPPI, u.KAKUTEI_CHAKUJUN as finish,
+                   u.TANSHO_ODDS as odds, u.TANSHO_NINKIJUN as popularity, u.FUTAN_JURYO as weight,
+                   u.BATAIJU as horse_weight, u.ZOGEN_SA as weight_change,
+                   u.KISHUMEI_RYAKUSHO as jockey, u.CHOKYOSHIMEI_RYAKUSHO as trainer,
+                   u.CORNER1_JUNI, u.CORNER2_JUNI, u.CORNER3_JUNI, u.CORNER4_JUNI,
+                   u.SOHA_TIME as time, u.BAREI as age, u.SEIBETSU_CODE as sex,
+                   r.KYORI as distance, r.TRACK_CODE as track,
+                   r.BABA_JOTAI_CODE as ground_condition, r.TENKOU_CODE as weather
+            FROM umagoto_race_joho u LEFT JOIN race_shosai r ON u.RACE_CODE = r.RACE_CODE
+            WHERE u.BAMEI = ? AND u.KAISAI_NEN >= '2020' AND u.KAISAI_NEN <= '2025'
+            AND u.KAKUTEI_CHAKUJUN IS NOT NULL
+            ORDER BY u.KAISAI_NEN DESC, u.KAISAI_GAPPI DESC
+        """, (name,))]
+        raw_data = build_horse_raw_data(races)
+        if raw_data["race_history"]:
+            horses[name] = {"name": name, "registered_race_count": len(races), **raw_data}
+    expected = {"meta": {"version": "2.0", "criteria": "5走以上", "total_count": len(horses)}, "horses": horses}
+    assert outputs[1].decode('utf-8') == json.dumps(expected, ensure_ascii=False, indent=2)
+
+    # 上限指定は出走数の多い順（同数は馬名順）で選ぶ
+    output, result, _ = build(3, 3, out_dir, limit=10)
+    with open(output, encoding='utf-8') as f:
+        limited = json.load(f)
+    top = sorted(horses.values(), key=lambda h: (-h['registered_race_count'], h['name']))[:10]
+    assert list(limited['horses']) == sorted(h['name'] for h in top)
+    assert limited['meta']['total_count'] == 10
+
+
+def _cpu_bound(partition, partitions, n):
+    total = 0
+    for i in range(n):
+        total += (i * partition) % 7
+    return total
+
+
+def benchmark_scaling():
+    """CPU処理のプロセス数によるスケーリング"""
+    n = 3_000_000
+    for workers in sorted({1, 2, os.cpu_count() or 1}):
+        start = time.time()
+        run_partitions(_cpu_bound, 8, workers, args=(n,))
+        print(f"  {workers}プロセス: {time.time() - start:.2f}秒 (8パーティション)")
+
+
+if __name__ == "__main__":
+    create_stand_in()
+    test_partition_assignment()
+    test_merge_is_byte_identical()
+    benchmark_scaling()
+    print("✅ 全テスト成功")
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+開催の事前計算（ウォームキャッシュ）のテスト
+登録した開催の全レースが標準・4馬場でキャッシュされ、最初のリクエストからヒットすること、
+同じ内容の再登録でジョブが増えないこと、ナレッジ更新で新しいバージョンの計算が走ること、
+OCR保存からの登録と進捗APIを確認する
+"""
+
+import os
+import time
+from datetime import datetime
+
+os.environ.setdefault('DLOGIC_PRECOMPUTE_SCORES', 'false')
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from services.cache_service import CacheService
+from services.fast_dlogic_engine import FastDLogicEngine
+from services.race_card_precompute import RaceCardPrecompute, get_race_card_precompute
+
+VOLATILE_KEYS = ('calculation_time', 'calculation_time_seconds', 'timing_breakdown')
+
+engine = FastDLogicEngine()
+
+
+def strip(horses):
+    return [{key: value for key, value in horse.items() if key not in VOLATILE_KEYS} for horse in horses]
+
+
+def analyzable_horses(count):
+    names = []
+    for name in engine.raw_manager.knowledge_data.get('horses', {}):
+        try:
+            for baba_condition in (1, 2, 3, 4):
+                engine.raw_manager.calculate_weather_adaptive_dlogic(name, baba_condition)
+        except Exception:
+            continue
+        names.append(name)
+        if len(names) == count:
+            break
+    return names
+
+
+def make_card(race_count=4, size=8):
+    names = analyzable_horses(race_count * size)
+    return [{'race_id': f'テスト_R{i + 1}', 'horses': names[i * size:(i + 1) * size] + ['存在しない馬XYZ']}
+            for i in range(race_count)]
+
+
+def test_card_is_precomputed():
+    """登録した開催の全レースが、最初のリクエストからキャッシュヒットする"""
+    cache = CacheService()
+    precompute = RaceCardPrecompute(engine, cache)
+    card = make_card()
+    job = precompute.register_card('card_a', card, source='test')
+    assert job['state'] in ('queued', 'running') and job['total_races'] == 4
+    assert precompute.wait(120)
+
+    done = precompute.get_job(job['job_id'])
+    assert done['state'] == 'completed' and done['completed_races'] == 4 and done['progress'] == 100.0
+    assert done['cached_races'] == 0 and done['knowledge_version'] == engine.raw_manager.get_knowledge_version()
+
+    hits = cache.hit_count
+    for race in card:
+        standard = precompute.get_race_analysis(race['horses'])
+        assert strip(standard['horses']) == strip(engine.analyze_race_horses(race['horses'])['horses'])
+        for baba_condition in (1, 2, 3, 4):
+            weather = precompute.get_weather(race['horses'], baba_condition)
+            expected = engine.analyze_race_horses_weather(race['horses'], baba_condition)
+            assert strip(weather['horses']) == strip(expected['horses'])
+            assert weather['race_analysis']['weather_condition'] == expected['race_analysis']['weather_condition']
+    assert cache.hit_count - hits == len(card) * 5
+
+    # 呼び出し側が書き換えてもキャッシュは変わらない
+    copied = precompute.get_race_analysis(card[0]['horses'])
+    copied['race_analysis']['race_name'] = '書き換え'
+    assert 'race_name' not in precompute.get_race_analysis(card[0]['horses'])['race_analysis']
+
+
+def test_reregistration():
+    """同じ内容の再登録はジョブを作らず、出走馬が変わったレースだけ計算する"""
+    precompute = RaceCardPrecompute(engine, CacheService())
+    card = make_card(3, 6)
+    first = precompute.register_card('card_b', card)
+    precompute.wait(120)
+    assert precompute.register_card('card_b', card)['job_id'] == first['job_id']
+
+    changed = [dict(race) for race in card]
+    changed[1] = {'race_id': changed[1]['race_id'], 'horses': changed[1]['horses'][:-2]}
+    second = precompute.register_card('card_b', changed)
+    assert second['job_id'] != first['job_id']
+    precompute.wait(120)
+    assert precompute.get_job(second['job_id'])['cached_races'] == 2
+    assert precompute.register_card('card_c', [{'race_id': 'R1', 'horses': []}]) is None
+
+
+def test_knowledge_update_recomputes():
+    """ナレッジが更新されたら登録済みの開催を新しいバージョンで計算し直す"""
+    cache = CacheService()
+    precompute = RaceCardPrecompute(cache=cache)
+    precompute.attach_engine(engine)
+    card = make_card(2, 5)
+    first = precompute.register_card('card_d', card)
+    precompute.wait(120)
+
+    # デルタ適用と同じ通知（バージョンが変わる）
+    engine.raw_manager.add_horse_raw_data('事前計算テスト馬', {'race_history': []})
+    engine.raw_manager._notify_listeners('delta')
+    precompute.wait(120)
+    latest = precompute.get_progress()['cards']['card_d']
+    assert latest['job_id'] != first['job_id'] and latest['source'] == 'knowledge_delta'
+    assert latest['knowledge_version'] == engine.raw_manager.get_knowledge_version()
+    assert latest['cached_races'] == 0
+
+    hits = cache.hit_count
+    precompute.get_race_analysis(card[0]['horses'])
+    assert cache.hit_count == hits + 1
+
+
+def test_ocr_registration_and_progress_api():
+    """OCRでのレース保存が当日の開催を登録し、進捗APIで確認できる"""
+    from api.today_races import router as today_router
+    from api.today_races_ocr import race_storage, router as ocr_router
+
+    get_race_card_precompute(engine)
+    app = FastAPI()
+    app.include_router(ocr_router)
+    app.include_router(today_router, prefix="/api")
+    client = TestClient(app)
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    horses = analyzable_horses(6)
+    for number in (1, 2):
+        response = client.post('/api/today-races/ocr/', json={
+            'race_date': today, 'venue': '東京', 'race_number': number,
+            'race_name': f'テスト{number}R', 'horses': horses[(number - 1) * 3:number * 3]
+        })
+        assert response.status_code == 200
+    assert get_race_card_precompute().wait(120)
+
+    progress = client.get('/api/today-races/precompute').json()
+    card = progress['cards'][f'ocr_{today}']
+    assert card['source'] == 'ocr' and card['total_races'] == 2 and card['state'] == 'completed'
+    assert progress['enabled'] and progress['jobs'][0]['job_id'] == card['job_id']
+    race_storage.clear()
+
+
+def benchmark_first_request():
+    """最初のリクエスト: 事前計算なし（その場で計算） vs 事前計算済み（キャッシュヒット）"""
+    card = make_card(6, 16)
+    cold = RaceCardPrecompute(engine, CacheService())
+    start = time.perf_counter()
+    for race in card:
+        cold.get_race_analysis(race['horses'])
+        cold.get_weather(race['horses'], 3)
+    cold_elapsed = (time.perf_counter() - start) / len(card)
+
+    warm = RaceCardPrecompute(engine, CacheService())
+    warm.register_card('card_bench', card)
+    warm.wait(300)
+    start = time.perf_counter()
+    for race in card:
+        warm.get_race_analysis(race['horses'])
+        warm.get_weather(race['horses'], 3)
+    warm_elapsed = (time.perf_counter() - start) / len(card)
+
+    print(f"  1レース17頭（標準+重）の最初のリクエスト: 事前計算なし {cold_elapsed * 1000:.1f}ms / "
+          f"事前計算済み {warm_elapsed * 1000:.2f}ms")
+    assert warm_elapsed * 5 < cold_elapsed
+
+
+if __name__ == "__main__":
+    test_card_is_precomputed()
+    test_reregistration()
+    test_knowledge_update_recomputes()
+    test_ocr_registration_and_progress_api()
+    benchmark_first_request()
+    print("✅ 全テスト成功")
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+一括抽出（RaceHistoryExtractor）のテストとベンチマーク
+MySQLの代わりにSQLiteで umagoto_race_joho / race_shosai を再現し、
+従来の馬ごとクエリと結果が一致すること・クエリ回数と時間を比較する
+"""
+
+import os
+import random
+import sqlite3
+import time
+from batch_dlogic_knowledge_builder_v2 import DLogicKnowledgeBuilder
+from services.race_history_extractor import RaceHistoryExtractor, RaceHistoryQuery
+
+HORSE_COUNT = int(os.getenv('BENCH_HORSES', 3000))
+# 馬ごとクエリの往復遅延の見積もり（ミリ秒、ネットワーク越しのMySQL想定）
+RTT_MS = float(os.getenv('BENCH_RTT_MS', 0.5))
+
+# 従来の馬ごとクエリ（batch_dlogic_knowledge_builder_v2.pyと同じ条件）
+PER_HORSE_QUERY = """
+    SELECT
+        u.BAMEI, u.RACE_CODE, u.KAISAI_NEN, u.KAISAI_GAPPI, u.KAKUTEI_CHAKUJUN,
+        u.TANSHO_ODDS, u.TANSHO_NINKIJUN, u.FUTAN_JURYO, u.BATAIJU, u.ZOGEN_SA,
+        u.KISHUMEI_RYAKUSHO, u.CHOKYOSHIMEI_RYAKUSHO,
+        u.CORNER1_JUNI, u.CORNER2_JUNI, u.CORNER3_JUNI, u.CORNER4_JUNI,
+        u.SOHA_TIME, u.BAREI, u.SEIBETSU_CODE,
+        r.KYORI, r.TRACK_CODE, r.SHIBA_BABAJOTAI_CODE, r.DIRT_BABAJOTAI_CODE, r.TENKO_CODE
+    FROM umagoto_race_joho u
+    LEFT JOIN race_shosai r ON u.RACE_CODE = r.RACE_CODE
+    WHERE u.BAMEI = ?
+    AND u.KAISAI_NEN >= '2015'
+    AND u.KAISAI_NEN <= '2025'
+    AND u.KAKUTEI_CHAKUJUN IS NOT NULL
+    ORDER BY u.KAISAI_NEN DESC, u.KAISAI_GAPPI DESC
+    LIMIT 5
+"""
+
+TARGET_QUERY = """
+    SELECT BAMEI, COUNT(*) as race_count
+    FROM umagoto_race_joho
+    WHERE KAISAI_NEN >= '2015'
+    AND KAISAI_NEN <= '2025'
+    AND BAMEI IS NOT NULL
+    AND BAMEI != ''
+    AND KAKUTEI_CHAKUJUN IS NOT NULL
+    GROUP BY BAMEI
+    HAVING race_count >= 3
+    ORDER BY race_count DESC, BAMEI
+"""
+
+
+def create_stand_in(horse_count=HORSE_COUNT):
+    """SQLiteでレースデータを作成"""
+    rng = random.Random(42)
+    conn = sqlite3.connect(':memory:')
+    conn.execute("""
+        CREATE TABLE umagoto_race_joho (
+            BAMEI TEXT, RACE_CODE TEXT, KAISAI_NEN TEXT, KAISAI_GAPPI TEXT,
+            KAKUTEI_CHAKUJUN TEXT, TANSHO_ODDS TEXT, TANSHO_NINKIJUN TEXT,
+            FUTAN_JURYO TEXT, BATAIJU TEXT, ZOGEN_SA TEXT,
+            KISHUMEI_RYAKUSHO TEXT, CHOKYOSHIMEI_RYAKUSHO TEXT,
+            CORNER1_JUNI TEXT, CORNER2_JUNI TEXT, CORNER3_JUNI TEXT, CORNER4_JUNI TEXT,
+            SOHA_TIME TEXT, BAREI TEXT, SEIBETSU_CODE TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE race_shosai (
+            RACE_CODE TEXT PRIMARY KEY, KYORI TEXT, TRACK_CODE TEXT,
+            SHIBA_BABAJOTAI_CODE TEXT, DIRT_BABAJOTAI_CODE TEXT, TENKO_CODE TEXT
+        )
+    """)
+
+    race_codes = []
+    for i in range(2000):
+        code = f"{rng.randint(2013, 2026)}{i:08d}"
+        race_codes.append(code)
+        conn.execute("INSERT INTO race_shosai VALUES (?, ?, ?, ?, ?, ?)", (
+            code, str(rng.choice([1200, 1600, 2000, 2400])), rng.choice(['10', '23']),
+            str(rng.randint(1, 4)), str(rng.randint(1, 4)), str(rng.randint(1, 6))
+        ))
+
+    rows = []
+    for h in range(horse_count):
+        name = f"ウマ{h:05d}"
+        dates = set()
+        for _ in range(rng.randint(0, 12)):
+            code = rng.choice(race_codes)
+            date = (code[:4], f"{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}")
+            if date in dates:
+                continue  # 同じ日に2回は出走しない
+            dates.add(date)
+            rows.append((
+                name, code, date[0], date[1],
+                None if rng.random() < 0.05 else f"{rng.randint(1, 18):02d} ",
+                str(rng.randint(10, 999)), str(rng.randint(1, 18)), '550', '480', '+002',
+                ' 騎手A ', '調教師B', '3', '3', '2', '1', '1345', '4', '1'
+            ))
+    conn.executemany(f"INSERT INTO umagoto_race_joho VALUES ({', '.join(['?'] * 19)})", rows)
+    conn.execute("CREATE INDEX idx_horse_date ON umagoto_race_joho (BAMEI, KAISAI_NEN, KAISAI_GAPPI)")
+    conn.commit()
+    return conn
+
+
+def per_horse_extract(conn, builder):
+    """従来方式: 対象馬リスト取得 + 1頭1クエリ"""
+    conn.row_factory = sqlite3.Row
+    horses = conn.execute(TARGET_QUERY).fetchall()
+    knowledge = {}
+    for horse in horses:
+        races = [dict(row) for row in conn.execute(PER_HORSE_QUERY, (horse['BAMEI'],)).fetchall()]
+        if len(races) >= 3:
+            knowledge[horse['BAMEI']] = builder.build_horse_record(horse['BAMEI'], races)
+    conn.row_factory = None
+    return knowledge, len(horses) + 1
+
+
+def strip_timestamps(knowledge):
+    return {name: {k: v for k, v in record.items() if k != 'last_update'} for name, record in knowledge.items()}
+
+
+def test_stream_matches_per_horse_queries():
+    """1本の流し読みで従来の馬ごとクエリと同じナレッジになる"""
+    conn = create_stand_in(500)
+    builder = DLogicKnowledgeBuilder()
+    expected, _ = per_horse_extract(conn, builder)
+
+    streamed = {name: builder.build_horse_record(name, races) for name, races in builder.extractor.stream(conn)}
+
+    assert strip_timestamps(streamed) == strip_timestamps(expected)
+    assert list(streamed) == sorted(streamed)
+    assert builder.extractor.query_count == 1
+    assert all(3 <= record['race_count'] <= 5 for record in streamed.values())
+
+
+def test_named_chunks_and_resume():
+    """対象馬指定はまとめたIN句で取得し、start_afterで途中から再開できる"""
+    conn = create_stand_in(200)
+    query = RaceHistoryQuery(
+        columns="u.RACE_CODE, u.KAISAI_NEN, u.KAISAI_GAPPI",
+        from_clause="umagoto_race_joho u",
+        conditions=["u.KAKUTEI_CHAKUJUN IS NOT NULL"],
+        max_races=2, min_races=1, placeholder='?'
+    )
+    extractor = RaceHistoryExtractor(query, name_chunk_size=40)
+    targets = [f"ウマ{h:05d}" for h in range(0, 200, 2)] + ['未登録馬']
+
+    found = dict(extractor.stream(conn, targets))
+    assert extractor.query_count == 3  # 101頭 -> 40頭ずつ
+    assert set(found) <= set(targets) and '未登録馬' not in found
+    assert all(len(races) <= 2 for races in found.values())
+    for races in found.values():
+        dates = [(race['KAISAI_NEN'], race['KAISAI_GAPPI']) for race in races]
+        assert dates == sorted(dates, reverse=True)
+
+    # 途中で切断された想定: 最後に返した馬名の次から再開
+    first_pass = []
+    for name, _ in extractor.stream(conn):
+        first_pass.append(name)
+        if len(first_pass) == 50:
+            break
+    resumed = [name for name, _ in extractor.stream(conn, start_after=first_pass[-1])]
+    full = [name for name, _ in extractor.stream(conn)]
+    assert first_pass + resumed == full
+    assert extractor.extract_one(conn, full[0]) is not None
+    assert extractor.extract_one(conn, '未登録馬') is None
+
+
+def benchmark():
+    """従来の馬ごとクエリとの比較"""
+    conn = create_stand_in()
+    builder = DLogicKnowledgeBuilder()
+
+    start = time.time()
+    expected, per_horse_queries = per_horse_extract(conn, builder)
+    per_horse_time = time.time() - start
+
+    start = time.time()
+    streamed = {name: builder.build_horse_record(name, races) for name, races in builder.extractor.stream(conn)}
+    stream_time = time.time() - start
+    assert strip_timestamps(streamed) == strip_timestamps(expected)
+
+    stream_queries = builder.extractor.query_count
+    print(f"🐎 対象 {len(streamed):,}頭 / {HORSE_COUNT:,}頭")
+    print(f"  馬ごとクエリ: {per_horse_queries:,}回 {per_horse_time:.3f}秒 "
+          f"(往復{RTT_MS}ms換算 {per_horse_time + per_horse_queries * RTT_MS / 1000:.3f}秒)")
+    print(f"  一括抽出    : {stream_queries:,}回 {stream_time:.3f}秒 "
+          f"(往復{RTT_MS}ms換算 {stream_time + stream_queries * RTT_MS / 1000:.3f}秒)")
+
+
+if __name__ == "__main__":
+    test_stream_matches_per_horse_queries()
+    test_named_chunks_and_resume()
+    benchmark()
+    print("✅ 全テスト成功")
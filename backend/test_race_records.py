@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+解析済みレース記録（RaceRecord）のテスト
+導入前の生データ辞書版の計算（tests/race_record_baseline.py の凍結コピー）と完全一致すること
+（空値・0・解析できない値・MySQL形式と小文字形式のキーが混在する走を含む。意図的に変えたのはトラック適性のゼロ除算のみ）、
+ナレッジ更新でキャッシュが作り直されること、メモリ使用量と計算時間の比較を確認する
+"""
+
+import copy
+import random
+import threading
+import time
+import tracemalloc
+
+from services import dlogic_raw_data_manager
+from services.dlogic_raw_data_manager import dlogic_manager
+from services.race_record import INVALID, HorseRecords, build_horse_records
+from tests.race_record_baseline import BaselineFactors
+
+FACTOR_METHODS = [
+    '_calc_distance_aptitude', '_calc_bloodline_evaluation', '_calc_jockey_compatibility',
+    '_calc_trainer_evaluation', '_calc_track_aptitude', '_calc_weather_aptitude',
+    '_calc_popularity_factor', '_calc_weight_impact', '_calc_horse_weight_impact',
+    '_calc_corner_specialist', '_calc_margin_analysis', '_calc_time_index'
+]
+
+ODD_VALUES = [None, '', 0, 0.0, '0', '00', '01', 1, '3', '12', 'abc', ' 2', '2.5', 3.7, '18', '-1']
+UPPER_KEYS = {
+    'KAKUTEI_CHAKUJUN': [], 'KYORI': ['1200', '1600', '2400'], 'TANSHO_NINKIJUN': [],
+    'FUTAN_JURYO': ['550', '570'], 'BATAIJU': ['480', '502'], 'ZOGEN_SA': ['+4', '-6'],
+    'CORNER1_JUNI': [], 'CORNER2_JUNI': [], 'CORNER3_JUNI': [], 'CORNER4_JUNI': [],
+    'SOHA_TIME': ['1345', '2231'], 'TRACK_CODE': ['10', '11', '23', '24'], 'TENKO_CODE': [],
+    'SHIBA_BABAJOTAI_CODE': [], 'DIRT_BABAJOTAI_CODE': [],
+    'KISHUMEI_RYAKUSHO': ['ルメール', '武豊'], 'CHOKYOSHIMEI_RYAKUSHO': ['友道', '矢作'],
+    'CHAKUSA': ['ハナ', 'クビ', '1 1/2'],
+}
+LOWER_KEYS = {
+    'finish': [], 'distance': ['1600'], 'popularity': [], 'weight': ['55'], 'horse_weight': ['480'],
+    'weight_change': ['+2'], 'corner1': [], 'time': ['1345'], 'track': ['11', '23'], 'weather': [],
+    'jockey': ['ルメール'], 'trainer': ['友道'], 'margin': ['クビ'],
+}
+# 旧形式の列名（混在した走にだけ現れる）
+ALT_KEYS = {
+    'KISYURYAKUSYO': ['武豊'], 'CHOUKYOUSIRYAKUSYO': ['矢作'], 'TRACKCD': ['11', '23'], 'NINKIJUN': [],
+    'FUTAN': ['560'], 'BATAI': ['470'], 'ZOUGEN': ['-2'], 'CORNER1JUN': [], 'CORNER2JUN': [], 'TIME': ['1580'],
+    'TANSHO_ODDS': ['32', '105'], 'odds': ['4.5'],
+}
+MIXED_KEYS = {**UPPER_KEYS, **LOWER_KEYS, **ALT_KEYS}
+
+
+def make_odd_horses(count, seed):
+    """空値・0・解析できない値・キー欠落・キーの混在・race_history形式を含む馬データ
+
+    混在した走は KAKUTEI_CHAKUJUN と finish のように同じ項目の別名を両方持ち、
+    片方が空・0 でもう片方に値がある組み合わせが出る
+    """
+    rng = random.Random(seed)
+    horses = []
+    for _ in range(count):
+        style = rng.choice(['upper', 'upper', 'lower', 'mixed', 'mixed'])
+        keys = {'upper': UPPER_KEYS, 'lower': LOWER_KEYS, 'mixed': MIXED_KEYS}[style]
+        ratio = 0.6 if style == 'mixed' else 0.85
+        races = []
+        for _ in range(rng.randint(0, 12)):
+            races.append({key: rng.choice(ODD_VALUES + typical * 3)
+                          for key, typical in keys.items() if rng.random() < ratio})
+        horse = {'race_history' if style != 'upper' and rng.random() < 0.5 else 'races': races}
+        if rng.random() < 0.2:
+            horse['aggregated_stats'] = {'wins': 1, 'total_races': rng.randint(0, 5)}
+        if rng.random() < 0.05:
+            horse.setdefault('aggregated_stats', {})['jockey_performance'] = {'武豊': [1, 3]}
+        horses.append(horse)
+    return horses
+
+
+def outcome(method, *args):
+    try:
+        return ('ok', method(*args))
+    except Exception as e:
+        return ('error', type(e).__name__)
+
+
+def baseline_outcome(baseline, name, raw_data):
+    """凍結コピーの結果。トラック適性のゼロ除算（着順が解析できない走だけのトラック）は意図的な変更で、
+    そのトラックを評価しない＝その走を除いた結果になる"""
+    expected = outcome(getattr(baseline, name), raw_data)
+    if name == '_calc_track_aptitude' and expected == ('error', 'ZeroDivisionError'):
+        races = raw_data.get("races", raw_data.get("race_history", []))
+        kept = [race for race in races if _finish_parses(race.get("KAKUTEI_CHAKUJUN", race.get("finish")))]
+        expected = outcome(baseline._calc_track_aptitude, {'races': kept})
+    return expected
+
+
+def _finish_parses(value):
+    if not value:
+        return True   # 空の着順はもともと集計しない
+    try:
+        int(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def test_records_match_raw_dicts():
+    """12項目・天候層の結果（例外も含む）が導入前の生データ辞書版の計算と一致する"""
+    baseline = BaselineFactors()
+    horses = list(dlogic_manager.knowledge_data.get('horses', {}).values())[:300]
+    horses += make_odd_horses(2000, 7)
+    mismatches = 0
+    for raw_data in horses:
+        records = build_horse_records(raw_data)
+        for name in FACTOR_METHODS:
+            expected = baseline_outcome(baseline, name, raw_data)
+            if expected != outcome(getattr(dlogic_manager, name), records):
+                mismatches += 1
+                print(f"❌ {name}: {expected}")
+        for baba_condition in (1, 2, 3, 4):
+            expected = outcome(baseline._calc_weather_layers, raw_data, baba_condition)
+            if expected != outcome(dlogic_manager._calc_weather_layers, records, baba_condition):
+                mismatches += 1
+                print(f"❌ 馬場{baba_condition}の天候層: {expected}")
+    print(f"  一致確認: {len(horses)}頭 / 不一致: {mismatches}件")
+    assert mismatches == 0
+
+
+def test_record_values():
+    """数値は解析済み・空はNone・解析できない値はINVALID"""
+    record = build_horse_records({'races': [{
+        'KAKUTEI_CHAKUJUN': '01', 'KYORI': '1600', 'SOHA_TIME': '1345', 'TANSHO_ODDS': '32',
+        'CORNER1_JUNI': '00', 'CORNER2_JUNI': '03', 'BATAIJU': 'xx', 'ZOGEN_SA': '',
+        'TRACK_CODE': '11', 'SHIBA_BABAJOTAI_CODE': '2', 'CHAKUSA': '1 1/2',
+    }]}).races[0]
+    assert record.finish == 1 and record.win and record.distance == 1600 and record.distance_key == '1600'
+    assert record.time == 1345 and record.odds == 32 and record.first_corner == 3
+    assert record.bataiju is None and record.w_bataiju is INVALID and record.zogen == 0
+    assert record.track == '芝' and record.w_baba == 2 and record.margin == 1.0
+
+    # 同じ騎手名・距離は1つのオブジェクトを共有する
+    other = build_horse_records({'races': [{'KYORI': ''.join(['16', '00'])}]}).races[0]
+    assert other.distance_key is record.distance_key
+
+
+def test_cache_follows_knowledge_updates():
+    """ナレッジ更新（馬の追加・差し替え）で解析済み記録を作り直す"""
+    name = next(iter(dlogic_manager.knowledge_data.get('horses', {})))
+    first = dlogic_manager.get_horse_records(name)
+    assert isinstance(first, HorseRecords) and dlogic_manager.get_horse_records(name) is first
+    assert dlogic_manager.get_horse_records('存在しない馬XYZ') is None
+
+    races = [{'KAKUTEI_CHAKUJUN': '01', 'KYORI': '1600', 'TRACK_CODE': '11'}]
+    dlogic_manager.add_horse_raw_data('記録テスト馬', {'race_history': races})
+    assert len(dlogic_manager.get_horse_records('記録テスト馬')) == 1
+    assert dlogic_manager.get_horse_records(name) is not first
+
+    dlogic_manager.add_horse_raw_data('記録テスト馬', {'race_history': races * 3})
+    assert len(dlogic_manager.get_horse_records('記録テスト馬')) == 3
+    result = dlogic_manager.calculate_dlogic_realtime('記録テスト馬')
+    expected = dlogic_manager.calculate_dlogic_realtime('記録テスト馬', raw_data={'races': races * 3})
+    assert result['d_logic_scores'] == expected['d_logic_scores']
+
+
+def test_cache_concurrent_access():
+    """threadモードのように複数スレッドから参照しても上限を超えず、例外も出ない"""
+    names = list(dlogic_manager.knowledge_data.get('horses', {}))[:200]
+    original_size = dlogic_raw_data_manager.RACE_RECORD_CACHE_SIZE
+    dlogic_raw_data_manager.RACE_RECORD_CACHE_SIZE = 16
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(2000):
+                name = rng.choice(names)
+                assert dlogic_manager.get_horse_records(name) is not None
+        except Exception as e:
+            errors.append(e)
+
+    try:
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        dlogic_raw_data_manager.RACE_RECORD_CACHE_SIZE = original_size
+    assert not errors, errors
+    assert len(dlogic_manager._race_records) <= 16
+
+
+def benchmark_records_vs_dicts():
+    """1頭分のメモリ使用量と12項目計算の時間: 生データ辞書 vs 解析済み記録"""
+    names = list(dlogic_manager.knowledge_data.get('horses', {}))
+    raw_datas = [dlogic_manager.get_horse_raw_data(name) for name in names]
+    race_count = sum(len(raw_data.get('races', [])) for raw_data in raw_datas)
+
+    tracemalloc.start()
+    dict_copies = [copy.deepcopy(raw_data.get('races', [])) for raw_data in raw_datas]
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    records = [build_horse_records(raw_data) for raw_data in raw_datas]
+    record_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del dict_copies
+
+    def score_all(calculator, inputs):
+        start = time.perf_counter()
+        for horse in inputs:
+            for name in FACTOR_METHODS:
+                outcome(getattr(calculator, name), horse)
+        return time.perf_counter() - start
+
+    dict_elapsed = score_all(BaselineFactors(), raw_datas)
+    record_elapsed = score_all(dlogic_manager, records)
+    print(f"  {len(names)}頭 / {race_count}走")
+    print(f"  メモリ: 辞書 {dict_bytes / 1024 / 1024:.1f}MB / 解析済み記録 {record_bytes / 1024 / 1024:.1f}MB")
+    print(f"  12項目計算: 辞書から {dict_elapsed * 1000:.0f}ms / 解析済み記録から {record_elapsed * 1000:.0f}ms")
+    assert record_bytes < dict_bytes
+    assert record_elapsed < dict_elapsed
+
+
+if __name__ == "__main__":
+    test_records_match_raw_dicts()
+    test_record_values()
+    test_cache_follows_knowledge_updates()
+    test_cache_concurrent_access()
+    benchmark_records_vs_dicts()
+    print("✅ 全テスト成功")
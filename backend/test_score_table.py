@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""事前計算スコアテーブルとリアルタイム計算の一致・速度テスト"""
+
+import glob
+import os
+import threading
+import time
+from services.dlogic_raw_data_manager import dlogic_manager
+from services.dlogic_batch_scorer import DLogicBatchScorer
+from services.dlogic_score_table import DLogicScoreTable
+
+SAMPLE_SIZE = 500
+
+
+def _strip(result):
+    result = dict(result)
+    result.pop('calculation_time', None)
+    return result
+
+
+def test_table_matches_realtime():
+    """テーブル参照結果がリアルタイム計算と完全一致することを確認"""
+    table = DLogicScoreTable(dlogic_manager, DLogicBatchScorer(dlogic_manager),
+                             table_file='/tmp/test_dlogic_score_table.pkl')
+    start_time = time.time()
+    table.build()
+    print(f"構築: {len(table)}頭 ({time.time() - start_time:.2f}秒)")
+
+    mismatches = 0
+    checked = 0
+    for name in list(table._rows)[:SAMPLE_SIZE]:
+        if _strip(table.lookup(name)) != _strip(dlogic_manager.calculate_dlogic_realtime(name)):
+            mismatches += 1
+            print(f"❌ 標準不一致: {name}")
+        for baba_condition in (1, 2, 3, 4):
+            table_result = table.lookup_weather(name, baba_condition)
+            if table_result is None:
+                continue
+            live_result = dlogic_manager.calculate_weather_adaptive_dlogic(name, baba_condition)
+            if _strip(table_result) != _strip(live_result):
+                mismatches += 1
+                print(f"❌ 馬場{baba_condition}不一致: {name}")
+        checked += 1
+
+    print(f"対象: {checked}頭 / 不一致: {mismatches}件")
+    assert mismatches == 0
+
+
+def test_engines_share_one_table():
+    """エンジンごとにテーブルを読み込まず、ナレッジマネージャーの1つを共有する"""
+    os.environ['DLOGIC_PRECOMPUTE_SCORES'] = 'false'
+    from services.fast_dlogic_engine import FastDLogicEngine
+    first, second = FastDLogicEngine(), FastDLogicEngine()
+    assert first.score_table is second.score_table is dlogic_manager.get_score_table()
+    assert first.batch_scorer is second.batch_scorer
+
+
+def test_concurrent_saves():
+    """同時に保存しても一時ファイルが重ならず、保存したテーブルを読み込める"""
+    table_file = '/tmp/test_dlogic_score_table_concurrent.pkl'
+    table = DLogicScoreTable(dlogic_manager, DLogicBatchScorer(dlogic_manager), table_file=table_file)
+    table.build()
+    threads = [threading.Thread(target=table._save) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not glob.glob(table_file + '.*.tmp')
+
+    loaded = DLogicScoreTable(dlogic_manager, table.batch_scorer, table_file=table_file)
+    assert loaded.load_or_build() and len(loaded) == len(table)
+    os.remove(table_file)
+
+
+if __name__ == "__main__":
+    test_table_matches_realtime()
+    test_engines_share_one_table()
+    test_concurrent_saves()
+    print("✅ 全テスト成功")
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+共通JSONシリアライズ（services/serialization.py）のテスト
+Decimal・日時・numpy・数値キーの変換、日本語をエスケープしないこと、orjson で扱えない値の標準jsonへの切り替え、
+orjson なしでも同じ結果になること、API（race-analysis・天候適性）のレスポンスが従来と同じ内容であること、
+ナレッジの読み込みとレスポンス生成の所要時間（標準json / ujson / 共通モジュール）を確認する
+"""
+
+import io
+import json
+import os
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+os.environ.setdefault('DLOGIC_PRECOMPUTE_SCORES', 'false')
+
+import numpy as np
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+import services.serialization as serialization
+from api.chat import router as chat_router
+from api.fast_dlogic_api import RaceAnalysisResponse, engine, router
+from services.serialization import FastJSONResponse, dump, dumps, dumps_bytes, json_default, load, loads
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+app = FastAPI(default_response_class=FastJSONResponse)
+app.include_router(router, prefix="/api/v2/dlogic")
+app.include_router(chat_router)
+client = TestClient(app)
+
+VOLATILE_KEYS = ('calculation_time', 'calculation_time_seconds', 'timing_breakdown', 'timestamp')
+
+SAMPLE = {
+    'horse_name': 'ドウデュース',
+    'odds': Decimal('3.5'),
+    'race_date': date(2025, 8, 2),
+    'updated': datetime(2025, 8, 2, 15, 40),
+    'scores': np.array([1.5, 2.0]),
+    'rank': np.int64(3),
+    'tags': {'重'},
+    'by_condition': {1: '良', 2: '稍重'},
+    'huge': 2 ** 70
+}
+
+
+def strip(value):
+    if isinstance(value, dict):
+        return {key: strip(item) for key, item in value.items() if key not in VOLATILE_KEYS}
+    if isinstance(value, list):
+        return [strip(item) for item in value]
+    return value
+
+
+def race_field(size=12):
+    names = []
+    for name in engine.raw_manager.knowledge_data.get('horses', {}):
+        try:
+            for baba_condition in (1, 2, 3, 4):
+                engine.raw_manager.calculate_weather_adaptive_dlogic(name, baba_condition)
+        except Exception:
+            continue
+        names.append(name)
+        if len(names) == size - 1:
+            break
+    return names + ['存在しない馬XYZ']
+
+
+def knowledge_sample(count=3000):
+    horses = engine.raw_manager.knowledge_data.get('horses', {})
+    names = [name for _, name in zip(range(count), horses)]
+    return {'meta': {'version': 'test'}, 'horses': {name: horses[name] for name in names}}
+
+
+def test_encoding_rules():
+    """Decimal・日時・numpy・set・数値キー・64bitを超える整数、日本語はエスケープしない"""
+    expected = {
+        'horse_name': 'ドウデュース', 'odds': 3.5, 'race_date': '2025-08-02', 'updated': '2025-08-02T15:40:00',
+        'scores': [1.5, 2.0], 'rank': 3, 'tags': ['重'], 'by_condition': {'1': '良', '2': '稍重'}, 'huge': 2 ** 70
+    }
+    text = dumps(SAMPLE)
+    assert 'ドウデュース' in text and '\\u' not in text
+    assert json.loads(text) == expected and loads(text) == expected
+    assert loads(dumps_bytes(SAMPLE, indent=True)) == expected
+
+    # 整形・キー順
+    plain = {'b': [1, {'c': 'あ'}], 'a': None}
+    assert dumps(plain, indent=True) == json.dumps(plain, ensure_ascii=False, indent=2)
+    assert dumps(plain, sort_keys=True) == json.dumps(plain, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+    # bytes・memoryview・NaN（標準jsonの出力）の読み込み、壊れたJSONは JSONDecodeError
+    assert loads(memoryview('{"馬":1}'.encode('utf-8'))) == {'馬': 1}
+    assert str(loads('[NaN]')[0]) == 'nan'
+    try:
+        loads('{"horses": ')
+        assert False
+    except serialization.JSONDecodeError:
+        pass
+
+    # ファイル（テキストで書いてバイナリで読む）
+    buffer = io.StringIO()
+    dump(SAMPLE, buffer, indent=True)
+    assert load(io.BytesIO(buffer.getvalue().encode('utf-8'))) == expected
+
+    try:
+        json_default(object())
+        assert False
+    except TypeError:
+        pass
+
+
+def test_stdlib_fallback():
+    """orjson がなくても同じ内容になる"""
+    with_orjson = [dumps(SAMPLE), dumps(SAMPLE, indent=True), loads('{"a": [1, 2.5, "い"]}')]
+    original, serialization.orjson = serialization.orjson, None
+    try:
+        without_orjson = [dumps(SAMPLE), dumps(SAMPLE, indent=True), loads('{"a": [1, 2.5, "い"]}')]
+    finally:
+        serialization.orjson = original
+    assert json.loads(with_orjson[0]) == json.loads(without_orjson[0])
+    assert json.loads(with_orjson[1]) == json.loads(without_orjson[1])
+    assert with_orjson[2] == without_orjson[2]
+
+
+def test_knowledge_round_trip():
+    """ナレッジの保存・読み込みが標準jsonと同じ内容になる"""
+    knowledge = knowledge_sample(500)
+    text = dumps(knowledge, indent=True)
+    assert json.loads(text) == json.loads(json.dumps(knowledge, ensure_ascii=False))
+    assert loads(json.dumps(knowledge, ensure_ascii=False, indent=2).encode('utf-8')) == loads(text)
+
+
+def test_api_responses():
+    """race-analysis・天候適性のレスポンスが従来（jsonable_encoder + JSONResponse）と同じ内容"""
+    field = race_field()
+    response = client.post('/api/v2/dlogic/race-analysis', json={'horse_names': field, 'race_name': 'テスト記念'})
+    assert response.status_code == 200 and response.headers['content-type'] == 'application/json'
+    payload = response.json()
+    expected = json.loads(JSONResponse(jsonable_encoder(engine.analyze_race_horses(field))).body)
+    assert set(payload) == set(RaceAnalysisResponse.model_fields)
+    assert payload['race_analysis']['race_name'] == 'テスト記念'
+    assert strip(payload['horses']) == strip(expected['horses'])
+
+    response = client.post('/api/chat/weather-analysis', json={'horse_names': field, 'all_conditions': True})
+    assert response.status_code == 200
+    conditions = response.json()['result']['conditions']
+    assert sorted(conditions) == ['1', '2', '3', '4']
+    expected = json.loads(JSONResponse(jsonable_encoder(engine.analyze_race_horses_all_weather(field))).body)
+    assert strip(conditions) == strip(expected['conditions'])
+
+    # 数値キーを含む通常のレスポンス（default_response_class）
+    response = client.post('/api/chat/weather-analysis', json={'horse_names': field[:1], 'baba_condition': 3})
+    assert response.status_code == 200 and response.json()['weather_condition'] == '重'
+
+
+def benchmark_serialization():
+    """ナレッジ読み込みとレスポンス生成: 従来の経路 vs 共通モジュール"""
+    knowledge = knowledge_sample()
+    body = json.dumps(knowledge, ensure_ascii=False, indent=2).encode('utf-8')
+
+    def measure(function, repeat=3):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            function()
+        return (time.perf_counter() - start) / repeat
+
+    stdlib_load = measure(lambda: json.loads(body.decode('utf-8')))
+    module_load = measure(lambda: loads(body))
+    stdlib_dump = measure(lambda: json.dumps(knowledge, ensure_ascii=False, indent=2))
+    module_dump = measure(lambda: dumps_bytes(knowledge, indent=True))
+    print(f"  ナレッジ{len(knowledge['horses'])}頭 ({len(body) / 1024 / 1024:.1f}MB) 読み込み: "
+          f"標準json {stdlib_load * 1000:.0f}ms / 共通 {module_load * 1000:.0f}ms")
+    if ujson is not None:
+        ujson_load = measure(lambda: ujson.loads(body))
+        print(f"    ujson {ujson_load * 1000:.0f}ms")
+    print(f"  ナレッジ保存（インデント付き）: 標準json {stdlib_dump * 1000:.0f}ms / 共通 {module_dump * 1000:.0f}ms")
+
+    result = engine.analyze_race_horses(race_field(18))
+    default_path = measure(lambda: JSONResponse(jsonable_encoder(
+        RaceAnalysisResponse.model_validate(result).model_dump())).body, 200)
+    module_path = measure(lambda: FastJSONResponse(result).body, 200)
+    print(f"  18頭のrace-analysisレスポンス: 従来（検証+jsonable_encoder+json） {default_path * 1000:.2f}ms / "
+          f"共通 {module_path * 1000:.3f}ms")
+
+    assert module_load < stdlib_load
+    assert module_path * 5 < default_path
+
+
+if __name__ == "__main__":
+    test_encoding_rules()
+    test_stdlib_fallback()
+    test_knowledge_round_trip()
+    test_api_responses()
+    benchmark_serialization()
+    print("✅ 全テスト成功")
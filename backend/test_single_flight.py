@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""シングルフライト（同時リクエストの合流）テスト"""
+
+import asyncio
+from services.cache_service import CacheService
+from services.single_flight import SingleFlight
+
+
+def test_concurrent_calls_coalesce():
+    """同じキーの同時呼び出しは1回だけ実行される"""
+    flight = SingleFlight(CacheService())
+    executions = []
+
+    async def analyze(race):
+        executions.append(race)
+        await asyncio.sleep(0.05)
+        return {'status': 'success', 'race': race}
+
+    async def main():
+        key = {'horses': ['ドウデュース', 'レガレイラ'], 'race_info': '有馬記念'}
+        same_key = {'race_info': '有馬記念', 'horses': ['ドウデュース', 'レガレイラ']}
+        calls = [flight.run('race_analysis', key, lambda: analyze('有馬記念')) for _ in range(10)]
+        calls += [flight.run('race_analysis', same_key, lambda: analyze('有馬記念')) for _ in range(5)]
+        calls.append(flight.run('race_analysis', {'horses': ['別の馬'], 'race_info': ''}, lambda: analyze('別レース')))
+        return await asyncio.gather(*calls)
+
+    results = asyncio.run(main())
+    assert executions == ['有馬記念', '別レース']
+    assert all(result == {'status': 'success', 'race': '有馬記念'} for result in results[:15])
+
+    stats = flight.get_stats()['prefixes']['race_analysis']
+    assert stats['calls'] == 16
+    assert stats['executions'] == 2
+    assert stats['coalesced'] == 14
+    assert flight.get_stats()['in_flight'] == 0
+
+
+def test_errors_are_shared_and_cleared():
+    """例外は待機中の全員に伝わり、次の呼び出しは再実行される"""
+    flight = SingleFlight(CacheService())
+    attempts = []
+
+    async def failing():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("分析失敗")
+
+    async def main():
+        results = await asyncio.gather(
+            *[flight.run('dlogic_analysis', 'ドウデュース', failing) for _ in range(3)],
+            return_exceptions=True
+        )
+        assert all(isinstance(result, RuntimeError) for result in results)
+        await asyncio.gather(flight.run('dlogic_analysis', 'ドウデュース', failing), return_exceptions=True)
+
+    asyncio.run(main())
+    assert len(attempts) == 2
+    assert flight.get_stats()['prefixes']['dlogic_analysis']['errors'] == 2
+
+
+if __name__ == "__main__":
+    test_concurrent_calls_coalesce()
+    test_errors_are_shared_and_cleared()
+    print("✅ 全テスト成功")
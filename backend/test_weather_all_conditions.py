@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+良・稍重・重・不良の一括天候適性分析のテスト
+1回の走査で求めた階層スコアが馬場状態ごとの計算（計算できない場合を含む）と一致すること、
+出走馬一括の結果が馬場状態ごとに4回呼んだ結果と一致すること、所要時間を確認する
+"""
+
+import os
+import time
+
+os.environ.setdefault('DLOGIC_PRECOMPUTE_SCORES', 'false')
+
+from services.dlogic_raw_data_manager import dlogic_manager
+from services.fast_dlogic_engine import FastDLogicEngine
+from services.race_record import build_horse_records
+from test_race_records import make_odd_horses
+
+VOLATILE_KEYS = ('calculation_time', 'calculation_time_seconds', 'timing_breakdown')
+
+engine = FastDLogicEngine()
+
+
+def outcome(method, *args):
+    try:
+        return method(*args)
+    except Exception:
+        return None
+
+
+def strip(result):
+    return {key: value for key, value in result.items() if key not in VOLATILE_KEYS}
+
+
+def race_field(size=18):
+    """4つの馬場状態すべてを従来の計算で分析できる馬（+ 基準馬・未登録馬）"""
+    field = []
+    for name in dlogic_manager.knowledge_data.get('horses', {}):
+        if all(outcome(dlogic_manager.calculate_weather_adaptive_dlogic, name, c) for c in (1, 2, 3, 4)):
+            field.append(name)
+        if len(field) == size - 2:
+            break
+    return field + ['ダンスインザダーク', '存在しない馬XYZ']
+
+
+def test_layers_match_per_condition():
+    """1回の走査で振り分けた階層スコアが馬場状態ごとの計算と一致する"""
+    horses = list(dlogic_manager.knowledge_data.get('horses', {}).values())
+    horses += make_odd_horses(2000, 11)
+    mismatches = failed = 0
+    for raw_data in horses:
+        records = build_horse_records(raw_data)
+        all_layers = dlogic_manager._calc_all_weather_layers(records)
+        for baba_condition in (2, 3, 4):
+            expected = outcome(dlogic_manager._calc_weather_layers, records, baba_condition)
+            failed += expected is None
+            if all_layers[baba_condition] != expected:
+                mismatches += 1
+    print(f"  階層スコア: {len(horses)}頭 × 3馬場 / 計算不能 {failed}件 / 不一致 {mismatches}件")
+    assert mismatches == 0
+
+
+def test_race_all_conditions_match():
+    """出走馬一括の4馬場の結果が、馬場状態ごとの一括分析と一致する（テーブルあり・なし）"""
+    field = race_field()
+    for use_table in (False, True):
+        if use_table:
+            engine.score_table.build()
+        combined = engine.analyze_race_horses_all_weather(field)
+        assert combined['race_analysis']['baba_conditions'] == [1, 2, 3, 4]
+        for baba_condition in (1, 2, 3, 4):
+            single = engine.analyze_race_horses_weather(field, baba_condition)
+            section = combined['conditions'][baba_condition]
+            assert [strip(r) for r in section['horses']] == [strip(r) for r in single['horses']], \
+                (use_table, baba_condition)
+            for key in ('analyzed_horses', 'not_found_horses', 'knowledge_hits', 'mysql_fallbacks'):
+                assert section[key] == single['race_analysis'][key]
+            assert section['weather_condition'] == single['race_analysis']['weather_condition']
+    engine.score_table.invalidate()
+
+    # 未登録馬は4馬場とも「データなし」
+    missing = engine.analyze_single_horse_all_weather('存在しない馬XYZ')
+    assert [r['weather_condition'] for r in missing.values()] == ['良', '稍重', '重', '不良']
+    assert all(r['data_source'] == 'not_found' for r in missing.values())
+
+
+def benchmark_all_conditions():
+    """18頭 × 4馬場: 馬場状態ごとに4回分析 vs 1回で一括分析（リアルタイム計算）"""
+    field = race_field()
+
+    start = time.perf_counter()
+    for _ in range(3):
+        for baba_condition in (1, 2, 3, 4):
+            engine.analyze_race_horses_weather(field, baba_condition)
+    separate_elapsed = (time.perf_counter() - start) / 3
+
+    start = time.perf_counter()
+    for _ in range(3):
+        engine.analyze_race_horses_all_weather(field)
+    combined_elapsed = (time.perf_counter() - start) / 3
+
+    print(f"  18頭 × 4馬場: 4回に分けて {separate_elapsed * 1000:.1f}ms / "
+          f"一括 {combined_elapsed * 1000:.1f}ms")
+    assert combined_elapsed < separate_elapsed
+
+
+if __name__ == "__main__":
+    test_layers_match_per_condition()
+    test_race_all_conditions_match()
+    benchmark_all_conditions()
+    print("✅ 全テスト成功")
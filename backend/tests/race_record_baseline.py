@@ -0,0 +1,561 @@
+#!/usr/bin/env python3
+"""
+D-Logic 12項目・天候層の計算（生データ辞書版）の凍結コピー（テスト専用）
+test_race_records.py で解析済みレース記録（services/race_record.py）の計算結果と比較するための基準。
+RaceRecord 導入前の DLogicRawDataManager の _calc_* を変更せずに残したもの。
+意図的に変えた挙動（トラック適性の空グループでのゼロ除算）はテスト側で例外として扱う
+"""
+
+import re
+from typing import Dict, List, Tuple
+
+
+class BaselineFactors:
+    """生データ辞書から直接計算する12項目・天候層"""
+
+    def _calc_distance_aptitude(self, raw_data: Dict) -> float:
+        """距離適性計算"""
+        races = raw_data.get("races", raw_data.get("race_history", []))
+        if not races:
+            return 50.0
+        
+        # 距離別成績を集計
+        distance_perf = {}
+        for race in races:
+            distance = race.get("KYORI") or race.get("distance")
+            finish = race.get("KAKUTEI_CHAKUJUN") or race.get("finish")
+            if distance and finish:
+                if distance not in distance_perf:
+                    distance_perf[distance] = []
+                try:
+                    distance_perf[distance].append(int(finish))
+                except:
+                    pass
+        
+        if not distance_perf:
+            return 50.0
+        
+        scores = []
+        for distance, finishes in distance_perf.items():
+            if finishes:
+                avg_finish = sum(finishes) / len(finishes)
+                score = max(0, 100 - (avg_finish - 1) * 10)
+                scores.append(score)
+        
+        return sum(scores) / len(scores) if scores else 50.0
+    
+    def _calc_bloodline_evaluation(self, raw_data: Dict) -> float:
+        """血統評価計算"""
+        # aggregated_statsから取得を試みる
+        stats = raw_data.get("aggregated_stats", {})
+        wins = stats.get("wins", 0)
+        total = stats.get("total_races", 0)
+        
+        # aggregated_statsがない場合はracesから集計
+        if total == 0:
+            races = raw_data.get("races", raw_data.get("race_history", []))
+            if races:
+                total = len(races)
+                wins = sum(1 for race in races if str(race.get("KAKUTEI_CHAKUJUN", race.get("finish", "99"))).strip() == "01" or race.get("KAKUTEI_CHAKUJUN", race.get("finish", 99)) == 1)
+        
+        win_rate = wins / total if total > 0 else 0
+        return min(100, win_rate * 200)
+    
+    def _calc_jockey_compatibility(self, raw_data: Dict) -> float:
+        """騎手相性計算"""
+        # まずaggregated_statsから取得を試みる
+        jockey_perf = raw_data.get("aggregated_stats", {}).get("jockey_performance", {})
+        
+        # aggregated_statsがない場合はracesから集計
+        if not jockey_perf:
+            races = raw_data.get("races", raw_data.get("race_history", []))
+            if races:
+                jockey_perf = {}
+                for race in races:
+                    jockey = race.get("KISHUMEI_RYAKUSHO", race.get("KISYURYAKUSYO", race.get("jockey", "")))
+                    finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish"))
+                    if jockey and finish:
+                        if jockey not in jockey_perf:
+                            jockey_perf[jockey] = []
+                        try:
+                            jockey_perf[jockey].append(int(finish))
+                        except:
+                            pass
+        
+        if not jockey_perf:
+            return 50.0
+        
+        scores = []
+        for jockey, finishes in jockey_perf.items():
+            if finishes:
+                avg_finish = sum(finishes) / len(finishes)
+                score = max(0, 100 - (avg_finish - 1) * 8)
+                scores.append(score)
+        
+        return sum(scores) / len(scores) if scores else 50.0
+    
+    def _calc_trainer_evaluation(self, raw_data: Dict) -> float:
+        """調教師評価計算"""
+        # まずaggregated_statsから取得を試みる
+        trainer_perf = raw_data.get("aggregated_stats", {}).get("trainer_performance", {})
+        
+        # aggregated_statsがない場合はracesから集計
+        if not trainer_perf:
+            races = raw_data.get("races", raw_data.get("race_history", []))
+            if races:
+                trainer_perf = {}
+                for race in races:
+                    trainer = race.get("CHOKYOSHIMEI_RYAKUSHO", race.get("CHOUKYOUSIRYAKUSYO", race.get("trainer", "")))
+                    finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish"))
+                    if trainer and finish:
+                        if trainer not in trainer_perf:
+                            trainer_perf[trainer] = []
+                        try:
+                            trainer_perf[trainer].append(int(finish))
+                        except:
+                            pass
+        
+        if not trainer_perf:
+            return 50.0
+        
+        scores = []
+        for trainer, finishes in trainer_perf.items():
+            if finishes:
+                avg_finish = sum(finishes) / len(finishes)
+                score = max(0, 100 - (avg_finish - 1) * 8)
+                scores.append(score)
+        
+        return sum(scores) / len(scores) if scores else 50.0
+    
+    def _calc_track_aptitude(self, raw_data: Dict) -> float:
+        """トラック適性計算"""
+        races = raw_data.get("races", raw_data.get("race_history", []))
+        track_perf = {}
+        
+        for race in races:
+            # トラックタイプの判定（芝/ダート）
+            track_code = race.get("TRACK_CODE", race.get("TRACKCD", race.get("track", "")))
+            finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish"))
+            
+            if track_code and finish:
+                # TRACKCDを芝/ダートに変換
+                if track_code in ["10", "11", "12", "13", "14", "15", "16", "17", "18", "19"]:
+                    track = "芝"
+                elif track_code in ["20", "21", "22", "23", "24", "25", "26", "27", "28", "29"]:
+                    track = "ダート"
+                else:
+                    track = track_code
+                
+                if track not in track_perf:
+                    track_perf[track] = []
+                try:
+                    track_perf[track].append(int(finish))
+                except:
+                    pass
+        
+        if not track_perf:
+            return 50.0
+        
+        scores = []
+        for track, finishes in track_perf.items():
+            avg_finish = sum(finishes) / len(finishes)
+            score = max(0, 100 - (avg_finish - 1) * 8)
+            scores.append(score)
+        
+        return sum(scores) / len(scores) if scores else 50.0
+    
+    def _calc_weather_aptitude(self, raw_data: Dict) -> float:
+        """天候適性計算"""
+        races = raw_data.get("races", raw_data.get("race_history", []))
+        if not races:
+            return 50.0
+        
+        # 天候別成績を集計
+        weather_perf = {}
+        
+        for race in races:
+            tenko = race.get("TENKO_CODE", race.get("weather", 0))
+            finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish", 0))
+            track_code = race.get("TRACK_CODE", "")
+            
+            # 馬場状態を取得（芝またはダート）
+            if str(track_code).startswith("1"):  # 芝
+                baba_jotai = race.get("SHIBA_BABAJOTAI_CODE", 0)
+            elif str(track_code).startswith("2"):  # ダート
+                baba_jotai = race.get("DIRT_BABAJOTAI_CODE", 0)
+            else:
+                baba_jotai = 0
+            
+            if tenko and finish:
+                try:
+                    tenko_int = int(tenko)
+                    finish_int = int(finish)
+                    baba_int = int(baba_jotai) if baba_jotai else 0
+                    
+                    # 天候コード: 1=晴, 2=曇, 3=雨, 4=小雨, 5=雪, 6=小雪
+                    # 馬場状態: 1=良, 2=稍重, 3=重, 4=不良
+                    
+                    # 天候と馬場状態の組み合わせでキーを作成
+                    if tenko_int <= 2:  # 晴/曇
+                        weather_key = "晴天"
+                    elif tenko_int <= 4:  # 雨/小雨
+                        weather_key = "雨天"
+                    else:  # 雪/小雪
+                        weather_key = "雪"
+                    
+                    if baba_int == 1:
+                        condition_key = f"{weather_key}・良"
+                    elif baba_int >= 2:
+                        condition_key = f"{weather_key}・重馬場"
+                    else:
+                        condition_key = weather_key
+                    
+                    if condition_key not in weather_perf:
+                        weather_perf[condition_key] = []
+                    weather_perf[condition_key].append(finish_int)
+                except:
+                    pass
+        
+        if not weather_perf:
+            return 50.0
+        
+        # 各天候条件での平均着順からスコアを計算
+        scores = []
+        for condition, finishes in weather_perf.items():
+            avg_finish = sum(finishes) / len(finishes)
+            score = max(0, 100 - (avg_finish - 1) * 8)
+            scores.append(score)
+        
+        return sum(scores) / len(scores) if scores else 50.0
+    
+    def _calc_popularity_factor(self, raw_data: Dict) -> float:
+        """人気度要因計算"""
+        races = raw_data.get("races", raw_data.get("race_history", []))
+        if not races:
+            return 50.0
+        
+        performance_scores = []
+        for race in races:
+            # 人気順位を取得
+            popularity = race.get("TANSHO_NINKIJUN", race.get("NINKIJUN", race.get("popularity", 0)))
+            finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish", 0))
+            
+            if popularity and finish:
+                try:
+                    pop_int = int(popularity)
+                    fin_int = int(finish)
+                    if pop_int > 0 and fin_int > 0:
+                        # 人気と着順の差を評価
+                        if fin_int <= pop_int:
+                            # 人気より上位に来た場合は高評価
+                            score = 100 - (fin_int - 1) * 5
+                        else:
+                            # 人気より下位の場合は低評価
+                            score = max(0, 80 - (fin_int - pop_int) * 10)
+                        performance_scores.append(score)
+                except:
+                    pass
+        
+        if performance_scores:
+            return sum(performance_scores) / len(performance_scores)
+        
+        return 50.0
+    
+    def _calc_weight_impact(self, raw_data: Dict) -> float:
+        """重量影響度計算"""
+        races = raw_data.get("races", raw_data.get("race_history", []))
+        weight_scores = []
+        
+        for race in races:
+            weight = race.get("FUTAN_JURYO", race.get("FUTAN", race.get("weight", 0)))
+            finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish", 0))
+            
+            if weight and finish:
+                try:
+                    weight_int = int(weight)
+                    finish_int = int(finish)
+                    
+                    # 負担重量の影響を評価（標準的な負担重量を55kgと仮定）
+                    weight_score = max(0, 100 - abs(weight_int - 550) / 10 * 5)
+                    finish_score = max(0, 100 - (finish_int - 1) * 8)
+                    
+                    combined = (weight_score + finish_score) / 2
+                    weight_scores.append(combined)
+                except:
+                    pass
+        
+        return sum(weight_scores) / len(weight_scores) if weight_scores else 50.0
+    
+    def _calc_horse_weight_impact(self, raw_data: Dict) -> float:
+        """馬体重影響度計算"""
+        races = raw_data.get("races", raw_data.get("race_history", []))
+        weight_scores = []
+        
+        for race in races:
+            horse_weight = race.get("BATAIJU", race.get("BATAI", race.get("horse_weight", 0)))
+            weight_change = race.get("ZOGEN_SA", race.get("ZOUGEN", race.get("weight_change", 0)))
+            finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish", 0))
+            
+            if horse_weight and finish:
+                try:
+                    weight_int = int(horse_weight)
+                    finish_int = int(finish)
+                    change_int = int(weight_change) if weight_change else 0
+                    
+                    # 最適体重を480kgと仮定
+                    weight_diff = abs(weight_int - 480)
+                    weight_score = max(0, 100 - weight_diff / 2)
+                    
+                    # 体重変化の影響も加味
+                    if abs(change_int) > 10:
+                        weight_score -= 10
+                    
+                    finish_score = max(0, 100 - (finish_int - 1) * 8)
+                    combined = (weight_score + finish_score) / 2
+                    weight_scores.append(combined)
+                except:
+                    pass
+        
+        return sum(weight_scores) / len(weight_scores) if weight_scores else 50.0
+    
+    def _calc_corner_specialist(self, raw_data: Dict) -> float:
+        """コーナー専門度計算"""
+        races = raw_data.get("races", raw_data.get("race_history", []))
+        improvements = []
+        
+        for race in races:
+            # コーナー通過順位
+            corner1 = race.get("CORNER1_JUNI", race.get("CORNER1JUN", race.get("corner1", 0)))
+            corner2 = race.get("CORNER2_JUNI", race.get("CORNER2JUN", race.get("corner2", 0)))
+            corner3 = race.get("CORNER3_JUNI", race.get("CORNER3JUN", race.get("corner3", 0)))
+            corner4 = race.get("CORNER4_JUNI", race.get("CORNER4JUN", race.get("corner4", 0)))
+            finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish", 0))
+            
+            if finish:
+                try:
+                    finish_int = int(finish)
+                    # 最も早いコーナー通過順位を取得
+                    corners = []
+                    for c in [corner1, corner2, corner3, corner4]:
+                        if c and int(c) > 0:
+                            corners.append(int(c))
+                    
+                    if corners:
+                        first_corner = corners[0]
+                        # コーナー順位から着順への改善度
+                        improvement = first_corner - finish_int
+                        improvements.append(improvement)
+                except:
+                    pass
+        
+        if improvements:
+            avg_improvement = sum(improvements) / len(improvements)
+            return min(100, max(0, 50 + avg_improvement * 5))
+        
+        return 50.0
+    
+    def _calc_margin_analysis(self, raw_data: Dict) -> float:
+        """着差分析計算"""
+        races = raw_data.get("races", raw_data.get("race_history", []))
+        finish_scores = []
+        
+        for race in races:
+            finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish", 0))
+            margin = race.get("CHAKUSA", race.get("margin", ""))
+            
+            if finish:
+                try:
+                    finish_int = int(finish)
+                    base_score = max(0, 100 - (finish_int - 1) * 6)
+                    
+                    # 着差も考慮（勝った場合は着差が大きいほど高評価）
+                    if finish_int == 1 and margin:
+                        try:
+                            # 着差を数値に変換（「1 1/2」→1.5など）
+                            margin_val = self._parse_margin(margin)
+                            if margin_val > 1:
+                                base_score = min(100, base_score + margin_val * 2)
+                        except:
+                            pass
+                    
+                    finish_scores.append(base_score)
+                except:
+                    pass
+        
+        return sum(finish_scores) / len(finish_scores) if finish_scores else 50.0
+    
+    def _parse_margin(self, margin: str) -> float:
+        """着差文字列を数値に変換"""
+        # 「1 1/2」「2」「ハナ」「クビ」などを数値化
+        if "ハナ" in margin:
+            return 0.1
+        elif "クビ" in margin:
+            return 0.2
+        elif "アタマ" in margin:
+            return 0.3
+        else:
+            # 数値部分を抽出
+            import re
+            nums = re.findall(r'\d+', margin)
+            if nums:
+                return float(nums[0])
+        return 0.0
+    
+    def _calc_time_index(self, raw_data: Dict) -> float:
+        """タイム指数計算（簡略版）"""
+        races = raw_data.get("races", raw_data.get("race_history", []))
+        time_scores = []
+        
+        for race in races:
+            # タイムデータ（秒単位）
+            time = race.get("SOHA_TIME", race.get("TIME", race.get("time", 0)))
+            finish = race.get("KAKUTEI_CHAKUJUN", race.get("finish", 0))
+            distance = race.get("KYORI", race.get("distance", 0))
+            
+            if time and finish and distance:
+                try:
+                    # SOHA_TIMEは1/10秒単位なので秒に変換
+                    time_float = float(time) / 10.0 if time else 0
+                    finish_int = int(finish)
+                    distance_int = int(distance)
+                    
+                    if time_float > 0 and distance_int > 0:
+                        # 距離別の基準タイムを設定（秒単位）
+                        if distance_int <= 1200:
+                            base_time = 70.0  # 1200m基準
+                        elif distance_int <= 1600:
+                            base_time = 95.0  # 1600m基準
+                        elif distance_int <= 2000:
+                            base_time = 120.0  # 2000m基準
+                        else:
+                            base_time = 150.0  # 2400m以上基準
+                        
+                        # タイム指数計算
+                        time_diff = time_float - base_time
+                        time_score = max(0, 100 - time_diff * 2)
+                        finish_score = max(0, 100 - (finish_int - 1) * 8)
+                        combined = (time_score + finish_score) / 2
+                        time_scores.append(combined)
+                except:
+                    pass
+        
+        return sum(time_scores) / len(time_scores) if time_scores else 50.0
+    
+    def _calc_weather_layers(self, raw_data: Dict, baba_condition: int) -> Tuple[float, float, float]:
+        """天候適性の第1〜3層スコアを計算（calculate_weather_adaptive_dlogic 内の呼び出し順そのまま）"""
+        races = raw_data.get("races", raw_data.get("race_history", []))
+        
+        # 第1層: 基礎能力（40%）
+        layer1_score = self._calc_layer1_base_ability(raw_data, races, baba_condition)
+        
+        # 第2層: 適応能力（35%）
+        layer2_score = self._calc_layer2_adaptive_ability(raw_data, races, baba_condition)
+        
+        # 第3層: 当日要因（25%）
+        layer3_score = self._calc_layer3_daily_factors(raw_data, races, baba_condition)
+        
+        return layer1_score, layer2_score, layer3_score
+    
+    def _calc_layer1_base_ability(self, raw_data: Dict, races: List[Dict], baba_condition: int) -> float:
+        """第1層: 基礎能力の評価（40%）"""
+        scores = []
+        
+        # 1. 馬体重評価
+        recent_weights = []
+        for race in races[-3:]:  # 直近3走
+            weight = race.get("BATAIJU", 0)
+            if weight:
+                recent_weights.append(int(weight))
+        
+        if recent_weights:
+            avg_weight = sum(recent_weights) / len(recent_weights)
+            if avg_weight >= 470:
+                weight_score = 1.1  # 重馬場向き（控えめに）
+            elif avg_weight <= 450:
+                weight_score = 0.9  # 軽量馬は不利（控えめに）
+            else:
+                weight_score = 1.0
+            scores.append(weight_score)
+        
+        # 2. 該当馬場での過去実績
+        baba_performances = []
+        for race in races:
+            track_code = race.get("TRACK_CODE", "")
+            if str(track_code).startswith("1"):  # 芝
+                baba_jotai = race.get("SHIBA_BABAJOTAI_CODE", 0)
+            else:  # ダート
+                baba_jotai = race.get("DIRT_BABAJOTAI_CODE", 0)
+            
+            if int(baba_jotai) == baba_condition:
+                finish = race.get("KAKUTEI_CHAKUJUN", 0)
+                if finish:
+                    baba_performances.append(int(finish))
+        
+        if baba_performances:
+            avg_finish = sum(baba_performances) / len(baba_performances)
+            baba_score = max(0.8, 1.3 - (avg_finish - 1) * 0.1)  # 1着なら1.3、5着なら0.9
+            scores.append(baba_score)
+        else:
+            # 該当馬場経験なしの場合は標準値
+            scores.append(1.0)
+        
+        return sum(scores) / len(scores) if scores else 1.0
+    
+    def _calc_layer2_adaptive_ability(self, raw_data: Dict, races: List[Dict], baba_condition: int) -> float:
+        """第2層: 適応能力の評価（35%）"""
+        scores = []
+        
+        # 1. 騎手の該当馬場成績
+        jockey_baba_perf = {}
+        for race in races:
+            baba_jotai = self._get_baba_jotai(race)
+            if int(baba_jotai) == baba_condition:
+                jockey = race.get("KISHUMEI_RYAKUSHO", "")
+                finish = race.get("KAKUTEI_CHAKUJUN", 0)
+                if jockey and finish:
+                    if jockey not in jockey_baba_perf:
+                        jockey_baba_perf[jockey] = []
+                    jockey_baba_perf[jockey].append(int(finish))
+        
+        if jockey_baba_perf:
+            jockey_scores = []
+            for jockey, finishes in jockey_baba_perf.items():
+                avg_finish = sum(finishes) / len(finishes)
+                score = max(0.8, 1.3 - (avg_finish - 1) * 0.1)
+                jockey_scores.append(score)
+            scores.append(sum(jockey_scores) / len(jockey_scores))
+        
+        # 2. 脚質評価（逃げ・先行有利）
+        early_positions = []
+        for race in races[-5:]:  # 直近5走
+            corner1 = race.get("CORNER1_JUNI", 0)
+            if corner1:
+                early_positions.append(int(corner1))
+        
+        if early_positions:
+            avg_position = sum(early_positions) / len(early_positions)
+            if avg_position <= 3:  # 逃げ・先行
+                pace_score = 1.15
+            elif avg_position <= 6:  # 中団
+                pace_score = 1.0
+            else:  # 後方
+                pace_score = 0.9
+            scores.append(pace_score)
+        
+        return sum(scores) / len(scores) if scores else 1.0
+    
+    def _calc_layer3_daily_factors(self, raw_data: Dict, races: List[Dict], baba_condition: int) -> float:
+        """第3層: 当日要因の評価（25%）"""
+        # 簡易実装：重馬場では内枠不利が解消される効果
+        if baba_condition >= 3:  # 重または不良
+            return 1.1  # 重馬場では有利不利が平準化
+        else:
+            return 1.0
+    
+    def _get_baba_jotai(self, race: Dict) -> int:
+        """レースの馬場状態を取得"""
+        track_code = race.get("TRACK_CODE", "")
+        if str(track_code).startswith("1"):  # 芝
+            return race.get("SHIBA_BABAJOTAI_CODE", 1)
+        else:  # ダート
+            return race.get("DIRT_BABAJOTAI_CODE", 1)